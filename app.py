@@ -16,6 +16,13 @@ import cloudinary.uploader
 import json
 import os
 import gspread
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import insights_cache
+import insights_history
+import job_store
+import graph_http
+import tracing
 from google.oauth2.service_account import Credentials
 
 # ====== CONSTANTS & CONFIGURATION ======
@@ -28,6 +35,13 @@ SPREADSHEET_ID = "1HUWXhKwglpJtp6yRuUfo2oy76uNKxDRx5n0RUG2q0hM"
 # Tên sheet trong Google Sheet để lưu lịch đăng bài
 SHEET_NAME = "xuongbinhgom"
 
+# File tín hiệu báo scheduler.py đọc lại sheet ngay khi có bài mới lên lịch
+# (cùng tên với SCHEDULE_SIGNAL_FILE trong scheduler.py)
+SCHEDULE_SIGNAL_FILE = "schedule_changed.flag"
+
+# File SQLite của job store dùng chung với scheduler (cùng với JOB_STORE_FILE trong scheduler.py)
+JOB_STORE_FILE = job_store.JOB_STORE_FILE
+
 # Các cột dữ liệu trong Google Sheet:
 # - product: tên sản phẩm
 # - keywords: từ khóa liên quan
@@ -44,6 +58,48 @@ HEADER = [
     "page_id", "mode", "date_str", "caption", "image_path"
 ]
 
+# Các trường thống kê bài viết lấy từ Graph API:
+# - summary(true).limit(0): chỉ lấy tổng số, không tải danh sách likes/comments/reactions
+# - Dùng chung cho fetch_post_stats, field expansion trên /posts và ?ids=
+POST_STATS_FIELDS = "message,likes.summary(true).limit(0),comments.summary(true).limit(0),shares,reactions.summary(true).limit(0)"
+
+# Số bài viết tối đa trong một request ?ids= (giới hạn của Graph API là 50)
+GRAPH_IDS_BATCH_SIZE = 50
+
+# Timeout (giây) cho mỗi request Graph API để tránh treo giao diện
+GRAPH_TIMEOUT = 15
+
+# Số request lấy thống kê chạy song song tối đa khi phải gọi từng bài
+FB_STATS_MAX_WORKERS = 8
+
+# Số bài viết mỗi trang khi duyệt edge /posts theo cursor
+FB_POSTS_PAGE_SIZE = 50
+
+# File SQLite lưu cache thống kê bài viết dùng chung giữa các phiên
+INSIGHTS_CACHE_FILE = "insights_cache.db"
+
+# Thư mục Parquet lưu lịch sử snapshot thống kê (chia theo ngày lấy)
+INSIGHTS_HISTORY_DIR = "insights_history"
+
+# Chu kỳ làm mới thống kê theo tuổi bài viết: (tuổi tối đa, chu kỳ) tính bằng giây
+# - Bài dưới 48 giờ: làm mới mỗi giờ
+# - Bài dưới 30 ngày: làm mới mỗi ngày
+# - Bài cũ hơn: giữ nguyên thống kê trong cache, không gọi API nữa
+FB_REFRESH_TIERS = [
+    (48 * 3600, 3600),
+    (30 * 86400, 86400),
+]
+
+# Dọn cache: chỉ giữ tối đa số bài mới nhất
+FB_CACHE_MAX_ENTRIES = 10000
+
+# Số bài lỗi thống kê tối đa chờ lấy lại ở lần đồng bộ sau (giữ bài mới nhất)
+FB_RETRY_MAX_POSTS = 50
+
+# Chu kỳ (giây) worker nền đồng bộ cache thống kê Facebook
+# - Đặt biến môi trường FB_PREWARM_INTERVAL=0 để tắt worker (ví dụ khi benchmark)
+FB_PREWARM_INTERVAL = int(os.getenv("FB_PREWARM_INTERVAL", "300"))
+
 # Đọc các token và secret từ Streamlit secrets:
 # - FB_PAGE_TOKEN: token xác thực Facebook Page API
 # - FB_PAGE_ID: ID của Facebook Page
@@ -132,62 +188,396 @@ def prepare_dataframe(posts_data, required_cols=None):
 # - Gọi Graph API để lấy bài viết của page.
 # - Trả về danh sách bài viết hoặc danh sách rỗng.
 def fetch_facebook_posts(page_id, access_token, limit=20):
-    url = f"https://graph.facebook.com/v19.0/{page_id}/posts"
+    url = graph_http.graph_url(f"{page_id}/posts")
     params = {
         "fields": "id,message,created_time",
         "limit": limit,
         "access_token": access_token
     }
-    resp = requests.get(url, params=params)
+    resp = graph_http.get(url, params=params, timeout=GRAPH_TIMEOUT)
     data = resp.json()
     return data.get("data", [])
 
 # ====== Hàm lấy thống kê bài viết Facebook ======
 # Chức năng: Lấy thống kê chi tiết của một bài viết từ Facebook API.
 # - Gọi Graph API lấy likes, comments, shares, reactions.
+# - Timeout mặc định GRAPH_TIMEOUT giây cho mỗi request.
 # - Trả về kiểu dữ liệu từ điển chứa tất cả thông tin.
-def fetch_post_stats(post_id, access_token):
-    url = f"https://graph.facebook.com/v19.0/{post_id}"
+@tracing.traced()
+def fetch_post_stats(post_id, access_token, timeout=GRAPH_TIMEOUT):
+    url = graph_http.graph_url(post_id)
     params = {
-        "fields": "message,likes.summary(true),comments.summary(true),shares,reactions.summary(true)",
+        "fields": POST_STATS_FIELDS,
         "access_token": access_token
     }
-    resp = requests.get(url, params=params)
+    resp = graph_http.get(url, params=params, timeout=timeout)
     return resp.json()
 
+# ====== Hàm lấy thống kê nhiều bài viết song song ======
+# Chức năng: Gọi fetch_post_stats cho nhiều bài viết qua thread pool giới hạn.
+# - Dùng khi không lấy được theo lô và buộc phải gọi từng bài.
+# - max_workers: số request chạy đồng thời tối đa.
+# - timeout: timeout cho từng request.
+# - Bài viết lỗi (timeout, mất kết nối) trả về {} để không ảnh hưởng bài khác.
+# - Trả về danh sách thống kê theo đúng thứ tự post_ids.
+# - Span của từng request nằm dưới span đang chạy (tracing.bind mang span sang thread pool).
+def fetch_post_stats_concurrent(post_ids, access_token, max_workers=FB_STATS_MAX_WORKERS, timeout=GRAPH_TIMEOUT):
+    def fetch_one(post_id):
+        try:
+            return fetch_post_stats(post_id, access_token, timeout=timeout)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Lỗi lấy thống kê bài {post_id}: {e}")
+            return {}
+    
+    if not post_ids:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(post_ids)))) as executor:
+        return list(executor.map(tracing.bind(fetch_one), post_ids))
+
+# ====== Hàm chuyển bài viết + thống kê thành bản ghi ======
+# Chức năng: Chuyển dữ liệu thô từ Graph API thành bản ghi dùng cho prepare_dataframe.
+# - post: bài viết từ edge /posts (id, created_time).
+# - stats: thống kê của bài viết (cùng cấu trúc với fetch_post_stats).
+# - Trả về từ điển với các cột: id, caption, likes, comments, shares, reactions, platform, created_time.
+def build_post_record(post, stats):
+    comments_count = 0
+    if "comments" in stats and isinstance(stats["comments"], dict):
+        comments_count = stats["comments"].get("summary", {}).get("total_count", 0)
+    
+    return {
+        "id": post["id"],
+        "caption": stats.get("message", ""),
+        "likes": stats.get("likes", {}).get("summary", {}).get("total_count", 0),
+        "comments": comments_count,
+        "shares": stats.get("shares", {}).get("count", 0),
+        "reactions": stats.get("reactions", {}).get("summary", {}).get("total_count", 0),
+        "platform": "Facebook",
+        "created_time": post.get("created_time", None)
+    }
+
+# ====== Hàm chuyển thời gian thành tham số since/until ======
+# Chức năng: Chuyển datetime hoặc chuỗi created_time của Graph API thành unix timestamp.
+# - Chuỗi created_time có dạng "2024-01-01T10:00:00+0000".
+# - Trả về None nếu không có giá trị.
+def to_graph_timestamp(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z")
+    return int(value.timestamp())
+
+# ====== Hàm duyệt bài viết theo trang (cursor pagination) ======
+# Chức năng: Generator duyệt toàn bộ bài viết của page theo cursor của Graph API.
+# - Mỗi lần yield một trang (danh sách bài viết), chỉ gọi trang tiếp khi cần.
+# - Đi theo paging.next cho tới khi hết bài.
+# - since/until: giới hạn thời gian đăng (datetime, chuỗi created_time hoặc unix timestamp).
+# - Raise Exception nếu Graph API báo lỗi.
+def iter_facebook_posts(page_id, access_token, fields="id,message,created_time", since=None, until=None, page_size=FB_POSTS_PAGE_SIZE):
+    url = graph_http.graph_url(f"{page_id}/posts")
+    params = {
+        "fields": fields,
+        "limit": page_size,
+        "access_token": access_token
+    }
+    if since is not None:
+        params["since"] = since if isinstance(since, int) else to_graph_timestamp(since)
+    if until is not None:
+        params["until"] = until if isinstance(until, int) else to_graph_timestamp(until)
+    
+    while url:
+        resp = graph_http.get(url, params=params, timeout=GRAPH_TIMEOUT)
+        data = resp.json()
+        if "error" in data:
+            raise Exception(f"Graph API lỗi: {data['error']}")
+        
+        page = data.get("data", [])
+        if page:
+            yield page
+        
+        # paging.next đã chứa sẵn toàn bộ tham số (kể cả cursor và token)
+        url = data.get("paging", {}).get("next")
+        params = None
+
+# ====== Hàm lấy bài viết kèm thống kê trong một lần gọi ======
+# Chức năng: Lấy bài viết và thống kê cùng lúc bằng field expansion trên edge /posts.
+# - Thay cho việc gọi fetch_post_stats từng bài (N+1 request).
+# - Đi hết các trang bằng iter_facebook_posts, có thể giới hạn bằng since/until.
+# - Mỗi bài viết trả về có cùng cấu trúc với fetch_post_stats.
+# - Trả về None nếu Graph API báo lỗi (ví dụ: page không cho phép mở rộng field).
+def fetch_facebook_posts_with_stats(page_id, access_token, limit=FB_POSTS_PAGE_SIZE, since=None, until=None):
+    posts = []
+    try:
+        for page in iter_facebook_posts(page_id, access_token, fields=f"id,created_time,{POST_STATS_FIELDS}",
+                                        since=since, until=until, page_size=limit):
+            posts.extend(page)
+    except Exception as e:
+        print(f"Lỗi lấy bài viết kèm thống kê: {e}")
+        return None
+    return posts
+
+# ====== Hàm lấy thống kê nhiều bài viết theo lô ======
+# Chức năng: Lấy thống kê nhiều bài viết bằng tham số ?ids= của Graph API.
+# - Mỗi request lấy tối đa GRAPH_IDS_BATCH_SIZE bài (giới hạn của Graph API là 50).
+# - Bài viết lỗi (kể cả lỗi mạng, bị giới hạn rate limit) sẽ không có trong kết quả.
+# - Trả về từ điển {post_id: stats}.
+@tracing.traced()
+def fetch_posts_stats_batch(post_ids, access_token):
+    url = graph_http.graph_url()
+    stats_by_id = {}
+    for start in range(0, len(post_ids), GRAPH_IDS_BATCH_SIZE):
+        chunk = post_ids[start:start + GRAPH_IDS_BATCH_SIZE]
+        params = {
+            "ids": ",".join(chunk),
+            "fields": POST_STATS_FIELDS,
+            "access_token": access_token
+        }
+        try:
+            resp = graph_http.get(url, params=params, timeout=GRAPH_TIMEOUT)
+            data = resp.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Lỗi lấy thống kê theo lô: {e}")
+            continue
+        if "error" in data:
+            print(f"Lỗi lấy thống kê theo lô: {data['error']}")
+            continue
+        stats_by_id.update(data)
+    return stats_by_id
+
+# ====== Hàm lấy thống kê cho danh sách bài viết ======
+# Chức năng: Lấy thống kê cho danh sách post_id với ít request nhất.
+# - Lấy theo lô (?ids=) trước.
+# - Bài nào lô không trả về (hoặc trả về {"error": ...}) thì lấy từng bài song song (fetch_post_stats_concurrent).
+# - Bài vẫn lỗi thì bỏ qua (giữ thống kê cũ), không ghi đè bằng số 0.
+# - Trả về từ điển {post_id: stats}.
+def fetch_stats_for_ids(post_ids, access_token):
+    stats_by_id = {
+        post_id: stats for post_id, stats in fetch_posts_stats_batch(post_ids, access_token).items()
+        if stats and "error" not in stats
+    }
+    missing_ids = [post_id for post_id in post_ids if post_id not in stats_by_id]
+    if missing_ids:
+        stats_list = fetch_post_stats_concurrent(missing_ids, access_token)
+        stats_by_id.update(
+            (post_id, stats) for post_id, stats in zip(missing_ids, stats_list)
+            if stats and "error" not in stats
+        )
+    return stats_by_id
+
+# ====== Hàm lấy bản ghi bài viết kèm thống kê ======
+# Chức năng: Lấy các bài viết của page (có thể giới hạn since/until) thành bản ghi.
+# - Ưu tiên field expansion (1 request cho mỗi trang bài viết).
+# - Nếu field expansion lỗi: duyệt danh sách bài rồi lấy thống kê bằng fetch_stats_for_ids.
+# - Bài không lấy được thống kê (lỗi mạng, token, body {"error": ...}) không tạo bản ghi số 0,
+#   được trả về riêng để lần đồng bộ sau lấy lại.
+# - Trả về (danh sách bản ghi theo build_post_record, danh sách bài lỗi thống kê),
+#   hoặc None nếu không duyệt hết được danh sách bài (danh sách dở dang sẽ làm mốc đồng bộ bỏ sót bài cũ hơn).
+def fetch_post_records(page_id, access_token, since=None, until=None):
+    fb_posts = fetch_facebook_posts_with_stats(page_id, access_token, since=since, until=until)
+    if fb_posts is not None:
+        return [build_post_record(post, post) for post in fb_posts], []
+    
+    fb_posts = []
+    try:
+        for page in iter_facebook_posts(page_id, access_token, since=since, until=until):
+            fb_posts.extend(page)
+    except Exception as e:
+        print(f"Lỗi lấy danh sách bài viết: {e}")
+        return None
+    stats_by_id = fetch_stats_for_ids([post["id"] for post in fb_posts], access_token)
+    records = [build_post_record(post, stats_by_id[post["id"]]) for post in fb_posts if post["id"] in stats_by_id]
+    failed_posts = [post for post in fb_posts if post["id"] not in stats_by_id]
+    if failed_posts:
+        print(f"Lỗi lấy thống kê {len(failed_posts)} bài viết, lấy lại ở lần đồng bộ sau")
+    return records, failed_posts
+
+# ====== Hàm đọc mốc đồng bộ bài viết ======
+# Chức năng: Đọc mốc created_time của bài viết mới nhất đã đồng bộ.
+# - Lưu trong bảng meta của cache để các lần làm mới sau chỉ lấy bài mới hơn.
+# - Trả về None nếu chưa có mốc.
+def load_sync_watermark():
+    return insights_cache.get_meta("last_created_time", INSIGHTS_CACHE_FILE)
+
+# ====== Hàm lưu mốc đồng bộ bài viết ======
+# Chức năng: Lưu mốc created_time của bài viết mới nhất đã đồng bộ vào cache.
+def save_sync_watermark(created_time):
+    insights_cache.set_meta("last_created_time", created_time, INSIGHTS_CACHE_FILE)
+
+# ====== Hàm đọc/lưu bài chờ lấy lại thống kê ======
+# Chức năng: Lưu {post_id: created_time} của các bài đã có trong danh sách nhưng lỗi thống kê
+#   vào bảng meta của cache, để mốc đồng bộ vẫn tiến mà bài lỗi được lấy lại ở lần đồng bộ sau.
+# - Chỉ giữ FB_RETRY_MAX_POSTS bài mới nhất.
+def load_retry_posts():
+    return json.loads(insights_cache.get_meta("retry_posts", INSIGHTS_CACHE_FILE, "{}"))
+
+def save_retry_posts(retry_posts):
+    newest = sorted(retry_posts.items(), key=lambda item: item[1] or "", reverse=True)[:FB_RETRY_MAX_POSTS]
+    insights_cache.set_meta("retry_posts", json.dumps(dict(newest)), INSIGHTS_CACHE_FILE)
+
+# ====== Hàm gộp bản ghi bài viết ======
+# Chức năng: Gộp bản ghi mới vào danh sách cũ theo id.
+# - Bản ghi mới ghi đè bản ghi cũ cùng id.
+# - Sắp xếp mới nhất lên đầu như thứ tự Graph API trả về.
+def merge_post_records(old_records, new_records):
+    merged = {record["id"]: record for record in old_records}
+    merged.update({record["id"]: record for record in new_records})
+    return sorted(merged.values(), key=lambda r: r.get("created_time") or "", reverse=True)
+
+# ====== Hàm đồng bộ thống kê Facebook với cache ======
+# Chức năng: Đồng bộ thống kê bài viết giữa Graph API và cache SQLite.
+# - Bài hết hạn được xác định theo tuổi bài viết (FB_REFRESH_TIERS).
+# - Cache còn mới (không có bài hết hạn): trả về ngay, không gọi API.
+# - Cache rỗng: lấy toàn bộ bài viết theo cursor, kèm thống kê (field expansion).
+# - Cache có bài hết hạn: lấy bài mới hơn mốc đồng bộ, cập nhật thống kê bài hết hạn theo lô (?ids=).
+# - force_refresh: luôn kiểm tra bài mới, nhưng vẫn chỉ cập nhật thống kê bài hết hạn.
+# - Bài lấy thống kê lỗi không được ghi vào cache: giữ bản ghi và fetched_at cũ (vẫn hết hạn,
+#   lần đồng bộ sau làm mới lại) thay vì lưu số 0 như dữ liệu mới. Bài mới lỗi thống kê được lưu
+#   vào danh sách chờ (save_retry_posts) và lấy lại ở lần đồng bộ sau cùng với bài hết hạn.
+# - Không duyệt hết được danh sách bài: giữ nguyên cache và mốc đồng bộ, lần sau lấy lại.
+# - Không dùng st.* nên có thể gọi ngoài phiên Streamlit.
+# - Trả về danh sách bản ghi trong cache, mới nhất lên đầu.
+@tracing.traced()
+def sync_facebook_insights(page_id, access_token, force_refresh=False):
+    cached_posts = insights_cache.get_post_records(INSIGHTS_CACHE_FILE)
+    stale_ids = insights_cache.get_stale_ids_by_age(FB_REFRESH_TIERS, INSIGHTS_CACHE_FILE)
+    retry_posts = load_retry_posts()
+    if cached_posts and not stale_ids and not retry_posts and not force_refresh:
+        return cached_posts
+    
+    since = load_sync_watermark() if cached_posts else None
+    fetched = fetch_post_records(page_id, access_token, since=since)
+    if fetched is None:
+        print("Không lấy được danh sách bài viết, giữ nguyên cache")
+        return cached_posts
+    new_posts, failed_posts = fetched
+    
+    # Cập nhật thống kê các bài hết hạn và bài lỗi lần trước mà không nằm trong đợt bài mới
+    new_ids = {post["id"] for post in new_posts}
+    posts_by_id = {post_id: {"id": post_id, "created_time": created_time} for post_id, created_time in retry_posts.items()}
+    posts_by_id.update({post["id"]: post for post in cached_posts})
+    refresh_ids = [post_id for post_id in dict.fromkeys(stale_ids + list(retry_posts)) if post_id not in new_ids]
+    refreshed_posts = []
+    if refresh_ids:
+        stats_by_id = fetch_stats_for_ids(refresh_ids, access_token)
+        refreshed_posts = [
+            build_post_record(posts_by_id[post_id], stats_by_id[post_id])
+            for post_id in refresh_ids if post_id in stats_by_id
+        ]
+    
+    # Bài vẫn lỗi và bài mới lỗi thống kê: chờ lấy lại ở lần đồng bộ sau
+    done_ids = new_ids | {post["id"] for post in refreshed_posts}
+    retry_posts = {post_id: created_time for post_id, created_time in retry_posts.items() if post_id not in done_ids}
+    retry_posts.update({post["id"]: post.get("created_time") for post in failed_posts})
+    save_retry_posts(retry_posts)
+    
+    insights_cache.put_post_records(new_posts + refreshed_posts, INSIGHTS_CACHE_FILE)
+    
+    # Ghi thêm snapshot vào lịch sử, lỗi ghi lịch sử không làm hỏng lần đồng bộ
+    try:
+        insights_history.append_snapshots(new_posts + refreshed_posts, INSIGHTS_HISTORY_DIR)
+    except Exception as e:
+        print(f"Lỗi ghi lịch sử thống kê: {e}")
+    insights_cache.evict_post_records(INSIGHTS_CACHE_FILE, max_entries=FB_CACHE_MAX_ENTRIES)
+    
+    # Mốc đồng bộ tính cả bài lỗi thống kê (đã nằm trong danh sách chờ lấy lại)
+    all_posts = merge_post_records(cached_posts, new_posts + refreshed_posts)
+    created_times = [post["created_time"] for post in all_posts[:1] + failed_posts if post.get("created_time")]
+    if created_times:
+        save_sync_watermark(max(created_times))
+    return insights_cache.get_post_records(INSIGHTS_CACHE_FILE)
+
 # ====== Hàm lấy dữ liệu Facebook và lưu dữ liệu và bộ nhớ tạm ======
 # Chức năng: Lấy dữ liệu Facebook và lưu vào trạng thái phiên.
 # - Lưu dữ liệu vào bộ nhớ tạm để tránh gọi API nhiều lần.
-# - Lấy 50 bài viết mới nhất.
+# - Phiên mới đọc snapshot trong cache SQLite (worker nền giữ cache luôn mới), không gọi API.
+# - Chỉ gọi API (chờ spinner) khi cache còn trống, ví dụ lần chạy đầu tiên.
+# - force_refresh: bỏ qua bộ nhớ phiên, kiểm tra bài mới và làm mới bài hết hạn theo tuổi.
 # - Trả về danh sách bài viết đã được xử lý.
+@tracing.traced()
 def get_facebook_data(force_refresh=False):
     if force_refresh or "fb_posts" not in st.session_state:
-        with st.spinner("Đang lấy dữ liệu Facebook..."):
-            fb_posts = fetch_facebook_posts(FB_PAGE_ID, FB_PAGE_TOKEN, limit=50)
-            new_posts = []
-            
-            for post in fb_posts:
-                stats = fetch_post_stats(post["id"], FB_PAGE_TOKEN)
-                comments_count = 0
-                if "comments" in stats and isinstance(stats["comments"], dict):
-                    comments_count = stats["comments"].get("summary", {}).get("total_count", 0)
-                
-                new_posts.append({
-                    "id": post["id"],
-                    "caption": stats.get("message", ""),
-                    "likes": stats.get("likes", {}).get("summary", {}).get("total_count", 0),
-                    "comments": comments_count,
-                    "shares": stats.get("shares", {}).get("count", 0),
-                    "reactions": stats.get("reactions", {}).get("summary", {}).get("total_count", 0),
-                    "platform": "Facebook",
-                    "created_time": post.get("created_time", None)
-                })
-            
-            st.session_state.fb_posts = new_posts
-            st.session_state.fb_data_fetched = True
+        posts = [] if force_refresh else insights_cache.get_post_records(INSIGHTS_CACHE_FILE)
+        if not posts:
+            with st.spinner("Đang lấy dữ liệu Facebook..."):
+                posts = sync_facebook_insights(FB_PAGE_ID, FB_PAGE_TOKEN, force_refresh=force_refresh)
+        st.session_state["fb_posts"] = posts
+        st.session_state["fb_data_fetched"] = True
     
     return st.session_state.get("fb_posts", [])
 
+# ====== Hàm đọc snapshot thống kê Facebook ======
+# Chức năng: Đọc ngay snapshot thống kê trong cache, không bao giờ gọi API.
+# - Dùng cho tab hiển thị để trang không bị chặn bởi spinner.
+# - Trả về (danh sách bài viết, thời điểm cập nhật gần nhất hoặc None nếu cache trống).
+def get_facebook_snapshot():
+    posts = insights_cache.get_post_records(INSIGHTS_CACHE_FILE)
+    last_fetched_at = insights_cache.get_last_fetched_at(INSIGHTS_CACHE_FILE)
+    last_updated = datetime.fromtimestamp(last_fetched_at) if last_fetched_at else None
+    return posts, last_updated
+
+# ====== Hàm đọc đường tăng trưởng tương tác ======
+# Chức năng: Trả về insights_history.average_growth_curve của lịch sử, chỉ quét Parquet khi lịch sử đã đổi.
+# - Khóa cache là phiên bản lịch sử (insights_history.history_version), đổi sau mỗi lần ghi snapshot
+#   hoặc gộp file: các lần rerun (mỗi lần bấm widget) ở giữa dùng lại kết quả.
+def get_growth_curve(base_dir=INSIGHTS_HISTORY_DIR):
+    return compute_growth_curve(base_dir, insights_history.history_version(base_dir))
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def compute_growth_curve(base_dir, history_version):
+    return insights_history.average_growth_curve(base_dir=base_dir)
+
+# ====== BACKGROUND WORKER ======
+
+# ====== Hàm khởi động worker làm nóng cache ======
+# Chức năng: Chạy thread nền đồng bộ cache thống kê Facebook theo chu kỳ.
+# - Mỗi FB_PREWARM_INTERVAL giây gọi sync_facebook_insights (chỉ gọi API khi có bài hết hạn).
+# - Có thể đánh thức sớm bằng request_insights_refresh (nút làm mới trên UI).
+# - st.cache_resource đảm bảo mỗi tiến trình Streamlit chỉ có 1 worker cho mọi phiên/rerun.
+# - interval <= 0: không chạy thread, chỉ trả về trạng thái rỗng (worker tắt, enabled = False):
+#   tab Hiệu quả tự lấy dữ liệu trực tiếp (chờ spinner).
+# - Trả về trạng thái worker: bật/tắt, event đánh thức, đang chạy, lần chạy cuối, lỗi cuối.
+@st.cache_resource
+def start_insights_worker(interval=FB_PREWARM_INTERVAL):
+    worker = {
+        "enabled": interval > 0,
+        "wake_event": threading.Event(),
+        "force_refresh": False,
+        "running": False,
+        "last_run": None,
+        "last_error": None
+    }
+    if interval <= 0:
+        return worker
+    
+    def run():
+        while True:
+            force_refresh = worker["force_refresh"]
+            worker["force_refresh"] = False
+            worker["wake_event"].clear()
+            worker["running"] = True
+            try:
+                sync_facebook_insights(FB_PAGE_ID, FB_PAGE_TOKEN, force_refresh=force_refresh)
+                insights_history.compact_history(INSIGHTS_HISTORY_DIR)
+                worker["last_error"] = None
+            except Exception as e:
+                print(f"Lỗi worker làm nóng cache: {e}")
+                worker["last_error"] = str(e)
+            finally:
+                worker["running"] = False
+                worker["last_run"] = datetime.now()
+            worker["wake_event"].wait(interval)
+    
+    thread = threading.Thread(target=run, name="insights-prewarm", daemon=True)
+    thread.start()
+    worker["thread"] = thread
+    return worker
+
+# ====== Hàm yêu cầu worker làm mới ngay ======
+# Chức năng: Đánh thức worker nền để đồng bộ ngay, không chặn giao diện.
+# - force_refresh: luôn kiểm tra bài mới (xem sync_facebook_insights).
+def request_insights_refresh(worker, force_refresh=True):
+    worker["force_refresh"] = worker["force_refresh"] or force_refresh
+    worker["wake_event"].set()
+
 # ====== GOOGLE SHEETS FUNCTIONS ======
 
 # ====== Hàm tạo client để kết nối với Google Sheets ======
@@ -213,18 +603,38 @@ def ensure_sheet_header(worksheet, header):
 # ====== Hàm lên lịch đăng bài ======
 # Chức năng: Lên lịch đăng bài bằng cách ghi vào Google Sheet.
 # - Ghi tất cả thông tin cần thiết vào sheet.
-# - Scheduler sẽ đọc và đăng theo lịch.
+# - Ghi song song vào job store (scheduler lấy bài đến hạn từ đây); lỗi ghi store không làm hỏng
+#   việc lên lịch vì scheduler vẫn đồng bộ dòng mới từ sheet.
+# - Scheduler sẽ đọc và đăng theo lịch (được báo ngay qua file tín hiệu).
+@tracing.traced()
 def schedule_post_to_sheet(product_name, keywords, platform, post_time, token, page_id, mode, date_str, caption, image_path=""):
     gc = get_gsheet_client()
     sh = gc.open_by_key(SPREADSHEET_ID)
     worksheet = sh.worksheet(SHEET_NAME)
     ensure_sheet_header(worksheet, HEADER)
     
-    worksheet.append_row([
+    row = [
         product_name, keywords, platform, post_time,
         token, page_id, mode, date_str,
         caption, image_path
-    ])
+    ]
+    worksheet.append_row(row)
+    try:
+        job_store.add_job(row, JOB_STORE_FILE)
+    except Exception as e:
+        print(f"Lỗi ghi job store: {e}")
+    notify_schedule_changed()
+
+# ====== Hàm báo scheduler có lịch mới ======
+# Chức năng: Chạm file tín hiệu để scheduler đọc lại sheet ngay thay vì chờ chu kỳ đọc lại.
+# - Lỗi ghi file không ảnh hưởng việc lên lịch (scheduler vẫn đọc lại theo chu kỳ).
+def notify_schedule_changed(signal_file=SCHEDULE_SIGNAL_FILE):
+    try:
+        with open(signal_file, "a", encoding="utf-8"):
+            pass
+        os.utime(signal_file, None)
+    except OSError as e:
+        print(f"Lỗi ghi file tín hiệu lịch đăng: {e}")
 
 # ====== AI & CONTENT FUNCTIONS ======
 
@@ -232,6 +642,7 @@ def schedule_post_to_sheet(product_name, keywords, platform, post_time, token, p
 # Chức năng: Sinh caption marketing cho sản phẩm bằng AI.
 # - Gọi OpenAI API để tạo nội dung.
 # - Style mộc mạc, có emoji, phù hợp platform.
+@tracing.traced()
 def generate_caption(product_name, keywords, platform):
     prompt = f"""
     
@@ -256,6 +667,7 @@ Format: 3-4 đoạn ngắn, hashtag #xuongbinhgom ở cuối và có hashtag d
 # Chức năng: Gọi AI để phân tích dữ liệu với prompt tùy chỉnh.
 # - Dùng cho dự báo hiệu quả và gợi ý chiến lược.
 # - Trả về kết quả phân tích hoặc thông báo lỗi.
+@tracing.traced()
 def call_ai_analysis(prompt, temperature=0.7):
     try:
         response = client.chat.completions.create(
@@ -273,6 +685,7 @@ def call_ai_analysis(prompt, temperature=0.7):
 # Chức năng: Upload ảnh lên Google Drive và trả về link ảnh công khai.
 # - Dùng cho bài viết Facebook.
 # - Set quyền chia sẻ công khai để có thể truy cập.
+@tracing.traced()
 def upload_image_to_gdrive(image_bytes, filename):
     SCOPES = ['https://www.googleapis.com/auth/drive']
     creds = service_account.Credentials.from_service_account_info(
@@ -300,6 +713,7 @@ def upload_image_to_gdrive(image_bytes, filename):
 # - Dùng cho bài viết Instagram.
 # - Sử dụng cấu hình định sẵn upload preset để tự động xử lý ảnh.
 # - Trả về link ảnh công khai.
+@tracing.traced()
 def upload_image_to_cloudinary(image_bytes, preset="ml_default"):
     upload_result = cloudinary.uploader.upload(
         image_bytes,
@@ -314,6 +728,7 @@ def upload_image_to_cloudinary(image_bytes, preset="ml_default"):
 # - Instagram: Upload lên Cloudinary.
 # - Trả về link ảnh công khai.
 # - Trả về None nếu có lỗi và thông báo lỗi.
+@tracing.traced()
 def handle_image_upload(uploaded_image, platform):
     if not uploaded_image:
         return None
@@ -389,6 +804,57 @@ def create_analytics_chart(df, group_type, chart_type):
     plt.legend()
     st.pyplot(fig)
 
+# ====== Hàm vẽ đường tăng trưởng tương tác ======
+# Chức năng: Vẽ tương tác trung bình theo tuổi bài viết từ lịch sử snapshot.
+# - curve: kết quả của insights_history.average_growth_curve.
+# - Trục hoành tính theo ngày tuổi bài viết.
+def create_growth_chart(curve):
+    fig, ax = plt.subplots(figsize=(8,4))
+    age_days = curve['age_hours'] / 24
+    for column, label in [('avg_engagement', 'Engagement'), ('avg_likes', 'Likes'),
+                          ('avg_comments', 'Comments'), ('avg_shares', 'Shares')]:
+        sns.lineplot(x=age_days, y=curve[column], label=label, marker='o', ax=ax)
+    
+    ax.set_title("Tương tác trung bình theo tuổi bài viết")
+    ax.set_xlabel("Tuổi bài viết (ngày)")
+    ax.set_ylabel("Trung bình mỗi bài")
+    plt.legend()
+    st.pyplot(fig)
+
+# ====== Hàm vẽ waterfall của một trace ======
+# Chức năng: Vẽ các span của một lần rerun theo thời gian bắt đầu và độ dài (debug tracing).
+# - rows: kết quả của tracing.waterfall, span lồng nhau được thụt lề theo độ sâu.
+# - Span lỗi tô màu đỏ.
+def create_trace_waterfall_chart(rows):
+    fig, ax = plt.subplots(figsize=(8, max(2, 0.35 * len(rows) + 1)))
+    labels = ["  " * row['depth'] + row['name'] for row in rows]
+    colors = ['tab:red' if row['error'] else 'tab:blue' for row in rows]
+    ax.barh(range(len(rows)), [row['duration_ms'] for row in rows],
+            left=[row['offset_ms'] for row in rows], color=colors)
+    ax.set_yticks(range(len(rows)))
+    ax.set_yticklabels(labels)
+    ax.invert_yaxis()
+    ax.set_xlabel("Thời gian từ đầu lượt chạy (ms)")
+    ax.set_title("Waterfall các span")
+    st.pyplot(fig)
+
+# ====== Hàm tóm tắt tốc độ tăng tương tác ======
+# Chức năng: Tạo đoạn mô tả tương tác trung bình sau 1 ngày và 7 ngày để đưa vào prompt AI.
+# - Trả về chuỗi rỗng nếu chưa có lịch sử.
+def summarize_growth_curve(curve):
+    if curve.empty:
+        return ""
+    lines = []
+    for age_hours, label in [(0, "trong 24 giờ đầu"), (6 * 24, "sau 7 ngày")]:
+        row = curve[curve["age_hours"] <= age_hours].tail(1)
+        if not row.empty:
+            row = row.iloc[0]
+            lines.append(
+                f"- {label}: trung bình {row['avg_likes']:.0f} likes, {row['avg_comments']:.0f} comments, "
+                f"{row['avg_shares']:.0f} shares ({int(row['snapshots'])} snapshot)"
+            )
+    return "\n".join(lines)
+
 # ====== Hàm làm đẹp output AI ======
 # Chức năng: Làm đẹp output của AI thành HTML.
 # - Parse nội dung thành các section.
@@ -436,6 +902,15 @@ def safe_remove_post(idx):
 
 # ====== MAIN APPLICATION INTERFACE ======
 
+# Mỗi lần rerun Streamlit là một trace (bật bằng TRACE_ENABLED=1, xem tracing.py):
+# - Nội dung các tab nằm trong các hàm render_*_tab, được gọi trong with tracing.span (xem cuối phần giao diện)
+# - Trace gắn với phiên trình duyệt (trace_session_id): mỗi phiên chỉ xem được trace của mình.
+tracing.configure(service_name="app")
+trace_session_id = st.session_state.setdefault("trace_session_id", uuid.uuid4().hex)
+
+# Khởi động worker nền giữ cache thống kê Facebook luôn mới (1 lần cho mỗi tiến trình)
+insights_worker = start_insights_worker()
+
 # ====== Tạo tabs chính của ứng dụng ======
 # Chức năng: Tạo 5 tabs chính cho các chức năng khác nhau.
 # - Tab 1: Tạo nội dung bài đăng với AI
@@ -465,7 +940,7 @@ tab1, tab3, tab2, tab4, tab5 = st.tabs([
 # 4. Mode "Chờ duyệt": Upload ảnh + lưu vào file JSON để duyệt sau
 # 5. Gọi AI sinh caption theo prompt mộc mạc, có emoji
 # 6. Lưu vào Google Sheets (auto) hoặc posts_data.json (manual)
-with tab1:
+def render_create_tab():
     st.header("📝 Tạo nội dung bài đăng")
     
     # Input form - Xử lý nhập liệu từ người dùng
@@ -614,17 +1089,46 @@ with tab1:
 # - Tạo biểu đồ tương tác theo thời gian với nhiều options
 #
 # Xử lý chi tiết:
-# 1. Gọi get_facebook_data() để lấy posts từ Facebook Graph API
+# 1. Đọc snapshot từ cache (get_facebook_snapshot), worker nền lo việc gọi Facebook Graph API
+#    - Hiển thị thời điểm cập nhật gần nhất và nút làm mới (không chặn trang)
 # 2. Prepare DataFrame với các cột: likes, comments, shares, reactions  
 # 3. Hiển thị bảng detail_df với format đẹp
 # 4. Gọi display_analytics_stats() để hiển thị tổng hợp
 # 5. Tạo chart với options: nhóm theo Ngày/Tuần/Tháng, type Line/Bar/Area
 # 6. Dùng matplotlib + seaborn để vẽ biểu đồ
-with tab3:
+def render_performance_tab():
     st.header("📊 Hiệu quả bài viết thực")
     
-    # Lấy dữ liệu từ Facebook API và lưu vào session state
-    fb_posts = get_facebook_data()
+    # Hiển thị mức sử dụng rate limit Graph API (đọc từ header response gần nhất)
+    st.caption(f"📶 Graph API usage: {graph_http.format_usage()}")
+    
+    # Đọc snapshot từ cache, không chờ gọi API
+    fb_posts, fb_last_updated = get_facebook_snapshot()
+    if not fb_posts and not insights_worker["enabled"]:
+        # Worker nền tắt: cache trống thì lấy dữ liệu trực tiếp (1 lần mỗi phiên, chờ spinner)
+        fb_posts = get_facebook_data()
+        fb_last_updated = get_facebook_snapshot()[1]
+    
+    # Thời điểm cập nhật và nút làm mới nền
+    col_updated, col_refresh = st.columns([3, 1])
+    with col_updated:
+        if fb_last_updated:
+            st.caption(f"🕐 Cập nhật lần cuối: {fb_last_updated.strftime('%d/%m/%Y %H:%M:%S')}")
+        if not insights_worker["enabled"]:
+            st.caption("ℹ️ Worker nền đang tắt (FB_PREWARM_INTERVAL <= 0), dữ liệu chỉ làm mới khi bấm 🔄 Làm mới.")
+        elif insights_worker["running"]:
+            st.caption("⏳ Đang làm mới dữ liệu ở chế độ nền...")
+        elif insights_worker["last_error"]:
+            st.caption(f"⚠️ Lần làm mới gần nhất bị lỗi: {insights_worker['last_error']}")
+    with col_refresh:
+        if st.button("🔄 Làm mới"):
+            if insights_worker["enabled"]:
+                request_insights_refresh(insights_worker)
+                st.toast("Đã yêu cầu làm mới dữ liệu, bấm lại sau ít giây để xem kết quả.")
+            else:
+                # Worker nền tắt: làm mới trực tiếp rồi vẽ lại trang với dữ liệu mới
+                get_facebook_data(force_refresh=True)
+                st.rerun()
     
     if fb_posts:
         # Xử lý dữ liệu thành DataFrame
@@ -660,6 +1164,15 @@ with tab3:
         
         # Tạo và hiển thị biểu đồ theo options đã chọn
         create_analytics_chart(df_fb, group_type, chart_type)
+        
+        # Đường tăng trưởng tương tác theo tuổi bài (từ lịch sử snapshot)
+        growth_curve = get_growth_curve()
+        if not growth_curve.empty:
+            st.markdown("<div style='padding-top:2em;'><b>Tốc độ tăng tương tác theo tuổi bài viết:</b></div>", unsafe_allow_html=True)
+            create_growth_chart(growth_curve)
+    elif insights_worker["enabled"] and (insights_worker["running"] or insights_worker["last_run"] is None):
+        # Worker đang lấy dữ liệu lần đầu
+        st.info("⏳ Đang tải dữ liệu Facebook lần đầu, vui lòng quay lại sau ít phút.")
     else:
         # Thông báo khi chưa có dữ liệu
         st.info("Chưa có dữ liệu bài viết.")
@@ -678,7 +1191,7 @@ with tab3:
 # 3. Tạo prompt cho AI đơn giản
 # 4. Gọi call_ai_analysis() 
 # 5. Hiển thị kết quả trực tiếp
-with tab2:
+def render_forecast_tab():
     st.header("🔮 Dự báo hiệu quả bài viết")
     
     # Input form - Chỉ nhập caption như logic cũ
@@ -693,11 +1206,16 @@ with tab2:
             if not fb_posts:
                 st.warning("⚠️ Chưa có dữ liệu lịch sử để dự báo.")
             else:
+                # Tốc độ tăng tương tác của các bài trước (từ lịch sử snapshot)
+                growth_summary = summarize_growth_curve(get_growth_curve())
+                growth_context = f"\nTương tác trung bình của các bài trước theo tuổi bài:\n{growth_summary}\n" if growth_summary else ""
+                
                 # Tạo prompt đơn giản cho AI
                 prompt = f"""
 Bạn là chuyên gia marketing. Dựa trên nội dung bài viết sau, hãy dự báo hiệu quả:
 
 "{caption_forecast}"
+{growth_context}
 
 Hãy đưa ra dự báo theo format:
 
@@ -749,7 +1267,7 @@ Hãy đưa ra dự báo theo format:
 # 5. Gọi call_ai_analysis() với temperature=0.7 để có độ sáng tạo vừa phải
 # 6. Dùng beautify_ai_output() để format kết quả thành HTML đẹp
 # 7. Hiển thị với background styling và màu sắc
-with tab4:
+def render_strategy_tab():
     st.header("🎯 Gợi ý chiến lược cải thiện")
     
     if st.button("🧠 Gợi ý từ AI"):
@@ -814,7 +1332,7 @@ Hãy:
 #    - st.rerun() để refresh UI
 # 5. Khi xóa: chỉ gọi safe_remove_post() và st.rerun()
 # 6. Hiển thị DataFrame tổng hợp tất cả posts
-with tab5:
+def render_approval_tab():
     st.header("📥 Bài chờ duyệt")
     
     # Load pending posts với spinner
@@ -879,6 +1397,21 @@ with tab5:
         # Thông báo khi không có bài viết nào
         st.info("Chưa có bài viết nào chờ duyệt.")
 
+# ====== Chạy giao diện các tab ======
+# Chức năng: Hiển thị các tab trong span gốc của lần rerun (span luôn đóng, kể cả khi rerun dừng
+# giữa chừng bằng st.stop()/st.rerun()).
+with tracing.span("streamlit.rerun", root=True, session_id=trace_session_id):
+    with tab1:
+        render_create_tab()
+    with tab3:
+        render_performance_tab()
+    with tab2:
+        render_forecast_tab()
+    with tab4:
+        render_strategy_tab()
+    with tab5:
+        render_approval_tab()
+
 # ====== SESSION STATE INITIALIZATION ======
 # Chức năng: Khởi tạo trạng thái phiên cho ứng dụng Streamlit
 # - Định nghĩa các biến trạng thái mặc định
@@ -890,4 +1423,27 @@ def_states = {
 
 for key, val in def_states.items():
     if key not in st.session_state:
-        st.session_state[key] = val
\ No newline at end of file
+        st.session_state[key] = val
+
+# ====== DEBUG: TRACING ======
+# Chức năng: Hiển thị các trace gần nhất của phiên này khi tracing bật.
+# - Waterfall thời gian các hàm I/O (gọi API, Google Sheets, AI, upload ảnh) của trace được chọn.
+# - Tải xuống các trace dạng OTLP JSON (mở bằng Jaeger, Grafana Tempo, collector OpenTelemetry...).
+if tracing.is_enabled():
+    with st.expander("🧭 Debug: Tracing"):
+        traces = tracing.get_traces(session_id=trace_session_id)
+        if traces:
+            options = list(range(len(traces) - 1, -1, -1))
+            selected = st.selectbox(
+                "Trace", options,
+                format_func=lambda i: f"#{i + 1} {traces[i]['name']} | {len(traces[i]['spans'])} span | "
+                                      f"{tracing.trace_duration_ms(traces[i]) or 0:.1f} ms")
+            rows = tracing.waterfall(traces[selected])
+            create_trace_waterfall_chart(rows)
+            st.dataframe(pd.DataFrame(rows))
+            st.download_button(
+                "⬇️ Tải trace (OTLP JSON)",
+                json.dumps(tracing.export_otlp(traces), ensure_ascii=False),
+                file_name="traces.json", mime="application/json")
+        else:
+            st.info("Chưa có trace nào.")
@@ -0,0 +1,154 @@
+# ==========================================
+# ====== BENCHMARK: ANALYTICS DATA PATH ======
+# ==========================================
+# Chức năng chính: Đo hiệu năng luồng dữ liệu của tab "Hiệu quả" với Graph API giả lập
+# - Chạy graph_stub_server với số bài viết 50 → 50k, không gọi Meta
+# - Các bước đo: get_facebook_data (cache trống / cache nóng / làm mới), prepare_dataframe,
+#   create_analytics_chart
+# - Mỗi bước báo: thời gian (ms), số request (phía client và phía server), bộ nhớ đỉnh (tracemalloc)
+#
+# Chạy:
+#   python bench_analytics.py
+#   python bench_analytics.py --posts 50 500 5000 50000 --latency 20 --error-rate 0.01 --output bench_output.txt
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import graph_stub_server
+
+# Số bài viết mặc định của các kịch bản
+DEFAULT_POST_COUNTS = [50, 500, 5000, 50000]
+
+# ====== Hàm nạp app trỏ tới server giả lập ======
+# Chức năng: Import app.py sau khi trỏ GRAPH_API_BASE sang server giả lập và tắt worker nền
+# (worker sẽ gọi API song song làm sai số liệu đo).
+# - Phải gọi trước mọi lần import app/graph_http khác trong tiến trình.
+def load_app(base_url):
+    os.environ["GRAPH_API_BASE"] = base_url
+    os.environ["FB_PREWARM_INTERVAL"] = "0"
+    import graph_http
+    graph_http.GRAPH_API_BASE = base_url
+    import app
+    return app, graph_http
+
+# ====== Hàm đo một bước ======
+# Chức năng: Chạy fn và đo thời gian, bộ nhớ đỉnh, số request.
+# - Số request phía client lấy từ thống kê độ trễ của graph_http (1 lần gọi dù có retry),
+#   phía server đếm từng request nhận được (gồm cả retry).
+def measure(name, fn, graph_http, server):
+    graph_http.reset_latency_stats()
+    graph_stub_server.reset_request_counts(server)
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    latency_stats = graph_http.get_latency_stats()
+    server_counts = graph_stub_server.get_request_counts(server)
+    return result, {
+        "step": name,
+        "ms": elapsed_ms,
+        "client_calls": sum(stats["count"] for stats in latency_stats.values()),
+        "server_requests": sum(count for label, count in server_counts.items() if not label.startswith("errors")),
+        "server_errors": server_counts.get("errors", 0),
+        "peak_mb": peak / (1024 * 1024),
+        "endpoints": ", ".join(f"{label}={stats['count']}" for label, stats in sorted(latency_stats.items()))
+    }
+
+# ====== Hàm chạy một kịch bản ======
+# Chức năng: Chạy toàn bộ luồng dữ liệu analytics với server có post_count bài viết.
+# - Cache SQLite và lịch sử Parquet nằm trong thư mục tạm riêng cho mỗi kịch bản.
+# - Trả về danh sách kết quả từng bước.
+def run_scenario(app, graph_http, post_count, latency_ms=0, error_rate=0.0, expansion_error=False):
+    server = graph_stub_server.start_stub_server(post_count=post_count, latency_ms=latency_ms,
+                                                 error_rate=error_rate, expansion_error=expansion_error)
+    graph_http.GRAPH_API_BASE = server.base_url
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            app.INSIGHTS_CACHE_FILE = os.path.join(work_dir, "insights_cache.db")
+            app.INSIGHTS_HISTORY_DIR = os.path.join(work_dir, "insights_history")
+
+            # Phiên mới, cache trống: phải lấy toàn bộ bài viết
+            app.st.session_state.clear()
+            posts, stats = measure("get_facebook_data (cache trống)", app.get_facebook_data, graph_http, server)
+            results.append(stats)
+
+            # Phiên mới, cache nóng: chỉ đọc SQLite
+            app.st.session_state.clear()
+            posts, stats = measure("get_facebook_data (cache nóng)", app.get_facebook_data, graph_http, server)
+            results.append(stats)
+
+            # Làm mới: chỉ lấy bài mới từ mốc đồng bộ
+            posts, stats = measure("get_facebook_data (làm mới)",
+                                   lambda: app.get_facebook_data(force_refresh=True), graph_http, server)
+            results.append(stats)
+
+            df, stats = measure("prepare_dataframe",
+                                lambda: app.prepare_dataframe(posts, ["likes", "comments", "shares", "reactions"]),
+                                graph_http, server)
+            results.append(stats)
+
+            _, stats = measure("create_analytics_chart",
+                               lambda: app.create_analytics_chart(df, "Ngày", "Line"), graph_http, server)
+            results.append(stats)
+            app.plt.close("all")
+
+            if len(posts) != post_count:
+                print(f"⚠️ Lấy được {len(posts)}/{post_count} bài viết")
+    finally:
+        graph_stub_server.stop_stub_server(server)
+        app.st.session_state.clear()
+    return results
+
+# ====== Hàm tạo báo cáo ======
+# Chức năng: Tạo bảng kết quả dạng văn bản.
+def format_report(all_results, latency_ms, error_rate):
+    lines = [
+        f"Benchmark analytics - độ trễ stub {latency_ms} ms, tỉ lệ lỗi {error_rate:.1%}",
+        "(bộ nhớ đo bằng tracemalloc, thời gian đã gồm chi phí của tracemalloc)",
+        ""
+    ]
+    header = f"{'Bài':>6}  {'Bước':<34} {'ms':>10} {'calls':>6} {'req':>6} {'lỗi':>5} {'peak MB':>8}  endpoint"
+    lines.append(header)
+    lines.append("-" * len(header))
+    for post_count, results in all_results:
+        for stats in results:
+            lines.append(
+                f"{post_count:>6}  {stats['step']:<34} {stats['ms']:>10.1f} {stats['client_calls']:>6} "
+                f"{stats['server_requests']:>6} {stats['server_errors']:>5} {stats['peak_mb']:>8.2f}  {stats['endpoints']}"
+            )
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark luồng dữ liệu analytics với Graph API giả lập")
+    parser.add_argument("--posts", type=int, nargs="+", default=DEFAULT_POST_COUNTS, help="Các số bài viết cần đo")
+    parser.add_argument("--latency", type=float, default=0, help="Độ trễ stub mỗi request (ms)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ request lỗi HTTP 500 (0 → 1)")
+    parser.add_argument("--expansion-error", action="store_true", help="Buộc chạy nhánh fallback lấy thống kê theo lô")
+    parser.add_argument("--output", help="Ghi báo cáo ra file")
+    args = parser.parse_args()
+
+    app, graph_http = load_app("http://127.0.0.1:0")
+    all_results = []
+    for post_count in args.posts:
+        print(f"▶️ Đang đo với {post_count} bài viết...", file=sys.stderr)
+        all_results.append((post_count, run_scenario(app, graph_http, post_count, args.latency,
+                                                     args.error_rate, args.expansion_error)))
+
+    report = format_report(all_results, args.latency, args.error_rate)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+# ==========================================
+# ====== EVENT LOG (JSON lines) ======
+# ==========================================
+# Chức năng chính: Ghi log sự kiện của scheduler dạng JSON lines (mỗi dòng một object JSON)
+# - Các trường chính: timestamp, row, platform, mode, status, latency_ms, post_id, error_class
+#   (thêm error, caption, image_path khi có)
+# - emit() chỉ thêm bản ghi vào buffer trong bộ nhớ, không mở file, không chặn lượt đăng bài
+# - Thread nền ghi buffer ra file theo lô: khi đủ LOG_FLUSH_SIZE bản ghi hoặc sau LOG_FLUSH_INTERVAL giây
+# - flush() ghi ngay phần còn lại (gọi khi tắt scheduler, tự gọi lúc thoát tiến trình)
+# - Buffer có giới hạn LOG_BUFFER_MAX: khi đĩa chậm/lỗi thì bỏ bản ghi cũ nhất và đếm số bản ghi bị bỏ
+# - Xoay vòng file log (trong thread ghi): file quá LOG_ROTATE_BYTES hoặc sang ngày mới thì được nén gzip
+#   vào LOG_ARCHIVE_DIR; archive quá LOG_ARCHIVE_RETENTION_DAYS ngày bị xóa
+# - Index của archive (<tên log>.index.json): khoảng thời gian và số bản ghi theo (ngày, platform, status)
+#   nên truy vấn thống kê không phải giải nén các archive nằm trọn trong khoảng thời gian cần xem
+
+import atexit
+import gzip
+import json
+import os
+import threading
+from collections import Counter, deque
+from datetime import datetime, timedelta
+
+# Các trường chuẩn của một bản ghi (thứ tự khi ghi ra file)
+LOG_FIELDS = ["timestamp", "row", "platform", "mode", "status", "latency_ms", "post_id", "error_class"]
+
+# Số bản ghi trong buffer để ghi ra file ngay (không chờ hết chu kỳ)
+LOG_FLUSH_SIZE = 200
+
+# Chu kỳ (giây) thread nền ghi buffer ra file
+LOG_FLUSH_INTERVAL = 1.0
+
+# Số bản ghi tối đa giữ trong bộ nhớ chờ ghi (mỗi file)
+LOG_BUFFER_MAX = 50000
+
+# Buffer theo file log: {đường dẫn: deque các dòng JSON đã mã hóa}
+_buffers = {}
+_buffer_lock = threading.Condition()
+
+# Chỉ một lần ghi file tại một thời điểm (thread nền hoặc flush())
+_write_lock = threading.Lock()
+
+# Xoay vòng file log: kích thước tối đa (byte) của file đang ghi
+LOG_ROTATE_BYTES = 10 * 1024 * 1024
+
+# Thư mục chứa archive (cùng thư mục với file log) và số ngày giữ archive
+LOG_ARCHIVE_DIR = "log_archive"
+LOG_ARCHIVE_RETENTION_DAYS = 365
+
+_writer_thread = None
+_stats = {"written": 0, "dropped": 0, "flushes": 0, "write_errors": 0, "rotations": 0}
+
+# ====== Hàm tạo bản ghi ======
+# Chức năng: Tạo bản ghi đủ LOG_FIELDS (trường không có = None) cộng các trường thêm khác None.
+# - timestamp: ISO 8601 theo giờ máy, có mili giây.
+def build_record(status, **fields):
+    record = {field: None for field in LOG_FIELDS}
+    record["timestamp"] = datetime.now().isoformat(timespec="milliseconds")
+    record["status"] = status
+    for key, value in fields.items():
+        if value is not None or key in record:
+            record[key] = value
+    return record
+
+# ====== Hàm ghi sự kiện ======
+# Chức năng: Thêm bản ghi vào buffer của file path (không chặn, không đụng tới đĩa).
+# - Mã hóa JSON ngay để bản ghi không bị sửa sau khi emit.
+# - Đủ LOG_FLUSH_SIZE bản ghi thì đánh thức thread nền.
+def emit(path, record):
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _buffer_lock:
+        ensure_writer()
+        buffer = _buffers.setdefault(path, deque(maxlen=LOG_BUFFER_MAX))
+        if len(buffer) == buffer.maxlen:
+            _stats["dropped"] += 1
+        buffer.append(line)
+        if len(buffer) >= LOG_FLUSH_SIZE:
+            _buffer_lock.notify()
+
+# ====== Hàm khởi động thread nền ======
+# Chức năng: Tạo thread ghi log (daemon) lần đầu có bản ghi. Gọi khi đang giữ _buffer_lock.
+def ensure_writer():
+    global _writer_thread
+    if _writer_thread is None or not _writer_thread.is_alive():
+        _writer_thread = threading.Thread(target=writer_loop, name="event-log-writer", daemon=True)
+        _writer_thread.start()
+
+def writer_loop():
+    while True:
+        with _buffer_lock:
+            if not any(len(buffer) >= LOG_FLUSH_SIZE for buffer in _buffers.values()):
+                _buffer_lock.wait(LOG_FLUSH_INTERVAL)
+        flush()
+
+# ====== Hàm ghi buffer ra file ======
+# Chức năng: Ghi toàn bộ bản ghi đang chờ ra file (mỗi file một lần mở, một lần write).
+# - Ghi lỗi thì trả bản ghi lại đầu buffer để lần sau ghi tiếp, chỉ in cảnh báo.
+# - Trả về số bản ghi đã ghi.
+def flush():
+    written = 0
+    with _write_lock:
+        with _buffer_lock:
+            pending = {path: lines for path, lines in _buffers.items() if lines}
+            for path in pending:
+                _buffers[path] = deque(maxlen=LOG_BUFFER_MAX)
+        for path, lines in pending.items():
+            try:
+                rotate_if_needed(path)
+            except Exception as e:
+                print(f"⚠️ Lỗi xoay vòng log {path}: {e}")
+            try:
+                with open(path, "a", encoding="utf-8") as logf:
+                    logf.write("\n".join(lines) + "\n")
+                written += len(lines)
+            except Exception as e:
+                print(f"❌ Lỗi ghi log {path}: {e}")
+                with _buffer_lock:
+                    _buffers[path] = deque(list(lines) + list(_buffers[path]), maxlen=LOG_BUFFER_MAX)
+                    _stats["write_errors"] += 1
+        with _buffer_lock:
+            _stats["written"] += written
+            if pending:
+                _stats["flushes"] += 1
+    return written
+
+# ====== Hàm kiểm tra cần xoay vòng log ======
+# Chức năng: File log đang ghi quá LOG_ROTATE_BYTES hoặc được ghi lần cuối từ ngày trước thì xoay vòng.
+# - File rỗng không xoay vòng.
+# - Gọi trong flush() (thread ghi), không ảnh hưởng emit().
+def rotate_if_needed(path, now=None):
+    now = now or datetime.now()
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if stat.st_size and (stat.st_size >= LOG_ROTATE_BYTES or datetime.fromtimestamp(stat.st_mtime).date() < now.date()):
+        return rotate(path, now)
+    return None
+
+# ====== Hàm xoay vòng log ======
+# Chức năng: Chuyển file log đang ghi vào archive nén gzip và cập nhật index.
+# - Đổi tên file trước (lần ghi sau tạo file mới ngay), rồi nén và đếm bản ghi theo (ngày, platform, status).
+# - Xóa archive quá LOG_ARCHIVE_RETENTION_DAYS ngày.
+# - Trả về đường dẫn archive.
+def rotate(path, now=None):
+    now = now or datetime.now()
+    directory = archive_dir(path)
+    os.makedirs(directory, exist_ok=True)
+    rotating = f"{path}.rotating"
+    if not os.path.exists(rotating):
+        os.replace(path, rotating)
+    archive = os.path.join(directory, f"{log_base(path)}.{now.strftime('%Y%m%d-%H%M%S-%f')}.jsonl.gz")
+    counts = Counter()
+    start = end = None
+    records = 0
+    with open(rotating, encoding="utf-8") as src, gzip.open(archive, "wt", encoding="utf-8") as dst:
+        for line in src:
+            dst.write(line)
+            try:
+                record = json.loads(line)
+                timestamp = record["timestamp"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            records += 1
+            counts[count_key(record)] += 1
+            start = timestamp if start is None or timestamp < start else start
+            end = timestamp if end is None or timestamp > end else end
+    entries = [entry for entry in load_index(path) if entry["file"] != os.path.basename(archive)]
+    entries.append({"file": os.path.basename(archive), "start": start, "end": end, "records": records,
+                    "counts": dict(counts)})
+    save_index(path, prune_archives(path, entries, now))
+    os.remove(rotating)
+    with _buffer_lock:
+        _stats["rotations"] += 1
+    print(f"🗜️ Đã nén log {path} → {archive} ({records} bản ghi)")
+    return archive
+
+# ====== Hàm xóa archive cũ ======
+# Chức năng: Xóa archive có bản ghi cuối cũ hơn LOG_ARCHIVE_RETENTION_DAYS ngày, trả về index còn lại.
+def prune_archives(path, entries, now):
+    cutoff = (now - timedelta(days=LOG_ARCHIVE_RETENTION_DAYS)).isoformat(timespec="milliseconds")
+    kept = []
+    for entry in entries:
+        if entry["end"] and entry["end"] < cutoff:
+            try:
+                os.remove(os.path.join(archive_dir(path), entry["file"]))
+            except FileNotFoundError:
+                pass
+            continue
+        kept.append(entry)
+    return kept
+
+def archive_dir(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), LOG_ARCHIVE_DIR)
+
+def log_base(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+# Khóa đếm trong index: "ngày|platform|status"
+def count_key(record):
+    return f"{str(record.get('timestamp'))[:10]}|{record.get('platform') or ''}|{record.get('status') or ''}"
+
+# ====== Hàm đọc/ghi index archive ======
+# Chức năng: Index là danh sách archive {file, start, end, records, counts}, lưu JSON cạnh các archive.
+# - Ghi ra file tạm rồi os.replace (không để lại index ghi dở).
+def load_index(path):
+    try:
+        with open(os.path.join(archive_dir(path), f"{log_base(path)}.index.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+def save_index(path, entries):
+    index_file = os.path.join(archive_dir(path), f"{log_base(path)}.index.json")
+    with open(f"{index_file}.tmp", "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False)
+    os.replace(f"{index_file}.tmp", index_file)
+
+# ====== Hàm đọc log ======
+# Chức năng: Đọc các bản ghi JSON của file log (bỏ qua dòng hỏng, vd dòng văn bản cũ).
+# - Đọc được cả archive .gz.
+def read_records(path):
+    return list(iter_file_records(path))
+
+def iter_file_records(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    try:
+        with opener(path, "rt", encoding="utf-8") as logf:
+            for line in logf:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        return
+
+# ====== Hàm lọc bản ghi ======
+# Chức năng: Bản ghi có nằm trong [since, until] và đúng platform/status không (None = không lọc).
+# - since/until: chuỗi ISO cùng định dạng timestamp của bản ghi (so sánh chuỗi).
+def record_matches(record, since=None, until=None, platform=None, status=None):
+    timestamp = str(record.get("timestamp") or "")
+    if (since and timestamp < since) or (until and timestamp > until):
+        return False
+    if platform and (record.get("platform") or "").lower() != platform.lower():
+        return False
+    if status and (record.get("status") or "").upper() != status.upper():
+        return False
+    return True
+
+def to_iso(value):
+    return value.isoformat(timespec="milliseconds") if isinstance(value, datetime) else value
+
+# ====== Hàm duyệt bản ghi theo khoảng thời gian ======
+# Chức năng: Duyệt bản ghi khớp bộ lọc trong các archive có khoảng thời gian giao với [since, until]
+#   (theo index, archive nằm ngoài khoảng không được mở) rồi tới file đang ghi.
+def iter_records(path, since=None, until=None, platform=None, status=None):
+    since, until = to_iso(since), to_iso(until)
+    for entry in load_index(path):
+        if not entry["start"] or (until and entry["start"] > until) or (since and entry["end"] < since):
+            continue
+        for record in iter_file_records(os.path.join(archive_dir(path), entry["file"])):
+            if record_matches(record, since, until, platform, status):
+                yield record
+    for record in iter_file_records(path):
+        if record_matches(record, since, until, platform, status):
+            yield record
+
+# ====== Hàm thống kê bản ghi ======
+# Chức năng: Đếm bản ghi theo (ngày, platform, status) trong [since, until].
+# - Archive nằm trọn trong khoảng: cộng số đếm trong index (không giải nén).
+# - Archive giao một phần và file đang ghi: đọc và lọc từng bản ghi.
+# - Trả về Counter {(ngày, platform, status): số bản ghi}.
+def count_records(path, since=None, until=None, platform=None, status=None):
+    since, until = to_iso(since), to_iso(until)
+    counts = Counter()
+    for entry in load_index(path):
+        if not entry["start"] or (until and entry["start"] > until) or (since and entry["end"] < since):
+            continue
+        if (not since or entry["start"] >= since) and (not until or entry["end"] <= until):
+            for key, count in entry["counts"].items():
+                day, record_platform, record_status = key.split("|", 2)
+                if record_matches({"platform": record_platform, "status": record_status}, None, None, platform, status):
+                    counts[(day, record_platform, record_status)] += count
+            continue
+        for record in iter_file_records(os.path.join(archive_dir(path), entry["file"])):
+            if record_matches(record, since, until, platform, status):
+                counts[tuple(count_key(record).split("|", 2))] += 1
+    for record in iter_file_records(path):
+        if record_matches(record, since, until, platform, status):
+            counts[tuple(count_key(record).split("|", 2))] += 1
+    return counts
+
+def get_stats():
+    with _buffer_lock:
+        return dict(_stats, buffered=sum(len(buffer) for buffer in _buffers.values()))
+
+# Ghi nốt buffer khi tiến trình thoát
+atexit.register(flush)
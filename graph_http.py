@@ -0,0 +1,312 @@
+# ==========================================
+# ====== GRAPH API HTTP TRANSPORT ======
+# ==========================================
+# Chức năng chính: Kết nối HTTP dùng chung cho mọi lời gọi Graph API (app.py và scheduler.py)
+# - Một requests.Session duy nhất, giữ kết nối (keep-alive) thay vì mở TLS mới mỗi lần gọi
+# - Pool kết nối đủ lớn cho các request chạy song song
+# - Timeout mặc định cho mọi request
+# - Tự động retry (urllib3) khi lỗi kết nối hoặc HTTP 429/5xx
+# - Đo thời gian từng lời gọi và thống kê theo endpoint
+# - Đọc header X-App-Usage / X-Business-Use-Case-Usage để tự giảm tốc trước khi bị Meta khóa
+# - Ưu tiên lời gọi đăng bài (publish) hơn lời gọi lấy thống kê (analytics)
+
+import json
+import os
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# ====== CONSTANTS & CONFIGURATION ======
+# Địa chỉ và phiên bản Graph API
+# - Đặt biến môi trường GRAPH_API_BASE để trỏ sang server giả lập (graph_stub_server.py) khi benchmark
+GRAPH_API_BASE = os.getenv("GRAPH_API_BASE", "https://graph.facebook.com").rstrip("/")
+GRAPH_API_VERSION = "v19.0"
+
+# Timeout mặc định (giây) cho mỗi request
+DEFAULT_TIMEOUT = 30
+
+# Số kết nối giữ sẵn trong pool (nên >= số request chạy song song tối đa)
+POOL_MAXSIZE = 64
+
+# Retry khi lỗi tạm thời:
+# - Lỗi kết nối (chưa gửi được request) được retry cho mọi method
+# - HTTP 429/5xx chỉ retry cho method idempotent (GET...), không retry POST để tránh đăng trùng bài
+RETRY_TOTAL = 3
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Mức ưu tiên của request
+PRIORITY_PUBLISH = "publish"
+PRIORITY_ANALYTICS = "analytics"
+
+# Ngưỡng sử dụng rate limit (% của giới hạn Meta):
+# - Từ THROTTLE_SLOWDOWN_PCT: request analytics bị chờ thêm, tăng dần tới THROTTLE_MAX_DELAY giây
+# - Từ THROTTLE_PAUSE_PCT: tạm dừng analytics trong THROTTLE_PAUSE_SECONDS giây
+# - Từ PUBLISH_PAUSE_PCT: tạm dừng cả publish
+THROTTLE_SLOWDOWN_PCT = 75
+THROTTLE_PAUSE_PCT = 90
+PUBLISH_PAUSE_PCT = 99
+THROTTLE_MAX_DELAY = 5
+THROTTLE_PAUSE_SECONDS = 60
+
+# Thời gian chờ tối đa (giây) trước khi bỏ qua request vì đang bị giới hạn
+ANALYTICS_MAX_WAIT = 10
+PUBLISH_MAX_WAIT = 60
+
+_session = None
+_session_lock = threading.Lock()
+
+# Mức sử dụng rate limit đọc từ header của response gần nhất
+_usage = {"app_pct": 0, "business_pct": 0, "max_pct": 0, "regain_at": 0.0, "updated_at": 0.0}
+_usage_lock = threading.Lock()
+
+# Số request publish đang chờ/đang gửi (analytics nhường khi gần giới hạn)
+_publish_inflight = 0
+
+# Thống kê độ trễ theo endpoint: {"GET posts": {"count", "errors", "total_ms", "max_ms", "last_ms"}}
+_latency_stats = {}
+_latency_lock = threading.Lock()
+
+# ====== Lỗi khi request bị giới hạn ======
+# Raise khi phải chờ lâu hơn thời gian cho phép; là RequestException nên
+# các chỗ đang bắt lỗi mạng của requests xử lý được luôn.
+class GraphThrottled(requests.exceptions.RequestException):
+    pass
+
+# ====== Hàm tạo URL Graph API ======
+# Chức năng: Ghép đường dẫn tương đối thành URL Graph API đầy đủ.
+# - Ví dụ: graph_url("123/posts") → "https://graph.facebook.com/v19.0/123/posts"
+def graph_url(path=""):
+    return f"{GRAPH_API_BASE}/{GRAPH_API_VERSION}/{path}"
+
+# ====== Hàm tạo session dùng chung ======
+# Chức năng: Tạo (một lần) requests.Session có pool kết nối và retry.
+# - An toàn khi gọi từ nhiều thread.
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=RETRY_TOTAL,
+                    backoff_factor=RETRY_BACKOFF_FACTOR,
+                    status_forcelist=RETRY_STATUS_CODES,
+                    respect_retry_after_header=True,
+                    raise_on_status=False
+                )
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+# ====== Hàm đóng session dùng chung ======
+# Chức năng: Đóng các kết nối đang giữ (dùng khi tắt scheduler hoặc trong test).
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+# ====== Hàm đặt nhãn endpoint cho thống kê ======
+# Chức năng: Bỏ phần ID (số) khỏi đường dẫn để gom thống kê theo loại endpoint.
+# - ".../v19.0/123/posts" → "posts", ".../v19.0/123_456" → "node", ".../v19.0/" → "ids"
+def endpoint_label(method, url):
+    path = url.split("?", 1)[0].rstrip("/")
+    parts = [p for p in path.split("/")[3:] if p and p != GRAPH_API_VERSION]
+    names = [p for p in parts if not re.fullmatch(r"[\d_]+", p)]
+    if names:
+        label = "/".join(names)
+    else:
+        label = "node" if parts else "ids"
+    return f"{method.upper()} {label}"
+
+# ====== Hàm ghi nhận độ trễ ======
+# Chức năng: Cộng dồn độ trễ của một lời gọi vào thống kê theo endpoint.
+def record_latency(label, latency_ms, error=False):
+    with _latency_lock:
+        stats = _latency_stats.setdefault(label, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0})
+        stats["count"] += 1
+        stats["errors"] += 1 if error else 0
+        stats["total_ms"] += latency_ms
+        stats["max_ms"] = max(stats["max_ms"], latency_ms)
+        stats["last_ms"] = latency_ms
+
+# ====== Hàm đọc header mức sử dụng của Meta ======
+# Chức năng: Đọc X-App-Usage và X-Business-Use-Case-Usage thành phần trăm sử dụng.
+# - X-App-Usage: {"call_count": 28, "total_time": 25, "total_cputime": 25}
+# - X-Business-Use-Case-Usage: {"<id>": [{"call_count": 5, ..., "estimated_time_to_regain_access": 0}]}
+# - Lấy giá trị lớn nhất trong các chỉ số; estimated_time_to_regain_access tính bằng phút.
+# - Trả về None nếu response không có header nào.
+def parse_usage_headers(headers):
+    app_header = headers.get("X-App-Usage")
+    business_header = headers.get("X-Business-Use-Case-Usage")
+    if not app_header and not business_header:
+        return None
+    
+    metrics = ("call_count", "total_time", "total_cputime")
+    app_pct, business_pct, regain_minutes = 0, 0, 0
+    try:
+        if app_header:
+            app_usage = json.loads(app_header)
+            app_pct = max(app_usage.get(m, 0) for m in metrics)
+        if business_header:
+            for entries in json.loads(business_header).values():
+                for entry in entries:
+                    business_pct = max([business_pct] + [entry.get(m, 0) for m in metrics])
+                    regain_minutes = max(regain_minutes, entry.get("estimated_time_to_regain_access", 0))
+    except (ValueError, AttributeError, TypeError) as e:
+        print(f"⚠️ Không đọc được header usage: {e}")
+        return None
+    
+    return {
+        "app_pct": app_pct,
+        "business_pct": business_pct,
+        "max_pct": max(app_pct, business_pct),
+        "regain_seconds": regain_minutes * 60
+    }
+
+# ====== Hàm cập nhật mức sử dụng ======
+# Chức năng: Cập nhật mức sử dụng từ header của response vừa nhận.
+def update_usage(headers, now=None):
+    usage = parse_usage_headers(headers)
+    if usage is None:
+        return
+    now = time.time() if now is None else now
+    with _usage_lock:
+        _usage["app_pct"] = usage["app_pct"]
+        _usage["business_pct"] = usage["business_pct"]
+        _usage["max_pct"] = usage["max_pct"]
+        _usage["regain_at"] = now + usage["regain_seconds"] if usage["regain_seconds"] else 0.0
+        _usage["updated_at"] = now
+    if usage["max_pct"] >= THROTTLE_SLOWDOWN_PCT:
+        print(f"⚠️ Graph API usage cao: {format_usage()}")
+
+# ====== Hàm lấy mức sử dụng hiện tại ======
+def get_usage():
+    with _usage_lock:
+        return dict(_usage)
+
+def reset_usage():
+    with _usage_lock:
+        _usage.update({"app_pct": 0, "business_pct": 0, "max_pct": 0, "regain_at": 0.0, "updated_at": 0.0})
+
+# ====== Hàm tạo chuỗi mức sử dụng ======
+# Chức năng: Tạo chuỗi mức sử dụng ngắn gọn để hiển thị trên UI và log.
+# - Ví dụ: "App 42% | Business 17%"
+def format_usage():
+    usage = get_usage()
+    text = f"App {usage['app_pct']:.0f}% | Business {usage['business_pct']:.0f}%"
+    if usage["regain_at"] > time.time():
+        text += f" | bị khóa thêm {usage['regain_at'] - time.time():.0f}s"
+    return text
+
+# ====== Hàm tính thời gian cần chờ ======
+# Chức năng: Tính số giây cần chờ trước khi gửi request theo mức sử dụng và mức ưu tiên.
+# - Meta báo estimated_time_to_regain_access: chờ tới lúc đó (mọi mức ưu tiên).
+# - publish: chỉ chờ khi mức sử dụng >= PUBLISH_PAUSE_PCT.
+# - analytics: chậm dần từ THROTTLE_SLOWDOWN_PCT, tạm dừng từ THROTTLE_PAUSE_PCT.
+# - Tạm dừng tính từ lần cập nhật header gần nhất, hết thời gian thì cho 1 request đi thăm dò
+#   (mức sử dụng giảm dần theo cửa sổ 1 giờ của Meta, chỉ biết được qua response mới).
+def throttle_delay(priority, now=None):
+    now = time.time() if now is None else now
+    usage = get_usage()
+    if usage["regain_at"] > now:
+        return usage["regain_at"] - now
+    
+    pct = usage["max_pct"]
+    pause_until = usage["updated_at"] + THROTTLE_PAUSE_SECONDS
+    if priority == PRIORITY_PUBLISH:
+        return max(0.0, pause_until - now) if pct >= PUBLISH_PAUSE_PCT else 0.0
+    
+    if pct >= THROTTLE_PAUSE_PCT:
+        return max(0.0, pause_until - now)
+    if pct >= THROTTLE_SLOWDOWN_PCT:
+        return THROTTLE_MAX_DELAY * (pct - THROTTLE_SLOWDOWN_PCT) / (THROTTLE_PAUSE_PCT - THROTTLE_SLOWDOWN_PCT)
+    return 0.0
+
+# ====== Hàm chờ tới khi được gửi request ======
+# Chức năng: Chờ theo throttle_delay trước khi gửi request.
+# - analytics còn nhường cho publish đang chờ/đang gửi khi mức sử dụng đã cao.
+# - Raise GraphThrottled nếu phải chờ lâu hơn max_wait giây.
+def wait_for_capacity(priority, max_wait):
+    deadline = time.time() + max_wait
+    while True:
+        now = time.time()
+        delay = throttle_delay(priority, now)
+        if (priority == PRIORITY_ANALYTICS and _publish_inflight > 0
+                and get_usage()["max_pct"] >= THROTTLE_SLOWDOWN_PCT):
+            delay = max(delay, 0.5)
+        if delay <= 0:
+            return
+        if now + delay > deadline:
+            raise GraphThrottled(f"Graph API đang bị giới hạn ({format_usage()}), cần chờ {delay:.0f}s")
+        time.sleep(min(delay, 1.0))
+
+# ====== Hàm gửi request ======
+# Chức năng: Gửi request qua session dùng chung và đo thời gian.
+# - Chờ theo mức sử dụng rate limit trước khi gửi (priority: publish/analytics).
+# - Tự thêm timeout mặc định nếu không truyền.
+# - Đọc header usage của response để điều chỉnh các request sau.
+# - Gắn latency_ms (mili giây, gồm cả các lần retry) vào response.
+# - Lỗi mạng (Timeout, ConnectionError...) vẫn được raise như requests.
+def request(method, url, timeout=DEFAULT_TIMEOUT, priority=PRIORITY_ANALYTICS, **kwargs):
+    global _publish_inflight
+    label = endpoint_label(method, url)
+    is_publish = priority == PRIORITY_PUBLISH
+    if is_publish:
+        with _usage_lock:
+            _publish_inflight += 1
+    try:
+        wait_for_capacity(priority, PUBLISH_MAX_WAIT if is_publish else ANALYTICS_MAX_WAIT)
+        start = time.perf_counter()
+        try:
+            resp = get_session().request(method, url, timeout=timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            record_latency(label, (time.perf_counter() - start) * 1000, error=True)
+            raise
+    finally:
+        if is_publish:
+            with _usage_lock:
+                _publish_inflight -= 1
+    latency_ms = (time.perf_counter() - start) * 1000
+    record_latency(label, latency_ms, error=resp.status_code >= 400)
+    update_usage(resp.headers)
+    resp.latency_ms = latency_ms
+    return resp
+
+def get(url, params=None, timeout=DEFAULT_TIMEOUT, priority=PRIORITY_ANALYTICS, **kwargs):
+    return request("GET", url, params=params, timeout=timeout, priority=priority, **kwargs)
+
+def post(url, data=None, timeout=DEFAULT_TIMEOUT, priority=PRIORITY_PUBLISH, **kwargs):
+    return request("POST", url, data=data, timeout=timeout, priority=priority, **kwargs)
+
+# ====== Hàm lấy thống kê độ trễ ======
+# Chức năng: Trả về bản sao thống kê độ trễ theo endpoint, kèm avg_ms.
+def get_latency_stats():
+    with _latency_lock:
+        return {
+            label: dict(stats, avg_ms=stats["total_ms"] / stats["count"] if stats["count"] else 0.0)
+            for label, stats in _latency_stats.items()
+        }
+
+def reset_latency_stats():
+    with _latency_lock:
+        _latency_stats.clear()
+
+# ====== Hàm tạo báo cáo độ trễ ======
+# Chức năng: Tạo chuỗi báo cáo độ trễ ngắn gọn để in ra log.
+# - Ví dụ: "POST photos: 3 lần, TB 420 ms, max 610 ms, 0 lỗi"
+def format_latency_report():
+    lines = []
+    for label, stats in sorted(get_latency_stats().items()):
+        lines.append(
+            f"{label}: {stats['count']} lần, TB {stats['avg_ms']:.0f} ms, "
+            f"max {stats['max_ms']:.0f} ms, {stats['errors']} lỗi"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,268 @@
+# ==========================================
+# ====== GRAPH API STUB SERVER ======
+# ==========================================
+# Chức năng chính: Server HTTP giả lập Graph API để đo hiệu năng mà không gọi Meta
+# - GET /{version}/{page_id}/posts: danh sách bài viết, phân trang bằng cursor (paging.next),
+#   lọc since/until, hỗ trợ field expansion (likes/comments/shares/reactions kèm theo bài)
+# - GET /{version}/{post_id}: thống kê một bài viết
+# - GET /{version}/?ids=a,b,c: thống kê nhiều bài viết trong một request
+# - Cấu hình được số bài viết (50 → 50k), độ trễ mỗi request và tỉ lệ lỗi
+# - Đếm số request theo loại endpoint để so sánh với thống kê phía client
+#
+# Chạy riêng:
+#   python graph_stub_server.py --posts 5000 --latency 50 --error-rate 0.01
+#   GRAPH_API_BASE=http://127.0.0.1:8765 FB_PREWARM_INTERVAL=0 streamlit run app.py
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+# ====== CONSTANTS & CONFIGURATION ======
+# Cổng mặc định khi chạy riêng (0 = hệ điều hành tự chọn cổng trống)
+STUB_DEFAULT_PORT = 8765
+
+# Số bài tối đa mỗi trang /posts (giống giới hạn của Graph API)
+STUB_MAX_PAGE_SIZE = 100
+
+# Khoảng cách thời gian đăng giữa 2 bài liên tiếp (giây)
+STUB_POST_INTERVAL = 3600
+
+# Các field thống kê, nếu được yêu cầu trong "fields" thì trả về kèm bài viết
+STAT_FIELDS = ("message", "likes", "comments", "shares", "reactions")
+
+# ====== Hàm tạo bài viết giả lập ======
+# Chức năng: Tạo dữ liệu của bài viết thứ index (0 = mới nhất).
+# - Số liệu tương tác cố định theo index để kết quả lặp lại được giữa các lần chạy.
+def build_stub_post(page_id, index, newest_time):
+    created = newest_time - index * STUB_POST_INTERVAL
+    likes = (index * 37) % 500
+    return {
+        "id": f"{page_id}_{index + 1}",
+        "created_time": time.strftime("%Y-%m-%dT%H:%M:%S+0000", time.gmtime(created)),
+        "created_ts": created,
+        "message": f"Bài viết mẫu số {index + 1}",
+        "likes": likes,
+        "comments": (index * 13) % 80,
+        "shares": (index * 7) % 30,
+        "reactions": likes + (index * 5) % 60
+    }
+
+# ====== Hàm chuyển bài viết theo field được yêu cầu ======
+# Chức năng: Trả về bài viết đúng cấu trúc Graph API với các field trong tham số "fields".
+# - "likes.summary(true).limit(0)" → {"data": [], "summary": {"total_count": n}}
+def render_post(post, fields):
+    requested = {field.strip().split(".")[0].split("{")[0] for field in fields.split(",") if field.strip()}
+    node = {"id": post["id"]}
+    if "created_time" in requested:
+        node["created_time"] = post["created_time"]
+    if "message" in requested:
+        node["message"] = post["message"]
+    for field in ("likes", "comments", "reactions"):
+        if field in requested:
+            node[field] = {"data": [], "summary": {"total_count": post[field]}}
+    if "shares" in requested:
+        node["shares"] = {"count": post["shares"]}
+    return node
+
+# ====== SERVER ======
+
+class GraphStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, post_count=50, latency_ms=0, error_rate=0.0, expansion_error=False,
+                 usage_pct=None, seed=0):
+        super().__init__(address, GraphStubHandler)
+        self.post_count = post_count
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.expansion_error = expansion_error
+        self.usage_pct = usage_pct
+        self.newest_time = int(time.time()) // 60 * 60
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_counts = {}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, label):
+        with self.lock:
+            self.request_counts[label] = self.request_counts.get(label, 0) + 1
+
+    def should_fail(self):
+        if self.error_rate <= 0:
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def post_at(self, page_id, index):
+        return build_stub_post(page_id, index, self.newest_time)
+
+class GraphStubHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.server.usage_pct is not None:
+            pct = self.server.usage_pct
+            self.send_header("X-App-Usage", json.dumps({"call_count": pct, "total_time": pct, "total_cputime": pct}))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message, code, label):
+        self.server.count("errors")
+        self.server.count(f"errors {label}")
+        self.send_json(status, {"error": {"message": message, "type": "OAuthException", "code": code}})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [p for p in url.path.split("/") if p and not re.fullmatch(r"v\d+\.\d+", p)]
+
+        if len(parts) == 2 and parts[1] == "posts":
+            label = "posts"
+        elif len(parts) == 1:
+            label = "node"
+        elif not parts and "ids" in params:
+            label = "ids"
+        else:
+            label = "unknown"
+        self.server.count(label)
+
+        if self.server.latency_ms:
+            time.sleep(self.server.latency_ms / 1000)
+        if self.server.should_fail():
+            self.send_error_json(500, "An unexpected error has occurred. Please retry your request later.", 2, label)
+            return
+
+        fields = params.get("fields", "id")
+        if label == "posts":
+            self.handle_posts(parts[0], params, fields)
+        elif label == "node":
+            self.handle_node(parts[0], fields)
+        elif label == "ids":
+            self.handle_ids(params["ids"], fields)
+        else:
+            self.send_error_json(400, "Unknown path components", 2500, label)
+
+    # ====== Xử lý /{page_id}/posts ======
+    # - Cursor "after" là vị trí (index) bài tiếp theo.
+    # - since/until lọc theo thời gian đăng (unix timestamp), bài mới nhất trước.
+    def handle_posts(self, page_id, params, fields):
+        if self.server.expansion_error and any(f"{field}." in fields for field in ("likes", "comments", "reactions")):
+            self.send_error_json(400, "(#100) Field expansion is not supported", 100, "posts")
+            return
+
+        server = self.server
+        limit = max(1, min(int(params.get("limit", 25)), STUB_MAX_PAGE_SIZE))
+        start = int(params.get("after", 0))
+        if "until" in params:
+            start = max(start, (server.newest_time - int(params["until"]) + STUB_POST_INTERVAL - 1) // STUB_POST_INTERVAL)
+        end = server.post_count
+        if "since" in params:
+            end = min(end, (server.newest_time - int(params["since"])) // STUB_POST_INTERVAL + 1)
+
+        stop = min(start + limit, end)
+        data = [render_post(server.post_at(page_id, index), fields) for index in range(start, max(start, stop))]
+        payload = {"data": data}
+        if stop < end:
+            next_params = dict(params, after=str(stop))
+            payload["paging"] = {
+                "cursors": {"after": str(stop)},
+                "next": f"{server.base_url}{urlsplit(self.path).path}?{urlencode(next_params)}"
+            }
+        self.send_json(200, payload)
+
+    def find_post(self, post_id):
+        page_id, _, number = post_id.rpartition("_")
+        if not page_id or not number.isdigit() or not 1 <= int(number) <= self.server.post_count:
+            return None
+        return self.server.post_at(page_id, int(number) - 1)
+
+    # ====== Xử lý /{post_id} ======
+    def handle_node(self, post_id, fields):
+        post = self.find_post(post_id)
+        if post is None:
+            self.send_error_json(400, f"Unsupported get request. Object with ID '{post_id}' does not exist", 100, "node")
+            return
+        self.send_json(200, render_post(post, fields))
+
+    # ====== Xử lý ?ids= ======
+    # - Tối đa 50 id mỗi request như Graph API.
+    def handle_ids(self, ids, fields):
+        post_ids = [post_id for post_id in ids.split(",") if post_id]
+        if len(post_ids) > 50:
+            self.send_error_json(400, "(#100) Too many IDs. Maximum: 50", 100, "ids")
+            return
+        result = {}
+        for post_id in post_ids:
+            post = self.find_post(post_id)
+            if post is None:
+                self.send_error_json(404, f"(#803) Some of the aliases you requested do not exist: {post_id}", 803, "ids")
+                return
+            result[post_id] = render_post(post, fields)
+        self.send_json(200, result)
+
+# ====== Hàm khởi động server giả lập ======
+# Chức năng: Chạy server giả lập trên thread nền.
+# - port=0: tự chọn cổng trống; địa chỉ lấy qua server.base_url.
+# - latency_ms: độ trễ thêm cho mỗi request.
+# - error_rate: tỉ lệ request trả về HTTP 500 (0 → 1).
+# - expansion_error: /posts từ chối field expansion (để chạy nhánh fallback lấy theo lô).
+# - usage_pct: trả về header X-App-Usage với mức sử dụng này (None = không trả header).
+# - Trả về đối tượng server (dừng bằng stop_stub_server).
+def start_stub_server(post_count=50, latency_ms=0, error_rate=0.0, expansion_error=False, usage_pct=None,
+                      host="127.0.0.1", port=0, seed=0):
+    server = GraphStubServer((host, port), post_count=post_count, latency_ms=latency_ms, error_rate=error_rate,
+                             expansion_error=expansion_error, usage_pct=usage_pct, seed=seed)
+    thread = threading.Thread(target=server.serve_forever, name="graph-stub", daemon=True)
+    thread.start()
+    return server
+
+def stop_stub_server(server):
+    server.shutdown()
+    server.server_close()
+
+# ====== Hàm đọc/xóa số request đã nhận ======
+def get_request_counts(server):
+    with server.lock:
+        return dict(server.request_counts)
+
+def reset_request_counts(server):
+    with server.lock:
+        server.request_counts.clear()
+
+def main():
+    parser = argparse.ArgumentParser(description="Server giả lập Graph API cho benchmark")
+    parser.add_argument("--posts", type=int, default=50, help="Số bài viết của page")
+    parser.add_argument("--latency", type=float, default=0, help="Độ trễ mỗi request (ms)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ request lỗi HTTP 500 (0 → 1)")
+    parser.add_argument("--expansion-error", action="store_true", help="Từ chối field expansion trên /posts")
+    parser.add_argument("--port", type=int, default=STUB_DEFAULT_PORT)
+    args = parser.parse_args()
+
+    server = GraphStubServer(("127.0.0.1", args.port), post_count=args.posts, latency_ms=args.latency,
+                             error_rate=args.error_rate, expansion_error=args.expansion_error)
+    print(f"✅ Graph API giả lập: {server.base_url} ({args.posts} bài viết)")
+    print(f"   Dùng: GRAPH_API_BASE={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# ==========================================
+# ====== INSIGHTS CACHE (SQLite) ======
+# ==========================================
+# Chức năng chính: Bộ nhớ đệm thống kê bài viết Facebook dùng chung giữa các phiên
+# - Lưu trên đĩa bằng SQLite, không phụ thuộc tiến trình Streamlit
+# - Mỗi bài viết một dòng: post_id, bản ghi thống kê (JSON), created_time, fetched_at
+# - Hết hạn theo tuổi bài viết (refresh tiers): bài mới làm mới thường xuyên, bài cũ thưa dần
+# - Dọn bớt bài cũ theo số lượng tối đa và thời gian lưu giữ
+# - Bảng meta lưu các giá trị trạng thái dạng key/value
+
+import json
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+# File SQLite mặc định
+INSIGHTS_CACHE_FILE = "insights_cache.db"
+
+# ====== Hàm mở kết nối SQLite ======
+# Chức năng: Mở kết nối tới file cache và tạo bảng nếu chưa có.
+# - Bật WAL để đọc không bị chặn khi có phiên khác đang ghi.
+# - timeout 30 giây khi file đang bị khóa.
+def connect(db_path=INSIGHTS_CACHE_FILE):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS post_stats (
+            post_id TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            created_time TEXT,
+            fetched_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_post_stats_created ON post_stats(created_time)")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    return conn
+
+# ====== Hàm ghi bản ghi bài viết vào cache ======
+# Chức năng: Ghi (hoặc ghi đè) bản ghi thống kê của nhiều bài viết.
+# - records: danh sách bản ghi có "id" và "created_time".
+# - fetched_at: thời điểm lấy (unix time), mặc định là hiện tại.
+def put_post_records(records, db_path=INSIGHTS_CACHE_FILE, fetched_at=None):
+    if not records:
+        return
+    fetched_at = time.time() if fetched_at is None else fetched_at
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO post_stats (post_id, payload, created_time, fetched_at) VALUES (?, ?, ?, ?)",
+                [
+                    (record["id"], json.dumps(record, ensure_ascii=False), record.get("created_time"), fetched_at)
+                    for record in records
+                ]
+            )
+    finally:
+        conn.close()
+
+# ====== Hàm đọc toàn bộ bản ghi trong cache ======
+# Chức năng: Đọc tất cả bản ghi thống kê, mới nhất lên đầu.
+# - Trả về danh sách bản ghi (cùng cấu trúc đã ghi vào).
+def get_post_records(db_path=INSIGHTS_CACHE_FILE):
+    conn = connect(db_path)
+    try:
+        rows = conn.execute("SELECT payload FROM post_stats ORDER BY created_time DESC").fetchall()
+    finally:
+        conn.close()
+    return [json.loads(payload) for (payload,) in rows]
+
+# ====== Hàm lấy danh sách bài viết cần làm mới theo tuổi bài ======
+# Chức năng: Lấy post_id các bài cần lấy lại thống kê theo bậc tuổi bài viết.
+# - tiers: danh sách (tuổi tối đa, chu kỳ làm mới) tính bằng giây, sắp xếp tăng dần.
+#   Ví dụ [(48 giờ, 1 giờ), (30 ngày, 1 ngày)]: bài dưới 48h làm mới mỗi giờ,
+#   bài dưới 30 ngày làm mới mỗi ngày, bài cũ hơn thì giữ nguyên (không làm mới nữa).
+# - Chu kỳ làm mới phải tăng dần theo tuổi bài.
+# - created_time của Graph API luôn ở UTC (+0000) nên so sánh chuỗi được.
+# - now: thời điểm so sánh (unix time), mặc định là hiện tại.
+def get_stale_ids_by_age(tiers, db_path=INSIGHTS_CACHE_FILE, now=None):
+    if not tiers:
+        return []
+    now = time.time() if now is None else now
+    clauses = []
+    params = []
+    for max_age, interval in tiers:
+        cutoff = datetime.fromtimestamp(now - max_age, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+0000")
+        clauses.append("(created_time >= ? AND fetched_at < ?)")
+        params.extend([cutoff, now - interval])
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(f"SELECT post_id FROM post_stats WHERE {' OR '.join(clauses)}", params).fetchall()
+    finally:
+        conn.close()
+    return [post_id for (post_id,) in rows]
+
+# ====== Hàm lấy thời điểm cập nhật gần nhất ======
+# Chức năng: Trả về fetched_at lớn nhất trong cache (unix time) hoặc None nếu cache rỗng.
+def get_last_fetched_at(db_path=INSIGHTS_CACHE_FILE):
+    conn = connect(db_path)
+    try:
+        return conn.execute("SELECT MAX(fetched_at) FROM post_stats").fetchone()[0]
+    finally:
+        conn.close()
+
+# ====== Hàm dọn cache ======
+# Chức năng: Xóa bớt bản ghi để cache không phình mãi.
+# - retention_days: xóa bài đăng (created_time) cũ hơn số ngày này; None để giữ hết.
+# - max_entries: chỉ giữ lại số bài mới nhất này; None để không giới hạn.
+# - Trả về số bản ghi đã xóa.
+def evict_post_records(db_path=INSIGHTS_CACHE_FILE, max_entries=None, retention_days=None):
+    conn = connect(db_path)
+    deleted = 0
+    try:
+        with conn:
+            if retention_days is not None:
+                cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).strftime("%Y-%m-%dT%H:%M:%S+0000")
+                deleted += conn.execute("DELETE FROM post_stats WHERE created_time < ?", (cutoff,)).rowcount
+            if max_entries is not None:
+                deleted += conn.execute("""
+                    DELETE FROM post_stats WHERE post_id NOT IN (
+                        SELECT post_id FROM post_stats ORDER BY created_time DESC LIMIT ?
+                    )
+                """, (max_entries,)).rowcount
+    finally:
+        conn.close()
+    return deleted
+
+# ====== Hàm xóa toàn bộ cache ======
+# Chức năng: Xóa hết bản ghi thống kê và meta.
+def clear(db_path=INSIGHTS_CACHE_FILE):
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("DELETE FROM post_stats")
+            conn.execute("DELETE FROM meta")
+    finally:
+        conn.close()
+
+# ====== Hàm đọc/ghi giá trị meta ======
+# Chức năng: Lưu các giá trị trạng thái nhỏ (dạng chuỗi) cùng file cache.
+def get_meta(key, db_path=INSIGHTS_CACHE_FILE, default=None):
+    conn = connect(db_path)
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else default
+
+def set_meta(key, value, db_path=INSIGHTS_CACHE_FILE):
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+    finally:
+        conn.close()
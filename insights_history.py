@@ -0,0 +1,206 @@
+# ==========================================
+# ====== INSIGHTS HISTORY (Parquet) ======
+# ==========================================
+# Chức năng chính: Lưu lịch sử thống kê bài viết theo thời gian để xem tốc độ tăng tương tác
+# - Mỗi lần lấy thống kê ghi thêm snapshot (post_id, fetched_at, likes, comments, shares, reactions)
+# - Lưu dạng cột (Parquet), chia thư mục theo ngày lấy: insights_history/date=YYYY-MM-DD/
+# - Đọc theo lô (record batch) có lọc theo ngày và post_id, bộ nhớ không tăng theo lịch sử
+# - Gộp các file nhỏ của những ngày đã qua thành 1 file (compaction)
+# - Mỗi lần ghi/gộp đổi phiên bản lịch sử (history_version) để nơi đọc biết khi nào cần tính lại
+
+import os
+import uuid
+from datetime import datetime, timezone
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Thư mục mặc định chứa lịch sử
+INSIGHTS_HISTORY_DIR = "insights_history"
+
+# Số dòng mỗi lô khi đọc (giới hạn bộ nhớ khi quét lịch sử lớn)
+READ_BATCH_SIZE = 65536
+
+# Cấu trúc cột của một snapshot
+SNAPSHOT_SCHEMA = pa.schema([
+    ("post_id", pa.string()),
+    ("created_time", pa.timestamp("s", tz="UTC")),
+    ("fetched_at", pa.timestamp("s", tz="UTC")),
+    ("likes", pa.int64()),
+    ("comments", pa.int64()),
+    ("shares", pa.int64()),
+    ("reactions", pa.int64()),
+])
+
+METRIC_COLUMNS = ["likes", "comments", "shares", "reactions"]
+
+# File lưu phiên bản lịch sử (tên bắt đầu bằng "_" nên dataset không đọc)
+VERSION_FILE = "_version"
+
+# ====== Hàm ghi snapshot ======
+# Chức năng: Ghi snapshot thống kê của nhiều bài viết vào thư mục ngày tương ứng.
+# - records: bản ghi theo build_post_record (id, created_time, likes, comments, shares, reactions).
+# - fetched_at: thời điểm lấy (unix time), mặc định là hiện tại.
+# - Mỗi lần ghi tạo 1 file mới (không sửa file cũ), trả về đường dẫn file hoặc None nếu không có gì.
+def append_snapshots(records, base_dir=INSIGHTS_HISTORY_DIR, fetched_at=None):
+    if not records:
+        return None
+    fetched = datetime.fromtimestamp(fetched_at, timezone.utc) if fetched_at else datetime.now(timezone.utc)
+    fetched = fetched.replace(microsecond=0)
+
+    created = pd.to_datetime([r.get("created_time") for r in records], utc=True, errors="coerce")
+    columns = {
+        "post_id": [str(r["id"]) for r in records],
+        "created_time": [None if pd.isna(t) else t.to_pydatetime().replace(microsecond=0) for t in created],
+        "fetched_at": [fetched] * len(records),
+    }
+    for metric in METRIC_COLUMNS:
+        columns[metric] = [int(r.get(metric) or 0) for r in records]
+    table = pa.table(columns, schema=SNAPSHOT_SCHEMA)
+
+    partition_dir = os.path.join(base_dir, f"date={fetched.strftime('%Y-%m-%d')}")
+    os.makedirs(partition_dir, exist_ok=True)
+    path = os.path.join(partition_dir, f"part-{fetched.strftime('%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet")
+    pq.write_table(table, path)
+    bump_version(base_dir)
+    return path
+
+# ====== Hàm đổi phiên bản lịch sử ======
+# Chức năng: Ghi phiên bản mới (ngẫu nhiên) sau khi lịch sử thay đổi (ghi snapshot, gộp file).
+# - Ghi ra file tạm rồi đổi tên nên nơi đọc không bao giờ thấy file ghi dở.
+def bump_version(base_dir=INSIGHTS_HISTORY_DIR):
+    tmp_path = os.path.join(base_dir, f"{VERSION_FILE}-{uuid.uuid4().hex[:8]}")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(tmp_path, os.path.join(base_dir, VERSION_FILE))
+
+# ====== Hàm đọc phiên bản lịch sử ======
+# Chức năng: Trả về phiên bản hiện tại của lịch sử (chỉ đọc 1 file nhỏ, không quét Parquet).
+# - Dùng làm khóa cache cho kết quả tổng hợp (vd average_growth_curve): đổi khi có snapshot mới hoặc vừa gộp file.
+# - Trả về None nếu chưa có lịch sử.
+def history_version(base_dir=INSIGHTS_HISTORY_DIR):
+    try:
+        with open(os.path.join(base_dir, VERSION_FILE), encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+# ====== Hàm mở dataset lịch sử ======
+# Chức năng: Mở toàn bộ thư mục lịch sử dạng dataset (chưa đọc dữ liệu).
+# - Cột "date" lấy từ tên thư mục (hive partitioning) để bỏ qua cả thư mục khi lọc theo ngày.
+# - Trả về None nếu chưa có lịch sử.
+def open_history(base_dir=INSIGHTS_HISTORY_DIR):
+    if not os.path.isdir(base_dir):
+        return None
+    partitioning = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+    dataset = ds.dataset(base_dir, format="parquet", schema=SNAPSHOT_SCHEMA.append(pa.field("date", pa.string())),
+                         partitioning=partitioning)
+    return dataset if dataset.files else None
+
+# ====== Hàm tạo điều kiện lọc ======
+# Chức năng: Tạo biểu thức lọc theo khoảng ngày (cắt bớt thư mục) và danh sách post_id.
+# - since/until: datetime hoặc chuỗi "YYYY-MM-DD" theo ngày lấy (UTC).
+def build_filter(post_ids=None, since=None, until=None):
+    conditions = []
+    if since is not None:
+        conditions.append(ds.field("date") >= (since if isinstance(since, str) else since.strftime("%Y-%m-%d")))
+    if until is not None:
+        conditions.append(ds.field("date") <= (until if isinstance(until, str) else until.strftime("%Y-%m-%d")))
+    if post_ids is not None:
+        conditions.append(ds.field("post_id").isin([str(p) for p in post_ids]))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+# ====== Hàm đọc snapshot ======
+# Chức năng: Đọc snapshot (đã lọc) thành DataFrame, sắp xếp theo post_id và fetched_at.
+# - Chỉ nên dùng cho tập nhỏ (vài bài viết); tổng hợp toàn bộ lịch sử dùng average_growth_curve.
+def load_snapshots(post_ids=None, since=None, until=None, base_dir=INSIGHTS_HISTORY_DIR):
+    dataset = open_history(base_dir)
+    columns = [field.name for field in SNAPSHOT_SCHEMA]
+    if dataset is None:
+        return pd.DataFrame(columns=columns)
+    table = dataset.to_table(columns=columns, filter=build_filter(post_ids, since, until))
+    return table.to_pandas().sort_values(["post_id", "fetched_at"]).reset_index(drop=True)
+
+# ====== Hàm tính đường tăng trưởng tương tác trung bình ======
+# Chức năng: Tính tương tác trung bình theo tuổi bài viết (thời điểm lấy - thời điểm đăng).
+# - Tương tác = reactions + comments + shares (reactions đã gồm likes).
+# - bucket_hours: độ rộng mỗi nhóm tuổi bài (giờ).
+# - max_age_hours: bỏ qua snapshot của bài cũ hơn mức này.
+# - Quét theo lô và cộng dồn tổng/số lượng nên bộ nhớ không phụ thuộc độ dài lịch sử.
+# - Trả về DataFrame: age_hours, avg_engagement, avg_likes, avg_comments, avg_shares, snapshots.
+def average_growth_curve(bucket_hours=24, max_age_hours=30 * 24, post_ids=None, since=None, base_dir=INSIGHTS_HISTORY_DIR):
+    result_columns = ["age_hours", "avg_engagement", "avg_likes", "avg_comments", "avg_shares", "snapshots"]
+    dataset = open_history(base_dir)
+    if dataset is None:
+        return pd.DataFrame(columns=result_columns)
+
+    sums = None
+    columns = ["created_time", "fetched_at"] + METRIC_COLUMNS
+    for batch in dataset.to_batches(columns=columns, filter=build_filter(post_ids, since), batch_size=READ_BATCH_SIZE):
+        if batch.num_rows == 0:
+            continue
+        age_seconds = pc.cast(pc.subtract(batch.column("fetched_at"), batch.column("created_time")), pa.int64())
+        age_hours = age_seconds.to_numpy(zero_copy_only=False) / 3600
+        frame = pd.DataFrame({metric: batch.column(metric).to_numpy(zero_copy_only=False) for metric in METRIC_COLUMNS})
+        frame["engagement"] = frame["reactions"] + frame["comments"] + frame["shares"]
+        frame["age_hours"] = (age_hours // bucket_hours) * bucket_hours
+        frame = frame[(frame["age_hours"] >= 0) & (frame["age_hours"] <= max_age_hours)]
+
+        partial = frame.groupby("age_hours")[["engagement", "likes", "comments", "shares"]].agg(["sum", "count"])
+        sums = partial if sums is None else sums.add(partial, fill_value=0)
+
+    if sums is None or sums.empty:
+        return pd.DataFrame(columns=result_columns)
+
+    counts = sums[("engagement", "count")].to_numpy()
+    curve = pd.DataFrame({
+        "age_hours": sums.index.to_numpy(dtype=float),
+        "avg_engagement": sums[("engagement", "sum")].to_numpy() / counts,
+        "avg_likes": sums[("likes", "sum")].to_numpy() / counts,
+        "avg_comments": sums[("comments", "sum")].to_numpy() / counts,
+        "avg_shares": sums[("shares", "sum")].to_numpy() / counts,
+        "snapshots": counts.astype(int),
+    })
+    return curve.sort_values("age_hours").reset_index(drop=True)
+
+# ====== Hàm gộp file nhỏ ======
+# Chức năng: Gộp các file snapshot của những ngày đã qua thành 1 file mỗi ngày.
+# - Không đụng tới thư mục của ngày hôm nay (vẫn đang được ghi thêm).
+# - Bỏ snapshot trùng (post_id, fetched_at) nếu lần gộp trước bị ngắt giữa chừng.
+# - Trả về số thư mục ngày đã gộp.
+def compact_history(base_dir=INSIGHTS_HISTORY_DIR, today=None):
+    if not os.path.isdir(base_dir):
+        return 0
+    today = today or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    compacted = 0
+    for name in sorted(os.listdir(base_dir)):
+        partition_dir = os.path.join(base_dir, name)
+        if not name.startswith("date=") or name[len("date="):] >= today or not os.path.isdir(partition_dir):
+            continue
+        files = sorted(f for f in os.listdir(partition_dir) if f.endswith(".parquet") and not f.startswith("_"))
+        if len(files) <= 1:
+            continue
+
+        paths = [os.path.join(partition_dir, f) for f in files]
+        table = pa.concat_tables([pq.read_table(path, schema=SNAPSHOT_SCHEMA) for path in paths])
+        table = table.group_by(["post_id", "fetched_at"]).aggregate(
+            [("created_time", "max")] + [(metric, "max") for metric in METRIC_COLUMNS]
+        ).rename_columns(["post_id", "fetched_at", "created_time"] + METRIC_COLUMNS).select(SNAPSHOT_SCHEMA.names)
+        table = table.sort_by([("post_id", "ascending"), ("fetched_at", "ascending")])
+
+        # Ghi ra file tạm (tên bắt đầu bằng "_" nên không được đọc), đổi tên rồi mới xóa file cũ
+        tmp_path = os.path.join(partition_dir, "_compacting.parquet")
+        pq.write_table(table.cast(SNAPSHOT_SCHEMA), tmp_path)
+        os.replace(tmp_path, os.path.join(partition_dir, f"part-compacted-{uuid.uuid4().hex[:8]}.parquet"))
+        for path in paths:
+            os.remove(path)
+        compacted += 1
+    if compacted:
+        bump_version(base_dir)
+    return compacted
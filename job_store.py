@@ -0,0 +1,813 @@
+# ==========================================
+# ====== JOB STORE (SQLite) ======
+# ==========================================
+# Chức năng chính: Hàng đợi lịch đăng bài cục bộ, là nguồn dữ liệu chính của scheduler
+# - Lưu trên đĩa bằng SQLite (WAL), app.py và scheduler.py dùng chung một file
+# - Mỗi bài lên lịch một dòng, có index theo (status, fire_at) và (platform_key, status, fire_at)
+#   nên tìm bài đến hạn là truy vấn theo khoảng, không phải quét toàn bộ sheet
+# - Google Sheet vẫn là giao diện cho người sửa tay, đồng bộ 2 chiều:
+#   + Sheet → store: dòng mới thêm thành job, dòng bị xóa/sửa tay thì job cũ bị hủy
+#   + Store → sheet: thay đổi sau khi đăng (xóa dòng once, đổi ngày daily) chưa ghi được lên sheet
+#     thì lần đồng bộ sau ghi lại
+# - Dòng trên sheet được nhận diện bằng nội dung (sheet_key = hash 10 cột + thứ tự nếu trùng nội dung)
+# - Nhiều scheduler chạy song song chia nhau job bằng lease (lease_owner, lease_expires):
+#   + claim_due_jobs: nhận job đến hạn chưa ai giữ (hoặc lease đã hết hạn do worker chết)
+#   + begin_publish: ngay trước khi gọi API, chuyển pending → publishing nếu còn giữ lease;
+#     chỉ một worker làm được bước này nên không bài nào bị đăng 2 lần
+#   + Job publishing mà lease hết hạn (worker chết giữa lúc đăng) không tự đăng lại,
+#     chuyển sang in_doubt để kiểm tra
+#   + Khóa theo tên (bảng locks) để các worker không ghi sheet cùng lúc
+# - Journal đăng bài (bảng publish_journal, ghi trước mọi thay đổi khác):
+#   intent (bắt đầu gọi API) → published (có post_id) → committed (đã ghi lên sheet) / failed
+#   + Kết quả được ghi ngay khi API trả về, trước khi scheduler cập nhật job và sheet
+#   + replay_journal khi khởi động chỉ đọc các bản ghi chưa xong (index theo state):
+#     bài đã lên mà chưa ghi nhận thì hoàn tất, không đăng lại và không quét lại lịch sử
+# - Bài đăng lỗi được thử lại sau next_retry_at (scheduler tính backoff); lỗi vĩnh viễn hoặc quá số lần thử
+#   thì job chuyển sang dead và được ghi vào bảng dead_letters (dòng trên sheet giữ nguyên, sửa dòng để đăng lại)
+# - Media container Instagram tạo trước (bảng ig_containers, theo job_id + fire_at):
+#   lúc đến giờ chỉ còn gọi media_publish
+
+import hashlib
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# File SQLite mặc định
+JOB_STORE_FILE = "scheduled_jobs.db"
+
+# Các cột dữ liệu của một bài lên lịch (cùng thứ tự với HEADER của sheet)
+JOB_FIELDS = [
+    "product", "keywords", "platform", "time_str", "token",
+    "page_id", "mode", "date_str", "caption", "image_path"
+]
+
+# Trạng thái job:
+# - pending: chờ đăng (daily sau khi đăng vẫn là pending với ngày mới)
+# - done: đã đăng xong (once)
+# - cancelled: dòng đã bị xóa/sửa tay trên sheet
+# - publishing: một worker đang gọi API đăng bài
+# - in_doubt: worker chết trong lúc đăng, không biết bài đã lên chưa (không tự đăng lại)
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_CANCELLED = "cancelled"
+STATUS_PUBLISHING = "publishing"
+STATUS_IN_DOUBT = "in_doubt"
+STATUS_DEAD = "dead"
+
+# Trạng thái bản ghi journal
+JOURNAL_INTENT = "intent"
+JOURNAL_PUBLISHED = "published"
+JOURNAL_COMMITTED = "committed"
+JOURNAL_FAILED = "failed"
+
+# Thời gian giữ bản ghi journal đã xong (committed/failed) trước khi xóa (giây)
+JOURNAL_RETENTION_SECONDS = 7 * 24 * 3600
+
+# Thời gian giữ lease mặc định (giây): phải dài hơn thời gian chờ + đăng một lượt bài
+JOB_LEASE_SECONDS = 600
+
+# Khi giới hạn số job mỗi page: chỉ xét tối đa limit * hệ số này job đến hạn sớm nhất trong một lần nhận
+# (giữ transaction ghi ngắn dù tồn đọng lớn dồn vào một page; phần còn lại để lần nhận sau)
+JOB_CLAIM_SCAN_FACTOR = 4
+
+# Cột thêm sau phiên bản đầu của bảng jobs (tự thêm vào file cũ khi mở)
+ADDED_COLUMNS = {"lease_owner": "TEXT", "lease_expires": "REAL", "sheet_written_at": "REAL", "next_retry_at": "REAL"}
+
+# Sau khi ghi lên sheet, giữ lại nội dung dòng cũ thêm một thời gian (giây): worker đọc sheet
+# trước lúc ghi (dữ liệu cũ) sẽ ghi lại thay đổi thay vì coi dòng cũ là bài mới và đăng lại
+SHEET_TOMBSTONE_SECONDS = 3600
+
+# Thay đổi đang chờ ghi lên sheet
+SHEET_ACTION_UPDATE = "update"
+SHEET_ACTION_DELETE = "delete"
+
+# Thời gian (giây) dùng một media container Instagram (Meta hủy container sau 24 giờ, chừa 1 giờ dự phòng)
+CONTAINER_MAX_AGE_SECONDS = 23 * 3600
+
+# Trạng thái container còn dùng để publish được (status_code của Graph API)
+CONTAINER_USABLE_STATUSES = ("FINISHED", "IN_PROGRESS")
+
+# Lỗi khi worker không còn giữ lease của job (worker khác đã nhận lại)
+class LeaseLost(Exception):
+    pass
+
+# Lỗi khi lệnh đăng raise exception: không biết bài đã lên chưa, job đã chuyển in_doubt (không tự đăng lại)
+class PublishInDoubt(Exception):
+    pass
+
+# ====== Hàm mở kết nối SQLite ======
+# Chức năng: Mở kết nối tới file job store và tạo bảng/index nếu chưa có.
+# - Bật WAL để app.py ghi trong lúc scheduler đang đọc.
+# - Các cột JOB_FIELDS giữ nguyên nội dung như trên sheet (để tính lại sheet_key),
+#   platform_key là platform đã chuẩn hóa (viết thường) để lọc theo index.
+# - sheet_key: nội dung dòng hiện có trên sheet (NULL khi dòng không còn trên sheet).
+# - sheet_action/sheet_match_key: thay đổi sau khi đăng và nội dung dòng cũ cần tìm để ghi;
+#   sheet_written_at: lúc đã ghi xong (NULL = chưa ghi).
+# - attempts/next_retry_at: số lần đăng lỗi và thời điểm sớm nhất được thử lại (NULL = thử ngay).
+# - lease_owner/lease_expires: worker đang giữ job và thời điểm hết hạn (unix time).
+# - Tự commit từng câu lệnh; thao tác nhiều bước dùng write_transaction.
+def connect(db_path=JOB_STORE_FILE):
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            {", ".join(f"{field} TEXT" for field in JOB_FIELDS)},
+            platform_key TEXT NOT NULL,
+            fire_at REAL NOT NULL,
+            status TEXT NOT NULL,
+            sheet_key TEXT UNIQUE,
+            sheet_row INTEGER,
+            sheet_action TEXT,
+            sheet_match_key TEXT,
+            sheet_written_at REAL,
+            post_id TEXT,
+            last_error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_retry_at REAL,
+            lease_owner TEXT,
+            lease_expires REAL,
+            source TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(status, fire_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_platform ON jobs(platform_key, status, fire_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_sheet_match ON jobs(sheet_match_key)")
+    conn.execute("CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS publish_journal (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            worker_id TEXT NOT NULL,
+            state TEXT NOT NULL,
+            post_id TEXT,
+            error TEXT,
+            fire_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_journal_open ON publish_journal(state) WHERE state IN ('intent', 'published')"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_journal_job ON publish_journal(job_id, state)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS dead_letters (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            platform TEXT NOT NULL,
+            error TEXT,
+            error_class TEXT,
+            attempts INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ig_containers (
+            job_id TEXT NOT NULL,
+            fire_at REAL NOT NULL,
+            creation_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (job_id, fire_at)
+        )
+    """)
+    existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+    for column, column_type in ADDED_COLUMNS.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+    return conn
+
+# ====== Hàm mở transaction ghi ======
+# Chức năng: Mở kết nối và transaction BEGIN IMMEDIATE (giữ quyền ghi ngay từ đầu).
+# - Đọc-rồi-ghi trong cùng transaction là nguyên tử giữa các tiến trình (nhận job, khóa...).
+# - Commit khi xong, rollback nếu lỗi.
+@contextmanager
+def write_transaction(db_path=JOB_STORE_FILE):
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+# ====== Hàm tạo mã worker ======
+# Chức năng: Mã riêng của một tiến trình scheduler (máy, pid, chuỗi ngẫu nhiên).
+def new_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+# ====== Hàm tính thời điểm đăng ======
+# Chức năng: Chuyển date_str (YYYY-MM-DD) + time_str (HH:MM) giờ máy thành unix time.
+# - Trả về None nếu sai định dạng.
+def to_fire_at(date_str, time_str):
+    try:
+        return datetime.strptime(f"{date_str.strip()} {time_str.strip()}", "%Y-%m-%d %H:%M").timestamp()
+    except (ValueError, AttributeError):
+        return None
+
+# ====== Hàm tính khóa nội dung dòng ======
+# Chức năng: Hash nội dung 10 cột của một dòng sheet.
+def content_hash(values):
+    values = (list(values) + [""] * len(JOB_FIELDS))[:len(JOB_FIELDS)]
+    return hashlib.sha1("\x1f".join(str(v) for v in values).encode("utf-8")).hexdigest()
+
+# ====== Hàm tính sheet_key cho toàn bộ sheet ======
+# Chức năng: Tính sheet_key của từng dòng (bỏ header): "<hash>:<thứ tự>" để phân biệt dòng trùng nội dung.
+# - Trả về danh sách (row_num, sheet_key).
+def sheet_row_keys(rows):
+    seen = {}
+    keys = []
+    for idx, row in enumerate(rows[1:]):
+        digest = content_hash(row)
+        keys.append((idx + 2, f"{digest}:{seen.get(digest, 0)}"))
+        seen[digest] = seen.get(digest, 0) + 1
+    return keys
+
+# ====== Hàm chuẩn hóa platform ======
+def platform_key(values):
+    return str(values[JOB_FIELDS.index("platform")]).strip().lower()
+
+# ====== Hàm chọn sheet_key còn trống ======
+# Chức năng: Lấy sheet_key "<hash>:<n>" nhỏ nhất chưa có job nào dùng.
+def next_free_key(conn, digest):
+    used = {row[0] for row in conn.execute(
+        "SELECT sheet_key FROM jobs WHERE sheet_key >= ? AND sheet_key < ?", (f"{digest}:", f"{digest};")
+    )}
+    n = 0
+    while f"{digest}:{n}" in used:
+        n += 1
+    return f"{digest}:{n}"
+
+# ====== Hàm chuyển dòng SQLite thành job ======
+# Chức năng: Trả về job cùng cấu trúc với scheduler.parse_schedule_row (thêm job_id).
+def row_to_job(row):
+    job = {field: row[field] for field in JOB_FIELDS}
+    job["platform"] = (job["platform"] or "").strip().lower()
+    job["mode"] = (job["mode"] or "").strip().lower()
+    for field in ("token", "page_id", "caption", "image_path", "date_str"):
+        job[field] = (job[field] or "").strip()
+    job.update({
+        "job_id": row["job_id"],
+        "row_num": row["sheet_row"],
+        "scheduled_time": datetime.fromtimestamp(row["fire_at"]),
+        "attempts": row["attempts"],
+        "next_retry_at": datetime.fromtimestamp(row["next_retry_at"]) if row["next_retry_at"] else None
+    })
+    return job
+
+# ====== Hàm thêm job ======
+# Chức năng: Thêm một bài lên lịch (ghi song song với sheet khi app.py lên lịch).
+# - values: 10 giá trị theo JOB_FIELDS (đúng nội dung dòng vừa ghi lên sheet).
+# - Nếu lần đồng bộ sheet đã thêm dòng này trước (cùng nội dung) thì không thêm trùng.
+# - Trả về job_id, hoặc None nếu thời gian sai định dạng.
+def add_job(values, db_path=JOB_STORE_FILE, source="app"):
+    values = [str(v) for v in (list(values) + [""] * len(JOB_FIELDS))[:len(JOB_FIELDS)]]
+    fire_at = to_fire_at(values[JOB_FIELDS.index("date_str")], values[JOB_FIELDS.index("time_str")])
+    if fire_at is None:
+        return None
+    digest = content_hash(values)
+    now = time.time()
+    with write_transaction(db_path) as conn:
+        # Dòng đồng bộ từ sheet vừa thêm (chưa ghi từ app) thì dùng lại
+        existing = conn.execute(
+            "SELECT job_id FROM jobs WHERE sheet_key >= ? AND sheet_key < ? AND status = ? AND source = 'sheet' "
+            "AND created_at >= ? ORDER BY sheet_key LIMIT 1",
+            (f"{digest}:", f"{digest};", STATUS_PENDING, now - 3600)
+        ).fetchone()
+        if existing:
+            conn.execute("UPDATE jobs SET source = ?, updated_at = ? WHERE job_id = ?", (source, now, existing[0]))
+            return existing[0]
+        job_id = uuid.uuid4().hex
+        conn.execute(
+            f"INSERT INTO jobs (job_id, {', '.join(JOB_FIELDS)}, platform_key, fire_at, status, sheet_key, source, "
+            f"created_at, updated_at) VALUES (?, {', '.join('?' * len(JOB_FIELDS))}, ?, ?, ?, ?, ?, ?, ?)",
+            [job_id] + values + [platform_key(values), fire_at, STATUS_PENDING, next_free_key(conn, digest), source, now, now]
+        )
+        return job_id
+
+# ====== Hàm đồng bộ với dữ liệu sheet ======
+# Chức năng: Đối chiếu toàn bộ dữ liệu sheet với store (đồng bộ 2 chiều).
+# - rows: dữ liệu sheet (kể cả header), jobs: job hợp lệ từ scheduler.parse_schedule_rows (có row_num).
+# - Dòng khớp job đang chờ: cập nhật số dòng.
+# - Dòng mới: thêm job (source = "sheet").
+# - Job đang chờ mà không còn dòng nào khớp (người dùng xóa/sửa): hủy.
+# - Dòng còn nội dung cũ của job có thay đổi sau khi đăng (chưa ghi, hoặc đã ghi nhưng rows là dữ liệu
+#   đọc trước lúc ghi): trả về để ghi lại lên sheet (ghi lặp được đối chiếu theo nội dung nên vô hại).
+# - read_at: thời điểm bắt đầu đọc rows; job thêm sau thời điểm này không bị hủy dù chưa có trên rows.
+# - Trả về (rows_to_update, rows_to_delete, job_ids) của các thay đổi cần ghi lại,
+#   job_ids dùng cho confirm_sheet_writes sau khi ghi xong.
+def sync_from_sheet(rows, jobs, db_path=JOB_STORE_FILE, read_at=None):
+    valid_rows = {job["row_num"]: job for job in jobs}
+    row_keys = sheet_row_keys(rows)
+    now = time.time()
+    read_at = now if read_at is None else read_at
+    rows_to_update, rows_to_delete, job_ids = [], [], []
+    with write_transaction(db_path) as conn:
+        # Bỏ dấu vết các thay đổi đã ghi quá SHEET_TOMBSTONE_SECONDS
+        conn.execute(
+            "UPDATE jobs SET sheet_action = NULL, sheet_match_key = NULL, sheet_written_at = NULL "
+            "WHERE sheet_written_at < ?", (now - SHEET_TOMBSTONE_SECONDS,)
+        )
+        by_key = {}
+        by_match_key = {}
+        for row in conn.execute(
+            "SELECT job_id, sheet_key, sheet_match_key, sheet_action, sheet_written_at, status, date_str, "
+            "created_at, updated_at FROM jobs WHERE sheet_key IS NOT NULL OR sheet_action IS NOT NULL"
+        ):
+            if row["sheet_key"]:
+                by_key[row["sheet_key"]] = row
+            if row["sheet_action"] and row["sheet_match_key"]:
+                by_match_key[row["sheet_match_key"]] = row
+
+        seen_keys = set()
+        seen_match_keys = set()
+        for row_num, key in row_keys:
+            pending_write = by_match_key.get(key)
+            if pending_write is not None:
+                # Thay đổi sau khi đăng chưa được ghi lên sheet: ghi lại
+                seen_match_keys.add(key)
+                job_ids.append(pending_write["job_id"])
+                if pending_write["sheet_action"] == SHEET_ACTION_DELETE:
+                    rows_to_delete.append(row_num)
+                else:
+                    rows_to_update.append((row_num, JOB_FIELDS.index("date_str") + 1, pending_write["date_str"]))
+                continue
+            if key in by_key:
+                seen_keys.add(key)
+                conn.execute("UPDATE jobs SET sheet_row = ? WHERE job_id = ?", (row_num, by_key[key]["job_id"]))
+                continue
+            job = valid_rows.get(row_num)
+            if job is None:
+                continue
+            values = (list(rows[row_num - 1]) + [""] * len(JOB_FIELDS))[:len(JOB_FIELDS)]
+            conn.execute(
+                f"INSERT INTO jobs (job_id, {', '.join(JOB_FIELDS)}, platform_key, fire_at, status, sheet_key, sheet_row, "
+                f"source, created_at, updated_at) VALUES (?, {', '.join('?' * len(JOB_FIELDS))}, ?, ?, ?, ?, ?, 'sheet', ?, ?)",
+                [uuid.uuid4().hex] + values + [platform_key(values), job["scheduled_time"].timestamp(), STATUS_PENDING,
+                                               key, row_num, now, now]
+            )
+            seen_keys.add(key)
+
+        # Job đang chờ (hoặc dead) mà dòng đã bị xóa/sửa trên sheet: hủy (job đang được đăng, job có thay đổi
+        # chưa ghi và job thêm sau lúc đọc sheet thì giữ nguyên)
+        for key, row in by_key.items():
+            if (key not in seen_keys and row["status"] in (STATUS_PENDING, STATUS_DEAD) and not row["sheet_action"]
+                    and row["updated_at"] < read_at):
+                conn.execute(
+                    "UPDATE jobs SET status = ?, sheet_key = NULL, sheet_row = NULL, lease_owner = NULL, "
+                    "lease_expires = NULL, updated_at = ? WHERE job_id = ?",
+                    (STATUS_CANCELLED, now, row["job_id"])
+                )
+        # Thay đổi chờ ghi mà không còn dòng cũ: đã được ghi (hoặc người dùng tự xóa)
+        for key, row in by_match_key.items():
+            if key not in seen_match_keys and row["sheet_written_at"] is None:
+                conn.execute("UPDATE jobs SET sheet_written_at = ? WHERE job_id = ?", (now, row["job_id"]))
+                commit_journal(conn, [row["job_id"]], now)
+    return rows_to_update, rows_to_delete, job_ids
+
+# ====== Hàm lấy job đến hạn ======
+# Chức năng: Lấy các job đang chờ có fire_at <= now (truy vấn theo index status, fire_at).
+# - now: datetime hoặc unix time, mặc định là hiện tại.
+# - platform: chỉ lấy job của nền tảng này (None = tất cả).
+# - Job đăng lỗi chỉ đến hạn lại khi đã qua next_retry_at.
+# - Chỉ đọc, không nhận job (scheduler dùng claim_due_jobs).
+def get_due_jobs(now=None, db_path=JOB_STORE_FILE, limit=None, platform=None):
+    now = time.time() if now is None else now
+    now = now.timestamp() if isinstance(now, datetime) else now
+    query = "SELECT * FROM jobs WHERE status = ? AND fire_at <= ?"
+    params = [STATUS_PENDING, now]
+    if platform:
+        query = "SELECT * FROM jobs WHERE platform_key = ? AND status = ? AND fire_at <= ?"
+        params = [platform.strip().lower(), STATUS_PENDING, now]
+    query += " AND (next_retry_at IS NULL OR next_retry_at <= ?) ORDER BY fire_at"
+    params.append(now)
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    conn = connect(db_path)
+    try:
+        return [row_to_job(row) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
+
+# ====== Hàm nhận job đến hạn ======
+# Chức năng: Nhận tối đa limit job đến hạn cho worker_id (đặt lease trong lease_seconds giây).
+# - Chỉ nhận job chưa ai giữ hoặc lease đã hết hạn (worker cũ đã chết), job đăng lỗi thì chờ tới next_retry_at.
+# - Chọn và đặt lease trong cùng một transaction BEGIN IMMEDIATE: 2 worker không nhận trùng job.
+# - now: thời điểm so với fire_at (datetime hoặc unix time); lease luôn tính theo giờ thực.
+# - max_per_page: số job tối đa của cùng một page (nền tảng + page_id) trong một lần nhận, để các job
+#   phải chờ lượt của page vẫn kịp đăng trước khi lease hết hạn (phần còn lại để lần sau/worker khác nhận).
+#   Chỉ xét limit * JOB_CLAIM_SCAN_FACTOR job đến hạn sớm nhất (truy vấn luôn có LIMIT).
+def claim_due_jobs(worker_id, now=None, limit=50, lease_seconds=JOB_LEASE_SECONDS, db_path=JOB_STORE_FILE,
+                   max_per_page=None):
+    now = time.time() if now is None else now
+    now = now.timestamp() if isinstance(now, datetime) else now
+    lease_now = time.time()
+    query = ("SELECT * FROM jobs WHERE status = ? AND fire_at <= ? AND (lease_owner IS NULL OR lease_expires < ?) "
+             "AND (next_retry_at IS NULL OR next_retry_at <= ?) ORDER BY fire_at")
+    params = (STATUS_PENDING, now, lease_now, now)
+    with write_transaction(db_path) as conn:
+        if max_per_page is None:
+            rows = conn.execute(query + " LIMIT ?", params + (limit,)).fetchall()
+        else:
+            rows = []
+            per_page = {}
+            for row in conn.execute(query + " LIMIT ?", params + (limit * JOB_CLAIM_SCAN_FACTOR,)):
+                page_key = (row["platform_key"], row["page_id"])
+                if per_page.get(page_key, 0) >= max_per_page:
+                    continue
+                per_page[page_key] = per_page.get(page_key, 0) + 1
+                rows.append(row)
+                if len(rows) >= limit:
+                    break
+        conn.executemany(
+            "UPDATE jobs SET lease_owner = ?, lease_expires = ? WHERE job_id = ?",
+            [(worker_id, lease_now + lease_seconds, row["job_id"]) for row in rows]
+        )
+    return [row_to_job(row) for row in rows]
+
+# ====== Hàm bắt đầu đăng job ======
+# Chức năng: Chuyển job từ pending sang publishing ngay trước khi gọi API đăng bài.
+# - Chỉ thành công nếu worker_id còn giữ lease chưa hết hạn; sau bước này không worker nào
+#   nhận được job nữa (claim chỉ lấy job pending).
+# - Ghi bản ghi journal "intent" trong cùng transaction.
+# - Gia hạn lease thêm lease_seconds tính từ lúc bắt đầu đăng: thời gian chờ lượt trước đó
+#   không làm bài đang đăng (chờ container Instagram...) bị coi là worker đã chết.
+# - Raise LeaseLost nếu không còn giữ lease.
+# - Trả về entry_id của bản ghi journal (dùng cho journal_result).
+def begin_publish(job_id, worker_id, db_path=JOB_STORE_FILE, lease_seconds=JOB_LEASE_SECONDS):
+    now = time.time()
+    with write_transaction(db_path) as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = ?, lease_expires = ?, updated_at = ? WHERE job_id = ? AND status = ? "
+            "AND lease_owner = ? AND lease_expires >= ?",
+            (STATUS_PUBLISHING, now + lease_seconds, now, job_id, STATUS_PENDING, worker_id, now)
+        )
+        if cursor.rowcount != 1:
+            raise LeaseLost(f"Job {job_id} không còn thuộc worker {worker_id}")
+        return conn.execute(
+            "INSERT INTO publish_journal (job_id, worker_id, state, fire_at, created_at, updated_at) "
+            "SELECT job_id, ?, ?, fire_at, ?, ? FROM jobs WHERE job_id = ?",
+            (worker_id, JOURNAL_INTENT, now, now, job_id)
+        ).lastrowid
+
+# ====== Hàm ghi kết quả đăng vào journal ======
+# Chức năng: Ghi ngay kết quả API (published + post_id, hoặc failed) cho bản ghi entry_id.
+# - Gọi ngay sau khi API trả về, trước khi scheduler cập nhật job/sheet: nếu tiến trình chết
+#   sau bước này, replay_journal biết bài đã lên và không đăng lại.
+def journal_result(entry_id, result, db_path=JOB_STORE_FILE):
+    with write_transaction(db_path) as conn:
+        if result and "success" in result:
+            conn.execute(
+                "UPDATE publish_journal SET state = ?, post_id = ?, updated_at = ? WHERE entry_id = ? AND state = ?",
+                (JOURNAL_PUBLISHED, result.get("post_id"), time.time(), entry_id, JOURNAL_INTENT)
+            )
+        else:
+            error_msg = result.get("error") if result else "Không có response"
+            conn.execute(
+                "UPDATE publish_journal SET state = ?, error = ?, updated_at = ? WHERE entry_id = ? AND state = ?",
+                (JOURNAL_FAILED, error_msg, time.time(), entry_id, JOURNAL_INTENT)
+            )
+
+# ====== Hàm chuyển job đang đăng sang in_doubt ======
+# Chức năng: Dùng khi lệnh đăng raise exception (không biết request đã tới API chưa).
+# - Bản ghi journal entry_id (còn intent) chuyển failed, job publishing chuyển in_doubt và nhả lease:
+#   không tự đăng lại, chờ kiểm tra thủ công (như worker chết giữa lúc gọi API, xem replay_journal).
+def mark_in_doubt(entry_id, error_msg, db_path=JOB_STORE_FILE):
+    now = time.time()
+    with write_transaction(db_path) as conn:
+        entry = conn.execute(
+            "SELECT job_id FROM publish_journal WHERE entry_id = ? AND state = ?", (entry_id, JOURNAL_INTENT)
+        ).fetchone()
+        if entry is None:
+            return
+        conn.execute(
+            "UPDATE publish_journal SET state = ?, error = ?, updated_at = ? WHERE entry_id = ?",
+            (JOURNAL_FAILED, f"in_doubt: {error_msg}", now, entry_id)
+        )
+        conn.execute(
+            "UPDATE jobs SET status = ?, last_error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE job_id = ? AND status = ?",
+            (STATUS_IN_DOUBT, error_msg, now, entry["job_id"], STATUS_PUBLISHING)
+        )
+
+# ====== Hàm đánh dấu journal đã ghi lên sheet ======
+# Chức năng: Chuyển các bản ghi published của job_ids sang committed (dùng trong transaction đang mở).
+def commit_journal(conn, job_ids, now):
+    conn.executemany(
+        "UPDATE publish_journal SET state = ?, updated_at = ? WHERE job_id = ? AND state = ?",
+        [(JOURNAL_COMMITTED, now, job_id, JOURNAL_PUBLISHED) for job_id in job_ids]
+    )
+
+# ====== Hàm tính ngày đăng tiếp theo ======
+# Chức năng: Ngày đăng kế tiếp của job daily (YYYY-MM-DD), None với job once.
+def next_date_for(row):
+    if (row["mode"] or "").strip().lower() != "daily":
+        return None
+    return (datetime.fromtimestamp(row["fire_at"]) + timedelta(days=1)).strftime("%Y-%m-%d")
+
+# ====== Hàm khôi phục từ journal ======
+# Chức năng: Đọc các bản ghi journal chưa xong (intent/published) và hoàn tất job bị bỏ dở.
+# - Chỉ xử lý job không còn worker nào đang đăng: in_doubt, publishing có lease hết hạn,
+#   hoặc publishing của chính worker_id (tiến trình trước của worker này đã chết).
+# - published: bài đã lên → ghi nhận như đăng thành công (once: done, daily: sang ngày sau),
+#   thay đổi trên sheet được ghi ở lần đồng bộ tới; không đăng lại.
+# - intent: không biết bài đã lên chưa → job chuyển in_doubt (không tự đăng lại).
+# - Xóa bản ghi đã xong quá JOURNAL_RETENTION_SECONDS.
+# - Trả về (danh sách job đã hoàn tất, danh sách job chuyển in_doubt).
+def replay_journal(worker_id=None, db_path=JOB_STORE_FILE):
+    now = time.time()
+    recovered, in_doubt = [], []
+    with write_transaction(db_path) as conn:
+        entries = conn.execute(
+            "SELECT entry_id, job_id, state, post_id FROM publish_journal WHERE state IN (?, ?) ORDER BY entry_id",
+            (JOURNAL_INTENT, JOURNAL_PUBLISHED)
+        ).fetchall()
+        for entry in entries:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (entry["job_id"],)).fetchone()
+            abandoned = row is not None and (
+                row["status"] == STATUS_IN_DOUBT or (
+                    row["status"] == STATUS_PUBLISHING and (
+                        (row["lease_expires"] or 0) < now or (worker_id and row["lease_owner"] == worker_id)
+                    )
+                )
+            )
+            if not abandoned:
+                # Job đang được worker khác xử lý, hoặc đã ghi nhận xong (chỉ còn chờ ghi sheet)
+                continue
+            if entry["state"] == JOURNAL_PUBLISHED:
+                apply_published(conn, row, entry["post_id"], next_date_for(row), now)
+                recovered.append(row_to_job(row))
+            else:
+                if row["status"] != STATUS_IN_DOUBT:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, last_error = ?, lease_owner = NULL, lease_expires = NULL, "
+                        "updated_at = ? WHERE job_id = ?",
+                        (STATUS_IN_DOUBT, "Worker dừng khi đang đăng", now, row["job_id"])
+                    )
+                    in_doubt.append(row_to_job(row))
+                conn.execute(
+                    "UPDATE publish_journal SET state = ?, error = ?, updated_at = ? WHERE entry_id = ?",
+                    (JOURNAL_FAILED, "in_doubt", now, entry["entry_id"])
+                )
+        conn.execute(
+            "DELETE FROM publish_journal WHERE state IN (?, ?) AND updated_at < ?",
+            (JOURNAL_COMMITTED, JOURNAL_FAILED, now - JOURNAL_RETENTION_SECONDS)
+        )
+    return recovered, in_doubt
+
+# ====== Hàm nhận lại job của worker đã chết ======
+# Chức năng: Xử lý lease hết hạn.
+# - Job pending: lease hết hạn thì claim_due_jobs tự nhận lại, chỉ cần đếm.
+# - Job publishing: không biết bài đã lên chưa → chuyển in_doubt (không tự đăng lại).
+# - Trả về (số job pending được nhả, danh sách job chuyển sang in_doubt).
+def reclaim_expired_leases(db_path=JOB_STORE_FILE):
+    now = time.time()
+    with write_transaction(db_path) as conn:
+        released = conn.execute(
+            "UPDATE jobs SET lease_owner = NULL, lease_expires = NULL WHERE status = ? AND lease_expires < ?",
+            (STATUS_PENDING, now)
+        ).rowcount
+        stuck = conn.execute(
+            "SELECT * FROM jobs WHERE status = ? AND lease_expires < ?", (STATUS_PUBLISHING, now)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE jobs SET status = ?, last_error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE job_id = ?",
+            [(STATUS_IN_DOUBT, f"Worker {row['lease_owner']} dừng khi đang đăng", now, row["job_id"]) for row in stuck]
+        )
+    return released, [row_to_job(row) for row in stuck]
+
+# ====== Hàm lấy các job sắp tới ======
+# Chức năng: Lấy limit job đang chờ có fire_at nhỏ nhất (kể cả job quá hạn chưa đăng được).
+def get_upcoming_jobs(limit=50, db_path=JOB_STORE_FILE):
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT * FROM jobs WHERE status = ? ORDER BY fire_at LIMIT ?", (STATUS_PENDING, limit)
+        ).fetchall()
+    finally:
+        conn.close()
+    return [row_to_job(row) for row in rows]
+
+# ====== Hàm ghi nhận đăng thành công ======
+# Chức năng: Cập nhật job sau khi đăng thành công và ghi nhớ thay đổi cần ghi lên sheet.
+# - next_date_str: ngày đăng tiếp theo (daily), None với once (job chuyển sang done).
+# - Thay đổi lên sheet được đánh dấu chờ ghi tới khi confirm_sheet_writes.
+# - Nhả lease của job.
+def mark_published(job_id, post_id, next_date_str=None, db_path=JOB_STORE_FILE):
+    with write_transaction(db_path) as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is not None:
+            apply_published(conn, row, post_id, next_date_str, time.time())
+
+# ====== Hàm cập nhật job đã đăng ======
+# Chức năng: Phần dùng chung của mark_published và replay_journal (trong transaction đang mở).
+# - Cùng post_id đã được ghi nhận (replay_journal chạy trước) thì bỏ qua, không cộng ngày 2 lần.
+def apply_published(conn, row, post_id, next_date_str, now):
+    job_id = row["job_id"]
+    if post_id and row["post_id"] == post_id and row["status"] not in (STATUS_PUBLISHING, STATUS_IN_DOUBT):
+        return
+    if next_date_str is None:
+        conn.execute(
+            "UPDATE jobs SET status = ?, post_id = ?, last_error = NULL, next_retry_at = NULL, sheet_action = ?, "
+            "sheet_match_key = sheet_key, sheet_written_at = NULL, sheet_key = NULL, lease_owner = NULL, "
+            "lease_expires = NULL, updated_at = ? WHERE job_id = ?",
+            (STATUS_DONE, post_id, SHEET_ACTION_DELETE, now, job_id)
+        )
+        return
+    values = [row[field] for field in JOB_FIELDS]
+    values[JOB_FIELDS.index("date_str")] = next_date_str
+    new_key = next_free_key(conn, content_hash(values))
+    conn.execute(
+        "UPDATE jobs SET status = ?, date_str = ?, fire_at = ?, post_id = ?, last_error = NULL, attempts = 0, "
+        "next_retry_at = NULL, "
+        "sheet_action = ?, sheet_match_key = sheet_key, sheet_written_at = NULL, sheet_key = ?, "
+        "lease_owner = NULL, lease_expires = NULL, updated_at = ? WHERE job_id = ?",
+        (STATUS_PENDING, next_date_str, to_fire_at(next_date_str, row["time_str"]), post_id,
+         SHEET_ACTION_UPDATE, new_key, now, job_id)
+    )
+
+# ====== Hàm ghi nhận đăng thất bại ======
+# Chức năng: Lưu lỗi và tăng số lần thử, job quay lại chờ đăng và nhả lease.
+# - retry_at: thời điểm sớm nhất được thử lại (datetime hoặc unix time), None = thử lại ngay.
+def mark_failed(job_id, error_msg, db_path=JOB_STORE_FILE, retry_at=None):
+    retry_at = retry_at.timestamp() if isinstance(retry_at, datetime) else retry_at
+    with write_transaction(db_path) as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, last_error = ?, attempts = attempts + 1, next_retry_at = ?, "
+            "lease_owner = NULL, lease_expires = NULL, updated_at = ? WHERE job_id = ? AND status IN (?, ?)",
+            (STATUS_PENDING, error_msg, retry_at, time.time(), job_id, STATUS_PENDING, STATUS_PUBLISHING)
+        )
+
+# ====== Hàm chuyển job vào dead-letter ======
+# Chức năng: Dừng thử lại job (lỗi vĩnh viễn hoặc đã hết số lần thử): job chuyển sang dead
+#   và được ghi vào bảng dead_letters để kiểm tra.
+# - Trả về True nếu job được chuyển (False nếu job không còn chờ/đang đăng).
+def dead_letter(job_id, error_msg, error_class, db_path=JOB_STORE_FILE):
+    now = time.time()
+    with write_transaction(db_path) as conn:
+        updated = conn.execute(
+            "UPDATE jobs SET status = ?, last_error = ?, attempts = attempts + 1, next_retry_at = NULL, "
+            "lease_owner = NULL, lease_expires = NULL, updated_at = ? WHERE job_id = ? AND status IN (?, ?)",
+            (STATUS_DEAD, error_msg, now, job_id, STATUS_PENDING, STATUS_PUBLISHING)
+        ).rowcount
+        if updated:
+            conn.execute(
+                "INSERT INTO dead_letters (job_id, platform, error, error_class, attempts, created_at) "
+                "SELECT job_id, platform_key, ?, ?, attempts, ? FROM jobs WHERE job_id = ?",
+                (error_msg, error_class, now, job_id)
+            )
+    return bool(updated)
+
+# ====== Hàm lấy danh sách dead-letter ======
+# Chức năng: Lấy limit bài bị dừng thử lại gần nhất, kèm nội dung job.
+def get_dead_letters(limit=50, db_path=JOB_STORE_FILE):
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT d.entry_id, d.job_id, d.platform, d.error, d.error_class, d.attempts, d.created_at, "
+            "j.product, j.caption, j.date_str, j.time_str, j.sheet_row, j.status "
+            "FROM dead_letters AS d LEFT JOIN jobs AS j ON j.job_id = d.job_id "
+            "ORDER BY d.entry_id DESC LIMIT ?", (limit,)
+        ).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+# ====== Hàm nhả lease ======
+# Chức năng: Nhả lease các job worker đã nhận nhưng chưa đăng (để worker khác nhận ngay).
+def release_jobs(job_ids, worker_id, db_path=JOB_STORE_FILE):
+    if not job_ids:
+        return
+    with write_transaction(db_path) as conn:
+        conn.executemany(
+            "UPDATE jobs SET lease_owner = NULL, lease_expires = NULL WHERE job_id = ? AND lease_owner = ? AND status = ?",
+            [(job_id, worker_id, STATUS_PENDING) for job_id in job_ids]
+        )
+
+# ====== Hàm xác nhận đã ghi lên sheet ======
+# Chức năng: Đánh dấu đã ghi sau khi batch_update lên sheet thành công.
+# - Nội dung dòng cũ được giữ thêm SHEET_TOMBSTONE_SECONDS (xem sync_from_sheet).
+def confirm_sheet_writes(job_ids, db_path=JOB_STORE_FILE):
+    if not job_ids:
+        return
+    now = time.time()
+    with write_transaction(db_path) as conn:
+        conn.executemany(
+            "UPDATE jobs SET sheet_written_at = ? WHERE job_id = ? AND sheet_action IS NOT NULL",
+            [(now, job_id) for job_id in job_ids]
+        )
+        commit_journal(conn, job_ids, now)
+
+# ====== Hàm lấy job Instagram cần tạo container trước ======
+# Chức năng: Lấy job Instagram đang chờ có now < fire_at <= until chưa có container còn hạn.
+# - Truy vấn theo index (platform_key, status, fire_at).
+# - Job đã có container (kể cả container lỗi) không được lấy lại: lúc đến giờ job đó đăng đầy đủ 2 bước.
+def get_jobs_to_stage(until, now=None, limit=50, db_path=JOB_STORE_FILE):
+    now = time.time() if now is None else now
+    now = now.timestamp() if isinstance(now, datetime) else now
+    until = until.timestamp() if isinstance(until, datetime) else until
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT jobs.* FROM jobs LEFT JOIN ig_containers AS c "
+            "ON c.job_id = jobs.job_id AND c.fire_at = jobs.fire_at AND c.created_at >= ? "
+            "WHERE jobs.platform_key = 'instagram' AND jobs.status = ? AND jobs.fire_at > ? AND jobs.fire_at <= ? "
+            "AND c.job_id IS NULL ORDER BY jobs.fire_at LIMIT ?",
+            (time.time() - CONTAINER_MAX_AGE_SECONDS, STATUS_PENDING, now, until, limit)
+        ).fetchall()
+    finally:
+        conn.close()
+    return [row_to_job(row) for row in rows]
+
+# ====== Hàm lưu container Instagram ======
+# Chức năng: Lưu (hoặc cập nhật trạng thái) container đã tạo cho lần đăng fire_at của job.
+# - created_at giữ nguyên khi chỉ cập nhật trạng thái của cùng creation_id.
+def save_container(job_id, fire_at, creation_id, status, db_path=JOB_STORE_FILE):
+    now = time.time()
+    with write_transaction(db_path) as conn:
+        conn.execute(
+            "INSERT INTO ig_containers (job_id, fire_at, creation_id, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(job_id, fire_at) DO UPDATE SET "
+            "status = excluded.status, updated_at = excluded.updated_at, "
+            "created_at = CASE WHEN ig_containers.creation_id = excluded.creation_id "
+            "THEN ig_containers.created_at ELSE excluded.created_at END, creation_id = excluded.creation_id",
+            (job_id, fire_at, creation_id, status, now, now)
+        )
+
+# ====== Hàm lấy container Instagram đã tạo ======
+# Chức năng: Trả về {"creation_id", "status", "created_at"} nếu container còn dùng được
+#   (FINISHED/IN_PROGRESS và chưa quá CONTAINER_MAX_AGE_SECONDS), ngược lại None.
+def get_container(job_id, fire_at, db_path=JOB_STORE_FILE):
+    conn = connect(db_path)
+    try:
+        row = conn.execute(
+            "SELECT creation_id, status, created_at FROM ig_containers WHERE job_id = ? AND fire_at = ?",
+            (job_id, fire_at)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None or row["status"] not in CONTAINER_USABLE_STATUSES:
+        return None
+    if row["created_at"] < time.time() - CONTAINER_MAX_AGE_SECONDS:
+        return None
+    return dict(row)
+
+def delete_container(job_id, fire_at, db_path=JOB_STORE_FILE):
+    with write_transaction(db_path) as conn:
+        conn.execute("DELETE FROM ig_containers WHERE job_id = ? AND fire_at = ?", (job_id, fire_at))
+
+# ====== Hàm dọn container Instagram không còn dùng ======
+# Chức năng: Xóa container đã hết hạn hoặc của lần đăng không còn chờ
+#   (job bị hủy/sửa trên sheet, đã đăng, daily đã sang ngày khác).
+# - Trả về số container đã xóa.
+def prune_containers(db_path=JOB_STORE_FILE):
+    with write_transaction(db_path) as conn:
+        return conn.execute(
+            "DELETE FROM ig_containers WHERE created_at < ? OR NOT EXISTS (SELECT 1 FROM jobs "
+            "WHERE jobs.job_id = ig_containers.job_id AND jobs.fire_at = ig_containers.fire_at "
+            "AND jobs.status IN (?, ?))",
+            (time.time() - CONTAINER_MAX_AGE_SECONDS, STATUS_PENDING, STATUS_PUBLISHING)
+        ).rowcount
+
+# ====== Hàm khóa theo tên ======
+# Chức năng: Giữ khóa name cho owner trong ttl giây (vd: chỉ một worker ghi sheet tại một thời điểm).
+# - Lấy được nếu chưa ai giữ, đã hết hạn, hoặc chính owner đang giữ (gia hạn).
+# - Trả về True nếu lấy được.
+def acquire_lock(name, owner, ttl, db_path=JOB_STORE_FILE):
+    now = time.time()
+    with write_transaction(db_path) as conn:
+        conn.execute(
+            "INSERT INTO locks (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE locks.owner = excluded.owner OR locks.expires_at < ?",
+            (name, owner, now + ttl, now)
+        )
+        row = conn.execute("SELECT owner FROM locks WHERE name = ?", (name,)).fetchone()
+    return row is not None and row["owner"] == owner
+
+def release_lock(name, owner, db_path=JOB_STORE_FILE):
+    with write_transaction(db_path) as conn:
+        conn.execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner))
+
+# ====== Hàm đếm job theo trạng thái ======
+def count_jobs(db_path=JOB_STORE_FILE):
+    conn = connect(db_path)
+    try:
+        return dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+    finally:
+        conn.close()
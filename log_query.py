@@ -0,0 +1,118 @@
+# ==========================================
+# ====== LOG QUERY (CLI) ======
+# ==========================================
+# Chức năng chính: Tra cứu log của scheduler (log_scheduler.txt + các archive đã nén)
+# - Lọc theo platform, status và khoảng thời gian
+# - In số bản ghi theo platform/status và tỷ lệ lỗi, tùy chọn theo từng ngày
+# - Dùng index của archive (event_log.count_records) nên thống kê nhiều tháng không phải giải nén lại
+#
+# Ví dụ:
+#   python log_query.py --platform instagram --status ERROR --since yesterday --until yesterday
+#   python log_query.py --since 2024-01-01 --until 2024-01-31 --by-date
+#   python log_query.py --platform facebook --list 20
+
+import argparse
+import sys
+from collections import Counter, deque
+from datetime import datetime, timedelta
+
+import event_log
+
+# File log mặc định (cùng LOG_FILE trong scheduler.py)
+LOG_FILE = "log_scheduler.txt"
+
+# Status được tính là lỗi khi tính tỷ lệ lỗi
+FAILURE_STATUSES = ("ERROR", "DEAD_LETTER")
+
+# ====== Hàm đọc mốc thời gian ======
+# Chức năng: Chuyển "today", "yesterday", "YYYY-MM-DD" hoặc "YYYY-MM-DD HH:MM" thành datetime.
+# - end_of_day: mốc chỉ có ngày thì lấy cuối ngày (dùng cho --until).
+def parse_time(value, end_of_day=False, now=None):
+    now = now or datetime.now()
+    value = value.strip().lower()
+    if value in ("today", "yesterday"):
+        day = now.date() - timedelta(days=1 if value == "yesterday" else 0)
+        value = day.isoformat()
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dt%H:%M"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    day = datetime.strptime(value, "%Y-%m-%d")
+    return day + timedelta(days=1) - timedelta(milliseconds=1) if end_of_day else day
+
+# ====== Hàm tính tỷ lệ lỗi ======
+# Chức năng: Số bản ghi lỗi / (thành công + lỗi), None nếu chưa có bài đăng nào.
+def failure_rate(status_counts):
+    failures = sum(status_counts.get(status, 0) for status in FAILURE_STATUSES)
+    attempts = failures + status_counts.get("SUCCESS", 0)
+    return failures / attempts if attempts else None
+
+# ====== Hàm tạo báo cáo ======
+# Chức năng: Tạo các dòng báo cáo từ Counter {(ngày, platform, status): số bản ghi}.
+# - by_date: thêm bảng theo từng ngày.
+def format_report(counts, by_date=False):
+    total = sum(counts.values())
+    lines = [f"📊 Tổng: {total} bản ghi"]
+    by_platform = {}
+    for (day, platform, status), count in counts.items():
+        by_platform.setdefault(platform or "?", Counter())[status] += count
+    for platform in sorted(by_platform):
+        lines.append(format_row(platform, by_platform[platform]))
+    if by_date:
+        by_day = {}
+        for (day, platform, status), count in counts.items():
+            by_day.setdefault(day, Counter())[status] += count
+        lines.append("📅 Theo ngày:")
+        for day in sorted(by_day):
+            lines.append(format_row(day, by_day[day]))
+    return lines
+
+def format_row(label, status_counts):
+    statuses = " | ".join(f"{status} {count}" for status, count in sorted(status_counts.items()))
+    rate = failure_rate(status_counts)
+    rate_text = f" | tỷ lệ lỗi {rate:.1%}" if rate is not None else ""
+    return f"  {label}: {sum(status_counts.values())} bản ghi | {statuses}{rate_text}"
+
+def format_record(record):
+    error = f" | {record.get('error_class') or ''} {record.get('error') or ''}".rstrip() if record.get("error") else ""
+    return (f"  [{record.get('timestamp')}] {str(record.get('platform') or '').upper()} | {record.get('mode')} | "
+            f"{record.get('status')} | dòng {record.get('row')} | post {record.get('post_id')}{error}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Tra cứu log của scheduler")
+    parser.add_argument("--log", default=LOG_FILE, help="file log (mặc định: %(default)s)")
+    parser.add_argument("--platform", help="facebook, instagram, system...")
+    parser.add_argument("--status", help="SUCCESS, ERROR, DEAD_LETTER, WARNING...")
+    parser.add_argument("--since", help="từ lúc: today, yesterday, YYYY-MM-DD hoặc 'YYYY-MM-DD HH:MM'")
+    parser.add_argument("--until", help="đến lúc (ngày không có giờ = hết ngày đó)")
+    parser.add_argument("--by-date", action="store_true", help="thống kê theo từng ngày")
+    parser.add_argument("--list", type=int, default=0, metavar="N", help="in N bản ghi mới nhất khớp bộ lọc")
+    return parser
+
+# ====== Hàm chính ======
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        since = parse_time(args.since) if args.since else None
+        until = parse_time(args.until, end_of_day=True) if args.until else None
+    except ValueError as e:
+        print(f"❌ Mốc thời gian không hợp lệ: {e}")
+        return 2
+
+    counts = event_log.count_records(args.log, since=since, until=until, platform=args.platform, status=args.status)
+    print(f"🔍 {args.log} | platform: {args.platform or 'tất cả'} | status: {args.status or 'tất cả'} | "
+          f"từ {since or 'đầu'} đến {until or 'nay'}")
+    for line in format_report(counts, by_date=args.by_date):
+        print(line)
+
+    if args.list:
+        records = deque(event_log.iter_records(args.log, since=since, until=until, platform=args.platform,
+                                               status=args.status), maxlen=args.list)
+        print(f"📝 {len(records)} bản ghi mới nhất:")
+        for record in records:
+            print(format_record(record))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
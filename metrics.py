@@ -0,0 +1,153 @@
+# ==========================================
+# ====== METRICS (Prometheus) ======
+# ==========================================
+# Chức năng chính: Đo và xuất số liệu vận hành của scheduler theo định dạng text của Prometheus
+# - Counter, gauge, histogram lưu trong bộ nhớ tiến trình (có khóa, các thread đăng bài ghi song song)
+# - start_server() mở endpoint /metrics trên cổng cục bộ bằng http.server của thư viện chuẩn
+#   (chạy trong thread nền, không cần thư viện prometheus_client)
+# - Tên, loại và mô tả của mỗi số liệu khai báo trong METRICS
+
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Mốc histogram mặc định (giây): từ request nhanh tới lượt kiểm tra chậm
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Mốc histogram độ trễ đăng so với giờ hẹn (giây)
+LATENESS_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 21600, 86400)
+
+# Khai báo số liệu: tên → (loại, mô tả, mốc histogram)
+METRICS = {
+    "scheduler_tick_seconds": ("histogram", "Thời gian một lượt process_scheduled_posts", DEFAULT_BUCKETS),
+    "scheduler_sheet_read_seconds": ("histogram", "Thời gian đọc Google Sheet (theo kết quả: full/skipped)",
+                                     DEFAULT_BUCKETS),
+    "scheduler_parse_seconds": ("histogram", "Thời gian kiểm tra và đồng bộ các dòng sheet", DEFAULT_BUCKETS),
+    "scheduler_publish_latency_seconds": ("histogram", "Thời gian gọi API đăng một bài theo nền tảng",
+                                          DEFAULT_BUCKETS),
+    "scheduler_publish_lateness_seconds": ("histogram", "Độ trễ lúc đăng xong so với giờ hẹn theo nền tảng",
+                                           LATENESS_BUCKETS),
+    "scheduler_publish_total": ("counter", "Số bài đã đăng theo nền tảng và kết quả (success/failure)", None),
+    "scheduler_ticks_total": ("counter", "Số lượt kiểm tra lịch đăng theo kết quả (ok/error)", None),
+    "scheduler_jobs": ("gauge", "Số job trong job store theo trạng thái", None),
+    "scheduler_due_jobs": ("gauge", "Số bài đến hạn đã nhận ở lượt kiểm tra gần nhất", None),
+}
+
+# Địa chỉ mặc định của endpoint (chỉ máy cục bộ)
+METRICS_HOST = "127.0.0.1"
+
+_lock = threading.Lock()
+_counters = {}    # (tên, nhãn) → giá trị
+_gauges = {}      # (tên, nhãn) → giá trị
+_histograms = {}  # (tên, nhãn) → [số lần theo từng mốc, tổng, số lần]
+
+def label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+# ====== Hàm cập nhật số liệu ======
+# Chức năng: inc (counter), set_gauge (gauge), observe (histogram).
+# - labels: dict nhãn, vd {"platform": "facebook"}.
+def inc(name, labels=None, value=1):
+    key = (name, label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, labels=None):
+    with _lock:
+        _gauges[(name, label_key(labels))] = value
+
+def observe(name, value, labels=None):
+    buckets = METRICS[name][2]
+    key = (name, label_key(labels))
+    with _lock:
+        state = _histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                state[0][i] += 1
+        state[1] += value
+        state[2] += 1
+
+# ====== Hàm đo thời gian một đoạn code ======
+# Chức năng: with timer(name, labels): ... → observe thời gian chạy (giây), kể cả khi có lỗi.
+@contextmanager
+def timer(name, labels=None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, labels)
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+def format_labels(labels, extra=None):
+    items = list(labels) + list(extra or [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in items) + "}"
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# ====== Hàm xuất số liệu ======
+# Chức năng: Tạo nội dung text exposition format 0.0.4 của Prometheus (HELP, TYPE, từng series).
+# - Histogram: _bucket tích lũy theo le (kể cả +Inf), _sum, _count.
+def render():
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: [list(state[0]), state[1], state[2]] for key, state in _histograms.items()}
+    lines = []
+    for name, (metric_type, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        if metric_type == "histogram":
+            for (series, labels), (bucket_counts, total, count) in sorted(histograms.items()):
+                if series != name:
+                    continue
+                for bound, bucket_count in zip(buckets, bucket_counts):
+                    lines.append(f"{name}_bucket{format_labels(labels, [('le', format_value(float(bound)))])} {bucket_count}")
+                lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(float(total))}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+            continue
+        values = counters if metric_type == "counter" else gauges
+        for (series, labels), value in sorted(values.items()):
+            if series == name:
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# ====== Hàm mở endpoint /metrics ======
+# Chức năng: Chạy HTTP server trong thread nền (daemon), trả về server (server.server_port là cổng thật,
+#   port=0 để hệ điều hành chọn cổng trống). Dừng bằng stop_server(server).
+def start_server(port, host=METRICS_HOST):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def stop_server(server):
+    server.shutdown()
+    server.server_close()
@@ -2,26 +2,47 @@
 # ====== AI AGENT SCHEDULER ======
 # ==========================================
 # Chức năng chính: Tự động đăng bài viết theo lịch từ Google Sheets
-# - Đọc lịch đăng từ Google Sheets mỗi 60 giây
+# - Lịch đăng lưu trong job store SQLite (job_store.py), đồng bộ 2 chiều với Google Sheets
+# - Chạy được nhiều tiến trình cùng lúc: mỗi worker nhận (lease) một phần bài đến hạn từ job store,
+#   không bài nào bị đăng 2 lần; lease của worker chết được nhận lại
+# - Journal đăng bài trong job store: kết quả API được ghi ngay, khởi động lại không đăng trùng
+# - Lấy bài đến hạn bằng truy vấn theo index trên job store, ngủ đúng tới thời điểm bài tiếp theo đến hạn (min-heap)
+# - Đọc lại sheet định kỳ hoặc khi app.py báo có bài mới (file tín hiệu)
 # - Đăng bài lên Facebook và Instagram khi đến giờ
 # - Xóa bài đã đăng (mode: once) hoặc lên lịch ngày tiếp theo (mode: daily)
 # - Ghi log chi tiết các hoạt động
+# - Đo số liệu vận hành (/metrics) và trace thời gian từng lượt kiểm tra (tracing.py)
 # - Error handling toàn diện với retry logic
 
+import asyncio
 import csv
+import functools
+import heapq
+import random
+import re
+import threading
 import time
 import requests
 import toml
-from datetime import datetime, timedelta
+import event_log
+import graph_http
+import job_store
+import metrics
+import tracing
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
 import gspread
+import google.auth.exceptions
+from google.auth.transport.requests import Request
 from google.oauth2.service_account import Credentials
+from googleapiclient.discovery import build
 import os
 
 # ====== CONSTANTS & CONFIGURATION ======
 # File CSV dự phòng (hiện tại không sử dụng)
 CSV_FILE = "scheduled_posts.csv"
 
-# File log để ghi lại hoạt động của scheduler
+# File log để ghi lại hoạt động của scheduler (mỗi dòng một bản ghi JSON, xem event_log)
 LOG_FILE = "log_scheduler.txt"
 
 # ID của Google Sheet chứa lịch đăng bài (cùng với app.py)
@@ -30,6 +51,131 @@ SPREADSHEET_ID = "1HUWXhKwglpJtp6yRuUfo2oy76uNKxDRx5n0RUG2q0hM"
 # Tên sheet trong Google Sheet
 SHEET_NAME = "xuongbinhgom"
 
+# File SQLite của job store (cùng với JOB_STORE_FILE trong app.py)
+JOB_STORE_FILE = job_store.JOB_STORE_FILE
+
+# Mã của tiến trình scheduler này (dùng làm chủ lease trong job store)
+WORKER_ID = os.getenv("SCHEDULER_WORKER_ID") or job_store.new_worker_id()
+
+# Cổng cục bộ của endpoint Prometheus /metrics (0 = tắt)
+METRICS_PORT = int(os.getenv("SCHEDULER_METRICS_PORT") or 9108)
+
+# Số job đến hạn tối đa một worker nhận mỗi lần (phần còn lại để worker khác nhận)
+JOB_CLAIM_LIMIT = 50
+
+# Thời gian giữ lease (giây): quá thời gian này mà worker chưa đăng thì worker khác được nhận lại
+JOB_LEASE_SECONDS = job_store.JOB_LEASE_SECONDS
+
+# Khóa ghi sheet dùng chung giữa các worker: tên khóa, thời gian giữ tối đa và thời gian chờ lấy khóa (giây)
+SHEET_WRITE_LOCK = "sheet_write"
+SHEET_WRITE_LOCK_TTL = 120
+SHEET_WRITE_LOCK_WAIT = 60
+
+# Số job sắp đến hạn đưa vào heap sau mỗi lần kiểm tra (job xa hơn được lấy ở các lần sau)
+UPCOMING_JOBS_LIMIT = 50
+
+# Chu kỳ (giây) đọc lại toàn bộ sheet khi không có bài nào đến hạn
+SHEET_RESYNC_INTERVAL = 300
+
+# File tín hiệu: app.py chạm file này mỗi khi lên lịch bài mới để scheduler đọc lại sheet ngay
+# (cùng tên với SCHEDULE_SIGNAL_FILE trong app.py)
+SCHEDULE_SIGNAL_FILE = "schedule_changed.flag"
+
+# Chu kỳ (giây) kiểm tra file tín hiệu khi đang chờ
+SIGNAL_POLL_INTERVAL = 5
+
+# Thời gian (giây) chờ trước khi thử lại bài đăng lỗi hoặc lần đọc sheet lỗi
+OVERDUE_RETRY_DELAY = 60
+
+# Đăng song song các bài đến hạn bằng vòng lặp asyncio:
+# - PUBLISH_MAX_INFLIGHT: số bài đang đăng đồng thời tối đa
+# - PUBLISH_IO_THREADS: số thread chạy request HTTP (requests là thư viện đồng bộ); bài đang chờ
+#   lượt (page/nền tảng) không giữ thread nào
+# - PLATFORM_CONCURRENCY: số bài đồng thời tối đa trên mỗi nền tảng
+# - PAGE_CONCURRENCY: số bài đồng thời tối đa trên cùng một page/tài khoản (tránh Meta chặn vì đăng dồn)
+PUBLISH_MAX_INFLIGHT = 200
+PUBLISH_IO_THREADS = 64
+PLATFORM_CONCURRENCY = {"facebook": 64, "instagram": 32}
+PAGE_CONCURRENCY = 2
+
+# Tạo trước media container Instagram cho bài sắp đến giờ (lúc đến giờ chỉ còn gọi media_publish):
+# - IG_PRESTAGE_MINUTES: tạo container cho bài đến hạn trong bao nhiêu phút tới
+# - IG_CONTAINER_POLL_INTERVAL: chu kỳ (giây) đọc status_code của container
+# - IG_CONTAINER_POLL_TIMEOUT: thời gian (giây) chờ container xử lý xong lúc đăng
+# - IG_STAGE_POLL_TIMEOUT: thời gian (giây) chờ lúc tạo trước (chưa xong thì đọc lại lúc đăng)
+# - IG_STAGE_LIMIT: số container tạo tối đa mỗi lần kiểm tra
+# - IG_STAGE_LOCK/IG_STAGE_LOCK_TTL: khóa dùng chung để nhiều worker không tạo trùng container
+IG_PRESTAGE_MINUTES = 10
+IG_CONTAINER_POLL_INTERVAL = 3
+IG_CONTAINER_POLL_TIMEOUT = 60
+IG_STAGE_POLL_TIMEOUT = 30
+IG_STAGE_LIMIT = 50
+IG_STAGE_LOCK = "ig_stage"
+IG_STAGE_LOCK_TTL = 300
+
+# Thời gian (giây) tối đa để đăng một bài: Instagram tạo container + chờ xử lý + media_publish
+JOB_PUBLISH_MAX_SECONDS = 30 + IG_CONTAINER_POLL_TIMEOUT + 30
+
+# Số job tối đa của một page trong một lần nhận: PAGE_CONCURRENCY bài đăng cùng lúc, mỗi bài tối đa
+# JOB_PUBLISH_MAX_SECONDS giây, job cuối của page vẫn phải bắt đầu đăng trước khi lease hết hạn
+JOB_CLAIM_PER_PAGE = max(1, PAGE_CONCURRENCY * JOB_LEASE_SECONDS // JOB_PUBLISH_MAX_SECONDS)
+
+# Thử lại bài đăng lỗi (theo từng job trong job store):
+# - RETRY_MAX_ATTEMPTS: số lần đăng lỗi tối đa trước khi chuyển vào dead-letter
+# - RETRY_BASE_DELAY/RETRY_MAX_DELAY: thời gian chờ (giây) lần đầu và tối đa, nhân đôi sau mỗi lần lỗi
+# - RETRY_JITTER: độ lệch ngẫu nhiên (±25%) để các bài lỗi cùng lúc không thử lại cùng lúc
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 60
+RETRY_MAX_DELAY = 3600
+RETRY_JITTER = 0.25
+
+# Phân loại lỗi đăng bài:
+# - transient (tạm thời): timeout, mất kết nối, HTTP 5xx/429, rate limit → thử lại với backoff
+# - permanent (vĩnh viễn): token sai/hết hạn, thiếu quyền, ảnh không hợp lệ... → dead-letter ngay
+ERROR_TRANSIENT = "transient"
+ERROR_PERMANENT = "permanent"
+# Mã lỗi Graph API tạm thời: lỗi phía Meta (1, 2), rate limit (4, 17, 32, 341, 613, 80000-80099),
+# media chưa sẵn sàng (9007)
+TRANSIENT_GRAPH_CODES = {1, 2, 4, 17, 32, 341, 613, 9007}
+TRANSIENT_ERROR_MARKERS = ("Timeout", "Không thể kết nối", "rate limit", "TIMEOUT", "EXPIRED", "IN_PROGRESS")
+PERMANENT_ERROR_MARKERS = ("Instagram yêu cầu phải có ảnh", "Container Instagram không dùng được")
+
+# Ghi thay đổi lên sheet: số lần thử tối đa và thời gian chờ (giây, tăng dần theo lần thử)
+SHEET_WRITE_RETRIES = 3
+SHEET_WRITE_RETRY_DELAY = 2
+
+# Quyền của service account:
+# - spreadsheets: đọc/ghi lịch đăng
+# - drive.metadata.readonly: đọc modifiedTime của file để biết sheet có thay đổi không
+SHEET_SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive.metadata.readonly'
+]
+
+# Làm mới token Google trước khi hết hạn (giây)
+SHEET_TOKEN_REFRESH_MARGIN = 300
+
+# Kết nối Google Sheets dùng lại giữa các lần đọc sheet (client, spreadsheet, worksheet, credentials)
+_sheet_handle = {}
+_sheet_handle_lock = threading.Lock()
+
+# Thống kê kết nối Google Sheets: số lần kết nối, dùng lại, làm mới token, kết nối lại do lỗi
+_sheet_stats = {"connects": 0, "connect_ms": 0.0, "reuses": 0, "token_refreshes": 0, "reconnects": 0}
+
+# Bản sao cục bộ của sheet: modifiedTime (Drive) lúc đọc, dữ liệu các dòng
+# và đã đồng bộ vào job store chưa
+_sheet_mirror = {}
+
+# Cache kết quả kiểm tra từng dòng theo nội dung dòng: {nội dung 10 cột: job (chưa có row_num) hoặc None}
+_row_parse_cache = {}
+
+# Thống kê đồng bộ sheet: số lần đọc toàn bộ, số lần bỏ qua nhờ modifiedTime, số dòng phải kiểm tra lại
+_sync_stats = {"full_reads": 0, "skipped_reads": 0, "rows_parsed": 0, "rows_cached": 0}
+
+# Thread pool chạy request HTTP cho engine asyncio (tạo khi cần)
+_io_executor = None
+_io_executor_lock = threading.Lock()
+
 # ====== Hàm đọc cấu hình secrets ======
 # Chức năng: Đọc secrets từ file .streamlit/secrets.toml một cách an toàn.
 # - Kiểm tra file tồn tại trước khi đọc
@@ -65,42 +211,39 @@ IG_TOKEN = secrets.get("IG_TOKEN", "")
 IG_ID = secrets.get("IG_ID", "")
 
 # ====== Hàm ghi log hoạt động ======
-# Chức năng: Ghi log chi tiết các hoạt động của scheduler.
-# - Ghi timestamp, platform, mode, status
-# - Ghi caption và image path
-# - Ghi error message nếu có lỗi
-# - Dùng encoding UTF-8 để hỗ trợ tiếng Việt
-def write_log(platform, mode, status, caption, image_path, error_msg=None):
+# Chức năng: Ghi log sự kiện của scheduler dạng JSON lines vào LOG_FILE (qua event_log).
+# - Trường chính: timestamp, row, platform, mode, status, latency_ms, post_id, error_class
+# - Kèm caption (tối đa 80 ký tự), image_path và error để debug
+# - Chỉ thêm vào buffer, thread nền của event_log ghi ra file theo lô (không chặn lượt đăng)
+# - error_class mặc định theo classify_publish_error khi có lỗi của bài đăng
+def write_log(platform, mode, status, caption, image_path, error_msg=None, row=None, latency_ms=None,
+              post_id=None, error_class=None):
     try:
-        # Mở file log ở chế độ append với encoding UTF-8
-        with open(LOG_FILE, "a", encoding="utf-8") as logf:
-            # Ghi timestamp và thông tin cơ bản
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            logf.write(f"[{timestamp}] Platform: {platform.upper()} | Mode: {mode} | Status: {status}\n")
-            
-            if status == "SUCCESS":
-                # Trường hợp đăng bài thành công:
-                # - Ghi caption (giới hạn 80 ký tự)
-                # - Ghi đường dẫn ảnh
-                logf.write(f"  ✅ Caption: {caption[:80]}...\n")
-                logf.write(f"  📷 Image: {image_path}\n\n")
-            else:
-                # Trường hợp đăng bài thất bại:
-                # - Ghi thông báo lỗi
-                # - Ghi caption và ảnh để debug
-                logf.write(f"  ❌ ERROR: {error_msg}\n")
-                logf.write(f"  📝 Caption: {caption[:80]}...\n")
-                logf.write(f"  📷 Image: {image_path}\n\n")
+        if error_msg and error_class is None and platform not in ("system", "unknown"):
+            error_class = classify_publish_error(error_msg)
+        event_log.emit(LOG_FILE, event_log.build_record(
+            status,
+            row=row,
+            platform=platform,
+            mode=mode,
+            latency_ms=round(latency_ms, 1) if latency_ms is not None else None,
+            post_id=post_id,
+            error_class=error_class,
+            error=error_msg,
+            caption=caption[:80] if caption else None,
+            image_path=image_path or None
+        ))
     except Exception as e:
-        # Xử lý lỗi khi không thể ghi file log
+        # Lỗi ghi log không được làm hỏng lượt đăng bài
         print(f"❌ Lỗi ghi log: {e}")
 
 # ====== Hàm đăng bài lên Facebook ======
 # Chức năng: Đăng bài lên Facebook với error handling cải thiện.
 # - Hỗ trợ đăng text only hoặc kèm ảnh
-# - Sử dụng Facebook Graph API v19.0
+# - Sử dụng Facebook Graph API v19.0 qua kết nối dùng chung (graph_http)
 # - Timeout 30 giây để tránh treo
 # - Trả về success với post_id hoặc error với message
+@tracing.traced()
 def post_content_to_facebook(page_id, access_token, message, image_url=None):
     print(f"🔄 Đang đăng lên Facebook...")
     
@@ -108,7 +251,7 @@ def post_content_to_facebook(page_id, access_token, message, image_url=None):
         # Xử lý trường hợp đăng kèm ảnh
         if image_url and image_url.strip():
             print(f"📷 Đăng kèm ảnh: {image_url}")
-            url = f"https://graph.facebook.com/v19.0/{page_id}/photos"
+            url = graph_http.graph_url(f"{page_id}/photos")
             data = {
                 "message": message,
                 "url": image_url,
@@ -117,15 +260,15 @@ def post_content_to_facebook(page_id, access_token, message, image_url=None):
         # Xử lý trường hợp đăng text only
         else:
             print("📝 Đăng text only")
-            url = f"https://graph.facebook.com/v19.0/{page_id}/feed"
+            url = graph_http.graph_url(f"{page_id}/feed")
             data = {
                 "message": message,
                 "access_token": access_token
             }
         
         # Gọi API với timeout 30s
-        response = requests.post(url, data=data, timeout=30)
-        print(f"📊 Facebook API response: {response.status_code}")
+        response = graph_http.post(url, data=data, timeout=30)
+        print(f"📊 Facebook API response: {response.status_code} ({response.latency_ms:.0f} ms)")
         
         # Xử lý response thành công
         if response.status_code == 200:
@@ -140,6 +283,8 @@ def post_content_to_facebook(page_id, access_token, message, image_url=None):
         return {"error": f"HTTP {response.status_code}: {error_text}"}
         
     # Xử lý các trường hợp lỗi
+    except graph_http.GraphThrottled as e:
+        return {"error": f"Facebook API đang bị giới hạn rate limit: {e}"}
     except requests.exceptions.Timeout:
         return {"error": "Timeout khi kết nối Facebook API"}
     except requests.exceptions.ConnectionError:
@@ -147,54 +292,74 @@ def post_content_to_facebook(page_id, access_token, message, image_url=None):
     except Exception as e:
         return {"error": f"Lỗi không xác định: {str(e)}"}
 
-# ====== Hàm đăng bài lên Instagram ======
-# Chức năng: Đăng bài lên Instagram với error handling cải thiện.
-# - Instagram bắt buộc phải có ảnh
-# - Quy trình 2 bước: tạo media object → publish
-# - Sử dụng Instagram Basic Display API
-# - Timeout 30 giây cho mỗi bước
-def post_content_to_instagram(ig_user_id, access_token, image_url, caption):
-    print(f"🔄 Đang đăng lên Instagram...")
-    
-    if not image_url or not image_url.strip():
-        return {"error": "Instagram yêu cầu phải có ảnh"}
-    
+# ====== Hàm tạo media container Instagram ======
+# Chức năng: Bước 1 của đăng Instagram: tạo media object (container) từ ảnh + caption.
+# - Trả về {"success": True, "creation_id": ...} hoặc {"error": ...}
+@tracing.traced()
+def create_instagram_container(ig_user_id, access_token, image_url, caption):
     try:
-        # Bước 1: Tạo media object
         print("📷 Tạo media object...")
-        create_url = f"https://graph.facebook.com/v19.0/{ig_user_id}/media"
+        create_url = graph_http.graph_url(f"{ig_user_id}/media")
         create_params = {
             "image_url": image_url,
             "caption": caption,
             "access_token": access_token
         }
         
-        create_resp = requests.post(create_url, data=create_params, timeout=30)
+        create_resp = graph_http.post(create_url, data=create_params, timeout=30)
         create_result = create_resp.json()
+        print(f"📊 Instagram /media response: {create_resp.status_code} ({create_resp.latency_ms:.0f} ms)")
         
         if "id" not in create_result:
             return {"error": f"Không tạo được media: {create_result}"}
-        
-        creation_id = create_result["id"]
-        print(f"✅ Media ID: {creation_id}")
-        
-        # Bước 2: Publish media object
+        print(f"✅ Media ID: {create_result['id']}")
+        return {"success": True, "creation_id": create_result["id"]}
+    except graph_http.GraphThrottled as e:
+        return {"error": f"Instagram API đang bị giới hạn rate limit: {e}"}
+    except requests.exceptions.Timeout:
+        return {"error": "Timeout khi kết nối Instagram API"}
+    except requests.exceptions.ConnectionError:
+        return {"error": "Không thể kết nối đến Instagram API"}
+    except Exception as e:
+        return {"error": f"Lỗi không xác định: {str(e)}"}
+
+# ====== Hàm đọc trạng thái container Instagram ======
+# Chức năng: Đọc status_code của container (IN_PROGRESS, FINISHED, ERROR, EXPIRED, PUBLISHED).
+# - Trả về chuỗi status_code, hoặc None nếu không đọc được (coi như chưa xong).
+@tracing.traced()
+def get_container_status(creation_id, access_token):
+    try:
+        resp = graph_http.get(graph_http.graph_url(creation_id),
+                              params={"fields": "status_code", "access_token": access_token},
+                              timeout=30, priority=graph_http.PRIORITY_PUBLISH)
+        return resp.json().get("status_code")
+    except Exception as e:
+        print(f"⚠️ Không đọc được trạng thái container {creation_id}: {e}")
+        return None
+
+# ====== Hàm publish container Instagram ======
+# Chức năng: Bước 2 của đăng Instagram: publish container đã tạo.
+# - Trả về {"success": True, "post_id": ...} hoặc {"error": ...}
+@tracing.traced()
+def publish_instagram_container(ig_user_id, access_token, creation_id):
+    try:
         print("📤 Publishing media...")
-        publish_url = f"https://graph.facebook.com/v19.0/{ig_user_id}/media_publish"
+        publish_url = graph_http.graph_url(f"{ig_user_id}/media_publish")
         publish_params = {
             "creation_id": creation_id,
             "access_token": access_token
         }
         
-        publish_resp = requests.post(publish_url, data=publish_params, timeout=30)
+        publish_resp = graph_http.post(publish_url, data=publish_params, timeout=30)
         publish_result = publish_resp.json()
+        print(f"📊 Instagram /media_publish response: {publish_resp.status_code} ({publish_resp.latency_ms:.0f} ms)")
         
         if "id" in publish_result:
             print(f"✅ Instagram post ID: {publish_result['id']}")
             return {"success": True, "post_id": publish_result["id"]}
-        else:
-            return {"error": f"Không publish được: {publish_result}"}
-            
+        return {"error": f"Không publish được: {publish_result}"}
+    except graph_http.GraphThrottled as e:
+        return {"error": f"Instagram API đang bị giới hạn rate limit: {e}"}
     except requests.exceptions.Timeout:
         return {"error": "Timeout khi kết nối Instagram API"}
     except requests.exceptions.ConnectionError:
@@ -202,24 +367,180 @@ def post_content_to_instagram(ig_user_id, access_token, image_url, caption):
     except Exception as e:
         return {"error": f"Lỗi không xác định: {str(e)}"}
 
+# ====== Hàm đăng bài lên Instagram ======
+# Chức năng: Đăng bài lên Instagram với error handling cải thiện.
+# - Instagram bắt buộc phải có ảnh
+# - Quy trình: tạo media object → chờ container xử lý xong (FINISHED) → publish
+# - Sử dụng Instagram Graph API qua kết nối dùng chung (graph_http)
+# - Timeout 30 giây cho mỗi bước
+@tracing.traced()
+def post_content_to_instagram(ig_user_id, access_token, image_url, caption):
+    print(f"🔄 Đang đăng lên Instagram...")
+    
+    if not image_url or not image_url.strip():
+        return {"error": "Instagram yêu cầu phải có ảnh"}
+    
+    # Bước 1: Tạo media object
+    created = create_instagram_container(ig_user_id, access_token, image_url, caption)
+    if "error" in created:
+        return created
+    
+    # Chờ Meta xử lý ảnh trước khi publish
+    status = wait_for_container(created["creation_id"], access_token, IG_CONTAINER_POLL_TIMEOUT)
+    if status not in ("FINISHED", None):
+        return {"error": f"Container Instagram không dùng được: {status}"}
+    
+    # Bước 2: Publish media object
+    return publish_instagram_container(ig_user_id, access_token, created["creation_id"])
+
+# ====== Hàm chờ container Instagram xử lý xong ======
+# Chức năng: Đọc status_code mỗi IG_CONTAINER_POLL_INTERVAL giây tới khi hết IN_PROGRESS hoặc hết timeout.
+# - Trả về status_code cuối cùng (FINISHED, ERROR, EXPIRED...), "TIMEOUT" nếu hết giờ,
+#   None nếu không đọc được trạng thái (vẫn thử publish như trước).
+def wait_for_container(creation_id, access_token, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        status = get_container_status(creation_id, access_token)
+        if status != "IN_PROGRESS":
+            return status
+        if time.monotonic() >= deadline:
+            return "TIMEOUT"
+        time.sleep(IG_CONTAINER_POLL_INTERVAL)
+
+# ====== Hàm tạo credentials Google ======
+# Chức năng: Tạo credentials service account cho Google Sheets.
+# - Scope: đọc/ghi spreadsheets, đọc metadata Drive (SHEET_SCOPES)
+# - Raise exception nếu không có thông tin service account
+def get_sheet_credentials():
+    gdrive_service_account = secrets.get("gdrive_service_account", {})
+    if not gdrive_service_account:
+        raise Exception("Không tìm thấy thông tin service account")
+    return Credentials.from_service_account_info(gdrive_service_account, scopes=SHEET_SCOPES)
+
 # ====== Hàm tạo Google Sheets client ======
 # Chức năng: Tạo client Google Sheets với error handling.
 # - Authenticate bằng service account key
-# - Scope chỉ cho phép đọc/ghi spreadsheets
 # - Raise exception nếu không tạo được client
-def get_gsheet_client():
+def get_gsheet_client(creds=None):
     try:
-        gdrive_service_account = secrets.get("gdrive_service_account", {})
-        if not gdrive_service_account:
-            raise Exception("Không tìm thấy thông tin service account")
-            
-        scopes = ['https://www.googleapis.com/auth/spreadsheets']
-        creds = Credentials.from_service_account_info(gdrive_service_account, scopes=scopes)
-        return gspread.authorize(creds)
+        return gspread.authorize(creds or get_sheet_credentials())
     except Exception as e:
         print(f"❌ Lỗi tạo Google Sheets client: {e}")
         raise
 
+# ====== Hàm kiểm tra token sắp hết hạn ======
+# Chức năng: True nếu token chưa có hoặc còn dưới SHEET_TOKEN_REFRESH_MARGIN giây.
+# - creds.expiry của google-auth là giờ UTC không kèm múi giờ.
+def token_needs_refresh(creds, now=None):
+    if not getattr(creds, "token", None) or getattr(creds, "expiry", None) is None:
+        return True
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    return creds.expiry - now < timedelta(seconds=SHEET_TOKEN_REFRESH_MARGIN)
+
+# ====== Hàm lấy kết nối Google Sheets dùng lại ======
+# Chức năng: Trả về (spreadsheet, worksheet) dùng chung giữa các tick.
+# - Lần đầu (hoặc force_reconnect): tạo credentials, authorize, open_by_key, worksheet(SHEET_NAME).
+# - Các lần sau: dùng lại, chỉ làm mới token khi sắp hết hạn (không tạo lại client).
+# - Ghi nhận thời gian kết nối để báo phần overhead tiết kiệm được.
+def get_sheet_handle(force_reconnect=False):
+    with _sheet_handle_lock:
+        if force_reconnect or not _sheet_handle:
+            start = time.perf_counter()
+            creds = get_sheet_credentials()
+            gc = get_gsheet_client(creds)
+            sh = gc.open_by_key(SPREADSHEET_ID)
+            worksheet = sh.worksheet(SHEET_NAME)
+            _sheet_handle.update({"creds": creds, "client": gc, "spreadsheet": sh, "worksheet": worksheet})
+            _sheet_stats["connects"] += 1
+            _sheet_stats["connect_ms"] += (time.perf_counter() - start) * 1000
+            print(f"🔌 Đã kết nối Google Sheets ({(time.perf_counter() - start) * 1000:.0f} ms)")
+        else:
+            _sheet_stats["reuses"] += 1
+            creds = _sheet_handle["creds"]
+            if token_needs_refresh(creds):
+                creds.refresh(Request())
+                _sheet_stats["token_refreshes"] += 1
+                print("🔑 Đã làm mới token Google Sheets")
+        return _sheet_handle["spreadsheet"], _sheet_handle["worksheet"]
+
+# ====== Hàm bỏ kết nối Google Sheets đang giữ ======
+# Chức năng: Bỏ kết nối, bản sao sheet và cache kiểm tra dòng (dùng khi cần đọc lại từ đầu).
+def reset_sheet_handle():
+    with _sheet_handle_lock:
+        _sheet_handle.clear()
+    _sheet_mirror.clear()
+    _row_parse_cache.clear()
+
+# ====== Hàm đọc modifiedTime của sheet ======
+# Chức năng: Hỏi Drive API thời điểm sửa gần nhất của file (request rất nhỏ, không tải dữ liệu).
+# - Dùng credentials của kết nối Google Sheets đang giữ.
+# - Trả về chuỗi modifiedTime, hoặc None nếu lỗi (chưa bật Drive API, thiếu quyền...):
+#   khi đó scheduler đọc toàn bộ sheet như bình thường.
+def get_sheet_modified_time():
+    try:
+        get_sheet_handle()
+        with _sheet_handle_lock:
+            if "drive" not in _sheet_handle:
+                _sheet_handle["drive"] = build("drive", "v3", credentials=_sheet_handle["creds"], cache_discovery=False)
+            drive = _sheet_handle["drive"]
+        meta = drive.files().get(fileId=SPREADSHEET_ID, fields="modifiedTime", supportsAllDrives=True).execute()
+        return meta.get("modifiedTime")
+    except Exception as e:
+        print(f"⚠️ Không đọc được modifiedTime của sheet, đọc toàn bộ: {e}")
+        return None
+
+# ====== Hàm đọc dữ liệu sheet có dùng bản sao cục bộ ======
+# Chức năng: Chỉ tải lại toàn bộ sheet khi file đã thay đổi từ lần đọc trước.
+# - So sánh modifiedTime của Drive với bản sao cục bộ; giống nhau thì dùng lại dữ liệu cũ.
+# - modifiedTime được đọc trước khi tải sheet: nếu sheet đổi trong lúc tải,
+#   lần sau sẽ thấy khác và tải lại (không bao giờ bỏ sót thay đổi).
+# - Trả về (spreadsheet, worksheet, rows, changed); changed = False khi dùng lại bản sao
+#   đã đồng bộ vào job store (không cần đồng bộ lại).
+@tracing.traced()
+def read_schedule_sheet():
+    start = time.perf_counter()
+    modified_time = get_sheet_modified_time()
+    if modified_time and _sheet_mirror.get("modified_time") == modified_time:
+        _sync_stats["skipped_reads"] += 1
+        print("♻️ Sheet không thay đổi, dùng bản sao cục bộ")
+        sh, worksheet = get_sheet_handle()
+        metrics.observe("scheduler_sheet_read_seconds", time.perf_counter() - start, {"result": "skipped"})
+        return sh, worksheet, _sheet_mirror["rows"], not _sheet_mirror.get("store_synced")
+    
+    read_at = time.time()
+    sh, worksheet, rows = call_sheet(lambda sh, worksheet: (sh, worksheet, worksheet.get_all_values()))
+    metrics.observe("scheduler_sheet_read_seconds", time.perf_counter() - start, {"result": "full"})
+    _sync_stats["full_reads"] += 1
+    _sheet_mirror.update({"modified_time": modified_time, "rows": rows, "read_at": read_at, "store_synced": False})
+    return sh, worksheet, rows, True
+
+# ====== Hàm gọi Google Sheets có tự kết nối lại ======
+# Chức năng: Chạy action(spreadsheet, worksheet); lỗi xác thực/HTTP thì kết nối lại và thử 1 lần nữa.
+# - Lỗi lần 2 được raise cho nơi gọi xử lý như trước.
+def call_sheet(action):
+    sh, worksheet = get_sheet_handle()
+    try:
+        return action(sh, worksheet)
+    except (gspread.exceptions.APIError, google.auth.exceptions.GoogleAuthError,
+            requests.exceptions.RequestException) as e:
+        print(f"⚠️ Lỗi Google Sheets ({e}), đang kết nối lại...")
+        _sheet_stats["reconnects"] += 1
+        sh, worksheet = get_sheet_handle(force_reconnect=True)
+        return action(sh, worksheet)
+
+# ====== Hàm báo cáo kết nối Google Sheets ======
+# Chức năng: Tạo chuỗi thống kê kết nối, gồm thời gian ước tính đã tiết kiệm nhờ dùng lại client.
+# - Mỗi lần dùng lại tiết kiệm ≈ thời gian kết nối trung bình (authorize + open_by_key + worksheet).
+def format_sheet_client_report():
+    stats = dict(_sheet_stats)
+    avg_connect_ms = stats["connect_ms"] / stats["connects"] if stats["connects"] else 0.0
+    saved_seconds = stats["reuses"] * avg_connect_ms / 1000
+    return (
+        f"{stats['connects']} lần kết nối (TB {avg_connect_ms:.0f} ms), dùng lại {stats['reuses']} lần "
+        f"(tiết kiệm ~{saved_seconds:.1f} s), làm mới token {stats['token_refreshes']} lần, "
+        f"kết nối lại do lỗi {stats['reconnects']} lần"
+    )
+
 # ====== Hàm parse thời gian từ string ======
 # Chức năng: Parse thời gian từ string với error handling.
 # - Format: YYYY-MM-DD HH:MM
@@ -241,288 +562,888 @@ def parse_scheduled_time(date_str, time_str):
     except ValueError as e:
         raise ValueError(f"Lỗi format thời gian '{date_str} {time_str}': {e}")
 
+# ====== Hàm đọc một dòng lịch đăng ======
+# Chức năng: Kiểm tra và chuẩn hóa một dòng dữ liệu từ sheet thành lịch đăng (job).
+# - row: danh sách giá trị của dòng, row_num: số dòng trên sheet (bắt đầu từ 2).
+# - Dòng không hợp lệ (thiếu cột, thiếu trường bắt buộc, sai thời gian, sai mode/platform): in lý do, trả về None.
+# - Trả về dict: row_num, product, platform, token, page_id, mode, date_str, caption, image_path, scheduled_time.
+def parse_schedule_row(row, row_num):
+    # BƯỚC 1: Kiểm tra tính đầy đủ của dữ liệu
+    # Kiểm tra số lượng cột: phải có đủ 10 cột theo định nghĩa HEADER
+    # [product, keywords, platform, time_str, token, page_id, mode, date_str, caption, image_path]
+    if len(row) < 10:
+        print(f"⚠️ Dòng {row_num}: Thiếu dữ liệu - {len(row)}/10 cột")
+        return None
+    
+    # Tách dữ liệu từ mảng row thành các biến riêng biệt theo thứ tự
+    # Chỉ lấy 10 cột đầu tiên, bỏ qua các cột thừa (nếu có)
+    product, keywords, platform, time_str, token, page_id, mode, date_str, caption, image_path = row[:10]
+    
+    # Kiểm tra các trường bắt buộc không được để trống
+    # platform: Facebook/Instagram, mode: once/daily, date_str: YYYY-MM-DD
+    # time_str: HH:MM, caption: nội dung bài viết
+    if not all([platform, mode, date_str, time_str, caption]):
+        print(f"⚠️ Dòng {row_num}: Thiếu thông tin bắt buộc")
+        return None
+    
+    # BƯỚC 2: Chuyển đổi và kiểm tra thời gian đăng
+    try:
+        # Gọi hàm parse_scheduled_time để chuyển chuỗi thành datetime
+        # Input: "2024-12-25" + "14:30" → Output: datetime(2024, 12, 25, 14, 30)
+        scheduled_time = parse_scheduled_time(date_str, time_str)
+    except ValueError as e:
+        # Nếu format thời gian sai (ví dụ: "2024-13-45" hoặc "25:70")
+        print(f"❌ Dòng {row_num}: {e}")
+        return None
+    
+    # BƯỚC 3: Làm sạch và chuẩn hóa dữ liệu đầu vào
+    # Loại bỏ khoảng trắng thừa ở đầu/cuối và chuyển về chữ thường
+    platform = platform.strip().lower()  # "Facebook " → "facebook"
+    mode = mode.strip().lower()           # "Once " → "once"
+    
+    # BƯỚC 4: Kiểm tra quy tắc nghiệp vụ
+    # Validate mode chỉ cho phép 2 giá trị: "once" hoặc "daily"
+    # - "once": đăng 1 lần rồi xóa khỏi lịch
+    # - "daily": đăng hàng ngày, tự động lên lịch ngày tiếp theo
+    if mode not in ["once", "daily"]:
+        print(f"⚠️ Dòng {row_num}: Mode không hợp lệ: '{mode}' (chỉ chấp nhận once/daily)")
+        return None
+    if platform not in ["facebook", "instagram"]:
+        print(f"❌ Dòng {row_num}: Platform không hỗ trợ: {platform}")
+        return None
+    
+    return {
+        "row_num": row_num,
+        "product": product,
+        "platform": platform,
+        "token": token.strip(),            # " abc123 " → "abc123"
+        "page_id": page_id.strip(),        # " 1234567890 " → "1234567890"
+        "mode": mode,
+        "date_str": date_str.strip(),
+        "caption": caption.strip(),        # Loại bỏ khoảng trắng thừa
+        "image_path": image_path.strip(),  # URL ảnh sạch
+        "scheduled_time": scheduled_time
+    }
+
+# ====== Hàm đọc lịch đăng từ dữ liệu sheet ======
+# Chức năng: Chuyển toàn bộ dữ liệu sheet (dòng 1 là header) thành danh sách job hợp lệ.
+# - Mỗi dòng được kiểm tra độc lập, lỗi 1 dòng không ảnh hưởng dòng khác.
+# - Chỉ kiểm tra lại dòng có nội dung mới/đã sửa; dòng không đổi lấy từ cache (kể cả dòng
+#   không hợp lệ, nên cảnh báo chỉ in 1 lần). Dòng chỉ đổi vị trí vẫn dùng cache.
+# - Cache chỉ giữ các dòng còn trên sheet.
+def parse_schedule_rows(rows):
+    global _row_parse_cache
+    jobs = []
+    new_cache = {}
+    for idx, row in enumerate(rows[1:]):
+        row_num = idx + 2  # +2 vì bắt đầu từ dòng 2 (dòng 1 là header)
+        key = tuple(row[:10])
+        if key in new_cache or key in _row_parse_cache:
+            parsed = new_cache[key] if key in new_cache else _row_parse_cache[key]
+            _sync_stats["rows_cached"] += 1
+        else:
+            try:
+                parsed = parse_schedule_row(row, row_num)
+            except Exception as e:
+                print(f"❌ Lỗi xử lý dòng {row_num}: {e}")
+                write_log('unknown', 'unknown', "ERROR", '', '', error_msg=str(e), row=row_num)
+                parsed = None
+            _sync_stats["rows_parsed"] += 1
+        new_cache[key] = parsed
+        if parsed:
+            jobs.append(dict(parsed, row_num=row_num))
+    _row_parse_cache = new_cache
+    return jobs
+
+# ====== Hàm lấy thread pool cho request HTTP ======
+# Chức năng: Tạo (một lần) thread pool PUBLISH_IO_THREADS thread dùng chung cho mọi lượt đăng.
+def get_io_executor():
+    global _io_executor
+    with _io_executor_lock:
+        if _io_executor is None:
+            _io_executor = ThreadPoolExecutor(max_workers=PUBLISH_IO_THREADS, thread_name_prefix="publish-io")
+        return _io_executor
+
+# ====== Hàm chạy hàm đồng bộ trong vòng lặp asyncio ======
+# Chức năng: Chạy fn (request HTTP qua session dùng chung của graph_http, ghi SQLite...) trên
+# thread pool I/O và chờ kết quả mà không chặn vòng lặp.
+# - Span đang chạy được mang sang thread I/O (span của fn nằm dưới span của lượt đăng).
+async def run_io(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_executor(), tracing.bind(functools.partial(fn, *args, **kwargs)))
+
+# ====== Hàm đăng bài bất đồng bộ ======
+# Chức năng: Bản async của post_content_to_facebook / post_content_to_instagram.
+# - Cùng kết quả: {"success": True, "post_id": ...} hoặc {"error": ...}
+# - Request chạy qua pool kết nối dùng chung của graph_http (retry, rate limit, đo độ trễ như bản đồng bộ).
+async def post_content_to_facebook_async(page_id, access_token, message, image_url=None):
+    return await run_io(post_content_to_facebook, page_id, access_token, message, image_url=image_url)
+
+async def post_content_to_instagram_async(ig_user_id, access_token, image_url, caption):
+    return await run_io(post_content_to_instagram, ig_user_id, access_token, image_url=image_url, caption=caption)
+
+# ====== Hàm chờ container Instagram (bất đồng bộ) ======
+# Chức năng: Bản async của wait_for_container: chờ bằng asyncio.sleep, không giữ thread I/O.
+async def wait_for_container_async(creation_id, access_token, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        status = await run_io(get_container_status, creation_id, access_token)
+        if status != "IN_PROGRESS":
+            return status
+        if time.monotonic() >= deadline:
+            return "TIMEOUT"
+        await asyncio.sleep(IG_CONTAINER_POLL_INTERVAL)
+
+# ====== Hàm tạo trước container cho một job Instagram ======
+# Chức năng: Tạo media container, chờ tối đa IG_STAGE_POLL_TIMEOUT giây rồi lưu vào job store.
+# - Container chưa xử lý xong được lưu là IN_PROGRESS (đọc lại lúc đến giờ đăng).
+# - Trả về status_code đã lưu, None nếu không tạo được (lúc đến giờ đăng đầy đủ 2 bước).
+async def stage_container(job):
+    if not job["image_path"]:
+        return None
+    access_token = job["token"] or IG_TOKEN
+    created = await run_io(create_instagram_container, job["page_id"] or IG_ID, access_token,
+                           job["image_path"], job["caption"])
+    if "error" in created:
+        print(f"⚠️ {job_label(job)}: không tạo trước được container: {created['error']}")
+        return None
+    status = await wait_for_container_async(created["creation_id"], access_token, IG_STAGE_POLL_TIMEOUT)
+    status = "IN_PROGRESS" if status in ("TIMEOUT", None) else status
+    await run_io(job_store.save_container, job["job_id"], job["scheduled_time"].timestamp(),
+                 created["creation_id"], status, db_path=JOB_STORE_FILE)
+    return status
+
+async def stage_containers_async(jobs):
+    semaphore = asyncio.Semaphore(PLATFORM_CONCURRENCY["instagram"])
+    
+    async def stage_limited(job):
+        async with semaphore:
+            return await stage_container(job)
+    
+    return await asyncio.gather(*(stage_limited(job) for job in jobs), return_exceptions=True)
+
+# ====== Hàm tạo trước container Instagram ======
+# Chức năng: Tạo container cho các bài Instagram đến hạn trong IG_PRESTAGE_MINUTES phút tới.
+# - Chỉ một worker tạo tại một thời điểm (khóa IG_STAGE_LOCK), worker khác bỏ qua lượt này.
+# - Dọn container của bài đã đăng/bị hủy/hết hạn trước khi tạo mới.
+# - Trả về số container đã sẵn sàng (FINISHED).
+@tracing.traced()
+def stage_instagram_containers(now):
+    if not job_store.acquire_lock(IG_STAGE_LOCK, WORKER_ID, IG_STAGE_LOCK_TTL, db_path=JOB_STORE_FILE):
+        return 0
+    try:
+        job_store.prune_containers(db_path=JOB_STORE_FILE)
+        jobs = job_store.get_jobs_to_stage(now + timedelta(minutes=IG_PRESTAGE_MINUTES), now=now,
+                                           limit=IG_STAGE_LIMIT, db_path=JOB_STORE_FILE)
+        if not jobs:
+            return 0
+        print(f"📦 Tạo trước {len(jobs)} container Instagram...")
+        statuses = asyncio.run(stage_containers_async(jobs))
+        for job, status in zip(jobs, statuses):
+            if isinstance(status, BaseException):
+                print(f"⚠️ {job_label(job)}: lỗi tạo trước container: {status}")
+        return sum(1 for status in statuses if status == "FINISHED")
+    finally:
+        job_store.release_lock(IG_STAGE_LOCK, WORKER_ID, db_path=JOB_STORE_FILE)
+
+# ====== Hàm đăng bằng container đã tạo trước ======
+# Chức năng: Lúc đến giờ, publish container đã tạo trước cho job (chỉ 1 request media_publish).
+# - Container còn IN_PROGRESS thì chờ tối đa IG_CONTAINER_POLL_TIMEOUT giây.
+# - Container đã dùng (hoặc hỏng) bị xóa khỏi job store; publish lỗi thì lần thử sau tạo container mới.
+# - Trả về None nếu không có container dùng được (đăng đầy đủ 2 bước).
+@tracing.traced()
+async def publish_staged_container(job, ig_user_id, access_token):
+    fire_at = job["scheduled_time"].timestamp()
+    try:
+        container = await run_io(job_store.get_container, job["job_id"], fire_at, db_path=JOB_STORE_FILE)
+    except Exception as e:
+        print(f"⚠️ Lỗi đọc container đã tạo trước {job_label(job)}: {e}")
+        return None
+    if container is None:
+        return None
+    creation_id = container["creation_id"]
+    status = container["status"]
+    if status != "FINISHED":
+        status = await wait_for_container_async(creation_id, access_token, IG_CONTAINER_POLL_TIMEOUT)
+    if status not in ("FINISHED", None):
+        print(f"⚠️ {job_label(job)}: container {creation_id} không dùng được ({status}), tạo lại")
+        await run_io(job_store.delete_container, job["job_id"], fire_at, db_path=JOB_STORE_FILE)
+        return None
+    print(f"⚡ Dùng container đã tạo trước {creation_id}")
+    result = await run_io(publish_instagram_container, ig_user_id, access_token, creation_id)
+    try:
+        await run_io(job_store.delete_container, job["job_id"], fire_at, db_path=JOB_STORE_FILE)
+    except Exception as e:
+        print(f"⚠️ Lỗi xóa container {creation_id}: {e}")
+    return result
+
+# ====== Hàm đăng một bài theo lịch ======
+# Chức năng: Đăng bài của một job lên đúng nền tảng.
+# - Facebook: text + ảnh tùy chọn; Instagram: bắt buộc có ảnh.
+# - Dùng token/page_id mặc định khi dòng không có token riêng.
+# - Instagram: dùng container đã tạo trước nếu có (xem stage_instagram_containers).
+# - Trả về kết quả của hàm đăng: {"success": True, "post_id": ...} hoặc {"error": ...}
+@tracing.traced()
+async def dispatch_post(job):
+    tracing.set_attribute("job", job_label(job))
+    if job["platform"] == "facebook":
+        # Xử lý đăng bài lên Facebook
+        # Sử dụng token và page_id riêng, nếu không có thì dùng mặc định
+        return await post_content_to_facebook_async(
+            job["page_id"] or DEFAULT_PAGE_ID,      # Fallback đến page mặc định
+            job["token"] or DEFAULT_ACCESS_TOKEN,   # Fallback đến token mặc định
+            job["caption"],                         # Nội dung bài viết
+            image_url=job["image_path"] or None     # Ảnh optional cho FB
+        )
+    # Xử lý đăng bài lên Instagram
+    # Container đã tạo trước thì chỉ còn publish
+    if job.get("job_id"):
+        result = await publish_staged_container(job, job["page_id"] or IG_ID, job["token"] or IG_TOKEN)
+        if result is not None:
+            return result
+    # Instagram bắt buộc phải có ảnh, không hỗ trợ text-only
+    return await post_content_to_instagram_async(
+        job["page_id"] or IG_ID,                    # Fallback đến IG account mặc định
+        job["token"] or IG_TOKEN,                   # Fallback đến IG token mặc định
+        image_url=job["image_path"],                # Ảnh bắt buộc cho Instagram
+        caption=job["caption"]                      # Caption đi kèm ảnh
+    )
+
+# ====== Hàm đăng một bài có đo thời gian ======
+# Chức năng: Gọi dispatch_post và thêm latency_ms (thời gian gọi API của bài) vào kết quả để ghi log.
+async def timed_dispatch_post(job):
+    start = time.perf_counter()
+    result = await dispatch_post(job)
+    if isinstance(result, dict):
+        result = dict(result, latency_ms=(time.perf_counter() - start) * 1000)
+    return result
+
+# ====== Hàm tạo giới hạn đồng thời cho một lượt đăng ======
+# Chức năng: Tạo semaphore asyncio của một lượt đăng: tổng số bài, theo nền tảng, theo page (tạo khi cần).
+def new_publish_limits():
+    return {
+        "inflight": asyncio.Semaphore(PUBLISH_MAX_INFLIGHT),
+        "platforms": {platform: asyncio.Semaphore(limit) for platform, limit in PLATFORM_CONCURRENCY.items()},
+        "pages": {}
+    }
+
+# ====== Hàm đăng một bài có giới hạn đồng thời ======
+# Chức năng: Gọi dispatch_post khi page và nền tảng còn chỗ trống.
+# - Giữ chỗ của page trước rồi mới tới nền tảng và tổng số bài (thứ tự cố định, không bị khóa chéo),
+#   để bài đang chờ page khác không chiếm chỗ của cả nền tảng.
+# - Job từ job store: chuyển sang publishing và ghi journal "intent" ngay trước khi gọi API
+#   (job_store.begin_publish); lease đã mất (worker khác nhận lại) thì raise LeaseLost, không đăng.
+# - Kết quả API được ghi vào journal ngay khi có (không chờ các bài khác),
+#   lỗi ghi journal chỉ in ra (không được biến bài đã đăng thành lỗi để rồi đăng lại).
+# - Lệnh đăng raise exception (không biết request đã tới API chưa): job chuyển in_doubt
+#   (job_store.mark_in_doubt) rồi raise PublishInDoubt, không trả job về pending để đăng lại.
+async def dispatch_post_limited(job, limits):
+    platform = job["platform"]
+    default_page = DEFAULT_PAGE_ID if platform == "facebook" else IG_ID
+    page_key = (platform, job["page_id"] or default_page)
+    page_semaphore = limits["pages"].setdefault(page_key, asyncio.Semaphore(PAGE_CONCURRENCY))
+    async with page_semaphore, limits["platforms"][platform], limits["inflight"]:
+        if not job.get("job_id"):
+            return await timed_dispatch_post(job)
+        entry_id = await run_io(job_store.begin_publish, job["job_id"], WORKER_ID, db_path=JOB_STORE_FILE)
+        try:
+            result = await timed_dispatch_post(job)
+        except Exception as e:
+            try:
+                await run_io(job_store.mark_in_doubt, entry_id, str(e), db_path=JOB_STORE_FILE)
+            except Exception as store_error:
+                # Job vẫn publishing: hết lease thì reclaim_expired_leases chuyển in_doubt
+                print(f"⚠️ Lỗi ghi journal {job_label(job)}: {store_error}")
+            raise job_store.PublishInDoubt(str(e)) from e
+        try:
+            await run_io(job_store.journal_result, entry_id, result, db_path=JOB_STORE_FILE)
+        except Exception as e:
+            print(f"⚠️ Lỗi ghi journal {job_label(job)}: {e}")
+        return result
+
+# ====== Hàm đăng song song các bài đến hạn ======
+# Chức năng: Đăng mọi bài đến hạn cùng lúc trong một vòng lặp asyncio.
+# - Giới hạn theo PUBLISH_MAX_INFLIGHT, PLATFORM_CONCURRENCY và PAGE_CONCURRENCY.
+# - Mỗi bài độc lập: lỗi (exception) của bài nào trả về đúng vị trí bài đó.
+# - Trả về danh sách (result, exception) theo đúng thứ tự jobs.
+async def dispatch_due_posts_async(jobs):
+    limits = new_publish_limits()
+    outcomes = await asyncio.gather(*(dispatch_post_limited(job, limits) for job in jobs), return_exceptions=True)
+    return [(None, outcome) if isinstance(outcome, BaseException) else (outcome, None) for outcome in outcomes]
+
+# ====== Hàm đăng song song các bài đến hạn (gọi từ code đồng bộ) ======
+# Chức năng: Chạy dispatch_due_posts_async trong vòng lặp asyncio riêng của lượt đăng.
+@tracing.traced()
+def dispatch_due_posts(jobs):
+    if not jobs:
+        return []
+    return asyncio.run(dispatch_due_posts_async(jobs))
+
+# ====== Hàm xử lý kết quả đăng bài ======
+# Chức năng: Ghi log và đánh dấu thay đổi trên sheet theo kết quả đăng.
+# - Mode "once" thành công: đánh dấu xóa dòng.
+# - Mode "daily" thành công: đánh dấu cập nhật ngày sang ngày tiếp theo.
+# - Thất bại: ghi log lỗi, dòng giữ nguyên để thử lại (job từ job store: xem record_publish_failure).
+# - Job từ job store (có job_id): ghi kết quả vào store; thay đổi trên sheet được đánh dấu chờ ghi
+#   cho tới khi confirm_sheet_writes. Job chưa biết số dòng (chưa đồng bộ sheet) để lần đồng bộ sau ghi.
+# - now: thời điểm của lượt kiểm tra (tính thời điểm thử lại), mặc định là hiện tại.
+# - Trả về thời điểm cần chạy lại job này (daily: lần đăng kế tiếp, lỗi: lần thử lại), None nếu đã xong.
+def handle_publish_result(job, result, rows_to_update, rows_to_delete, now=None):
+    platform, mode, row_num = job["platform"], job["mode"], job["row_num"]
+    if result and "success" in result:
+        # Trường hợp đăng bài thành công
+        print(f"✅ Đăng thành công {platform.upper()}!")
+        write_log(platform, mode, "SUCCESS", job["caption"], job["image_path"], row=row_num,
+                  latency_ms=result.get("latency_ms"), post_id=result.get("post_id"))
+        
+        if mode == "once":
+            if job.get("job_id"):
+                job_store.mark_published(job["job_id"], result.get("post_id"), db_path=JOB_STORE_FILE)
+            # Thêm vào danh sách dòng cần xóa (xóa sau cùng để tránh lệch index)
+            if row_num:
+                rows_to_delete.append(row_num)
+                print(f"🗑️ Đánh dấu xóa dòng {row_num} (mode: once)")
+            return None
+        
+        # Mode "daily": cộng thêm 1 ngày từ thời gian đã đăng
+        next_date = job["scheduled_time"] + timedelta(days=1)
+        new_date_str = next_date.strftime("%Y-%m-%d")  # Format YYYY-MM-DD
+        if job.get("job_id"):
+            job_store.mark_published(job["job_id"], result.get("post_id"), next_date_str=new_date_str,
+                                     db_path=JOB_STORE_FILE)
+        # Thêm vào danh sách cập nhật: (row_num, col_index, new_value)
+        # Cột 8 (index bắt đầu từ 1) chứa date_str
+        if row_num:
+            rows_to_update.append((row_num, 8, new_date_str))
+        print(f"📅 Lên lịch ngày tiếp theo: {new_date_str}")
+        return next_date
+    
+    # Trường hợp đăng bài thất bại
+    # Lấy thông báo lỗi từ result, nếu không có thì dùng message mặc định
+    error_msg = result.get("error", "Lỗi không xác định") if result else "Không có response"
+    print(f"❌ Đăng thất bại {platform.upper()}: {error_msg}")
+    latency_ms = result.get("latency_ms") if result else None
+    if job.get("job_id"):
+        return record_publish_failure(job, error_msg, now or datetime.now(), latency_ms=latency_ms)
+    # Ghi log lỗi để debug sau này
+    write_log(platform, mode, "ERROR", job["caption"], job["image_path"], error_msg=error_msg, row=row_num,
+              latency_ms=latency_ms)
+    return job["scheduled_time"]
+
+# ====== Hàm phân loại lỗi đăng bài ======
+# Chức năng: Trả về ERROR_TRANSIENT hoặc ERROR_PERMANENT cho thông báo lỗi của hàm đăng.
+# - Ưu tiên mã lỗi Graph API ("code": ...), rồi HTTP status, rồi nội dung thông báo.
+# - HTTP 4xx / mã Graph khác (token sai 190, thiếu quyền 10/200, tham số/ảnh sai 100...) là vĩnh viễn.
+# - Lỗi không nhận ra được coi là tạm thời (vẫn bị giới hạn bởi RETRY_MAX_ATTEMPTS).
+def classify_publish_error(error_msg):
+    error_msg = str(error_msg or "")
+    code_match = re.search(r"""["']code["']\s*:\s*(\d+)""", error_msg)
+    if code_match:
+        code = int(code_match.group(1))
+        if code in TRANSIENT_GRAPH_CODES or 80000 <= code < 80100:
+            return ERROR_TRANSIENT
+        return ERROR_PERMANENT
+    status_match = re.search(r"HTTP (\d{3})", error_msg)
+    if status_match:
+        status = int(status_match.group(1))
+        return ERROR_TRANSIENT if status == 429 or status >= 500 else ERROR_PERMANENT
+    if any(marker in error_msg for marker in TRANSIENT_ERROR_MARKERS):
+        return ERROR_TRANSIENT
+    if any(marker in error_msg for marker in PERMANENT_ERROR_MARKERS):
+        return ERROR_PERMANENT
+    return ERROR_TRANSIENT
+
+# ====== Hàm tính thời gian chờ thử lại ======
+# Chức năng: Exponential backoff có jitter: RETRY_BASE_DELAY * 2^(attempts-1), tối đa RETRY_MAX_DELAY,
+#   lệch ngẫu nhiên ±RETRY_JITTER.
+def retry_delay(attempts):
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(1 - RETRY_JITTER, 1 + RETRY_JITTER)
+
+# ====== Hàm ghi nhận bài đăng lỗi ======
+# Chức năng: Phân loại lỗi rồi hẹn thử lại hoặc chuyển vào dead-letter.
+# - Lỗi tạm thời và chưa quá RETRY_MAX_ATTEMPTS lần: hẹn thử lại sau retry_delay, dòng giữ nguyên.
+# - Lỗi vĩnh viễn hoặc hết số lần thử: job chuyển sang dead, không thử lại nữa
+#   (dòng trên sheet giữ nguyên; sửa dòng trên sheet sẽ tạo job mới).
+# - Trả về thời điểm thử lại, None nếu đã chuyển vào dead-letter.
+def record_publish_failure(job, error_msg, now, latency_ms=None):
+    error_class = classify_publish_error(error_msg)
+    attempts = (job.get("attempts") or 0) + 1
+    if error_class == ERROR_PERMANENT or attempts >= RETRY_MAX_ATTEMPTS:
+        print(f"🪦 {job_label(job)}: dừng thử lại sau {attempts} lần ({error_class}), chuyển vào dead-letter")
+        write_log(job["platform"], job["mode"], "DEAD_LETTER", job["caption"], job["image_path"],
+                  error_msg=f"{error_msg} ({attempts} lần thử)", row=job["row_num"], latency_ms=latency_ms,
+                  error_class=error_class)
+        job_store.dead_letter(job["job_id"], error_msg, error_class, db_path=JOB_STORE_FILE)
+        return None
+    retry_at = now + timedelta(seconds=retry_delay(attempts))
+    print(f"🔁 {job_label(job)}: lỗi {error_class}, thử lại lúc {retry_at:%Y-%m-%d %H:%M:%S} "
+          f"(lần {attempts}/{RETRY_MAX_ATTEMPTS})")
+    write_log(job["platform"], job["mode"], "ERROR", job["caption"], job["image_path"],
+              error_msg=f"{error_msg} (lần {attempts}/{RETRY_MAX_ATTEMPTS})", row=job["row_num"],
+              latency_ms=latency_ms, error_class=error_class)
+    job_store.mark_failed(job["job_id"], error_msg, db_path=JOB_STORE_FILE, retry_at=retry_at)
+    return retry_at
+
+# ====== Hàm tạo request ghi thay đổi lên sheet ======
+# Chức năng: Tạo danh sách request cho spreadsheet.batch_update (1 request API cho cả tick).
+# - updateCells cho các dòng "daily" (ghi ngày mới dạng chuỗi, giống append_row của app.py).
+# - deleteDimension cho các dòng "once", từ cuối lên đầu (tránh lệch index).
+# - Các request chạy theo thứ tự nên cập nhật phải đứng trước xóa.
+def build_sheet_requests(sheet_id, rows_to_update, rows_to_delete):
+    requests_body = []
+    for row_num, col_num, new_value in rows_to_update:
+        requests_body.append({
+            "updateCells": {
+                "range": {
+                    "sheetId": sheet_id,
+                    "startRowIndex": row_num - 1, "endRowIndex": row_num,
+                    "startColumnIndex": col_num - 1, "endColumnIndex": col_num
+                },
+                "rows": [{"values": [{"userEnteredValue": {"stringValue": new_value}}]}],
+                "fields": "userEnteredValue"
+            }
+        })
+    for row_num in sorted(set(rows_to_delete), reverse=True):
+        requests_body.append({
+            "deleteDimension": {
+                "range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": row_num - 1, "endIndex": row_num}
+            }
+        })
+    return requests_body
+
+# ====== Hàm tìm lại vị trí dòng sau khi ghi lỗi ======
+# Chức năng: Đối chiếu nội dung dòng cũ với dữ liệu sheet mới đọc để lấy lại số dòng hiện tại.
+# - Ghi lỗi (timeout...) có thể đã được Google áp dụng, hoặc sheet bị sửa tay trong lúc đó.
+# - Dòng không còn tìm thấy (đã đổi ngày / đã xóa) coi như đã xử lý xong, bỏ qua.
+# - Nhiều dòng giống hệt nhau: chọn dòng chưa dùng gần vị trí cũ nhất.
+# - Trả về (rows_to_update, rows_to_delete) theo số dòng mới.
+def remap_sheet_changes(old_rows, new_rows, rows_to_update, rows_to_delete):
+    def key(row):
+        return tuple((list(row) + [""] * 10)[:10])
+    
+    positions = {}
+    for idx, row in enumerate(new_rows[1:]):
+        positions.setdefault(key(row), []).append(idx + 2)
+    used = set()
+    
+    def find(row_num):
+        if row_num - 1 >= len(old_rows):
+            return None
+        candidates = [num for num in positions.get(key(old_rows[row_num - 1]), []) if num not in used]
+        if not candidates:
+            return None
+        match = min(candidates, key=lambda num: abs(num - row_num))
+        used.add(match)
+        return match
+    
+    new_updates = []
+    for row_num, col_num, new_value in rows_to_update:
+        match = find(row_num)
+        if match is not None:
+            new_updates.append((match, col_num, new_value))
+    new_deletes = [match for match in (find(row_num) for row_num in rows_to_delete) if match is not None]
+    return new_updates, new_deletes
+
+# ====== Hàm ghi thay đổi lên sheet ======
+# Chức năng: Ghi toàn bộ cập nhật ngày (daily) và xóa dòng (once) của một tick bằng 1 request batch_update.
+# - rows: dữ liệu sheet đã đọc ở đầu tick (để đối chiếu khi phải thử lại).
+# - Lỗi: chờ rồi đọc lại sheet, đối chiếu theo nội dung dòng (remap_sheet_changes) và thử lại,
+#   tối đa SHEET_WRITE_RETRIES lần; không bao giờ ghi lại theo số dòng cũ.
+# - Trả về True nếu ghi xong, False nếu vẫn lỗi sau khi thử lại (đã ghi log).
+def apply_sheet_changes(spreadsheet, worksheet, rows, rows_to_update, rows_to_delete):
+    if not rows_to_update and not rows_to_delete:
+        return True
+    
+    print(f"📝 Ghi thay đổi lên sheet: cập nhật {len(rows_to_update)} dòng, xóa {len(rows_to_delete)} dòng (1 request)...")
+    need_reread = False
+    for attempt in range(SHEET_WRITE_RETRIES):
+        if attempt:
+            time.sleep(SHEET_WRITE_RETRY_DELAY * attempt)
+        try:
+            if need_reread:
+                # Đọc lại sheet để biết thay đổi nào đã được áp dụng và vị trí dòng hiện tại
+                current_rows = worksheet.get_all_values()
+                rows_to_update, rows_to_delete = remap_sheet_changes(rows, current_rows, rows_to_update, rows_to_delete)
+                rows = current_rows
+                need_reread = False
+            
+            requests_body = build_sheet_requests(worksheet.id, rows_to_update, rows_to_delete)
+            if not requests_body:
+                print("✅ Thay đổi đã được áp dụng trước đó")
+                return True
+            spreadsheet.batch_update({"requests": requests_body})
+            print(f"✅ Đã ghi {len(requests_body)} thay đổi lên sheet")
+            # Sheet vừa đổi: lần sau phải đọc lại
+            _sheet_mirror.clear()
+            return True
+        except Exception as e:
+            # Ghi lỗi nếu không ghi được (network, quota, quyền, etc.)
+            print(f"❌ Lỗi ghi sheet (lần {attempt + 1}/{SHEET_WRITE_RETRIES}): {e}")
+            need_reread = True
+    
+    write_log('system', 'sheet_update', 'ERROR', '', '',
+              error_msg=f"Không ghi được thay đổi lên sheet: cập nhật {rows_to_update}, xóa {rows_to_delete}")
+    return False
+
+# ====== Hàm ghi thay đổi lên sheet có khóa giữa các worker ======
+# Chức năng: Giữ khóa SHEET_WRITE_LOCK rồi mới ghi, để các worker không xóa/cập nhật sheet cùng lúc
+# (ghi đồng thời làm lệch số dòng của nhau).
+# - Trong khóa: nếu sheet đã đổi từ lần đọc (worker khác vừa ghi, hoặc không đọc được modifiedTime)
+#   thì đọc lại và đối chiếu số dòng theo nội dung (remap_sheet_changes) trước khi ghi.
+# - Không lấy được khóa sau SHEET_WRITE_LOCK_WAIT giây: trả về False, thay đổi vẫn chờ trong job store
+#   và được ghi lại ở lần đồng bộ sau.
+@tracing.traced()
+def write_sheet_changes(spreadsheet, worksheet, rows, rows_to_update, rows_to_delete):
+    if not rows_to_update and not rows_to_delete:
+        return True
+    deadline = time.monotonic() + SHEET_WRITE_LOCK_WAIT
+    while not job_store.acquire_lock(SHEET_WRITE_LOCK, WORKER_ID, SHEET_WRITE_LOCK_TTL, db_path=JOB_STORE_FILE):
+        if time.monotonic() >= deadline:
+            print("⚠️ Worker khác đang ghi sheet quá lâu, để lần sau ghi")
+            return False
+        time.sleep(0.5)
+    try:
+        modified_time = get_sheet_modified_time()
+        if not modified_time or modified_time != _sheet_mirror.get("modified_time"):
+            current_rows = worksheet.get_all_values()
+            if current_rows != rows:
+                rows_to_update, rows_to_delete = remap_sheet_changes(rows, current_rows, rows_to_update, rows_to_delete)
+                rows = current_rows
+        return apply_sheet_changes(spreadsheet, worksheet, rows, rows_to_update, rows_to_delete)
+    finally:
+        job_store.release_lock(SHEET_WRITE_LOCK, WORKER_ID, db_path=JOB_STORE_FILE)
+
+# ====== Hàm khôi phục từ journal đăng bài ======
+# Chức năng: Chạy job_store.replay_journal và ghi log kết quả.
+# - Bài đã lên (journal có post_id) nhưng chưa ghi nhận: hoàn tất, thay đổi sheet ghi ở lần đồng bộ tới.
+# - Bài chỉ có "intent" (chết giữa lúc gọi API): chuyển in_doubt, ghi log để kiểm tra thủ công.
+# - Trả về (danh sách job đã hoàn tất, danh sách job in_doubt).
+def recover_from_journal():
+    recovered, in_doubt = job_store.replay_journal(WORKER_ID, db_path=JOB_STORE_FILE)
+    for job in recovered:
+        print(f"♻️ {job_label(job)}: đã đăng trước khi worker dừng, ghi nhận lại (không đăng lại)")
+        write_log(job["platform"], job["mode"], "SUCCESS", job["caption"], job["image_path"], row=job["row_num"])
+    for job in in_doubt:
+        print(f"⚠️ {job_label(job)}: worker dừng khi đang đăng, cần kiểm tra thủ công")
+        write_log(job["platform"], job["mode"], "WARNING", job["caption"], job["image_path"],
+                  error_msg="Worker dừng khi đang đăng, không tự đăng lại (in_doubt)", row=job["row_num"],
+                  error_class=job_store.STATUS_IN_DOUBT)
+    return recovered, in_doubt
+
+# ====== Hàm tạo nhãn job ======
+# Chức năng: Tạo nhãn ngắn gọn của job để in lịch chạy tiếp theo.
+def job_label(job):
+    where = f"dòng {job['row_num']}" if job.get("row_num") else f"job {job.get('job_id', '')[:8]}"
+    return f"{where} [{job['product']}] {job['platform'].upper()}"
+
 # ====== Hàm xử lý hàng loạt bài viết đã lên lịch ======
-# Chức năng: Đọc và xử lý tự động tất cả bài viết đã lên lịch từ Google Sheets.
+# Chức năng: Đồng bộ sheet với job store, đăng các bài đã đến giờ và trả về lịch chạy tiếp theo.
 # Quy trình tổng quát:
-# - Kết nối với Google Sheets và lấy toàn bộ dữ liệu
-# - Duyệt từng dòng để kiểm tra và xử lý riêng biệt
-# - Đăng bài lên mạng xã hội khi đúng thời gian
-# - Cập nhật lại lịch hoặc xóa bài đã đăng tùy theo chế độ
-# BƯỚC 1 - Kết nối và lấy dữ liệu:
-# - Tạo Google Sheets client với quyền đọc/ghi
-# - Mở spreadsheet theo ID và lấy worksheet theo tên
-# - Đọc tất cả dữ liệu (header + data rows)
-# - Kiểm tra có dữ liệu để xử lý không
-# BƯỚC 2 - Chuẩn bị xử lý:
-# - Tách header (dòng 1) và data (từ dòng 2)
-# - Khởi tạo lists để theo dõi thay đổi (xóa/cập nhật)
-# - Lấy thời gian hiện tại để so sánh với lịch đăng
-# BƯỚC 3 - Xử lý từng dòng:
-# - Validate dữ liệu: kiểm tra đủ 10 cột, không thiếu trường bắt buộc
-# - Parse thời gian đăng từ chuỗi thành datetime object
-# - Chuẩn hóa dữ liệu: trim spaces, lowercase platform/mode
-# - Kiểm tra business logic: mode hợp lệ (once/daily)
-# - So sánh thời gian: chỉ đăng khi đã đến giờ
-# BƯỚC 4 - Đăng bài theo nền tảng:
-# - Facebook: gọi post_content_to_facebook() với text+ảnh optional
-# - Instagram: gọi post_content_to_instagram() với ảnh bắt buộc
-# - Xử lý fallback tokens khi không có token riêng
-# BƯỚC 5 - Cập nhật sau khi đăng:
-# - Mode "once": đánh dấu xóa dòng khỏi sheet
-# - Mode "daily": cập nhật ngày sang ngày tiếp theo
-# - Ghi log chi tiết cho mọi trường hợp (thành công/thất bại)
-# BƯỚC 6 - Thực hiện thay đổi trên sheet:
-# - Cập nhật các dòng "daily" với ngày mới
-# - Xóa các dòng "once" từ cuối lên đầu (tránh lệch index)
-# - Error handling riêng cho từng thao tác sheet
+# BƯỚC 1 - Đồng bộ sheet → job store:
+# - Dùng lại kết nối Google Sheets (get_sheet_handle), chỉ tải lại khi sheet đã thay đổi
+# - Sheet thay đổi: parse_schedule_rows() kiểm tra từng dòng, job_store.sync_from_sheet() thêm dòng mới,
+#   hủy job có dòng đã bị xóa/sửa tay và trả về các thay đổi trước đó chưa ghi được lên sheet
+# BƯỚC 2 - Đăng các bài đã đến giờ:
+# - recover_from_journal(): hoàn tất bài đã đăng mà worker chết trước khi ghi nhận
+# - job_store.reclaim_expired_leases(): nhả lease của worker đã chết; bài đang đăng dở thì chuyển in_doubt
+# - job_store.claim_due_jobs(): nhận tối đa JOB_CLAIM_LIMIT bài đến hạn, mỗi page tối đa JOB_CLAIM_PER_PAGE bài
+#   (truy vấn theo index status, fire_at), worker khác hoặc lần sau nhận phần còn lại
+# - dispatch_due_posts() đăng song song (giới hạn theo nền tảng và page)
+# - handle_publish_result() ghi log, cập nhật job store và đánh dấu xóa (once) / cập nhật ngày (daily),
+#   chạy lần lượt theo thứ tự thời gian đăng sau khi có đủ kết quả
+# BƯỚC 3 - Đồng bộ job store → sheet:
+# - write_sheet_changes() giữ khóa ghi sheet, ghi mọi cập nhật + xóa dòng trong 1 request batch_update,
+#   ghi xong thì job_store.confirm_sheet_writes(); lỗi thì lượt sau đồng bộ lại từ bản sao sheet
+#   (kể cả khi sheet không đổi) và ghi lại
+# Giá trị trả về (dùng cho vòng lặp theo thời điểm đến hạn trong main):
+# - Danh sách (thời điểm chạy, nhãn) của UPCOMING_JOBS_LIMIT job đang chờ sớm nhất: bài chưa đến giờ,
+#   lần đăng daily kế tiếp, bài đăng lỗi (thử lại sau)
+# - None nếu không đọc được sheet
 # Đảm bảo an toàn:
-# - Mỗi dòng được xử lý độc lập (lỗi 1 dòng không ảnh hưởng dòng khác)
+# - Mỗi job được xử lý độc lập (lỗi 1 job không ảnh hưởng job khác)
 # - Ghi log đầy đủ để debug và audit trail
-# - Network timeout và retry logic cho API calls
-# - Validate dữ liệu nghiêm ngặt trước khi thực hiện
-def process_scheduled_posts():
+@tracing.traced("scheduler.tick", root=True)
+def process_scheduled_posts(now=None):
+    tick_start = time.perf_counter()
     try:
         print("🔍 Đang kiểm tra Google Sheets...")
         
-        # Kết nối với Google Sheets
-        gc = get_gsheet_client()
-        sh = gc.open_by_key(SPREADSHEET_ID)
-        worksheet = sh.worksheet(SHEET_NAME)
-        
-        # Lấy tất cả dữ liệu từ sheet
-        rows = worksheet.get_all_values()
-        if len(rows) <= 1:
-            print("ℹ️ Không có dữ liệu để xử lý")
-            return
-        
-        # Tách header và data rows
-        header = rows[0]  # Dòng đầu tiên là header
-        data_rows = rows[1:]  # Các dòng còn lại là dữ liệu
-        now = datetime.now()
+        # Lấy dữ liệu sheet (kết nối được dùng lại, chỉ tải lại khi sheet đã thay đổi)
+        sh, worksheet, rows, changed = read_schedule_sheet()
         
         # Khởi tạo lists để track các thay đổi
         # Đánh dấu các dòng cần xóa (sẽ xóa từ cuối lên đầu để tránh lệch index)
         rows_to_delete = []
         # Đánh dấu các dòng cần cập nhật (cho mode daily)
         rows_to_update = []
+        # Job có thay đổi cần xác nhận sau khi ghi sheet
+        written_job_ids = []
         
-        print(f"📋 Tìm thấy {len(data_rows)} dòng dữ liệu")
+        if changed and not rows:
+            print("⚠️ Sheet trống (không có header), bỏ qua đồng bộ job store")
+        elif changed:
+            print(f"📋 Tìm thấy {max(len(rows) - 1, 0)} dòng dữ liệu, đồng bộ vào job store...")
+            with metrics.timer("scheduler_parse_seconds"):
+                jobs = parse_schedule_rows(rows)
+                rows_to_update, rows_to_delete, written_job_ids = job_store.sync_from_sheet(
+                    rows, jobs, db_path=JOB_STORE_FILE, read_at=_sheet_mirror.get("read_at"))
+            _sheet_mirror["store_synced"] = True
+            if rows_to_update or rows_to_delete:
+                print(f"🔁 Ghi lại {len(rows_to_update) + len(rows_to_delete)} thay đổi chưa lên sheet")
+        now = now or datetime.now()
         
-        # Xử lý từng dòng dữ liệu
-        for idx, row in enumerate(data_rows):
-            row_num = idx + 2  # +2 vì bắt đầu từ dòng 2 (dòng 1 là header)
-            
+        # Hoàn tất bài đã đăng của worker đã chết, nhả lease; bài đang đăng dở không tự đăng lại
+        recover_from_journal()
+        released, in_doubt = job_store.reclaim_expired_leases(db_path=JOB_STORE_FILE)
+        if released:
+            print(f"♻️ Nhận lại {released} bài từ worker đã dừng")
+        for job in in_doubt:
+            print(f"⚠️ {job_label(job)}: worker dừng khi đang đăng, cần kiểm tra thủ công")
+            write_log(job["platform"], job["mode"], "WARNING", job["caption"], job["image_path"],
+                      error_msg="Worker dừng khi đang đăng, không tự đăng lại (in_doubt)", row=job["row_num"],
+                      error_class=job_store.STATUS_IN_DOUBT)
+        
+        # Nhận bài đến hạn từ job store (truy vấn theo index, theo thứ tự thời gian đăng)
+        due_jobs = job_store.claim_due_jobs(WORKER_ID, now, limit=JOB_CLAIM_LIMIT,
+                                            lease_seconds=JOB_LEASE_SECONDS, db_path=JOB_STORE_FILE,
+                                            max_per_page=JOB_CLAIM_PER_PAGE)
+        metrics.set_gauge("scheduler_due_jobs", len(due_jobs))
+        for job in due_jobs:
+            print(f"\n📝 {job_label(job)} | {job['mode']} | {job['scheduled_time']}")
+        
+        # Đăng song song các bài đến hạn, rồi xử lý kết quả lần lượt theo thứ tự thời gian đăng
+        if due_jobs:
+            print(f"\n🚀 Đăng {len(due_jobs)} bài đến hạn...")
+        for job, (result, error) in zip(due_jobs, dispatch_due_posts(due_jobs)):
+            if isinstance(error, job_store.LeaseLost):
+                print(f"⏭️ {job_label(job)}: worker khác đã nhận bài này, bỏ qua")
+                continue
+            if isinstance(error, job_store.PublishInDoubt):
+                print(f"⚠️ {job_label(job)}: lỗi khi đang đăng ({error}), không tự đăng lại, cần kiểm tra thủ công")
+                write_log(job["platform"], job["mode"], "WARNING", job["caption"], job["image_path"],
+                          error_msg=f"Lỗi khi đang đăng, không tự đăng lại (in_doubt): {error}", row=job["row_num"],
+                          error_class=job_store.STATUS_IN_DOUBT)
+                continue
+            record_publish_metrics(job, result)
             try:
-                # BƯỚC 1: Kiểm tra tính đầy đủ của dữ liệu
-                # Kiểm tra số lượng cột: phải có đủ 10 cột theo định nghĩa HEADER
-                # [product, keywords, platform, time_str, token, page_id, mode, date_str, caption, image_path]
-                if len(row) < 10:
-                    print(f"⚠️ Dòng {row_num}: Thiếu dữ liệu - {len(row)}/10 cột")
-                    continue  # Bỏ qua dòng này, tiếp tục dòng tiếp theo
-                
-                # Tách dữ liệu từ mảng row thành các biến riêng biệt theo thứ tự
-                # Chỉ lấy 10 cột đầu tiên, bỏ qua các cột thừa (nếu có)
-                product, keywords, platform, time_str, token, page_id, mode, date_str, caption, image_path = row[:10]
-                
-                # Kiểm tra các trường bắt buộc không được để trống
-                # platform: Facebook/Instagram, mode: once/daily, date_str: YYYY-MM-DD
-                # time_str: HH:MM, caption: nội dung bài viết
-                if not all([platform, mode, date_str, time_str, caption]):
-                    print(f"⚠️ Dòng {row_num}: Thiếu thông tin bắt buộc")
-                    continue  # Bỏ qua dòng này vì thiếu thông tin quan trọng
-                
-                # BƯỚC 2: Chuyển đổi và kiểm tra thời gian đăng
-                try:
-                    # Gọi hàm parse_scheduled_time để chuyển chuỗi thành datetime
-                    # Input: "2024-12-25" + "14:30" → Output: datetime(2024, 12, 25, 14, 30)
-                    scheduled_time = parse_scheduled_time(date_str, time_str)
-                except ValueError as e:
-                    # Nếu format thời gian sai (ví dụ: "2024-13-45" hoặc "25:70")
-                    print(f"❌ Dòng {row_num}: {e}")
-                    continue  # Bỏ qua dòng này vì thời gian không hợp lệ
-                
-                # BƯỚC 3: Làm sạch và chuẩn hóa dữ liệu đầu vào
-                # Loại bỏ khoảng trắng thừa ở đầu/cuối và chuyển về chữ thường
-                platform = platform.strip().lower()  # "Facebook " → "facebook"
-                mode = mode.strip().lower()           # "Once " → "once"
-                token = token.strip()                 # " abc123 " → "abc123"
-                page_id = page_id.strip()            # " 1234567890 " → "1234567890"
-                caption = caption.strip()            # Loại bỏ khoảng trắng thừa
-                image_path = image_path.strip()      # URL ảnh sạch
-                
-                print(f"\n📝 Dòng {row_num}: [{product}] | {platform.upper()} | {mode} | {scheduled_time}")
-                
-                # BƯỚC 4: Kiểm tra quy tắc nghiệp vụ
-                # Validate mode chỉ cho phép 2 giá trị: "once" hoặc "daily"
-                # - "once": đăng 1 lần rồi xóa khỏi lịch
-                # - "daily": đăng hàng ngày, tự động lên lịch ngày tiếp theo
-                if mode not in ["once", "daily"]:
-                    print(f"⚠️ Mode không hợp lệ: '{mode}' (chỉ chấp nhận once/daily)")
-                    continue  # Bỏ qua dòng này vì mode sai
-                
-                # BƯỚC 5: So sánh thời gian để quyết định có đăng hay không
-                # Chỉ đăng khi thời gian hiện tại >= thời gian đã lên lịch
-                if now < scheduled_time:
-                    time_diff = scheduled_time - now  # Tính thời gian còn lại
-                    print(f"⏰ Chưa đến giờ (còn {time_diff})")
-                    continue  # Bỏ qua, chờ đến lượt kiểm tra tiếp theo
-                
-                # BƯỚC 6: Thực hiện đăng bài lên mạng xã hội
-                result = None  # Khởi tạo biến để lưu kết quả đăng bài
-                
-                if platform == "facebook":
-                    # Xử lý đăng bài lên Facebook
-                    # Sử dụng token và page_id riêng, nếu không có thì dùng mặc định
-                    result = post_content_to_facebook(
-                        page_id or DEFAULT_PAGE_ID,      # Fallback đến page mặc định
-                        token or DEFAULT_ACCESS_TOKEN,   # Fallback đến token mặc định  
-                        caption,                         # Nội dung bài viết
-                        image_url=image_path if image_path else None  # Ảnh optional cho FB
-                    )
-                elif platform == "instagram":
-                    # Xử lý đăng bài lên Instagram
-                    # Instagram bắt buộc phải có ảnh, không hỗ trợ text-only
-                    result = post_content_to_instagram(
-                        page_id or IG_ID,               # Fallback đến IG account mặc định
-                        token or IG_TOKEN,              # Fallback đến IG token mặc định
-                        image_url=image_path,           # Ảnh bắt buộc cho Instagram
-                        caption=caption                 # Caption đi kèm ảnh
-                    )
-                else:
-                    # Platform không được hỗ trợ (không phải facebook/instagram)
-                    print(f"❌ Platform không hỗ trợ: {platform}")
-                    continue  # Bỏ qua dòng này, tiếp tục dòng tiếp theo
-                
-                # BƯỚC 7: Xử lý kết quả đăng bài và cập nhật lịch
-                if result and "success" in result:
-                    # Trường hợp đăng bài thành công
-                    print(f"✅ Đăng thành công {platform.upper()}!")
-                    write_log(platform, mode, "SUCCESS", caption, image_path)
-                    
-                    if mode == "once":
-                        # Mode "once": đăng 1 lần rồi xóa khỏi lịch
-                        # Thêm vào danh sách dòng cần xóa (xóa sau cùng để tránh lệch index)
-                        rows_to_delete.append(row_num)
-                        print(f"🗑️ Đánh dấu xóa dòng {row_num} (mode: once)")
-                    elif mode == "daily":
-                        # Mode "daily": lên lịch cho ngày tiếp theo
-                        # Cộng thêm 1 ngày từ thời gian đã đăng
-                        next_date = scheduled_time + timedelta(days=1)
-                        new_date_str = next_date.strftime("%Y-%m-%d")  # Format YYYY-MM-DD
-                        # Thêm vào danh sách cập nhật: (row_num, col_index, new_value)
-                        # Cột 8 (index bắt đầu từ 1) chứa date_str
-                        rows_to_update.append((row_num, 8, new_date_str))
-                        print(f"📅 Lên lịch ngày tiếp theo: {new_date_str}")
-                else:
-                    # Trường hợp đăng bài thất bại
-                    # Lấy thông báo lỗi từ result, nếu không có thì dùng message mặc định
-                    error_msg = result.get("error", "Lỗi không xác định") if result else "Không có response"
-                    print(f"❌ Đăng thất bại {platform.upper()}: {error_msg}")
-                    # Ghi log lỗi để debug sau này
-                    write_log(platform, mode, "ERROR", caption, image_path, error_msg=error_msg)
-                
+                if error is not None:
+                    raise error
+                handle_publish_result(job, result, rows_to_update, rows_to_delete, now=now)
+                if job["row_num"] and result and "success" in result:
+                    written_job_ids.append(job["job_id"])
             except Exception as e:
-                print(f"❌ Lỗi xử lý dòng {row_num}: {e}")
-                platform_name = locals().get('platform', 'unknown')
-                mode_name = locals().get('mode', 'unknown')
-                caption_text = locals().get('caption', '')
-                image_text = locals().get('image_path', '')
-                write_log(platform_name, mode_name, "ERROR", caption_text, image_text, error_msg=str(e))
+                print(f"❌ Lỗi xử lý {job_label(job)}: {e}")
+                if result and "success" in result:
+                    # Bài đã lên (journal đã ghi published): không trả job về pending (sẽ bị đăng lại),
+                    # job giữ trạng thái publishing, recover_from_journal hoàn tất ở lượt kiểm tra sau
+                    print(f"♻️ {job_label(job)}: đã đăng, ghi nhận lại ở lượt kiểm tra sau (không đăng lại)")
+                    continue
+                record_publish_failure(job, str(e), now)
         
-        # BƯỚC 8: Thực hiện các thay đổi trên Google Sheets
-        # Xử lý cập nhật dòng trước (cho mode "daily")
-        if rows_to_update:
-            print(f"📝 Cập nhật {len(rows_to_update)} dòng...")
-            for row_num, col_num, new_value in rows_to_update:
-                try:
-                    # Gọi Google Sheets API để cập nhật 1 cell cụ thể
-                    # row_num: số dòng, col_num: số cột, new_value: giá trị mới
-                    worksheet.update_cell(row_num, col_num, new_value)
-                    print(f"✅ Cập nhật dòng {row_num}")
-                except Exception as e:
-                    # Ghi log lỗi nếu không cập nhật được (network, quyền, etc.)
-                    print(f"❌ Lỗi cập nhật dòng {row_num}: {e}")
+        sheet_written = False
+        try:
+            sheet_written = write_sheet_changes(sh, worksheet, rows, rows_to_update, rows_to_delete)
+        finally:
+            if not sheet_written:
+                # Chưa ghi được: lượt sau đồng bộ lại job store từ bản sao (kể cả khi sheet không đổi)
+                # để lấy lại các thay đổi chờ ghi và ghi lại
+                _sheet_mirror["store_synced"] = False
+        if sheet_written:
+            job_store.confirm_sheet_writes(written_job_ids, db_path=JOB_STORE_FILE)
         
-        # Xử lý xóa dòng sau (cho mode "once")
-        if rows_to_delete:
-            print(f"🗑️ Xóa {len(rows_to_delete)} dòng...")
-            # Xóa từ cuối lên đầu để tránh lệch số thứ tự dòng
-            # Ví dụ: xóa dòng [2,4,6] → xóa 6 trước, rồi 4, cuối cùng 2
-            for row_num in sorted(rows_to_delete, reverse=True):
-                try:
-                    # Gọi Google Sheets API để xóa 1 dòng hoàn toàn
-                    worksheet.delete_rows(row_num)
-                    print(f"✅ Xóa dòng {row_num}")
-                except Exception as e:
-                    # Ghi log lỗi nếu không xóa được (network, quyền, etc.)
-                    print(f"❌ Lỗi xóa dòng {row_num}: {e}")
+        # Tạo trước container cho bài Instagram sắp đến giờ (lỗi không ảnh hưởng lịch đăng)
+        try:
+            staged = stage_instagram_containers(now)
+            if staged:
+                print(f"📦 {staged} container Instagram đã sẵn sàng")
+        except Exception as e:
+            print(f"⚠️ Lỗi tạo trước container Instagram: {e}")
+        
+        # Lịch chạy tiếp theo: các job đang chờ sớm nhất trong job store,
+        # bài Instagram thêm lần thức dậy IG_PRESTAGE_MINUTES phút trước giờ đăng để tạo container
+        next_runs = []
+        for job in job_store.get_upcoming_jobs(UPCOMING_JOBS_LIMIT, db_path=JOB_STORE_FILE):
+            run_at = max(job["scheduled_time"], job["next_retry_at"] or job["scheduled_time"])
+            next_runs.append((run_at, job_label(job)))
+            stage_at = job["scheduled_time"] - timedelta(minutes=IG_PRESTAGE_MINUTES)
+            if job["platform"] == "instagram" and stage_at > now:
+                next_runs.append((stage_at, f"tạo container {job_label(job)}"))
+        next_runs.sort(key=lambda run: run[0])
+        pending = [run for run in next_runs if run[0] > now]
+        if pending:
+            print(f"⏰ Bài chưa đến giờ sớm nhất: {pending[0][1]} (còn {pending[0][0] - now})")
         
         # Thông báo khi không có gì để xử lý (tất cả bài chưa đến giờ)
         if not rows_to_delete and not rows_to_update:
             print("ℹ️ Không có dòng nào cần xử lý")
+        
+        # In thống kê độ trễ Graph API (cộng dồn từ khi khởi động)
+        latency_report = graph_http.format_latency_report()
+        if latency_report:
+            print(f"⏱️ Độ trễ Graph API:\n{latency_report}")
+        
+        # In thống kê kết nối và đồng bộ Google Sheets
+        print(f"🔌 Google Sheets: {format_sheet_client_report()}")
+        print(f"🔁 Đồng bộ sheet: đọc toàn bộ {_sync_stats['full_reads']} lần, bỏ qua {_sync_stats['skipped_reads']} lần, "
+              f"kiểm tra {_sync_stats['rows_parsed']} dòng, dùng cache {_sync_stats['rows_cached']} dòng")
+        
+        # Số job theo trạng thái cho /metrics
+        for status, count in job_store.count_jobs(db_path=JOB_STORE_FILE).items():
+            metrics.set_gauge("scheduler_jobs", count, {"status": status})
+        metrics.inc("scheduler_ticks_total", {"result": "ok"})
+        
+        # In mức sử dụng rate limit, ghi log khi đã tới ngưỡng giảm tốc
+        print(f"📶 Graph API usage: {graph_http.format_usage()}")
+        if graph_http.get_usage()["max_pct"] >= graph_http.THROTTLE_SLOWDOWN_PCT:
+            write_log('system', 'throttle', 'WARNING', '', '', error_msg=f"Graph API usage cao: {graph_http.format_usage()}")
+        
+        return next_runs
             
     except Exception as e:
         print(f"❌ Lỗi nghiêm trọng trong process_scheduled_posts: {e}")
         write_log('system', 'process', 'ERROR', '', '', error_msg=str(e))
+        metrics.inc("scheduler_ticks_total", {"result": "error"})
+        return None
+    finally:
+        metrics.observe("scheduler_tick_seconds", time.perf_counter() - tick_start)
+
+# ====== Hàm ghi số liệu một bài đã đăng ======
+# Chức năng: Đếm kết quả đăng theo nền tảng, ghi thời gian gọi API và độ trễ so với giờ hẹn
+#   (tính theo giờ thực lúc đăng xong; chỉ với bài đăng thành công).
+def record_publish_metrics(job, result):
+    labels = {"platform": job["platform"]}
+    success = bool(result and "success" in result)
+    metrics.inc("scheduler_publish_total", dict(labels, result="success" if success else "failure"))
+    if result and result.get("latency_ms") is not None:
+        metrics.observe("scheduler_publish_latency_seconds", result["latency_ms"] / 1000, labels)
+    if success:
+        lateness = (datetime.now() - job["scheduled_time"]).total_seconds()
+        metrics.observe("scheduler_publish_lateness_seconds", max(lateness, 0.0), labels)
+
+# ====== Hàm tạo hàng đợi theo thời điểm đến hạn ======
+# Chức năng: Tạo min-heap (thời điểm chạy, thứ tự, nhãn) từ lịch chạy tiếp theo.
+# - Job đã quá hạn (đăng lỗi, daily còn nợ ngày) được dời tới now + OVERDUE_RETRY_DELAY
+#   để không thử lại liên tục.
+# - heap[0] luôn là job đến hạn sớm nhất.
+def build_schedule_heap(next_runs, now=None):
+    now = now or datetime.now()
+    heap = []
+    for seq, (run_at, label) in enumerate(next_runs):
+        if run_at <= now:
+            run_at = now + timedelta(seconds=OVERDUE_RETRY_DELAY)
+        heapq.heappush(heap, (run_at, seq, label))
+    return heap
+
+# ====== Hàm đọc tín hiệu lịch đăng thay đổi ======
+# Chức năng: Trả về thời điểm sửa file tín hiệu (app.py chạm file này khi lên lịch bài mới).
+# - Trả về None nếu chưa có file.
+def get_schedule_signal(signal_file=SCHEDULE_SIGNAL_FILE):
+    try:
+        return os.stat(signal_file).st_mtime
+    except OSError:
+        return None
+
+# ====== Hàm tính thời gian ngủ ======
+# Chức năng: Tính số giây ngủ tới lần thức dậy tiếp theo.
+# - Thức dậy sớm nhất trong: job đến hạn đầu heap, lần đọc lại sheet định kỳ,
+#   lần kiểm tra file tín hiệu (SIGNAL_POLL_INTERVAL).
+def seconds_until_next_wake(heap, now, seconds_to_resync):
+    wake = min(seconds_to_resync, SIGNAL_POLL_INTERVAL)
+    if heap:
+        wake = min(wake, (heap[0][0] - now).total_seconds())
+    return max(0.0, wake)
 
 # ====== Hàm chính - Vòng lặp scheduler chạy 24/7 ======
-# Chức năng: Vòng lặp chính của scheduler, chạy liên tục để tự động đăng bài.
+# Chức năng: Vòng lặp chính của scheduler, ngủ đúng tới thời điểm bài tiếp theo đến hạn.
 # Cách thức hoạt động:
-# - Chạy vòng lặp vô hạn với interval 60 giây
-# - Mỗi lần lặp gọi process_scheduled_posts() để xử lý lịch đăng
-# - Hiển thị thông tin khởi động và trạng thái hoạt động
-# Xử lý khởi động:
-# - In thông tin cấu hình: Spreadsheet ID, Sheet Name
-# - Thông báo interval kiểm tra (60 giây)
-# - Hiển thị timestamp cho mỗi lần kiểm tra
-# Vòng lặp chính:
-# - Lấy timestamp hiện tại và hiển thị đang kiểm tra
-# - Gọi process_scheduled_posts() để xử lý tất cả bài đã lên lịch
-# - Sleep 60 giây trước khi kiểm tra lần tiếp theo
-# - In dấu phân cách để dễ đọc log
+# - Giữ min-heap thời điểm đến hạn của các bài (build_schedule_heap)
+# - Đọc sheet và đăng bài (process_scheduled_posts) khi:
+#   + bài đầu heap đã đến hạn
+#   + đã qua SHEET_RESYNC_INTERVAL giây từ lần đọc trước (phát hiện dòng sửa tay trên sheet)
+#   + file tín hiệu SCHEDULE_SIGNAL_FILE thay đổi (app.py vừa lên lịch bài mới)
+# - Mỗi lần kiểm tra xây lại heap từ job store (số dòng luôn đúng khi đăng)
+# - Khi rảnh chỉ kiểm tra file tín hiệu (không gọi API)
 # Xử lý ngắt và lỗi:
 # - KeyboardInterrupt (Ctrl+C): Dừng scheduler một cách graceful
-# - Exception khác: Ghi log lỗi nhưng không dừng, tiếp tục sau 60 giây
-# - Đảm bảo scheduler luôn hoạt động trừ khi bị dừng thủ công
-# Monitoring và logging:
-# - Log mọi hoạt động với timestamp rõ ràng
-# - Ghi lỗi hệ thống vào log file để debug
-# - Hiển thị trạng thái real-time trên console
+# - Không đọc được sheet / Exception khác: ghi log, thử lại sau OVERDUE_RETRY_DELAY giây
 def main():
     print("🟢 AI Agent Scheduler đang khởi động...")
     print(f"📊 Spreadsheet ID: {SPREADSHEET_ID}")
     print(f"📋 Sheet Name: {SHEET_NAME}")
-    print("⏰ Kiểm tra mỗi 60 giây...\n")
+    print(f"🆔 Worker: {WORKER_ID}")
+    
+    # Mở endpoint /metrics cho Prometheus (lỗi không ảnh hưởng scheduler)
+    if METRICS_PORT:
+        try:
+            metrics.start_server(METRICS_PORT)
+            print(f"📈 Metrics: http://{metrics.METRICS_HOST}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            print(f"⚠️ Không mở được cổng metrics {METRICS_PORT}: {e}")
+    
+    # Trace từng lượt kiểm tra (bật bằng TRACE_ENABLED=1, xuất OTLP JSON ra TRACE_EXPORT_FILE)
+    tracing.configure(service_name="scheduler")
+    if tracing.is_enabled():
+        print("🧭 Tracing: bật")
+    
+    # Khôi phục các bài đăng dở từ journal trước khi đọc sheet
+    start = time.perf_counter()
+    try:
+        recovered, in_doubt = recover_from_journal()
+        print(f"📒 Journal: hoàn tất {len(recovered)} bài, {len(in_doubt)} bài cần kiểm tra "
+              f"({(time.perf_counter() - start) * 1000:.1f} ms)")
+    except Exception as e:
+        print(f"❌ Lỗi đọc journal: {e}")
+        write_log('system', 'journal', 'ERROR', '', '', error_msg=str(e))
+    print(f"⏰ Đăng đúng giờ theo lịch, đọc lại sheet mỗi {SHEET_RESYNC_INTERVAL} giây hoặc khi có tín hiệu thay đổi\n")
+    
+    heap = []
+    last_sync = None
+    last_signal = get_schedule_signal()
     
     # Vòng lặp chính chạy liên tục 24/7
     while True:
         try:
-            # Lấy và hiển thị thời gian hiện tại cho mỗi lần kiểm tra
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            print(f"\n🕐 [{current_time}] Đang kiểm tra lịch đăng...")
+            now = datetime.now()
+            signal = get_schedule_signal()
+            due = bool(heap) and heap[0][0] <= now
+            resync_due = last_sync is None or time.monotonic() - last_sync >= SHEET_RESYNC_INTERVAL
             
-            # Gọi hàm chính để xử lý tất cả bài viết đã lên lịch
-            # Hàm này sẽ đọc Google Sheets và đăng bài nếu đúng giờ
-            process_scheduled_posts()
+            if due or resync_due or signal != last_signal:
+                reason = "đến giờ đăng" if due else ("có tín hiệu thay đổi" if signal != last_signal else "đọc lại định kỳ")
+                print(f"\n🕐 [{now.strftime('%Y-%m-%d %H:%M:%S')}] Đang kiểm tra lịch đăng ({reason})...")
+                last_signal = signal
+                
+                # Đọc sheet, đăng bài đã đến hạn và lấy lịch chạy tiếp theo
+                next_runs = process_scheduled_posts()
+                last_sync = time.monotonic()
+                now = datetime.now()
+                if next_runs is None:
+                    # Không đọc được sheet: thử lại sau
+                    next_runs = [(now, "thử lại đọc sheet")]
+                heap = build_schedule_heap(next_runs, now)
+                
+                if heap:
+                    print(f"⏭️ Bài tiếp theo: {heap[0][2]} lúc {heap[0][0].strftime('%Y-%m-%d %H:%M:%S')}")
+                print("💤 Chờ tới bài tiếp theo...\n" + "="*50)
             
-            # Hiển thị thông báo chờ và dấu phân cách để dễ đọc log
-            print("💤 Chờ 60 giây...\n" + "="*50)
-            # Sleep 60 giây trước khi kiểm tra lần tiếp theo
-            time.sleep(60)
+            seconds_to_resync = SHEET_RESYNC_INTERVAL - (time.monotonic() - last_sync)
+            time.sleep(seconds_until_next_wake(heap, datetime.now(), seconds_to_resync))
             
         except KeyboardInterrupt:
             # Xử lý khi người dùng nhấn Ctrl+C để dừng scheduler
             print("\n🛑 Dừng scheduler theo yêu cầu người dùng")
+            # Ghi nốt log còn trong buffer trước khi thoát
+            event_log.flush()
             break  # Thoát khỏi vòng lặp và kết thúc chương trình
         except Exception as e:
             # Xử lý mọi lỗi khác (network, API, file, etc.)
             print(f"❌ Lỗi không xác định: {e}")
             # Ghi lỗi vào log file để debug sau này
             write_log('system', 'main_loop', 'ERROR', '', '', error_msg=str(e))
-            print("⏰ Tiếp tục sau 60 giây...")
-            # Không break, tiếp tục chạy sau 60 giây để đảm bảo scheduler luôn hoạt động
-            time.sleep(60)
+            print(f"⏰ Tiếp tục sau {OVERDUE_RETRY_DELAY} giây...")
+            # Không break, tiếp tục chạy để đảm bảo scheduler luôn hoạt động
+            time.sleep(OVERDUE_RETRY_DELAY)
 
 if __name__ == "__main__":
     main()
-
@@ -3,7 +3,11 @@ import pytest
 import json
 import pandas as pd
 from unittest.mock import patch, MagicMock, mock_open
-from datetime import datetime, date, time
+from datetime import datetime, date, time, timedelta, timezone
+import time as time_module
+import insights_cache
+import insights_history
+import job_store
 
 # Import các hàm từ app.py để test
 from app import (
@@ -12,9 +16,14 @@ from app import (
     
     # Facebook API Functions  
     fetch_facebook_posts, fetch_post_stats, get_facebook_data,
+    build_post_record, fetch_facebook_posts_with_stats, fetch_posts_stats_batch,
+    fetch_post_stats_concurrent, iter_facebook_posts, to_graph_timestamp,
+    sync_facebook_insights, get_facebook_snapshot, request_insights_refresh, start_insights_worker,
+    get_growth_curve,
+    fetch_stats_for_ids, fetch_post_records, FB_REFRESH_TIERS,
     
     # Google Sheets Functions
-    get_gsheet_client, ensure_sheet_header, schedule_post_to_sheet,
+    get_gsheet_client, ensure_sheet_header, schedule_post_to_sheet, notify_schedule_changed,
     
     # AI & Content Functions
     generate_caption, call_ai_analysis,
@@ -27,6 +36,11 @@ from app import (
 )
 
 TEST_FILE = "test_posts.json"
+
+# Tạo created_time theo định dạng Graph API, cách hiện tại một khoảng thời gian
+def graph_time(**delta):
+    return (datetime.now(timezone.utc) - timedelta(**delta)).strftime("%Y-%m-%dT%H:%M:%S+0000")
+
 SAMPLE_POSTS = [
     {"id": "001", "caption": "Test post 1", "likes": 10, "comments": 5},
     {"id": "002", "caption": "Test post 2", "likes": 20, "comments": 3}
@@ -111,7 +125,7 @@ class TestUtilityFunctions:
 
 class TestFacebookAPIFunctions:
     
-    @patch("app.requests.get")
+    @patch("app.graph_http.get")
     def test_fetch_facebook_posts_success(self, mock_get):
         """Test lấy posts Facebook thành công"""
         mock_response = MagicMock()
@@ -132,7 +146,7 @@ class TestFacebookAPIFunctions:
         args, kwargs = mock_get.call_args
         assert "page_id/posts" in args[0], "❌ URL không đúng"
     
-    @patch("app.requests.get")
+    @patch("app.graph_http.get")
     def test_fetch_facebook_posts_empty_response(self, mock_get):
         """Test xử lý response rỗng từ Facebook API"""
         mock_response = MagicMock()
@@ -143,7 +157,7 @@ class TestFacebookAPIFunctions:
         
         assert result == [], "❌ Phải trả về list rỗng khi không có data"
     
-    @patch("app.requests.get")
+    @patch("app.graph_http.get")
     def test_fetch_post_stats_success(self, mock_get):
         """Test lấy stats của post thành công"""
         mock_response = MagicMock()
@@ -161,26 +175,382 @@ class TestFacebookAPIFunctions:
         assert result["likes"]["summary"]["total_count"] == 50, "❌ Likes count không đúng"
         assert result["comments"]["summary"]["total_count"] == 10, "❌ Comments count không đúng"
     
-    @patch("app.fetch_facebook_posts")
+    @patch("app.graph_http.get")
+    def test_fetch_facebook_posts_with_stats_success(self, mock_get):
+        """Test lấy posts kèm thống kê trong 1 request (field expansion)"""
+        mock_response = MagicMock()
+        mock_response.json.return_value = {
+            "data": [
+                {
+                    "id": "123", "created_time": "2024-01-01T10:00:00+0000", "message": "Test",
+                    "likes": {"summary": {"total_count": 10}},
+                    "comments": {"summary": {"total_count": 5}}
+                }
+            ]
+        }
+        mock_get.return_value = mock_response
+        
+        result = fetch_facebook_posts_with_stats("page_id", "token")
+        
+        assert len(result) == 1, "❌ Phải trả về 1 post"
+        mock_get.assert_called_once()
+        args, kwargs = mock_get.call_args
+        assert "page_id/posts" in args[0], "❌ URL không đúng"
+        assert "likes.summary(true)" in kwargs["params"]["fields"], "❌ Thiếu field expansion cho likes"
+    
+    @patch("app.graph_http.get")
+    def test_fetch_facebook_posts_with_stats_error(self, mock_get):
+        """Test trả về None khi Graph API báo lỗi"""
+        mock_response = MagicMock()
+        mock_response.json.return_value = {"error": {"message": "Unsupported field"}}
+        mock_get.return_value = mock_response
+        
+        result = fetch_facebook_posts_with_stats("page_id", "token")
+        
+        assert result is None, "❌ Phải trả về None khi có lỗi"
+    
+    @patch("app.graph_http.get")
+    def test_fetch_posts_stats_batch_chunks_ids(self, mock_get):
+        """Test lấy thống kê theo lô, mỗi request tối đa 50 ids"""
+        mock_response = MagicMock()
+        mock_response.json.side_effect = [
+            {f"p{i}": {"message": f"post {i}"} for i in range(50)},
+            {f"p{i}": {"message": f"post {i}"} for i in range(50, 60)}
+        ]
+        mock_get.return_value = mock_response
+        
+        result = fetch_posts_stats_batch([f"p{i}" for i in range(60)], "token")
+        
+        assert mock_get.call_count == 2, "❌ Phải gọi 2 request cho 60 ids"
+        assert len(result) == 60, "❌ Phải có thống kê cho 60 bài"
+        first_ids = mock_get.call_args_list[0][1]["params"]["ids"].split(",")
+        assert len(first_ids) == 50, "❌ Request đầu phải có 50 ids"
+    
     @patch("app.fetch_post_stats")
+    def test_fetch_post_stats_concurrent_keeps_order(self, mock_stats):
+        """Test lấy thống kê song song, kết quả giữ đúng thứ tự"""
+        def fake_stats(post_id, access_token, timeout):
+            time_module.sleep(0.02 if post_id == "p0" else 0)
+            return {"message": post_id}
+        mock_stats.side_effect = fake_stats
+        
+        result = fetch_post_stats_concurrent(["p0", "p1", "p2"], "token", max_workers=3, timeout=5)
+        
+        assert [r["message"] for r in result] == ["p0", "p1", "p2"], "❌ Kết quả phải đúng thứ tự"
+        assert all(c[1]["timeout"] == 5 for c in mock_stats.call_args_list), "❌ Phải truyền timeout"
+    
+    @patch("app.fetch_post_stats")
+    def test_fetch_post_stats_concurrent_isolates_errors(self, mock_stats):
+        """Test lỗi 1 bài không ảnh hưởng các bài khác"""
+        import requests
+        mock_stats.side_effect = [{"message": "ok"}, requests.exceptions.Timeout("timeout")]
+        
+        result = fetch_post_stats_concurrent(["p0", "p1"], "token", max_workers=1)
+        
+        assert result == [{"message": "ok"}, {}], "❌ Bài lỗi phải trả về {}"
+    
+    def test_build_post_record_shape(self):
+        """Test bản ghi có đúng các cột prepare_dataframe cần"""
+        record = build_post_record(
+            {"id": "123", "created_time": "2024-01-01T10:00:00+0000"},
+            {"message": "Test", "shares": {"count": 2}, "reactions": {"summary": {"total_count": 15}}}
+        )
+        
+        assert record == {
+            "id": "123", "caption": "Test", "likes": 0, "comments": 0, "shares": 2,
+            "reactions": 15, "platform": "Facebook", "created_time": "2024-01-01T10:00:00+0000"
+        }, "❌ Bản ghi không đúng cấu trúc"
+    
+    @patch("app.graph_http.get")
+    def test_iter_facebook_posts_follows_cursor(self, mock_get):
+        """Test duyệt bài viết theo paging.next cho tới khi hết trang"""
+        page1, page2 = MagicMock(), MagicMock()
+        page1.json.return_value = {"data": [{"id": "1"}, {"id": "2"}], "paging": {"next": "https://next-page"}}
+        page2.json.return_value = {"data": [{"id": "3"}], "paging": {}}
+        mock_get.side_effect = [page1, page2]
+        
+        pages = iter_facebook_posts("page_id", "token", since="2024-01-01T00:00:00+0000")
+        
+        assert next(pages) == [{"id": "1"}, {"id": "2"}], "❌ Trang đầu không đúng"
+        assert mock_get.call_count == 1, "❌ Chỉ được gọi trang tiếp khi cần"
+        assert list(pages) == [[{"id": "3"}]], "❌ Trang sau không đúng"
+        assert mock_get.call_args_list[0][1]["params"]["since"] == 1704067200, "❌ since phải là unix timestamp"
+        assert mock_get.call_args_list[1][0][0] == "https://next-page", "❌ Phải gọi URL paging.next"
+    
+    @patch("app.graph_http.get")
+    def test_iter_facebook_posts_error(self, mock_get):
+        """Test raise lỗi khi Graph API báo lỗi"""
+        mock_response = MagicMock()
+        mock_response.json.return_value = {"error": {"message": "Invalid token"}}
+        mock_get.return_value = mock_response
+        
+        with pytest.raises(Exception):
+            list(iter_facebook_posts("page_id", "token"))
+    
+    def test_to_graph_timestamp(self):
+        """Test chuyển created_time thành unix timestamp"""
+        assert to_graph_timestamp("2024-01-01T10:00:00+0000") == 1704103200, "❌ Timestamp không đúng"
+        assert to_graph_timestamp(None) is None, "❌ None phải trả về None"
+    
+    @patch("app.save_sync_watermark")
+    @patch("app.fetch_facebook_posts_with_stats")
     @patch("app.st.session_state", {})
-    def test_get_facebook_data_fresh_fetch(self, mock_stats, mock_posts):
+    def test_get_facebook_data_fresh_fetch(self, mock_posts, mock_save_watermark, tmp_path):
         """Test lấy Facebook data lần đầu (không có cache)"""
         # Mock data
-        mock_posts.return_value = [{"id": "123", "created_time": "2024-01-01T10:00:00+0000"}]
-        mock_stats.return_value = {
+        mock_posts.return_value = [{
+            "id": "123",
+            "created_time": "2024-01-01T10:00:00+0000",
             "message": "Test",
             "likes": {"summary": {"total_count": 10}},
             "comments": {"summary": {"total_count": 5}},
             "shares": {"count": 2},
             "reactions": {"summary": {"total_count": 15}}
-        }
+        }]
         
-        result = get_facebook_data()
+        with patch("app.INSIGHTS_CACHE_FILE", str(tmp_path / "cache.db")), patch("app.INSIGHTS_HISTORY_DIR", str(tmp_path / "history")):
+            result = get_facebook_data()
         
         assert len(result) == 1, "❌ Phải có 1 post"
         assert result[0]["likes"] == 10, "❌ Likes không đúng"
         assert result[0]["platform"] == "Facebook", "❌ Platform phải là Facebook"
+        assert mock_posts.call_args[1]["since"] is None, "❌ Lần đầu phải lấy toàn bộ lịch sử"
+        mock_save_watermark.assert_called_once_with("2024-01-01T10:00:00+0000")
+    
+    @patch("app.save_sync_watermark")
+    @patch("app.iter_facebook_posts")
+    @patch("app.fetch_facebook_posts_with_stats", return_value=None)
+    @patch("app.fetch_posts_stats_batch")
+    @patch("app.st.session_state", {})
+    def test_get_facebook_data_batch_fallback(self, mock_batch, mock_expanded, mock_iter, mock_save_watermark, tmp_path):
+        """Test fallback lấy thống kê theo lô khi field expansion lỗi"""
+        mock_iter.return_value = iter([[{"id": "123", "created_time": "2024-01-01T10:00:00+0000"}]])
+        mock_batch.return_value = {"123": {"message": "Test", "likes": {"summary": {"total_count": 10}}}}
+        
+        with patch("app.INSIGHTS_CACHE_FILE", str(tmp_path / "cache.db")), patch("app.INSIGHTS_HISTORY_DIR", str(tmp_path / "history")):
+            result = get_facebook_data()
+        
+        mock_batch.assert_called_once()
+        assert mock_batch.call_args[0][0] == ["123"], "❌ Phải lấy thống kê theo lô cho post 123"
+        assert result[0]["likes"] == 10, "❌ Likes không đúng"
+    
+    @patch("app.fetch_post_stats_concurrent")
+    @patch("app.fetch_posts_stats_batch", return_value={})
+    def test_fetch_stats_for_ids_skips_failed_posts(self, mock_batch, mock_concurrent):
+        """Test bài lỗi mạng ({}) hoặc Graph trả {"error": ...} không có trong kết quả"""
+        mock_concurrent.return_value = [{"message": "ok"}, {}, {"error": {"message": "Invalid token"}}]
+        
+        result = fetch_stats_for_ids(["p0", "p1", "p2"], "token")
+        
+        assert result == {"p0": {"message": "ok"}}, "❌ Bài lỗi không được có thống kê"
+    
+    @patch("app.fetch_post_stats_concurrent")
+    @patch("app.fetch_posts_stats_batch", return_value={})
+    @patch("app.iter_facebook_posts")
+    @patch("app.fetch_facebook_posts_with_stats", return_value=None)
+    def test_fetch_post_records_skips_failed_posts(self, mock_expanded, mock_iter, mock_batch, mock_concurrent):
+        """Test fallback không tạo bản ghi số 0 cho bài lỗi, giữ mọi bài lấy được và trả về bài lỗi riêng"""
+        mock_iter.return_value = iter([[{"id": "new", "created_time": "2024-01-03T10:00:00+0000"},
+                                        {"id": "mid", "created_time": "2024-01-02T10:00:00+0000"},
+                                        {"id": "old", "created_time": "2024-01-01T10:00:00+0000"}]])
+        mock_concurrent.return_value = [{"likes": {"summary": {"total_count": 3}}}, {},
+                                        {"likes": {"summary": {"total_count": 5}}}]
+        
+        records, failed_posts = fetch_post_records("page_id", "token")
+        
+        assert [(record["id"], record["likes"]) for record in records] == [("new", 3), ("old", 5)], \
+            "❌ Phải giữ mọi bài lấy được thống kê"
+        assert [post["id"] for post in failed_posts] == ["mid"], "❌ Bài lỗi phải được trả về để lấy lại"
+    
+    @patch("app.fetch_posts_stats_batch")
+    @patch("app.iter_facebook_posts")
+    @patch("app.fetch_facebook_posts_with_stats", return_value=None)
+    def test_fetch_post_records_pagination_error(self, mock_expanded, mock_iter, mock_batch):
+        """Test lỗi giữa chừng khi duyệt trang: trả về None, không dùng danh sách dở dang"""
+        def pages(*args, **kwargs):
+            yield [{"id": "new", "created_time": "2024-01-03T10:00:00+0000"}]
+            raise Exception("Graph API lỗi: timeout")
+        mock_iter.side_effect = pages
+        
+        assert fetch_post_records("page_id", "token") is None, "❌ Phải trả về None khi duyệt trang lỗi"
+        mock_batch.assert_not_called()
+    
+    @patch("app.fetch_post_records")
+    def test_sync_facebook_insights_fresh_cache(self, mock_records, tmp_path):
+        """Test cache còn mới thì không gọi Graph API"""
+        cache_file = str(tmp_path / "cache.db")
+        history_dir = str(tmp_path / "history")
+        insights_cache.put_post_records([{"id": "123", "likes": 5, "created_time": "2024-01-01T10:00:00+0000"}], cache_file)
+        
+        with patch("app.INSIGHTS_CACHE_FILE", cache_file), patch("app.INSIGHTS_HISTORY_DIR", history_dir):
+            result = sync_facebook_insights("page_id", "token")
+        
+        mock_records.assert_not_called()
+        assert result[0]["likes"] == 5, "❌ Phải đọc từ cache"
+    
+    @patch("app.fetch_posts_stats_batch")
+    @patch("app.fetch_facebook_posts_with_stats")
+    def test_sync_facebook_insights_incremental_refresh(self, mock_posts, mock_batch, tmp_path):
+        """Test cache hết hạn: chỉ lấy bài mới hơn mốc đồng bộ, bài cũ cập nhật theo lô"""
+        cache_file = str(tmp_path / "cache.db")
+        history_dir = str(tmp_path / "history")
+        old_time, new_time = graph_time(hours=10), graph_time(hours=1)
+        old_post = {"id": "123", "caption": "Old", "likes": 1, "created_time": old_time}
+        insights_cache.put_post_records([old_post], cache_file, fetched_at=time_module.time() - 7200)
+        insights_cache.set_meta("last_created_time", old_time, cache_file)
+        mock_posts.return_value = [{"id": "456", "created_time": new_time, "message": "New"}]
+        mock_batch.return_value = {"123": {"message": "Old", "likes": {"summary": {"total_count": 7}}}}
+        
+        with patch("app.INSIGHTS_CACHE_FILE", cache_file), patch("app.INSIGHTS_HISTORY_DIR", history_dir):
+            result = sync_facebook_insights("page_id", "token")
+        
+        assert mock_posts.call_args[1]["since"] == old_time, "❌ Phải lấy bài từ mốc đồng bộ"
+        assert [post["id"] for post in result] == ["456", "123"], "❌ Bài mới phải lên đầu"
+        assert result[1]["likes"] == 7, "❌ Thống kê bài cũ phải được cập nhật"
+        assert insights_cache.get_meta("last_created_time", cache_file) == new_time, "❌ Mốc đồng bộ chưa cập nhật"
+        snapshots = insights_history.load_snapshots(base_dir=history_dir)
+        assert sorted(snapshots["post_id"]) == ["123", "456"], "❌ Phải ghi snapshot vào lịch sử"
+    
+    @patch("app.fetch_posts_stats_batch")
+    @patch("app.fetch_facebook_posts_with_stats", return_value=[])
+    def test_sync_facebook_insights_force_refresh_age_tiers(self, mock_posts, mock_batch, tmp_path):
+        """Test force_refresh chỉ làm mới bài hết hạn theo tuổi bài viết"""
+        cache_file = str(tmp_path / "cache.db")
+        history_dir = str(tmp_path / "history")
+        now = time_module.time()
+        insights_cache.put_post_records([{"id": "young", "created_time": graph_time(hours=1)}], cache_file, fetched_at=now - 600)
+        insights_cache.put_post_records([{"id": "week", "created_time": graph_time(days=7)}], cache_file, fetched_at=now - 2 * 86400)
+        insights_cache.put_post_records([{"id": "frozen", "created_time": graph_time(days=90)}], cache_file, fetched_at=0)
+        mock_batch.return_value = {"week": {"likes": {"summary": {"total_count": 9}}}}
+        
+        with patch("app.INSIGHTS_CACHE_FILE", cache_file), patch("app.INSIGHTS_HISTORY_DIR", history_dir):
+            result = sync_facebook_insights("page_id", "token", force_refresh=True)
+        
+        mock_posts.assert_called_once()
+        assert mock_batch.call_args[0][0] == ["week"], "❌ Chỉ bài hết hạn được làm mới"
+        assert {post["id"]: post.get("likes") for post in result}["week"] == 9, "❌ Likes phải được cập nhật"
+    
+    @patch("app.fetch_post_stats_concurrent")
+    @patch("app.fetch_posts_stats_batch")
+    @patch("app.fetch_facebook_posts_with_stats", return_value=[])
+    def test_sync_facebook_insights_keeps_cache_on_fetch_error(self, mock_posts, mock_batch, mock_concurrent, tmp_path):
+        """Test lỗi mạng/token khi làm mới: bản ghi cũ trong cache giữ nguyên và vẫn hết hạn"""
+        cache_file = str(tmp_path / "cache.db")
+        history_dir = str(tmp_path / "history")
+        old_fetched_at = time_module.time() - 7200
+        insights_cache.put_post_records([{"id": "123", "caption": "Old", "likes": 4, "created_time": graph_time(hours=10)}],
+                                        cache_file, fetched_at=old_fetched_at)
+        mock_batch.return_value = {"123": {"error": {"message": "Invalid OAuth access token"}}}
+        mock_concurrent.return_value = [{"error": {"message": "Invalid OAuth access token"}}]
+        
+        with patch("app.INSIGHTS_CACHE_FILE", cache_file), patch("app.INSIGHTS_HISTORY_DIR", history_dir):
+            result = sync_facebook_insights("page_id", "token", force_refresh=True)
+        
+        assert (result[0]["caption"], result[0]["likes"]) == ("Old", 4), "❌ Không được ghi đè bằng số 0"
+        assert insights_cache.get_stale_ids_by_age(FB_REFRESH_TIERS, cache_file) == ["123"], \
+            "❌ Bài lỗi phải vẫn hết hạn để làm mới lại"
+    
+    @patch("app.fetch_post_records", return_value=None)
+    def test_sync_facebook_insights_keeps_watermark_on_pagination_error(self, mock_records, tmp_path):
+        """Test duyệt danh sách bài lỗi: giữ nguyên cache và mốc đồng bộ"""
+        cache_file = str(tmp_path / "cache.db")
+        history_dir = str(tmp_path / "history")
+        old_time = graph_time(hours=10)
+        insights_cache.put_post_records([{"id": "123", "likes": 4, "created_time": old_time}],
+                                        cache_file, fetched_at=time_module.time() - 7200)
+        insights_cache.set_meta("last_created_time", old_time, cache_file)
+        
+        with patch("app.INSIGHTS_CACHE_FILE", cache_file), patch("app.INSIGHTS_HISTORY_DIR", history_dir):
+            result = sync_facebook_insights("page_id", "token")
+        
+        assert [(post["id"], post["likes"]) for post in result] == [("123", 4)], "❌ Cache phải giữ nguyên"
+        assert insights_cache.get_meta("last_created_time", cache_file) == old_time, "❌ Mốc đồng bộ không được đổi"
+    
+    @patch("app.fetch_post_stats_concurrent")
+    @patch("app.fetch_posts_stats_batch")
+    @patch("app.iter_facebook_posts")
+    @patch("app.fetch_facebook_posts_with_stats", return_value=None)
+    def test_sync_facebook_insights_retries_failed_posts(self, mock_expanded, mock_iter, mock_batch, mock_concurrent, tmp_path):
+        """Test bài lỗi thống kê không chặn bài mới hơn, được lấy lại ở lần đồng bộ sau"""
+        cache_file = str(tmp_path / "cache.db")
+        history_dir = str(tmp_path / "history")
+        new_time, failed_time = graph_time(hours=1), graph_time(hours=2)
+        mock_iter.return_value = iter([[{"id": "new", "created_time": new_time},
+                                        {"id": "failed", "created_time": failed_time}]])
+        mock_batch.return_value = {"new": {"likes": {"summary": {"total_count": 3}}},
+                                   "failed": {"error": {"message": "Unsupported get request"}}}
+        mock_concurrent.return_value = [{"error": {"message": "Unsupported get request"}}]
+        
+        with patch("app.INSIGHTS_CACHE_FILE", cache_file), patch("app.INSIGHTS_HISTORY_DIR", history_dir):
+            first = sync_facebook_insights("page_id", "token")
+            assert [post["id"] for post in first] == ["new"], "❌ Bài lấy được phải vào cache dù có bài lỗi"
+            assert insights_cache.get_meta("last_created_time", cache_file) == new_time, "❌ Mốc đồng bộ phải tiến"
+            
+            mock_iter.return_value = iter([])
+            mock_batch.return_value = {"failed": {"likes": {"summary": {"total_count": 7}}}}
+            second = sync_facebook_insights("page_id", "token")
+        
+        assert mock_batch.call_args[0][0] == ["failed"], "❌ Phải lấy lại bài lỗi lần trước"
+        assert {post["id"]: post["likes"] for post in second} == {"new": 3, "failed": 7}, "❌ Bài lỗi phải vào cache"
+        assert second[1]["created_time"] == failed_time, "❌ Thời gian đăng của bài lỗi không đúng"
+    
+    @patch("app.sync_facebook_insights")
+    @patch("app.st.session_state", {})
+    def test_get_facebook_data_reads_warm_cache(self, mock_sync, tmp_path):
+        """Test phiên mới đọc snapshot trong cache, không gọi API"""
+        cache_file = str(tmp_path / "cache.db")
+        insights_cache.put_post_records([{"id": "123", "likes": 3, "created_time": graph_time(hours=1)}], cache_file)
+        
+        with patch("app.INSIGHTS_CACHE_FILE", cache_file):
+            result = get_facebook_data()
+        
+        mock_sync.assert_not_called()
+        assert result[0]["likes"] == 3, "❌ Phải đọc từ cache"
+    
+    def test_get_facebook_snapshot(self, tmp_path):
+        """Test đọc snapshot kèm thời điểm cập nhật"""
+        cache_file = str(tmp_path / "cache.db")
+        with patch("app.INSIGHTS_CACHE_FILE", cache_file):
+            assert get_facebook_snapshot() == ([], None), "❌ Cache trống phải trả về ([], None)"
+            insights_cache.put_post_records([{"id": "123", "created_time": graph_time(hours=1)}], cache_file, fetched_at=1704103200)
+            posts, last_updated = get_facebook_snapshot()
+        
+        assert [post["id"] for post in posts] == ["123"], "❌ Snapshot không đúng"
+        assert last_updated == datetime.fromtimestamp(1704103200), "❌ Thời điểm cập nhật không đúng"
+    
+    def test_request_insights_refresh_wakes_worker(self):
+        """Test nút làm mới đánh thức worker nền mà không chặn"""
+        import threading
+        worker = {"wake_event": threading.Event(), "force_refresh": False}
+        
+        request_insights_refresh(worker)
+        
+        assert worker["wake_event"].is_set(), "❌ Worker phải được đánh thức"
+        assert worker["force_refresh"], "❌ Phải yêu cầu kiểm tra bài mới"
+    
+    def test_get_growth_curve_scans_only_after_history_changes(self, tmp_path):
+        """Test đường tăng trưởng chỉ được tính lại khi lịch sử có snapshot mới"""
+        history_dir = str(tmp_path / "history")
+        records = [{"id": "123", "likes": 4, "reactions": 4, "created_time": "2024-01-01T00:00:00+0000"}]
+        insights_history.append_snapshots(records, history_dir, fetched_at=1704067200 + 3600)
+        
+        with patch("app.insights_history.average_growth_curve", wraps=insights_history.average_growth_curve) as mock_curve:
+            first = get_growth_curve(history_dir)
+            get_growth_curve(history_dir)
+            assert mock_curve.call_count == 1, "❌ Lịch sử không đổi thì không được quét lại"
+            
+            insights_history.append_snapshots(records, history_dir, fetched_at=1704067200 + 7200)
+            get_growth_curve(history_dir)
+        
+        assert mock_curve.call_count == 2, "❌ Có snapshot mới phải tính lại"
+        assert list(first["snapshots"]) == [1], "❌ Kết quả không đúng"
+    
+    def test_start_insights_worker_disabled(self):
+        """Test FB_PREWARM_INTERVAL <= 0: không chạy thread, báo worker tắt"""
+        worker = start_insights_worker(interval=0)
+        
+        assert not worker["enabled"], "❌ Worker phải báo đang tắt"
+        assert "thread" not in worker, "❌ Không được chạy thread nền"
     
     @patch("app.st.session_state", {"fb_posts": SAMPLE_POSTS})
     def test_get_facebook_data_cached(self):
@@ -233,10 +603,11 @@ class TestGoogleSheetsFunctions:
         mock_worksheet.clear.assert_called_once()
         mock_worksheet.append_row.assert_called_once_with(header)
     
+    @patch("app.notify_schedule_changed")
     @patch("app.get_gsheet_client")
     @patch("app.ensure_sheet_header")
-    def test_schedule_post_to_sheet_success(self, mock_ensure, mock_client):
-        """Test lên lịch đăng bài vào Sheet thành công"""
+    def test_schedule_post_to_sheet_success(self, mock_ensure, mock_client, mock_notify, tmp_path):
+        """Test lên lịch đăng bài vào Sheet thành công và ghi song song vào job store"""
         # Mock objects
         mock_gc = MagicMock()
         mock_sh = MagicMock()
@@ -247,17 +618,33 @@ class TestGoogleSheetsFunctions:
         mock_sh.worksheet.return_value = mock_worksheet
         
         # Test function
-        schedule_post_to_sheet(
-            "Product", "keywords", "Facebook", "09:00",
-            "token", "page_id", "once", "2024-01-01",
-            "Test caption", "image_url"
-        )
+        store_file = str(tmp_path / "jobs.db")
+        with patch("app.JOB_STORE_FILE", store_file):
+            schedule_post_to_sheet(
+                "Product", "keywords", "Facebook", "09:00",
+                "token", "page_id", "once", "2024-01-01",
+                "Test caption", "image_url"
+            )
         
         # Verify calls
         mock_gc.open_by_key.assert_called_once()
         mock_sh.worksheet.assert_called_once()
         mock_ensure.assert_called_once()
         mock_worksheet.append_row.assert_called_once()
+        mock_notify.assert_called_once()
+        jobs = job_store.get_due_jobs(datetime(2024, 1, 1, 9, 0), store_file)
+        assert [job["caption"] for job in jobs] == ["Test caption"], "❌ Phải ghi job vào job store"
+    
+    def test_notify_schedule_changed(self, tmp_path):
+        """Test chạm file tín hiệu để scheduler đọc lại sheet"""
+        signal_file = tmp_path / "schedule_changed.flag"
+        notify_schedule_changed(str(signal_file))
+        first_mtime = signal_file.stat().st_mtime
+        os.utime(signal_file, (0, 0))
+        notify_schedule_changed(str(signal_file))
+        
+        assert signal_file.exists(), "❌ Phải tạo file tín hiệu"
+        assert signal_file.stat().st_mtime >= first_mtime, "❌ Phải cập nhật thời điểm sửa file"
 
 # ==========================================
 # ====== AI & CONTENT FUNCTIONS TESTS ======
@@ -111,7 +111,7 @@ class TestUtilityFunctions:
 
 class TestFacebookAPIFunctions:
     
-    @patch("app.requests.get")
+    @patch("app.graph_http.get")
     def test_fetch_facebook_posts_success(self, mock_get):
         """Test lấy posts Facebook thành công"""
         mock_response = MagicMock()
@@ -132,7 +132,7 @@ class TestFacebookAPIFunctions:
         args, kwargs = mock_get.call_args
         assert "page_id/posts" in args[0], "❌ URL không đúng"
     
-    @patch("app.requests.get")
+    @patch("app.graph_http.get")
     def test_fetch_facebook_posts_empty_response(self, mock_get):
         """Test xử lý response rỗng từ Facebook API"""
         mock_response = MagicMock()
@@ -143,7 +143,7 @@ class TestFacebookAPIFunctions:
         
         assert result == [], "❌ Phải trả về list rỗng khi không có data"
     
-    @patch("app.requests.get")
+    @patch("app.graph_http.get")
     def test_fetch_post_stats_success(self, mock_get):
         """Test lấy stats của post thành công"""
         mock_response = MagicMock()
@@ -0,0 +1,174 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import event_log
+
+# ==========================================
+# ====== EVENT LOG TESTS ======
+# ==========================================
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+class TestEventLog:
+
+    def test_emit_is_buffered_until_flush(self, tmp_path):
+        """Test emit chỉ thêm vào buffer, flush mới ghi JSON lines ra file"""
+        path = str(tmp_path / "log.jsonl")
+        with patch("event_log.LOG_FLUSH_INTERVAL", 60):
+            event_log.emit(path, event_log.build_record("SUCCESS", row=2, platform="facebook", post_id="p1"))
+            assert not (tmp_path / "log.jsonl").exists(), "❌ Không được ghi file ngay khi emit"
+
+            assert event_log.flush() == 1, "❌ Phải ghi 1 bản ghi"
+
+        lines = (tmp_path / "log.jsonl").read_text(encoding="utf-8").splitlines()
+        record = json.loads(lines[0])
+        assert list(record)[:len(event_log.LOG_FIELDS)] == event_log.LOG_FIELDS, "❌ Thiếu trường chuẩn"
+        assert (record["row"], record["status"], record["post_id"]) == (2, "SUCCESS", "p1"), "❌ Sai nội dung"
+        assert record["latency_ms"] is None, "❌ Trường không có phải là null"
+
+    def test_background_flush_on_size(self, tmp_path):
+        """Test đủ LOG_FLUSH_SIZE bản ghi thì thread nền tự ghi"""
+        path = str(tmp_path / "log.jsonl")
+        with patch("event_log.LOG_FLUSH_SIZE", 5), patch("event_log.LOG_FLUSH_INTERVAL", 60):
+            for i in range(5):
+                event_log.emit(path, event_log.build_record("SUCCESS", row=i))
+
+            assert wait_for(lambda: len(event_log.read_records(path)) == 5), "❌ Thread nền phải ghi khi đủ lô"
+
+    def test_background_flush_on_interval(self, tmp_path):
+        """Test bản ghi lẻ được ghi sau LOG_FLUSH_INTERVAL giây"""
+        path = str(tmp_path / "log.jsonl")
+        with patch("event_log.LOG_FLUSH_INTERVAL", 0.05):
+            event_log.emit(path, event_log.build_record("ERROR", error_class="transient"))
+            with event_log._buffer_lock:
+                event_log._buffer_lock.notify_all()  # thread nền có thể đang chờ theo chu kỳ của test trước
+
+            assert wait_for(lambda: len(event_log.read_records(path)) == 1), "❌ Phải ghi sau chu kỳ"
+
+    def test_emit_does_not_wait_for_slow_disk(self, tmp_path):
+        """Test emit không bị chặn khi đang ghi file chậm"""
+        path = str(tmp_path / "log.jsonl")
+        with event_log._write_lock:
+            start = time.perf_counter()
+            for i in range(100):
+                event_log.emit(path, event_log.build_record("SUCCESS", row=i))
+            elapsed = time.perf_counter() - start
+
+        assert elapsed < 0.5, "❌ emit không được chờ ghi file"
+        event_log.flush()
+        assert [r["row"] for r in event_log.read_records(path)] == list(range(100)), "❌ Phải giữ đúng thứ tự"
+
+    def test_failed_write_is_kept(self, tmp_path):
+        """Test ghi file lỗi thì bản ghi được giữ lại để ghi lần sau"""
+        path = str(tmp_path / "log.jsonl")
+        with patch("event_log.LOG_FLUSH_INTERVAL", 60):
+            event_log.emit(path, event_log.build_record("SUCCESS", row=1))
+            with patch("builtins.open", side_effect=OSError("Disk full")):
+                assert event_log.flush() == 0, "❌ Ghi lỗi không được tính là đã ghi"
+            event_log.emit(path, event_log.build_record("SUCCESS", row=2))
+            event_log.flush()
+
+        assert [r["row"] for r in event_log.read_records(path)] == [1, 2], "❌ Không được mất bản ghi"
+
+    def test_buffer_is_bounded(self, tmp_path):
+        """Test buffer đầy thì bỏ bản ghi cũ nhất và đếm số bản ghi bị bỏ"""
+        path = str(tmp_path / "log.jsonl")
+        dropped = event_log.get_stats()["dropped"]
+        with patch("event_log.LOG_BUFFER_MAX", 3), patch("event_log.LOG_FLUSH_INTERVAL", 60), \
+                patch.dict(event_log._buffers, clear=True):
+            for i in range(5):
+                event_log.emit(path, event_log.build_record("SUCCESS", row=i))
+            event_log.flush()
+
+        assert [r["row"] for r in event_log.read_records(path)] == [2, 3, 4], "❌ Phải giữ bản ghi mới nhất"
+        assert event_log.get_stats()["dropped"] - dropped == 2, "❌ Phải đếm bản ghi bị bỏ"
+
+    def test_read_records_skips_plain_text(self, tmp_path):
+        """Test đọc log bỏ qua dòng không phải JSON (log văn bản cũ)"""
+        path = tmp_path / "log.jsonl"
+        path.write_text('[2024-01-01] Platform: FACEBOOK\n{"status": "SUCCESS"}\n', encoding="utf-8")
+
+        assert event_log.read_records(str(path)) == [{"status": "SUCCESS"}], "❌ Chỉ đọc dòng JSON"
+
+def write_lines(path, records):
+    with open(path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+def make_record(timestamp, platform="facebook", status="SUCCESS"):
+    return dict(event_log.build_record(status, platform=platform), timestamp=timestamp)
+
+class TestLogRotation:
+
+    def test_rotate_on_size(self, tmp_path):
+        """Test file log quá LOG_ROTATE_BYTES thì được nén vào archive và ghi index"""
+        path = str(tmp_path / "log.txt")
+        write_lines(path, [make_record("2024-01-01T09:00:00.000"), make_record("2024-01-02T10:00:00.000", status="ERROR")])
+
+        with patch("event_log.LOG_ROTATE_BYTES", 10):
+            archive = event_log.rotate_if_needed(path, now=datetime(2024, 1, 2, 12, 0))
+
+        assert archive.endswith(".jsonl.gz") and not os.path.exists(path), "❌ Phải chuyển file log vào archive"
+        assert [r["status"] for r in event_log.read_records(archive)] == ["SUCCESS", "ERROR"], "❌ Archive thiếu bản ghi"
+        index = event_log.load_index(path)
+        assert (index[0]["start"], index[0]["end"], index[0]["records"]) == \
+            ("2024-01-01T09:00:00.000", "2024-01-02T10:00:00.000", 2), "❌ Index sai khoảng thời gian"
+        assert index[0]["counts"] == {"2024-01-01|facebook|SUCCESS": 1, "2024-01-02|facebook|ERROR": 1}, "❌ Index sai số đếm"
+
+    def test_rotate_on_new_day(self, tmp_path):
+        """Test sang ngày mới thì file của ngày cũ được xoay vòng, cùng ngày thì giữ nguyên"""
+        path = str(tmp_path / "log.txt")
+        write_lines(path, [make_record("2024-01-01T09:00:00.000")])
+
+        assert event_log.rotate_if_needed(path, now=datetime.now()) is None, "❌ Cùng ngày không được xoay vòng"
+        assert event_log.rotate_if_needed(path, now=datetime.now() + timedelta(days=1)), "❌ Ngày mới phải xoay vòng"
+
+    def test_flush_rotates_before_writing(self, tmp_path):
+        """Test flush xoay vòng file cũ rồi ghi bản ghi mới vào file mới"""
+        path = str(tmp_path / "log.txt")
+        write_lines(path, [make_record("2024-01-01T09:00:00.000")])
+        with patch("event_log.LOG_ROTATE_BYTES", 10), patch("event_log.LOG_FLUSH_INTERVAL", 60), \
+                patch("event_log.LOG_ARCHIVE_RETENTION_DAYS", 100000):
+            event_log.emit(path, event_log.build_record("SUCCESS", row=5))
+            event_log.flush()
+
+        assert [r["row"] for r in event_log.read_records(path)] == [5], "❌ File mới chỉ có bản ghi mới"
+        assert [r["timestamp"] for r in event_log.iter_records(path)][0] == "2024-01-01T09:00:00.000", \
+            "❌ Phải đọc được cả archive"
+
+    def test_count_uses_index_for_covered_archives(self, tmp_path):
+        """Test thống kê dùng index cho archive nằm trọn trong khoảng, chỉ giải nén archive giao một phần"""
+        path = str(tmp_path / "log.txt")
+        for day in (1, 2, 3):
+            write_lines(path, [make_record(f"2024-01-0{day}T08:00:00.000"),
+                               make_record(f"2024-01-0{day}T20:00:00.000", platform="instagram", status="ERROR")])
+            event_log.rotate(path, now=datetime(2024, 1, day, 23, 59))
+        write_lines(path, [make_record("2024-01-04T08:00:00.000", platform="instagram", status="ERROR")])
+
+        with patch("event_log.iter_file_records", wraps=event_log.iter_file_records) as mock_iter:
+            counts = event_log.count_records(path, since=datetime(2024, 1, 2), until=datetime(2024, 1, 3, 12, 0),
+                                             platform="instagram")
+
+        assert counts == {("2024-01-02", "instagram", "ERROR"): 1}, "❌ Sai số đếm"
+        opened = [c[0][0] for c in mock_iter.call_args_list]
+        assert len(opened) == 2 and opened[-1] == path, "❌ Chỉ được mở archive ngày 3 (giao một phần) và file đang ghi"
+
+    def test_old_archives_are_pruned(self, tmp_path):
+        """Test archive quá LOG_ARCHIVE_RETENTION_DAYS ngày bị xóa"""
+        path = str(tmp_path / "log.txt")
+        write_lines(path, [make_record("2023-01-01T09:00:00.000")])
+        old_archive = event_log.rotate(path, now=datetime(2023, 1, 1, 12, 0))
+        write_lines(path, [make_record("2024-06-01T09:00:00.000")])
+        event_log.rotate(path, now=datetime(2024, 6, 1, 12, 0))
+
+        assert not os.path.exists(old_archive), "❌ Archive cũ phải bị xóa"
+        assert [entry["start"][:10] for entry in event_log.load_index(path)] == ["2024-06-01"], "❌ Index chỉ còn archive mới"
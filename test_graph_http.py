@@ -0,0 +1,127 @@
+import pytest
+import requests
+from unittest.mock import patch, MagicMock
+
+import graph_http
+
+# ==========================================
+# ====== GRAPH API HTTP TRANSPORT TESTS ======
+# ==========================================
+
+class TestGraphHttp:
+    
+    def setup_method(self):
+        graph_http.reset_latency_stats()
+        graph_http.reset_usage()
+    
+    def test_graph_url(self):
+        """Test ghép URL Graph API"""
+        assert graph_http.graph_url("123/posts") == "https://graph.facebook.com/v19.0/123/posts"
+    
+    def test_endpoint_label_strips_ids(self):
+        """Test nhãn endpoint bỏ phần ID"""
+        assert graph_http.endpoint_label("get", "https://graph.facebook.com/v19.0/123/posts?limit=5") == "GET posts"
+        assert graph_http.endpoint_label("GET", "https://graph.facebook.com/v19.0/123_456") == "GET node"
+        assert graph_http.endpoint_label("GET", "https://graph.facebook.com/v19.0/") == "GET ids"
+        assert graph_http.endpoint_label("POST", "https://graph.facebook.com/v19.0/1/media_publish") == "POST media_publish"
+    
+    def test_session_is_shared_and_retries_only_idempotent_status(self):
+        """Test session dùng chung, không retry POST khi gặp 5xx"""
+        graph_http.close_session()
+        session = graph_http.get_session()
+        
+        assert graph_http.get_session() is session, "❌ Phải dùng chung 1 session"
+        retry = session.get_adapter("https://graph.facebook.com").max_retries
+        assert 503 in retry.status_forcelist, "❌ Phải retry khi 503"
+        assert "POST" not in retry.allowed_methods, "❌ Không được retry POST theo status"
+        graph_http.close_session()
+    
+    @patch("graph_http.get_session")
+    def test_request_records_latency_and_default_timeout(self, mock_session):
+        """Test request gắn latency_ms, dùng timeout mặc định và ghi thống kê"""
+        mock_response = MagicMock(status_code=200, headers={})
+        mock_session.return_value.request.return_value = mock_response
+        
+        resp = graph_http.get("https://graph.facebook.com/v19.0/123/posts", params={"limit": 5})
+        
+        assert resp.latency_ms >= 0, "❌ Thiếu latency_ms"
+        assert mock_session.return_value.request.call_args[1]["timeout"] == graph_http.DEFAULT_TIMEOUT
+        stats = graph_http.get_latency_stats()
+        assert stats["GET posts"]["count"] == 1, "❌ Chưa ghi thống kê độ trễ"
+        assert "GET posts: 1 lần" in graph_http.format_latency_report()
+    
+    @patch("graph_http.get_session")
+    def test_request_error_is_raised_and_counted(self, mock_session):
+        """Test lỗi mạng vẫn raise như requests và được đếm là lỗi"""
+        mock_session.return_value.request.side_effect = requests.exceptions.Timeout("timeout")
+        
+        with pytest.raises(requests.exceptions.Timeout):
+            graph_http.post("https://graph.facebook.com/v19.0/1/feed", data={})
+        
+        assert graph_http.get_latency_stats()["POST feed"]["errors"] == 1, "❌ Lỗi phải được đếm"
+
+
+# ==========================================
+# ====== RATE LIMIT THROTTLER TESTS ======
+# ==========================================
+
+class TestGraphThrottle:
+    
+    def setup_method(self):
+        graph_http.reset_usage()
+    
+    def teardown_method(self):
+        graph_http.reset_usage()
+    
+    def test_parse_usage_headers(self):
+        """Test đọc header X-App-Usage và X-Business-Use-Case-Usage"""
+        usage = graph_http.parse_usage_headers({
+            "X-App-Usage": '{"call_count": 28, "total_time": 40, "total_cputime": 10}',
+            "X-Business-Use-Case-Usage": '{"123": [{"type": "pages", "call_count": 80, "total_cputime": 5, "total_time": 5, "estimated_time_to_regain_access": 2}]}'
+        })
+        
+        assert usage["app_pct"] == 40, "❌ App usage phải là chỉ số lớn nhất"
+        assert usage["business_pct"] == 80, "❌ Business usage không đúng"
+        assert usage["max_pct"] == 80, "❌ max_pct không đúng"
+        assert usage["regain_seconds"] == 120, "❌ Thời gian mở khóa phải đổi sang giây"
+        assert graph_http.parse_usage_headers({}) is None, "❌ Không có header phải trả về None"
+    
+    def test_throttle_delay_by_priority(self):
+        """Test analytics chậm lại/tạm dừng trước, publish chỉ dừng khi gần chạm giới hạn"""
+        graph_http.update_usage({"X-App-Usage": '{"call_count": 50}'}, now=1000)
+        assert graph_http.throttle_delay(graph_http.PRIORITY_ANALYTICS, now=1000) == 0, "❌ Dưới ngưỡng không được chờ"
+        
+        graph_http.update_usage({"X-App-Usage": '{"call_count": 85}'}, now=1000)
+        assert 0 < graph_http.throttle_delay(graph_http.PRIORITY_ANALYTICS, now=1000) <= graph_http.THROTTLE_MAX_DELAY
+        assert graph_http.throttle_delay(graph_http.PRIORITY_PUBLISH, now=1000) == 0, "❌ Publish được ưu tiên"
+        
+        graph_http.update_usage({"X-App-Usage": '{"call_count": 95}'}, now=1000)
+        assert graph_http.throttle_delay(graph_http.PRIORITY_ANALYTICS, now=1010) == graph_http.THROTTLE_PAUSE_SECONDS - 10
+        assert graph_http.throttle_delay(graph_http.PRIORITY_ANALYTICS, now=1000 + graph_http.THROTTLE_PAUSE_SECONDS) == 0, "❌ Hết thời gian dừng phải cho thăm dò"
+        assert graph_http.throttle_delay(graph_http.PRIORITY_PUBLISH, now=1010) == 0, "❌ Publish chưa phải dừng"
+    
+    def test_throttle_delay_regain_access_blocks_all(self):
+        """Test Meta báo khóa thì mọi request đều phải chờ"""
+        graph_http.update_usage({"X-Business-Use-Case-Usage": '{"1": [{"call_count": 100, "estimated_time_to_regain_access": 1}]}'}, now=1000)
+        
+        assert graph_http.throttle_delay(graph_http.PRIORITY_PUBLISH, now=1000) == 60, "❌ Publish phải chờ tới lúc mở khóa"
+    
+    @patch("graph_http.get_session")
+    def test_request_raises_when_wait_too_long(self, mock_session):
+        """Test raise GraphThrottled (RequestException) khi phải chờ quá lâu"""
+        graph_http.update_usage({"X-App-Usage": '{"call_count": 95}'})
+        
+        with pytest.raises(requests.exceptions.RequestException):
+            graph_http.get("https://graph.facebook.com/v19.0/123/posts")
+        
+        mock_session.return_value.request.assert_not_called()
+    
+    @patch("graph_http.get_session")
+    def test_request_updates_usage_from_headers(self, mock_session):
+        """Test mỗi response đều cập nhật mức sử dụng"""
+        mock_session.return_value.request.return_value = MagicMock(status_code=200, headers={"X-App-Usage": '{"call_count": 42}'})
+        
+        graph_http.get("https://graph.facebook.com/v19.0/123/posts")
+        
+        assert graph_http.get_usage()["app_pct"] == 42, "❌ Chưa cập nhật mức sử dụng"
+        assert "App 42%" in graph_http.format_usage()
@@ -0,0 +1,86 @@
+import pytest
+import requests
+from unittest.mock import patch
+
+import graph_http
+import graph_stub_server
+from app import fetch_post_records, POST_STATS_FIELDS
+
+# ==========================================
+# ====== GRAPH API STUB SERVER TESTS ======
+# ==========================================
+
+@pytest.fixture
+def stub():
+    server = graph_stub_server.start_stub_server(post_count=120)
+    yield server
+    graph_stub_server.stop_stub_server(server)
+
+class TestGraphStubServer:
+
+    def test_posts_pagination(self, stub):
+        """Test /posts phân trang theo cursor tới hết bài"""
+        url = f"{stub.base_url}/v19.0/page/posts"
+        params = {"fields": "id,created_time", "limit": 50}
+        ids = []
+        while url:
+            data = requests.get(url, params=params, timeout=5).json()
+            ids.extend(post["id"] for post in data["data"])
+            url, params = data.get("paging", {}).get("next"), None
+
+        assert len(ids) == 120, "❌ Phải duyệt hết 120 bài"
+        assert ids[0] == "page_1", "❌ Bài mới nhất phải lên đầu"
+        assert graph_stub_server.get_request_counts(stub)["posts"] == 3, "❌ Phải có 3 trang"
+
+    def test_posts_since_filter(self, stub):
+        """Test since chỉ trả về bài đăng từ mốc thời gian"""
+        since = stub.newest_time - 2 * graph_stub_server.STUB_POST_INTERVAL
+        data = requests.get(f"{stub.base_url}/v19.0/page/posts", params={"since": since}, timeout=5).json()
+
+        assert [post["id"] for post in data["data"]] == ["page_1", "page_2", "page_3"], "❌ Lọc since không đúng"
+        assert "paging" not in data, "❌ Không được có trang tiếp"
+
+    def test_node_and_ids_field_expansion(self, stub):
+        """Test /{post_id} và ?ids= trả về thống kê theo fields"""
+        node = requests.get(f"{stub.base_url}/v19.0/page_2", params={"fields": POST_STATS_FIELDS}, timeout=5).json()
+        batch = requests.get(f"{stub.base_url}/v19.0/", params={"ids": "page_1,page_2", "fields": POST_STATS_FIELDS},
+                             timeout=5).json()
+
+        assert node["likes"]["summary"]["total_count"] == 37, "❌ Likes không đúng"
+        assert batch["page_2"] == node, "❌ ?ids= phải trả cùng dữ liệu với /{post_id}"
+        assert "likes" not in requests.get(f"{stub.base_url}/v19.0/page_2", timeout=5).json(), "❌ Chỉ trả field được yêu cầu"
+
+    def test_error_rate(self):
+        """Test tỉ lệ lỗi 100% luôn trả về HTTP 500"""
+        server = graph_stub_server.start_stub_server(post_count=10, error_rate=1.0)
+        try:
+            resp = requests.get(f"{server.base_url}/v19.0/page_1", timeout=5)
+        finally:
+            graph_stub_server.stop_stub_server(server)
+
+        assert resp.status_code == 500, "❌ Phải trả về lỗi 500"
+        assert "error" in resp.json(), "❌ Phải có thông tin lỗi"
+
+    def test_fetch_post_records_against_stub(self, stub):
+        """Test luồng lấy bài viết của app chạy được với server giả lập"""
+        with patch("graph_http.GRAPH_API_BASE", stub.base_url):
+            records, failed_posts = fetch_post_records("page", "token")
+
+        assert not failed_posts, "❌ Không được có bài lỗi"
+        assert len(records) == 120, "❌ Phải lấy đủ 120 bài"
+        assert records[1]["likes"] == 37, "❌ Likes không đúng"
+        assert records[1]["platform"] == "Facebook", "❌ Platform phải là Facebook"
+
+    def test_fetch_post_records_fallback_against_stub(self):
+        """Test nhánh fallback lấy thống kê theo lô khi /posts từ chối field expansion"""
+        server = graph_stub_server.start_stub_server(post_count=60, expansion_error=True)
+        try:
+            with patch("graph_http.GRAPH_API_BASE", server.base_url):
+                records, failed_posts = fetch_post_records("page", "token")
+            counts = graph_stub_server.get_request_counts(server)
+        finally:
+            graph_stub_server.stop_stub_server(server)
+
+        assert len(records) == 60, "❌ Phải lấy đủ 60 bài"
+        assert counts["ids"] == 2, "❌ 60 bài phải lấy thống kê trong 2 request ?ids="
+        assert counts.get("node", 0) == 0, "❌ Không được gọi từng bài"
@@ -0,0 +1,76 @@
+import pytest
+from datetime import datetime, timezone
+
+import insights_cache
+
+# ==========================================
+# ====== INSIGHTS CACHE TESTS ======
+# ==========================================
+
+SAMPLE_RECORDS = [
+    {"id": "001", "caption": "Bài 1", "likes": 10, "created_time": "2024-01-01T10:00:00+0000"},
+    {"id": "002", "caption": "Bài 2", "likes": 20, "created_time": "2024-01-02T10:00:00+0000"}
+]
+
+class TestInsightsCache:
+    
+    @pytest.fixture
+    def cache_file(self, tmp_path):
+        return str(tmp_path / "cache.db")
+    
+    def test_put_and_get_post_records(self, cache_file):
+        """Test ghi và đọc bản ghi, mới nhất lên đầu"""
+        insights_cache.put_post_records(SAMPLE_RECORDS, cache_file)
+        
+        result = insights_cache.get_post_records(cache_file)
+        
+        assert [r["id"] for r in result] == ["002", "001"], "❌ Thứ tự bản ghi không đúng"
+        assert result[0]["caption"] == "Bài 2", "❌ Nội dung bản ghi không đúng"
+    
+    def test_put_overwrites_same_post(self, cache_file):
+        """Test ghi đè bản ghi cùng post_id"""
+        insights_cache.put_post_records(SAMPLE_RECORDS, cache_file)
+        insights_cache.put_post_records([dict(SAMPLE_RECORDS[0], likes=99)], cache_file)
+        
+        result = insights_cache.get_post_records(cache_file)
+        
+        assert len(result) == 2, "❌ Không được nhân đôi bản ghi"
+        assert result[1]["likes"] == 99, "❌ Bản ghi phải được ghi đè"
+    
+    def test_get_last_fetched_at(self, cache_file):
+        """Test lấy thời điểm cập nhật gần nhất của cache"""
+        insights_cache.put_post_records(SAMPLE_RECORDS[:1], cache_file, fetched_at=1000)
+        insights_cache.put_post_records(SAMPLE_RECORDS[1:], cache_file, fetched_at=5000)
+        
+        assert insights_cache.get_last_fetched_at(cache_file) == 5000, "❌ fetched_at mới nhất không đúng"
+    
+    def test_get_stale_ids_by_age_tiers(self, cache_file):
+        """Test làm mới theo bậc tuổi bài: bài mới làm mới thường xuyên, bài cũ giữ nguyên"""
+        now = 1_700_000_000
+        tiers = [(48 * 3600, 3600), (30 * 86400, 86400)]
+        def created(seconds_ago):
+            return datetime.fromtimestamp(now - seconds_ago, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+0000")
+        insights_cache.put_post_records([{"id": "young_fresh", "created_time": created(3600)}], cache_file, fetched_at=now - 600)
+        insights_cache.put_post_records([{"id": "young_stale", "created_time": created(3600)}], cache_file, fetched_at=now - 7200)
+        insights_cache.put_post_records([{"id": "week_fresh", "created_time": created(7 * 86400)}], cache_file, fetched_at=now - 7200)
+        insights_cache.put_post_records([{"id": "week_stale", "created_time": created(7 * 86400)}], cache_file, fetched_at=now - 2 * 86400)
+        insights_cache.put_post_records([{"id": "frozen", "created_time": created(90 * 86400)}], cache_file, fetched_at=0)
+        
+        result = insights_cache.get_stale_ids_by_age(tiers, cache_file, now=now)
+        
+        assert sorted(result) == ["week_stale", "young_stale"], "❌ Bài cần làm mới không đúng"
+    
+    def test_evict_post_records_max_entries(self, cache_file):
+        """Test dọn cache chỉ giữ bài mới nhất"""
+        insights_cache.put_post_records(SAMPLE_RECORDS, cache_file)
+        
+        deleted = insights_cache.evict_post_records(cache_file, max_entries=1)
+        
+        assert deleted == 1, "❌ Phải xóa 1 bản ghi"
+        assert [r["id"] for r in insights_cache.get_post_records(cache_file)] == ["002"], "❌ Phải giữ bài mới nhất"
+    
+    def test_meta_roundtrip(self, cache_file):
+        """Test đọc/ghi giá trị meta"""
+        assert insights_cache.get_meta("missing", cache_file) is None, "❌ Key chưa có phải trả về None"
+        insights_cache.set_meta("last_created_time", "2024-01-02T10:00:00+0000", cache_file)
+        assert insights_cache.get_meta("last_created_time", cache_file) == "2024-01-02T10:00:00+0000"
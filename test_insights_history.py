@@ -0,0 +1,91 @@
+import os
+import pytest
+
+import insights_history
+
+# ==========================================
+# ====== INSIGHTS HISTORY TESTS ======
+# ==========================================
+
+# 2024-01-01 00:00:00 UTC
+BASE_TIME = 1704067200
+
+SAMPLE_RECORDS = [
+    {"id": "001", "likes": 10, "comments": 2, "shares": 1, "reactions": 12, "created_time": "2024-01-01T00:00:00+0000"},
+    {"id": "002", "likes": 4, "comments": 0, "shares": 0, "reactions": 4, "created_time": "2024-01-01T00:00:00+0000"}
+]
+
+class TestInsightsHistory:
+
+    @pytest.fixture
+    def history_dir(self, tmp_path):
+        return str(tmp_path / "history")
+
+    def test_append_and_load_snapshots(self, history_dir):
+        """Test ghi snapshot vào thư mục theo ngày và đọc lại"""
+        path = insights_history.append_snapshots(SAMPLE_RECORDS, history_dir, fetched_at=BASE_TIME + 3600)
+
+        assert os.path.basename(os.path.dirname(path)) == "date=2024-01-01", "❌ Sai thư mục ngày"
+        df = insights_history.load_snapshots(base_dir=history_dir)
+        assert list(df["post_id"]) == ["001", "002"], "❌ Snapshot không đúng"
+        assert df.loc[0, "likes"] == 10, "❌ Likes không đúng"
+
+    def test_append_empty_records(self, history_dir):
+        """Test không ghi gì khi không có bản ghi"""
+        assert insights_history.append_snapshots([], history_dir) is None, "❌ Không có bản ghi phải trả về None"
+        assert insights_history.load_snapshots(base_dir=history_dir).empty, "❌ Lịch sử phải rỗng"
+
+    def test_load_snapshots_filters(self, history_dir):
+        """Test lọc theo post_id và ngày lấy"""
+        insights_history.append_snapshots(SAMPLE_RECORDS, history_dir, fetched_at=BASE_TIME + 3600)
+        insights_history.append_snapshots(SAMPLE_RECORDS, history_dir, fetched_at=BASE_TIME + 86400 + 3600)
+
+        df = insights_history.load_snapshots(post_ids=["001"], since="2024-01-02", base_dir=history_dir)
+
+        assert list(df["post_id"]) == ["001"], "❌ Phải lọc theo post_id và ngày"
+
+    def test_average_growth_curve(self, history_dir):
+        """Test tương tác trung bình theo tuổi bài viết"""
+        insights_history.append_snapshots(SAMPLE_RECORDS, history_dir, fetched_at=BASE_TIME + 3600)
+        grown = [dict(record, likes=record["likes"] * 2, reactions=record["reactions"] * 2) for record in SAMPLE_RECORDS]
+        insights_history.append_snapshots(grown, history_dir, fetched_at=BASE_TIME + 30 * 3600)
+
+        curve = insights_history.average_growth_curve(bucket_hours=24, base_dir=history_dir)
+
+        assert list(curve["age_hours"]) == [0, 24], "❌ Sai nhóm tuổi bài"
+        assert curve.loc[0, "avg_likes"] == 7, "❌ Likes trung bình ngày đầu không đúng"
+        assert curve.loc[1, "avg_likes"] == 14, "❌ Likes trung bình ngày thứ 2 không đúng"
+        assert curve.loc[0, "avg_engagement"] == 9.5, "❌ Engagement trung bình không đúng"
+        assert list(curve["snapshots"]) == [2, 2], "❌ Số snapshot không đúng"
+
+    def test_average_growth_curve_empty(self, history_dir):
+        """Test chưa có lịch sử thì trả về DataFrame rỗng"""
+        assert insights_history.average_growth_curve(base_dir=history_dir).empty, "❌ Phải trả về DataFrame rỗng"
+
+    def test_compact_history(self, history_dir):
+        """Test gộp file nhỏ của ngày đã qua, bỏ qua ngày hôm nay"""
+        for offset in (3600, 7200, 7200):
+            insights_history.append_snapshots(SAMPLE_RECORDS, history_dir, fetched_at=BASE_TIME + offset)
+        insights_history.append_snapshots(SAMPLE_RECORDS, history_dir, fetched_at=BASE_TIME + 86400)
+        insights_history.append_snapshots(SAMPLE_RECORDS, history_dir, fetched_at=BASE_TIME + 86400 + 60)
+
+        assert insights_history.compact_history(history_dir, today="2024-01-02") == 1, "❌ Phải gộp 1 ngày"
+
+        assert len(os.listdir(os.path.join(history_dir, "date=2024-01-01"))) == 1, "❌ Ngày cũ phải còn 1 file"
+        assert len(os.listdir(os.path.join(history_dir, "date=2024-01-02"))) == 2, "❌ Không được gộp ngày hôm nay"
+        df = insights_history.load_snapshots(until="2024-01-01", base_dir=history_dir)
+        assert len(df) == 4, "❌ Snapshot trùng phải được bỏ"
+
+    def test_history_version_changes_on_write_and_compaction(self, history_dir):
+        """Test phiên bản lịch sử đổi sau mỗi lần ghi snapshot và gộp file"""
+        assert insights_history.history_version(history_dir) is None, "❌ Chưa có lịch sử phải trả về None"
+
+        insights_history.append_snapshots(SAMPLE_RECORDS, history_dir, fetched_at=BASE_TIME + 3600)
+        first = insights_history.history_version(history_dir)
+        insights_history.append_snapshots(SAMPLE_RECORDS, history_dir, fetched_at=BASE_TIME + 7200)
+        second = insights_history.history_version(history_dir)
+        insights_history.compact_history(history_dir, today="2024-01-02")
+        third = insights_history.history_version(history_dir)
+
+        assert len({first, second, third}) == 3, "❌ Phiên bản phải đổi sau mỗi lần ghi/gộp"
+        assert len(insights_history.load_snapshots(base_dir=history_dir)) == 4, "❌ Không được đọc file phiên bản"
@@ -0,0 +1,392 @@
+import pytest
+import threading
+import time
+from datetime import datetime
+from unittest.mock import patch
+
+import job_store
+
+# ==========================================
+# ====== JOB STORE TESTS ======
+# ==========================================
+
+HEADER = ["product", "keywords", "platform", "time_str", "token", "page_id", "mode", "date_str", "caption", "image_path"]
+NOW = datetime(2024, 1, 1, 9, 0)
+
+def make_row(platform="Facebook", time_str="09:00", mode="once", date_str="2024-01-01", caption="Caption"):
+    return ["Bình gốm", "gốm", platform, time_str, "token", "page", mode, date_str, caption, ""]
+
+def parsed(rows):
+    """Job hợp lệ tối thiểu như scheduler.parse_schedule_rows trả về"""
+    return [
+        {"row_num": idx + 2, "scheduled_time": datetime.strptime(f"{row[7]} {row[3]}", "%Y-%m-%d %H:%M")}
+        for idx, row in enumerate(rows[1:])
+    ]
+
+def sync(rows, store):
+    return job_store.sync_from_sheet(rows, parsed(rows), db_path=store)
+
+class TestJobStore:
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        return str(tmp_path / "jobs.db")
+
+    def test_due_jobs_range_query(self, store):
+        """Test chỉ lấy job đến hạn, theo thứ tự thời gian, lọc được theo nền tảng"""
+        job_store.add_job(make_row(time_str="08:00"), store)
+        job_store.add_job(make_row(platform="Instagram", time_str="07:00"), store)
+        job_store.add_job(make_row(time_str="15:00"), store)
+
+        due = job_store.get_due_jobs(NOW, store)
+
+        assert [job["scheduled_time"].hour for job in due] == [7, 8], "❌ Chỉ lấy job đến hạn, sớm nhất trước"
+        assert due[0]["platform"] == "instagram", "❌ Platform phải viết thường"
+        assert len(job_store.get_due_jobs(NOW, store, platform="facebook")) == 1, "❌ Lọc theo nền tảng không đúng"
+
+    def test_due_query_uses_index(self, store):
+        """Test truy vấn job đến hạn dùng index (status, fire_at), không quét bảng"""
+        conn = job_store.connect(store)
+        try:
+            plan = " ".join(str(tuple(row)) for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM jobs WHERE status = ? AND fire_at <= ? ORDER BY fire_at",
+                (job_store.STATUS_PENDING, NOW.timestamp())
+            ))
+        finally:
+            conn.close()
+
+        assert "idx_jobs_due" in plan, "❌ Phải dùng index idx_jobs_due"
+
+    def test_sync_inserts_and_dedupes_app_jobs(self, store):
+        """Test đồng bộ sheet thêm dòng mới, không nhân đôi job app.py vừa ghi"""
+        rows = [HEADER, make_row(caption="A"), make_row(caption="B")]
+        job_store.add_job(rows[1], store)
+
+        sync(rows, store)
+
+        due = job_store.get_due_jobs(NOW, store)
+        assert sorted(job["caption"] for job in due) == ["A", "B"], "❌ Mỗi dòng phải đúng 1 job"
+        assert sorted(job["row_num"] for job in due) == [2, 3], "❌ Phải lưu số dòng trên sheet"
+
+    def test_identical_rows_are_separate_jobs(self, store):
+        """Test 2 dòng giống hệt nhau là 2 job riêng"""
+        sync([HEADER, make_row(), make_row()], store)
+
+        assert len(job_store.get_due_jobs(NOW, store)) == 2, "❌ Dòng trùng nội dung vẫn là 2 job"
+
+    def test_sync_cancels_removed_rows(self, store):
+        """Test dòng bị xóa/sửa tay trên sheet thì job cũ bị hủy"""
+        sync([HEADER, make_row(caption="A"), make_row(caption="B")], store)
+        sync([HEADER, make_row(caption="B sửa")], store)
+
+        assert [job["caption"] for job in job_store.get_due_jobs(NOW, store)] == ["B sửa"], "❌ Job cũ phải bị hủy"
+        assert job_store.count_jobs(store)[job_store.STATUS_CANCELLED] == 2, "❌ Phải hủy 2 job"
+
+    def test_unwritten_delete_is_replayed(self, store):
+        """Test bài once đã đăng mà chưa xóa được dòng trên sheet thì lần đồng bộ sau xóa lại"""
+        rows = [HEADER, make_row(caption="A"), make_row(caption="B")]
+        sync(rows, store)
+        job_a = next(job for job in job_store.get_due_jobs(NOW, store) if job["caption"] == "A")
+        job_store.mark_published(job_a["job_id"], "post_1", db_path=store)
+
+        updates, deletes, job_ids = sync(rows, store)
+
+        assert (updates, deletes, job_ids) == ([], [2], [job_a["job_id"]]), "❌ Phải xóa lại dòng 2"
+        assert [job["caption"] for job in job_store.get_due_jobs(NOW, store)] == ["B"], "❌ Bài đã đăng không được đăng lại"
+
+        job_store.confirm_sheet_writes(job_ids, store)
+        assert sync([HEADER, make_row(caption="B")], store) == ([], [], []), "❌ Đã ghi xong thì không ghi lại"
+
+    def test_daily_publish_moves_fire_time(self, store):
+        """Test bài daily đã đăng chuyển sang ngày sau, dòng chưa đổi ngày trên sheet được ghi lại"""
+        rows = [HEADER, make_row(mode="daily")]
+        sync(rows, store)
+        job = job_store.get_due_jobs(NOW, store)[0]
+        job_store.mark_published(job["job_id"], "post_1", next_date_str="2024-01-02", db_path=store)
+
+        updates, deletes, _ = sync(rows, store)
+
+        assert updates == [(2, 8, "2024-01-02")], "❌ Phải ghi lại ngày mới lên dòng 2"
+        assert job_store.get_due_jobs(NOW, store) == [], "❌ Không còn đến hạn hôm nay"
+        upcoming = job_store.get_upcoming_jobs(db_path=store)
+        assert upcoming[0]["scheduled_time"] == datetime(2024, 1, 2, 9, 0), "❌ Lần đăng tiếp theo không đúng"
+
+        # Sheet đã có ngày mới: job giữ nguyên, không bị hủy
+        sync([HEADER, make_row(mode="daily", date_str="2024-01-02")], store)
+        assert job_store.count_jobs(store) == {job_store.STATUS_PENDING: 1}, "❌ Job daily không được bị hủy"
+
+    def test_stale_read_does_not_cancel_new_job(self, store):
+        """Test dữ liệu sheet đọc trước lúc app.py thêm bài không làm hủy bài mới"""
+        read_at = time.time()
+        job_store.add_job(make_row(caption="Mới"), store)
+
+        job_store.sync_from_sheet([HEADER], [], db_path=store, read_at=read_at - 1)
+
+        assert [job["caption"] for job in job_store.get_due_jobs(NOW, store)] == ["Mới"], "❌ Bài mới không được bị hủy"
+
+    def test_stale_read_after_write_is_not_reposted(self, store):
+        """Test đọc sheet cũ (trước khi worker khác xóa dòng) không tạo lại bài đã đăng"""
+        rows = [HEADER, make_row()]
+        sync(rows, store)
+        job = job_store.get_due_jobs(NOW, store)[0]
+        job_store.mark_published(job["job_id"], "post_1", db_path=store)
+        job_store.confirm_sheet_writes([job["job_id"]], store)
+
+        _, deletes, _ = sync(rows, store)
+
+        assert deletes == [2], "❌ Dòng cũ phải được xóa lại, không phải thêm job mới"
+        assert job_store.get_due_jobs(NOW, store) == [], "❌ Không được đăng lại"
+
+    def test_mark_failed_keeps_job_due(self, store):
+        """Test bài đăng lỗi vẫn đến hạn để thử lại"""
+        job_id = job_store.add_job(make_row(), store)
+
+        job_store.mark_failed(job_id, "HTTP 500", store)
+
+        due = job_store.get_due_jobs(NOW, store)
+        assert [job["job_id"] for job in due] == [job_id], "❌ Bài lỗi phải còn đến hạn"
+        assert due[0]["attempts"] == 1, "❌ Phải tăng số lần thử"
+
+    def test_retry_waits_until_retry_time(self, store):
+        """Test bài lỗi có hẹn thử lại chỉ đến hạn sau next_retry_at"""
+        job_id = job_store.add_job(make_row(), store)
+
+        job_store.mark_failed(job_id, "HTTP 500", store, retry_at=datetime(2024, 1, 1, 9, 5))
+
+        assert job_store.claim_due_jobs("w1", datetime(2024, 1, 1, 9, 1), db_path=store) == [], "❌ Chưa tới giờ thử lại"
+        due = job_store.claim_due_jobs("w1", datetime(2024, 1, 1, 9, 5), db_path=store)
+        assert [job["job_id"] for job in due] == [job_id], "❌ Tới giờ thử lại phải đến hạn"
+        assert due[0]["next_retry_at"] == datetime(2024, 1, 1, 9, 5), "❌ Phải trả về giờ thử lại"
+
+    def test_dead_letter_stops_retries(self, store):
+        """Test job dead-letter không còn đến hạn, dòng còn trên sheet không tạo job mới, xóa dòng thì hủy job"""
+        rows = [HEADER, make_row()]
+        sync(rows, store)
+        job_id = job_store.get_due_jobs(NOW, db_path=store)[0]["job_id"]
+
+        assert job_store.dead_letter(job_id, "HTTP 400", "permanent", store), "❌ Phải chuyển vào dead-letter"
+        sync(rows, store)
+
+        assert job_store.get_due_jobs(NOW, db_path=store) == [], "❌ Job dead không được đăng lại"
+        assert [d["job_id"] for d in job_store.get_dead_letters(db_path=store)] == [job_id], "❌ Phải có trong dead-letter"
+        sync([HEADER], store)
+        assert job_store.count_jobs(store) == {job_store.STATUS_CANCELLED: 1}, "❌ Xóa dòng thì hủy job dead"
+
+    def test_add_job_rejects_bad_time(self, store):
+        """Test thời gian sai định dạng không được thêm"""
+        assert job_store.add_job(make_row(time_str="25:70"), store) is None, "❌ Thời gian sai phải trả về None"
+
+class TestJobLeases:
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        return str(tmp_path / "jobs.db")
+
+    def test_workers_claim_disjoint_jobs(self, store):
+        """Test nhiều worker nhận job cùng lúc không bao giờ trùng nhau"""
+        for minute in range(40):
+            job_store.add_job(make_row(time_str=f"08:{minute:02d}"), store)
+        claimed = {}
+
+        def worker(worker_id):
+            claimed[worker_id] = []
+            while True:
+                jobs = job_store.claim_due_jobs(worker_id, NOW, limit=3, db_path=store)
+                if not jobs:
+                    return
+                claimed[worker_id].extend(job["job_id"] for job in jobs)
+
+        threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        all_ids = [job_id for ids in claimed.values() for job_id in ids]
+        assert len(all_ids) == 40, "❌ Phải nhận đủ 40 job"
+        assert len(set(all_ids)) == 40, "❌ Không được nhận trùng job"
+
+    def test_expired_lease_is_reclaimed(self, store):
+        """Test lease hết hạn (worker chết) thì worker khác nhận lại"""
+        job_store.add_job(make_row(), store)
+        assert len(job_store.claim_due_jobs("w1", NOW, lease_seconds=60, db_path=store)) == 1, "❌ w1 phải nhận được job"
+        assert job_store.claim_due_jobs("w2", NOW, db_path=store) == [], "❌ Job đang được giữ"
+
+        with patch("job_store.time.time", return_value=time.time() + 120):
+            released, in_doubt = job_store.reclaim_expired_leases(store)
+            jobs = job_store.claim_due_jobs("w2", NOW, db_path=store)
+
+        assert (released, in_doubt) == (1, []), "❌ Phải nhả lease hết hạn"
+        assert len(jobs) == 1, "❌ w2 phải nhận lại job"
+
+    def test_begin_publish_fences_lost_lease(self, store):
+        """Test worker mất lease không được bắt đầu đăng"""
+        job_id = job_store.add_job(make_row(), store)
+        job_store.claim_due_jobs("w1", NOW, lease_seconds=60, db_path=store)
+        with patch("job_store.time.time", return_value=time.time() + 120):
+            job_store.claim_due_jobs("w2", NOW, db_path=store)
+
+        with pytest.raises(job_store.LeaseLost):
+            job_store.begin_publish(job_id, "w1", store)
+
+    def test_begin_publish_renews_lease(self, store):
+        """Test bắt đầu đăng thì lease được gia hạn tính từ lúc đăng (thời gian chờ lượt không bị tính)"""
+        job_id = job_store.add_job(make_row(), store)
+        job_store.claim_due_jobs("w1", NOW, lease_seconds=60, db_path=store)
+        with patch("job_store.time.time", return_value=time.time() + 50):
+            job_store.begin_publish(job_id, "w1", store, lease_seconds=600)
+
+        with patch("job_store.time.time", return_value=time.time() + 120):
+            released, in_doubt = job_store.reclaim_expired_leases(store)
+
+        assert in_doubt == [], "❌ Bài vừa bắt đầu đăng không được coi là worker đã chết"
+
+    def test_claim_caps_jobs_per_page(self, store):
+        """Test mỗi lần nhận chỉ lấy tối đa max_per_page job của cùng một page, phần còn lại để lần sau"""
+        for minute in range(4):
+            job_store.add_job(make_row(time_str=f"08:0{minute}"), store)
+        other_page = make_row(time_str="08:05")
+        other_page[5] = "page_2"
+        job_store.add_job(other_page, store)
+
+        first = job_store.claim_due_jobs("w1", NOW, db_path=store, max_per_page=2)
+        second = job_store.claim_due_jobs("w2", NOW, db_path=store, max_per_page=2)
+
+        assert [(job["page_id"], job["scheduled_time"].minute) for job in first] == \
+            [("page", 0), ("page", 1), ("page_2", 5)], "❌ Mỗi page tối đa 2 job, theo thứ tự giờ đăng"
+        assert [job["scheduled_time"].minute for job in second] == [2, 3], "❌ Phần còn lại để lần nhận sau"
+
+    def test_claim_per_page_scan_is_bounded(self, store):
+        """Test giới hạn theo page chỉ xét limit * JOB_CLAIM_SCAN_FACTOR job sớm nhất, không quét cả tồn đọng"""
+        for minute in range(6):
+            job_store.add_job(make_row(time_str=f"08:0{minute}"), store)
+        other_page = make_row(time_str="08:09")
+        other_page[5] = "page_2"
+        job_store.add_job(other_page, store)
+
+        with patch("job_store.JOB_CLAIM_SCAN_FACTOR", 2):
+            first = job_store.claim_due_jobs("w1", NOW, limit=2, db_path=store, max_per_page=1)
+
+        assert [(job["page_id"], job["scheduled_time"].minute) for job in first] == [("page", 0)], \
+            "❌ Chỉ xét 4 job sớm nhất, job của page khác để lần nhận sau"
+
+    def test_crash_while_publishing_is_not_republished(self, store):
+        """Test worker chết khi đang đăng: job chuyển in_doubt, không ai nhận lại"""
+        job_id = job_store.add_job(make_row(), store)
+        job_store.claim_due_jobs("w1", NOW, lease_seconds=60, db_path=store)
+        job_store.begin_publish(job_id, "w1", store, lease_seconds=60)
+
+        with patch("job_store.time.time", return_value=time.time() + 120):
+            released, in_doubt = job_store.reclaim_expired_leases(store)
+            jobs = job_store.claim_due_jobs("w2", NOW, db_path=store)
+
+        assert [job["job_id"] for job in in_doubt] == [job_id], "❌ Job phải chuyển in_doubt"
+        assert jobs == [], "❌ Không được nhận lại job đang đăng dở"
+
+    def test_named_lock(self, store):
+        """Test khóa theo tên: một chủ tại một thời điểm, hết hạn thì người khác lấy được"""
+        assert job_store.acquire_lock("sheet", "w1", 60, store), "❌ w1 phải lấy được khóa"
+        assert not job_store.acquire_lock("sheet", "w2", 60, store), "❌ w2 không được lấy khóa đang giữ"
+        with patch("job_store.time.time", return_value=time.time() + 120):
+            assert job_store.acquire_lock("sheet", "w2", 60, store), "❌ Khóa hết hạn phải lấy được"
+        job_store.release_lock("sheet", "w2", store)
+        assert job_store.acquire_lock("sheet", "w1", 60, store), "❌ Khóa đã nhả phải lấy được"
+
+class TestPublishJournal:
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        return str(tmp_path / "jobs.db")
+
+    def start_publish(self, store, mode="once", worker_id="w1"):
+        rows = [HEADER, make_row(mode=mode)]
+        sync(rows, store)
+        job = job_store.claim_due_jobs(worker_id, NOW, db_path=store)[0]
+        return rows, job, job_store.begin_publish(job["job_id"], worker_id, store)
+
+    def test_crash_after_publish_is_recovered(self, store):
+        """Test worker chết sau khi đăng: khởi động lại ghi nhận bài, không đăng lại, ghi sheet ở lần đồng bộ sau"""
+        rows, job, entry_id = self.start_publish(store)
+        job_store.journal_result(entry_id, {"success": True, "post_id": "post_1"}, store)
+
+        recovered, in_doubt = job_store.replay_journal("w1", store)
+
+        assert [j["job_id"] for j in recovered] == [job["job_id"]], "❌ Phải hoàn tất bài đã đăng"
+        assert in_doubt == [], "❌ Không được coi là in_doubt"
+        assert job_store.count_jobs(store) == {job_store.STATUS_DONE: 1}, "❌ Bài phải chuyển done"
+        _, deletes, job_ids = sync(rows, store)
+        assert deletes == [2], "❌ Phải xóa dòng ở lần đồng bộ sau"
+
+        job_store.confirm_sheet_writes(job_ids, store)
+        assert job_store.replay_journal("w1", store) == ([], []), "❌ Journal đã xong không được xử lý lại"
+
+    def test_daily_recovery_is_idempotent(self, store):
+        """Test khôi phục bài daily chỉ cộng 1 ngày dù worker cũ ghi nhận lại cùng post_id"""
+        _, job, entry_id = self.start_publish(store, mode="daily")
+        job_store.journal_result(entry_id, {"success": True, "post_id": "post_1"}, store)
+
+        job_store.replay_journal("w1", store)
+        job_store.mark_published(job["job_id"], "post_1", next_date_str="2024-01-02", db_path=store)
+
+        upcoming = job_store.get_upcoming_jobs(db_path=store)
+        assert upcoming[0]["scheduled_time"] == datetime(2024, 1, 2, 9, 0), "❌ Chỉ được cộng 1 ngày"
+
+    def test_crash_during_publish_is_in_doubt(self, store):
+        """Test worker chết giữa lúc gọi API (chỉ có intent): chuyển in_doubt, không đăng lại"""
+        _, job, _ = self.start_publish(store)
+
+        recovered, in_doubt = job_store.replay_journal("w1", store)
+
+        assert recovered == [], "❌ Không có bài nào đã đăng"
+        assert [j["job_id"] for j in in_doubt] == [job["job_id"]], "❌ Phải chuyển in_doubt"
+        assert job_store.claim_due_jobs("w2", NOW, db_path=store) == [], "❌ Không được nhận lại để đăng"
+
+    def test_live_worker_is_not_touched(self, store):
+        """Test worker khác đang đăng (lease còn hạn) thì không khôi phục"""
+        _, job, entry_id = self.start_publish(store, worker_id="w1")
+        job_store.journal_result(entry_id, {"success": True, "post_id": "post_1"}, store)
+
+        assert job_store.replay_journal("w2", store) == ([], []), "❌ Không được động vào job của worker đang chạy"
+        assert job_store.count_jobs(store) == {job_store.STATUS_PUBLISHING: 1}, "❌ Job vẫn đang đăng"
+
+class TestInstagramContainers:
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        return str(tmp_path / "jobs.db")
+
+    def test_jobs_to_stage_window(self, store):
+        """Test chỉ lấy bài Instagram sắp đến giờ và chưa có container"""
+        job_store.add_job(make_row(platform="Instagram", time_str="09:05"), store)
+        job_store.add_job(make_row(platform="Instagram", time_str="12:00"), store)
+        job_store.add_job(make_row(time_str="09:05"), store)
+
+        jobs = job_store.get_jobs_to_stage(datetime(2024, 1, 1, 9, 10), now=NOW, db_path=store)
+        assert [job["time_str"] for job in jobs] == ["09:05"], "❌ Chỉ lấy bài Instagram trong khoảng"
+
+        job_store.save_container(jobs[0]["job_id"], jobs[0]["scheduled_time"].timestamp(), "c1", "FINISHED", store)
+        assert job_store.get_jobs_to_stage(datetime(2024, 1, 1, 9, 10), now=NOW, db_path=store) == [], \
+            "❌ Bài đã có container không được tạo lại"
+
+    def test_expired_container_is_not_used(self, store):
+        """Test container quá hạn hoặc lỗi không được dùng để publish"""
+        job_store.save_container("j1", 1.0, "c1", "FINISHED", store)
+        job_store.save_container("j2", 1.0, "c2", "ERROR", store)
+        assert job_store.get_container("j1", 1.0, store)["creation_id"] == "c1", "❌ Phải lấy được container"
+        assert job_store.get_container("j2", 1.0, store) is None, "❌ Container lỗi không được dùng"
+
+        with patch("job_store.time.time", return_value=time.time() + job_store.CONTAINER_MAX_AGE_SECONDS + 1):
+            assert job_store.get_container("j1", 1.0, store) is None, "❌ Container hết hạn không được dùng"
+
+    def test_prune_containers_of_finished_jobs(self, store):
+        """Test container của bài đã đăng/bị hủy bị dọn, bài còn chờ giữ nguyên"""
+        rows = [HEADER, make_row(platform="Instagram", caption="A"), make_row(platform="Instagram", caption="B")]
+        sync(rows, store)
+        jobs = job_store.get_due_jobs(NOW, db_path=store)
+        for job in jobs:
+            job_store.save_container(job["job_id"], job["scheduled_time"].timestamp(), job["caption"], "FINISHED", store)
+        job_store.mark_published(jobs[0]["job_id"], "post_1", db_path=store)
+
+        assert job_store.prune_containers(store) == 1, "❌ Phải dọn container của bài đã đăng"
+        assert job_store.get_container(jobs[1]["job_id"], jobs[1]["scheduled_time"].timestamp(), store), \
+            "❌ Container của bài còn chờ phải giữ nguyên"
@@ -0,0 +1,53 @@
+import json
+from datetime import datetime
+
+import event_log
+import log_query
+
+# ==========================================
+# ====== LOG QUERY TESTS ======
+# ==========================================
+
+def write_log_file(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for timestamp, platform, status in records:
+            f.write(json.dumps(dict(event_log.build_record(status, platform=platform), timestamp=timestamp)) + "\n")
+
+class TestLogQuery:
+
+    def test_parse_time(self):
+        """Test đọc mốc thời gian: today/yesterday, ngày, ngày giờ; --until hết ngày"""
+        now = datetime(2024, 1, 10, 15, 0)
+        assert log_query.parse_time("yesterday", now=now) == datetime(2024, 1, 9), "❌ Sai yesterday"
+        assert log_query.parse_time("2024-01-05 08:30") == datetime(2024, 1, 5, 8, 30), "❌ Sai ngày giờ"
+        assert log_query.parse_time("2024-01-05", end_of_day=True).date() == datetime(2024, 1, 5).date(), \
+            "❌ --until phải là cuối ngày"
+
+    def test_failure_rate(self):
+        """Test tỷ lệ lỗi tính trên bài đã đăng (SUCCESS + ERROR + DEAD_LETTER)"""
+        assert log_query.failure_rate({"SUCCESS": 3, "ERROR": 1, "WARNING": 5}) == 0.25, "❌ Sai tỷ lệ lỗi"
+        assert log_query.failure_rate({"WARNING": 1}) is None, "❌ Không có bài đăng thì không có tỷ lệ"
+
+    def test_cli_filters_and_reports(self, tmp_path, capsys):
+        """Test lọc theo platform và khoảng thời gian, in số đếm và tỷ lệ lỗi"""
+        path = str(tmp_path / "log.txt")
+        write_log_file(path, [
+            ("2024-01-01T09:00:00.000", "instagram", "SUCCESS"),
+            ("2024-01-02T09:00:00.000", "instagram", "ERROR"),
+            ("2024-01-02T10:00:00.000", "instagram", "SUCCESS"),
+            ("2024-01-02T11:00:00.000", "facebook", "ERROR"),
+        ])
+
+        code = log_query.main(["--log", path, "--platform", "instagram", "--since", "2024-01-02",
+                               "--until", "2024-01-02", "--list", "1"])
+
+        output = capsys.readouterr().out
+        assert code == 0, "❌ Phải chạy thành công"
+        assert "📊 Tổng: 2 bản ghi" in output, "❌ Sai tổng số bản ghi"
+        assert "instagram: 2 bản ghi | ERROR 1 | SUCCESS 1 | tỷ lệ lỗi 50.0%" in output, "❌ Sai thống kê"
+        assert "facebook" not in output.split("📝")[0], "❌ Không được tính platform khác"
+        assert "2024-01-02T10:00:00.000" in output.split("📝")[1], "❌ Phải in bản ghi mới nhất"
+
+    def test_cli_rejects_bad_time(self, tmp_path, capsys):
+        """Test mốc thời gian sai định dạng"""
+        assert log_query.main(["--log", str(tmp_path / "log.txt"), "--since", "hôm qua"]) == 2, "❌ Phải báo lỗi"
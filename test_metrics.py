@@ -0,0 +1,75 @@
+import pytest
+import urllib.error
+import urllib.request
+
+import metrics
+
+# ==========================================
+# ====== METRICS TESTS ======
+# ==========================================
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    """Mỗi test bắt đầu với số liệu trống"""
+    metrics.reset()
+    yield
+    metrics.reset()
+
+class TestMetrics:
+
+    def test_counter_and_gauge(self):
+        """Test counter cộng dồn theo nhãn, gauge giữ giá trị mới nhất"""
+        metrics.inc("scheduler_publish_total", {"platform": "facebook", "result": "success"})
+        metrics.inc("scheduler_publish_total", {"result": "success", "platform": "facebook"})
+        metrics.set_gauge("scheduler_jobs", 5, {"status": "pending"})
+        metrics.set_gauge("scheduler_jobs", 3, {"status": "pending"})
+
+        text = metrics.render()
+        assert 'scheduler_publish_total{platform="facebook",result="success"} 2' in text, "❌ Counter phải cộng dồn"
+        assert 'scheduler_jobs{status="pending"} 3' in text, "❌ Gauge phải giữ giá trị mới nhất"
+        assert "# TYPE scheduler_publish_total counter" in text, "❌ Thiếu khai báo TYPE"
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test histogram: bucket tích lũy, +Inf bằng số lần đo, có _sum và _count"""
+        for value in (0.003, 0.2, 500):
+            metrics.observe("scheduler_publish_latency_seconds", value, {"platform": "instagram"})
+
+        text = metrics.render()
+        assert 'scheduler_publish_latency_seconds_bucket{platform="instagram",le="0.005"} 1' in text, "❌ Sai bucket nhỏ"
+        assert 'scheduler_publish_latency_seconds_bucket{platform="instagram",le="0.25"} 2' in text, "❌ Bucket phải tích lũy"
+        assert 'scheduler_publish_latency_seconds_bucket{platform="instagram",le="300.0"} 2' in text, "❌ Sai bucket lớn"
+        assert 'scheduler_publish_latency_seconds_bucket{platform="instagram",le="+Inf"} 3' in text, "❌ Sai +Inf"
+        assert 'scheduler_publish_latency_seconds_count{platform="instagram"} 3' in text, "❌ Sai _count"
+        assert 'scheduler_publish_latency_seconds_sum{platform="instagram"} 500.203' in text, "❌ Sai _sum"
+
+    def test_timer_observes_on_error(self):
+        """Test timer vẫn ghi thời gian khi đoạn code bị lỗi"""
+        with pytest.raises(ValueError):
+            with metrics.timer("scheduler_tick_seconds"):
+                raise ValueError("boom")
+
+        assert "scheduler_tick_seconds_count 1" in metrics.render(), "❌ Phải ghi lần đo khi có lỗi"
+
+    def test_label_values_are_escaped(self):
+        """Test giá trị nhãn có ký tự đặc biệt được escape"""
+        metrics.set_gauge("scheduler_jobs", 1, {"status": 'a"b\\c'})
+
+        assert 'scheduler_jobs{status="a\\"b\\\\c"} 1' in metrics.render(), "❌ Phải escape nhãn"
+
+    def test_http_endpoint(self):
+        """Test endpoint /metrics trả text Prometheus, đường dẫn khác trả 404"""
+        metrics.inc("scheduler_ticks_total", {"result": "ok"})
+        server = metrics.start_server(0)
+        try:
+            base_url = f"http://{metrics.METRICS_HOST}:{server.server_port}"
+            with urllib.request.urlopen(f"{base_url}/metrics", timeout=5) as resp:
+                body = resp.read().decode("utf-8")
+                content_type = resp.headers["Content-Type"]
+            with pytest.raises(urllib.error.HTTPError) as exc_info:
+                urllib.request.urlopen(f"{base_url}/other", timeout=5)
+        finally:
+            metrics.stop_server(server)
+
+        assert content_type.startswith("text/plain; version=0.0.4"), "❌ Sai Content-Type"
+        assert 'scheduler_ticks_total{result="ok"} 1' in body, "❌ Thiếu số liệu"
+        assert exc_info.value.code == 404, "❌ Đường dẫn khác phải trả 404"
@@ -0,0 +1,727 @@
+import asyncio
+import pytest
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch, MagicMock
+
+import google.auth.exceptions
+import scheduler
+from scheduler import (
+    parse_schedule_row, parse_schedule_rows, process_scheduled_posts,
+    build_schedule_heap, seconds_until_next_wake, get_schedule_signal
+)
+
+# ==========================================
+# ====== SCHEDULER TESTS ======
+# ==========================================
+
+HEADER = ["product", "keywords", "platform", "time_str", "token", "page_id", "mode", "date_str", "caption", "image_path"]
+NOW = datetime(2024, 1, 1, 9, 0)
+
+def make_row(platform="Facebook", time_str="09:00", mode="once", date_str="2024-01-01", caption="Caption", image=""):
+    return ["Bình gốm", "gốm", platform, time_str, "token", "page", mode, date_str, caption, image]
+
+@pytest.fixture(autouse=True)
+def fresh_sheet_handle(tmp_path):
+    """Mỗi test bắt đầu với kết nối Google Sheets mới và job store trống, không dùng credentials thật"""
+    scheduler.reset_sheet_handle()
+    with patch("scheduler.get_sheet_credentials", return_value=MagicMock(token="t", expiry=datetime(2100, 1, 1))), \
+            patch("scheduler.get_sheet_modified_time", return_value=None), \
+            patch("scheduler.JOB_STORE_FILE", str(tmp_path / "jobs.db")):
+        yield
+    scheduler.reset_sheet_handle()
+
+def mock_sheet(rows):
+    worksheet = MagicMock()
+    worksheet.get_all_values.return_value = rows
+    gc = MagicMock()
+    gc.open_by_key.return_value.worksheet.return_value = worksheet
+    return gc, worksheet
+
+class TestParseSchedule:
+
+    def test_parse_valid_row(self):
+        """Test chuẩn hóa dòng hợp lệ thành job"""
+        job = parse_schedule_row(make_row(platform=" Facebook ", mode="Daily "), 2)
+
+        assert job["platform"] == "facebook", "❌ Platform phải viết thường"
+        assert job["mode"] == "daily", "❌ Mode phải viết thường"
+        assert job["scheduled_time"] == NOW, "❌ Thời gian đăng không đúng"
+        assert job["row_num"] == 2, "❌ Số dòng không đúng"
+
+    @pytest.mark.parametrize("row", [
+        make_row()[:8],
+        make_row(caption=""),
+        make_row(time_str="25:70"),
+        make_row(mode="weekly"),
+        make_row(platform="tiktok"),
+    ])
+    def test_parse_invalid_rows(self, row):
+        """Test dòng không hợp lệ bị bỏ qua"""
+        assert parse_schedule_row(row, 2) is None, "❌ Dòng không hợp lệ phải trả về None"
+
+    def test_parse_schedule_rows_keeps_row_numbers(self):
+        """Test bỏ header và giữ đúng số dòng trên sheet"""
+        jobs = parse_schedule_rows([HEADER, make_row(mode="weekly"), make_row()])
+
+        assert [job["row_num"] for job in jobs] == [3], "❌ Số dòng không đúng"
+
+@patch("scheduler.write_log")
+class TestProcessScheduledPosts:
+
+    @patch("scheduler.post_content_to_facebook", return_value={"success": True, "post_id": "1"})
+    @patch("scheduler.get_gsheet_client")
+    def test_due_posts_and_next_runs(self, mock_client, mock_fb, mock_log):
+        """Test đăng bài đến hạn và trả về lịch chạy tiếp theo"""
+        gc, worksheet = mock_sheet([
+            HEADER,
+            make_row(mode="once"),
+            make_row(mode="daily"),
+            make_row(time_str="15:00"),
+        ])
+        mock_client.return_value = gc
+
+        next_runs = process_scheduled_posts(now=NOW)
+
+        assert mock_fb.call_count == 2, "❌ Chỉ đăng 2 bài đã đến giờ"
+        requests_body = gc.open_by_key.return_value.batch_update.call_args[0][0]["requests"]
+        assert gc.open_by_key.return_value.batch_update.call_count == 1, "❌ Chỉ được gọi 1 request ghi sheet"
+        assert requests_body[0]["updateCells"]["range"]["startRowIndex"] == 2, "❌ Phải cập nhật dòng 3"
+        assert requests_body[0]["updateCells"]["rows"][0]["values"][0]["userEnteredValue"]["stringValue"] == "2024-01-02", "❌ Ngày mới không đúng"
+        assert requests_body[1]["deleteDimension"]["range"]["startIndex"] == 1, "❌ Phải xóa dòng 2"
+        assert sorted(run_at for run_at, _ in next_runs) == [
+            datetime(2024, 1, 1, 15, 0), datetime(2024, 1, 2, 9, 0)
+        ], "❌ Lịch chạy tiếp theo không đúng"
+
+    @patch("scheduler.post_content_to_facebook", return_value={"error": "HTTP 500"})
+    @patch("scheduler.get_gsheet_client")
+    def test_failed_post_is_retried(self, mock_client, mock_fb, mock_log):
+        """Test bài đăng lỗi giữ nguyên trên sheet và được thử lại"""
+        gc, worksheet = mock_sheet([HEADER, make_row()])
+        mock_client.return_value = gc
+
+        next_runs = process_scheduled_posts(now=NOW)
+
+        gc.open_by_key.return_value.batch_update.assert_not_called()
+        assert NOW + timedelta(seconds=45) <= next_runs[0][0] <= NOW + timedelta(seconds=75), \
+            "❌ Bài lỗi phải được thử lại sau backoff"
+        assert mock_log.call_args[0][2] == "ERROR", "❌ Phải ghi log lỗi"
+
+    @patch("scheduler.get_gsheet_client", side_effect=Exception("Auth lỗi"))
+    def test_sheet_error_returns_none(self, mock_client, mock_log):
+        """Test không đọc được sheet trả về None"""
+        assert process_scheduled_posts(now=NOW) is None, "❌ Lỗi sheet phải trả về None"
+
+class TestScheduleHeap:
+
+    def test_heap_orders_by_due_time(self):
+        """Test heap luôn trả về bài đến hạn sớm nhất"""
+        heap = build_schedule_heap([
+            (NOW + timedelta(hours=2), "b"),
+            (NOW + timedelta(minutes=5), "a"),
+        ], now=NOW)
+
+        assert heap[0][2] == "a", "❌ Bài sớm nhất phải ở đầu heap"
+
+    def test_overdue_jobs_are_delayed(self):
+        """Test bài quá hạn được dời thay vì thử lại liên tục"""
+        heap = build_schedule_heap([(NOW - timedelta(hours=1), "late")], now=NOW)
+
+        assert heap[0][0] == NOW + timedelta(seconds=scheduler.OVERDUE_RETRY_DELAY), "❌ Bài quá hạn phải được dời"
+
+    def test_seconds_until_next_wake(self):
+        """Test ngủ tới bài tiếp theo nhưng vẫn kiểm tra tín hiệu định kỳ"""
+        heap = build_schedule_heap([(NOW + timedelta(seconds=2), "a")], now=NOW)
+
+        assert seconds_until_next_wake(heap, NOW, 300) == 2, "❌ Phải thức dậy đúng lúc đến hạn"
+        assert seconds_until_next_wake([], NOW, 300) == scheduler.SIGNAL_POLL_INTERVAL, "❌ Phải kiểm tra tín hiệu định kỳ"
+        assert seconds_until_next_wake([], NOW, -1) == 0, "❌ Không được ngủ số âm"
+
+    def test_get_schedule_signal(self, tmp_path):
+        """Test đọc thời điểm sửa file tín hiệu"""
+        signal_file = tmp_path / "schedule_changed.flag"
+        assert get_schedule_signal(str(signal_file)) is None, "❌ Chưa có file phải trả về None"
+        signal_file.write_text("")
+        assert get_schedule_signal(str(signal_file)) == signal_file.stat().st_mtime, "❌ Sai thời điểm sửa file"
+
+@patch("scheduler.write_log")
+class TestParallelDispatch:
+
+    def test_dispatch_respects_page_limit(self, mock_log):
+        """Test đăng song song nhưng không vượt giới hạn mỗi page"""
+        lock = threading.Lock()
+        active = {"now": 0, "max": 0}
+
+        def fake_post(page_id, token, message, image_url=None):
+            with lock:
+                active["now"] += 1
+                active["max"] = max(active["max"], active["now"])
+            time.sleep(0.05)
+            with lock:
+                active["now"] -= 1
+            return {"success": True, "post_id": message}
+
+        jobs = [parse_schedule_row(make_row(caption=f"Bài {i}"), i + 2) for i in range(6)]
+        with patch("scheduler.post_content_to_facebook", side_effect=fake_post):
+            start = time.perf_counter()
+            outcomes = scheduler.dispatch_due_posts(jobs)
+            elapsed = time.perf_counter() - start
+
+        assert [result["post_id"] for result, _ in outcomes] == [f"Bài {i}" for i in range(6)], "❌ Kết quả phải đúng thứ tự"
+        assert active["max"] == scheduler.PAGE_CONCURRENCY, "❌ Vượt giới hạn đồng thời của page"
+        assert elapsed < 6 * 0.05, "❌ Phải đăng song song"
+
+    def test_many_pages_in_flight(self, mock_log):
+        """Test nhiều page khác nhau được đăng cùng lúc (không bị giới hạn bởi số thread cũ)"""
+        lock = threading.Lock()
+        active = {"now": 0, "max": 0}
+
+        def fake_post(page_id, token, message, image_url=None):
+            with lock:
+                active["now"] += 1
+                active["max"] = max(active["max"], active["now"])
+            time.sleep(0.1)
+            with lock:
+                active["now"] -= 1
+            return {"success": True, "post_id": page_id}
+
+        jobs = [dict(parse_schedule_row(make_row(caption=f"Bài {i}"), i + 2), page_id=f"page_{i}") for i in range(40)]
+        with patch("scheduler.post_content_to_facebook", side_effect=fake_post):
+            outcomes = scheduler.dispatch_due_posts(jobs)
+
+        assert [result["post_id"] for result, _ in outcomes] == [f"page_{i}" for i in range(40)], "❌ Kết quả phải đúng thứ tự"
+        assert active["max"] == 40, "❌ 40 page khác nhau phải được đăng cùng lúc"
+
+    @patch("scheduler.post_content_to_facebook", return_value={"error": "HTTP 500"})
+    def test_async_publisher_keeps_result_contract(self, mock_fb, mock_log):
+        """Test bản async trả về đúng kết quả của hàm đăng đồng bộ"""
+        result = asyncio.run(scheduler.post_content_to_facebook_async("page", "token", "Caption"))
+
+        assert result == {"error": "HTTP 500"}, "❌ Kết quả phải giữ nguyên dạng success/error"
+        mock_fb.assert_called_once_with("page", "token", "Caption", image_url=None)
+
+    @patch("scheduler.post_content_to_instagram", side_effect=Exception("Lỗi mạng"))
+    @patch("scheduler.post_content_to_facebook", return_value={"success": True, "post_id": "1"})
+    @patch("scheduler.get_gsheet_client")
+    def test_error_isolated_per_row(self, mock_client, mock_fb, mock_ig, mock_log):
+        """Test lỗi của 1 bài không ảnh hưởng bài khác khi đăng song song"""
+        gc, worksheet = mock_sheet([HEADER, make_row(platform="Instagram", image="img"), make_row()])
+        mock_client.return_value = gc
+
+        next_runs = process_scheduled_posts(now=NOW)
+
+        requests_body = gc.open_by_key.return_value.batch_update.call_args[0][0]["requests"]
+        assert [r["deleteDimension"]["range"]["startIndex"] for r in requests_body] == [2], "❌ Chỉ xóa dòng 3"
+        assert next_runs == [], "❌ Bài lỗi khi đang đăng (in_doubt) không được tự thử lại"
+        statuses = [c[0][2] for c in mock_log.call_args_list]
+        assert sorted(statuses) == ["SUCCESS", "WARNING"], "❌ Phải ghi log cho cả 2 bài"
+
+@patch("scheduler.time.sleep")
+@patch("scheduler.write_log")
+class TestSheetBatchUpdate:
+
+    def test_build_sheet_requests_order(self, mock_log, mock_sleep):
+        """Test cập nhật trước, xóa sau và xóa từ cuối lên đầu"""
+        requests_body = scheduler.build_sheet_requests(7, [(4, 8, "2024-01-02")], [2, 5])
+
+        assert list(requests_body[0]) == ["updateCells"], "❌ Cập nhật phải đứng trước"
+        assert [r["deleteDimension"]["range"]["startIndex"] for r in requests_body[1:]] == [4, 1], "❌ Phải xóa từ cuối lên"
+        assert requests_body[1]["deleteDimension"]["range"]["sheetId"] == 7, "❌ Sai sheetId"
+
+    def test_retry_remaps_rows_by_content(self, mock_log, mock_sleep):
+        """Test ghi lỗi thì đọc lại sheet và đối chiếu theo nội dung trước khi thử lại"""
+        old_rows = [HEADER, make_row(caption="A"), make_row(caption="B", mode="daily"), make_row(caption="C")]
+        # Có người chèn thêm 1 dòng lên đầu trong lúc ghi lỗi
+        new_rows = [HEADER, make_row(caption="Mới"), make_row(caption="A"), make_row(caption="B", mode="daily"), make_row(caption="C")]
+        spreadsheet, worksheet = MagicMock(), MagicMock()
+        worksheet.id = 0
+        worksheet.get_all_values.return_value = new_rows
+        spreadsheet.batch_update.side_effect = [Exception("Quota"), None]
+
+        ok = scheduler.apply_sheet_changes(spreadsheet, worksheet, old_rows, [(3, 8, "2024-01-02")], [2, 4])
+
+        assert ok, "❌ Lần thử lại phải thành công"
+        retry_body = spreadsheet.batch_update.call_args[0][0]["requests"]
+        assert retry_body[0]["updateCells"]["range"]["startRowIndex"] == 3, "❌ Phải cập nhật dòng B mới (dòng 4)"
+        assert [r["deleteDimension"]["range"]["startIndex"] for r in retry_body[1:]] == [4, 2], "❌ Phải xóa A, C theo vị trí mới"
+
+    def test_retry_skips_already_applied(self, mock_log, mock_sleep):
+        """Test lần ghi lỗi nhưng thực ra đã áp dụng thì không ghi lại"""
+        old_rows = [HEADER, make_row(caption="A")]
+        spreadsheet, worksheet = MagicMock(), MagicMock()
+        worksheet.get_all_values.return_value = [HEADER]
+        spreadsheet.batch_update.side_effect = Exception("Timeout")
+
+        ok = scheduler.apply_sheet_changes(spreadsheet, worksheet, old_rows, [], [2])
+
+        assert ok, "❌ Thay đổi đã áp dụng phải coi như thành công"
+        assert spreadsheet.batch_update.call_count == 1, "❌ Không được xóa lại"
+
+    def test_gives_up_after_retries(self, mock_log, mock_sleep):
+        """Test lỗi liên tục thì dừng và ghi log"""
+        spreadsheet, worksheet = MagicMock(), MagicMock()
+        worksheet.get_all_values.return_value = [HEADER, make_row()]
+        spreadsheet.batch_update.side_effect = Exception("Quota")
+
+        ok = scheduler.apply_sheet_changes(spreadsheet, worksheet, [HEADER, make_row()], [], [2])
+
+        assert not ok, "❌ Phải báo thất bại"
+        assert spreadsheet.batch_update.call_count == scheduler.SHEET_WRITE_RETRIES, "❌ Sai số lần thử"
+        mock_log.assert_called_once()
+
+class TestSheetHandle:
+
+    @patch("scheduler.get_gsheet_client")
+    def test_handle_is_reused(self, mock_client):
+        """Test dùng lại client/worksheet giữa các tick, chỉ làm mới token khi sắp hết hạn"""
+        creds = MagicMock(token="t", expiry=datetime(2100, 1, 1))
+        reuses_before = scheduler._sheet_stats["reuses"]
+        with patch("scheduler.get_sheet_credentials", return_value=creds):
+            first = scheduler.get_sheet_handle()
+            second = scheduler.get_sheet_handle()
+
+        assert first == second, "❌ Phải dùng lại worksheet"
+        mock_client.assert_called_once()
+        creds.refresh.assert_not_called()
+        assert scheduler._sheet_stats["reuses"] == reuses_before + 1, "❌ Phải ghi nhận lần dùng lại"
+        assert "tiết kiệm" in scheduler.format_sheet_client_report(), "❌ Báo cáo phải có phần tiết kiệm"
+
+    @patch("scheduler.get_gsheet_client")
+    def test_token_refreshed_near_expiry(self, mock_client):
+        """Test token sắp hết hạn được làm mới, không tạo lại client"""
+        creds = MagicMock(token="t", expiry=datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=60))
+        with patch("scheduler.get_sheet_credentials", return_value=creds):
+            scheduler.get_sheet_handle()
+            scheduler.get_sheet_handle()
+
+        creds.refresh.assert_called_once()
+        mock_client.assert_called_once()
+
+    @patch("scheduler.get_gsheet_client")
+    def test_call_sheet_reconnects_on_error(self, mock_client):
+        """Test lỗi xác thực/HTTP thì kết nối lại và thử lại"""
+        calls = []
+
+        def action(sh, worksheet):
+            calls.append(worksheet)
+            if len(calls) == 1:
+                raise google.auth.exceptions.RefreshError("Token hết hạn")
+            return "ok"
+
+        assert scheduler.call_sheet(action) == "ok", "❌ Phải thử lại sau khi kết nối lại"
+        assert mock_client.call_count == 2, "❌ Phải tạo lại client"
+
+class TestDeltaSync:
+
+    @patch("scheduler.get_gsheet_client")
+    def test_unchanged_sheet_is_not_downloaded(self, mock_client):
+        """Test sheet không đổi (cùng modifiedTime) thì không tải lại"""
+        gc, worksheet = mock_sheet([HEADER, make_row()])
+        mock_client.return_value = gc
+
+        with patch("scheduler.get_sheet_modified_time", side_effect=["t1", "t1", "t2"]):
+            first = scheduler.read_schedule_sheet()[2]
+            second = scheduler.read_schedule_sheet()[2]
+            scheduler.read_schedule_sheet()
+
+        assert first == second, "❌ Phải dùng bản sao cục bộ"
+        assert worksheet.get_all_values.call_count == 2, "❌ Chỉ tải lại khi modifiedTime đổi"
+
+    @patch("scheduler.get_gsheet_client")
+    def test_modified_time_unavailable_falls_back(self, mock_client):
+        """Test không đọc được modifiedTime thì luôn tải toàn bộ"""
+        gc, worksheet = mock_sheet([HEADER, make_row()])
+        mock_client.return_value = gc
+
+        scheduler.read_schedule_sheet()
+        scheduler.read_schedule_sheet()
+
+        assert worksheet.get_all_values.call_count == 2, "❌ Phải tải toàn bộ khi không có modifiedTime"
+
+    def test_only_changed_rows_are_parsed(self):
+        """Test chỉ kiểm tra lại dòng mới/đã sửa"""
+        rows = [HEADER, make_row(caption="A"), make_row(caption="B")]
+        scheduler.parse_schedule_rows(rows)
+
+        with patch("scheduler.parse_schedule_row", wraps=scheduler.parse_schedule_row) as mock_parse:
+            jobs = scheduler.parse_schedule_rows([HEADER, make_row(caption="Mới"), make_row(caption="A"), make_row(caption="B")])
+
+        assert mock_parse.call_count == 1, "❌ Chỉ dòng mới được kiểm tra lại"
+        assert [(job["row_num"], job["caption"]) for job in jobs] == [(2, "Mới"), (3, "A"), (4, "B")], "❌ Số dòng phải theo vị trí mới"
+
+@patch("scheduler.time.sleep")
+@patch("scheduler.write_log")
+class TestJobStoreSync:
+
+    @patch("scheduler.post_content_to_facebook", return_value={"success": True, "post_id": "1"})
+    @patch("scheduler.get_gsheet_client")
+    def test_failed_sheet_write_is_replayed_without_reposting(self, mock_client, mock_fb, mock_log, mock_sleep):
+        """Test ghi sheet lỗi thì lần sau ghi lại thay đổi, không đăng lại bài"""
+        gc, worksheet = mock_sheet([HEADER, make_row(caption="A"), make_row(caption="B", time_str="15:00")])
+        mock_client.return_value = gc
+        spreadsheet = gc.open_by_key.return_value
+        spreadsheet.batch_update.side_effect = Exception("Timeout")
+
+        process_scheduled_posts(now=NOW)
+        spreadsheet.batch_update.side_effect = None
+        spreadsheet.batch_update.reset_mock()
+        next_runs = process_scheduled_posts(now=NOW)
+
+        assert mock_fb.call_count == 1, "❌ Bài đã đăng không được đăng lại"
+        requests_body = spreadsheet.batch_update.call_args[0][0]["requests"]
+        assert [r["deleteDimension"]["range"]["startIndex"] for r in requests_body] == [1], "❌ Phải xóa lại dòng 2"
+        assert [run_at for run_at, _ in next_runs] == [datetime(2024, 1, 1, 15, 0)], "❌ Chỉ còn bài 15:00"
+
+    @patch("scheduler.post_content_to_facebook", return_value={"success": True, "post_id": "1"})
+    @patch("scheduler.get_gsheet_client")
+    def test_failed_sheet_write_is_replayed_when_sheet_unchanged(self, mock_client, mock_fb, mock_log, mock_sleep):
+        """Test ghi sheet lỗi mà sheet không đổi (cùng modifiedTime) thì lượt sau vẫn ghi lại"""
+        gc, worksheet = mock_sheet([HEADER, make_row(caption="A"), make_row(caption="B", time_str="15:00")])
+        mock_client.return_value = gc
+        spreadsheet = gc.open_by_key.return_value
+        spreadsheet.batch_update.side_effect = Exception("Timeout")
+
+        with patch("scheduler.get_sheet_modified_time", return_value="t1"):
+            process_scheduled_posts(now=NOW)
+            # Ghi thành công thì dòng 2 biến mất khỏi sheet
+            spreadsheet.batch_update.side_effect = lambda body: setattr(
+                worksheet.get_all_values, "return_value", [HEADER, make_row(caption="B", time_str="15:00")])
+            spreadsheet.batch_update.reset_mock()
+            process_scheduled_posts(now=NOW)
+            process_scheduled_posts(now=NOW)
+
+        assert mock_fb.call_count == 1, "❌ Bài đã đăng không được đăng lại"
+        assert spreadsheet.batch_update.call_count == 1, "❌ Phải ghi lại thay đổi đúng 1 lần"
+        requests_body = spreadsheet.batch_update.call_args[0][0]["requests"]
+        assert [r["deleteDimension"]["range"]["startIndex"] for r in requests_body] == [1], "❌ Phải xóa lại dòng 2"
+
+    @patch("scheduler.post_content_to_facebook", return_value={"success": True, "post_id": "1"})
+    @patch("scheduler.get_gsheet_client")
+    def test_unchanged_sheet_uses_store(self, mock_client, mock_fb, mock_log, mock_sleep):
+        """Test sheet không đổi thì không đồng bộ lại, bài đến hạn lấy từ job store"""
+        gc, worksheet = mock_sheet([HEADER, make_row(time_str="10:00")])
+        mock_client.return_value = gc
+
+        with patch("scheduler.get_sheet_modified_time", return_value="t1"), \
+                patch("scheduler.job_store.sync_from_sheet", wraps=scheduler.job_store.sync_from_sheet) as mock_sync:
+            process_scheduled_posts(now=NOW)
+            process_scheduled_posts(now=datetime(2024, 1, 1, 10, 0))
+
+        assert mock_sync.call_count == 1, "❌ Sheet không đổi thì không đồng bộ lại"
+        assert mock_fb.call_count == 1, "❌ Phải đăng bài khi đến giờ"
+        assert gc.open_by_key.return_value.batch_update.call_count == 1, "❌ Phải xóa dòng đã đăng"
+
+    @patch("scheduler.post_content_to_facebook", return_value={"success": True, "post_id": "1"})
+    @patch("scheduler.get_gsheet_client")
+    def test_second_worker_does_not_repost(self, mock_client, mock_fb, mock_log, mock_sleep):
+        """Test 2 worker cùng đọc một sheet: mỗi bài chỉ được đăng 1 lần"""
+        rows = [HEADER, make_row(caption="A"), make_row(caption="B")]
+        gc, worksheet = mock_sheet(rows)
+        mock_client.return_value = gc
+
+        with patch("scheduler.WORKER_ID", "w1"):
+            process_scheduled_posts(now=NOW)
+        scheduler.reset_sheet_handle()
+        worksheet.get_all_values.return_value = rows  # worker 2 đọc sheet cũ trước khi w1 xóa dòng
+        with patch("scheduler.WORKER_ID", "w2"):
+            process_scheduled_posts(now=NOW)
+
+        assert mock_fb.call_count == 2, "❌ Mỗi bài chỉ được đăng 1 lần"
+
+    @patch("scheduler.post_content_to_facebook", return_value={"success": True, "post_id": "1"})
+    @patch("scheduler.get_gsheet_client")
+    def test_lost_lease_skips_publish(self, mock_client, mock_fb, mock_log, mock_sleep):
+        """Test bài bị worker khác nhận lại trước khi đăng thì bỏ qua"""
+        gc, worksheet = mock_sheet([HEADER, make_row()])
+        mock_client.return_value = gc
+
+        with patch("scheduler.job_store.begin_publish", side_effect=scheduler.job_store.LeaseLost("mất lease")):
+            process_scheduled_posts(now=NOW)
+
+        mock_fb.assert_not_called()
+        gc.open_by_key.return_value.batch_update.assert_not_called()
+
+    @patch("scheduler.post_content_to_facebook", return_value={"success": True, "post_id": "1"})
+    @patch("scheduler.get_gsheet_client")
+    def test_restart_after_crash_does_not_repost(self, mock_client, mock_fb, mock_log, mock_sleep):
+        """Test scheduler chết sau khi đăng, trước khi ghi sheet: khởi động lại không đăng lại và xóa dòng"""
+        gc, worksheet = mock_sheet([HEADER, make_row()])
+        mock_client.return_value = gc
+
+        with patch("scheduler.handle_publish_result", side_effect=KeyboardInterrupt):
+            with pytest.raises(KeyboardInterrupt):
+                process_scheduled_posts(now=NOW)
+        scheduler.reset_sheet_handle()
+        recovered, in_doubt = scheduler.recover_from_journal()
+        process_scheduled_posts(now=NOW)
+
+        assert len(recovered) == 1 and not in_doubt, "❌ Phải khôi phục bài đã đăng"
+        assert mock_fb.call_count == 1, "❌ Không được đăng lại"
+        requests_body = gc.open_by_key.return_value.batch_update.call_args[0][0]["requests"]
+        assert [r["deleteDimension"]["range"]["startIndex"] for r in requests_body] == [1], "❌ Phải xóa dòng đã đăng"
+
+    @patch("scheduler.post_content_to_facebook", return_value={"success": True, "post_id": "1"})
+    @patch("scheduler.get_gsheet_client")
+    def test_store_error_after_publish_does_not_repost(self, mock_client, mock_fb, mock_log, mock_sleep):
+        """Test đăng xong nhưng ghi job store lỗi (database is locked): không thử lại, lượt sau hoàn tất từ journal"""
+        import sqlite3
+        gc, worksheet = mock_sheet([HEADER, make_row()])
+        mock_client.return_value = gc
+
+        with patch("scheduler.job_store.mark_published", side_effect=sqlite3.OperationalError("database is locked")):
+            process_scheduled_posts(now=NOW)
+        assert scheduler.job_store.count_jobs(db_path=scheduler.JOB_STORE_FILE) == \
+            {scheduler.job_store.STATUS_PUBLISHING: 1}, "❌ Bài đã lên không được trả về pending"
+        
+        for hours in (1, 2):  # lượt sau hoàn tất từ journal, lượt tiếp theo ghi thay đổi lên sheet
+            scheduler.reset_sheet_handle()
+            process_scheduled_posts(now=NOW + timedelta(hours=hours))
+
+        assert mock_fb.call_count == 1, "❌ Không được đăng lại"
+        assert scheduler.job_store.count_jobs(db_path=scheduler.JOB_STORE_FILE) == \
+            {scheduler.job_store.STATUS_DONE: 1}, "❌ Phải hoàn tất job từ journal"
+        requests_body = gc.open_by_key.return_value.batch_update.call_args[0][0]["requests"]
+        assert [r["deleteDimension"]["range"]["startIndex"] for r in requests_body] == [1], "❌ Phải xóa dòng đã đăng"
+
+    @patch("scheduler.post_content_to_facebook", side_effect=RuntimeError("Lỗi đọc response"))
+    @patch("scheduler.get_gsheet_client")
+    def test_dispatch_exception_is_in_doubt(self, mock_client, mock_fb, mock_log, mock_sleep):
+        """Test lệnh đăng raise exception: job chuyển in_doubt, journal không còn intent, không đăng lại"""
+        gc, worksheet = mock_sheet([HEADER, make_row()])
+        mock_client.return_value = gc
+
+        process_scheduled_posts(now=NOW)
+        process_scheduled_posts(now=NOW + timedelta(hours=1))
+
+        assert mock_fb.call_count == 1, "❌ Không được đăng lại khi không biết bài đã lên chưa"
+        assert scheduler.job_store.count_jobs(db_path=scheduler.JOB_STORE_FILE) == \
+            {scheduler.job_store.STATUS_IN_DOUBT: 1}, "❌ Job phải chuyển in_doubt"
+        conn = scheduler.job_store.connect(scheduler.JOB_STORE_FILE)
+        try:
+            states = [row[0] for row in conn.execute("SELECT state FROM publish_journal")]
+        finally:
+            conn.close()
+        assert states == [scheduler.job_store.JOURNAL_FAILED], "❌ Journal không được còn intent"
+        gc.open_by_key.return_value.batch_update.assert_not_called()
+
+@patch("scheduler.time.sleep")
+@patch("scheduler.write_log")
+class TestInstagramPrestage:
+
+    @patch("scheduler.publish_instagram_container", return_value={"success": True, "post_id": "ig_1"})
+    @patch("scheduler.get_container_status", return_value="FINISHED")
+    @patch("scheduler.create_instagram_container", return_value={"success": True, "creation_id": "c1"})
+    @patch("scheduler.get_gsheet_client")
+    def test_staged_container_publishes_on_time(self, mock_client, mock_create, mock_status, mock_publish,
+                                                mock_log, mock_sleep):
+        """Test tạo container trước giờ đăng, đến giờ chỉ gọi media_publish"""
+        gc, worksheet = mock_sheet([HEADER, make_row(platform="Instagram", time_str="09:30", image="img")])
+        mock_client.return_value = gc
+
+        next_runs = process_scheduled_posts(now=NOW)
+        mock_create.assert_not_called()
+        assert [run_at for run_at, _ in next_runs] == [datetime(2024, 1, 1, 9, 20), datetime(2024, 1, 1, 9, 30)], \
+            "❌ Phải thức dậy trước giờ đăng để tạo container"
+
+        process_scheduled_posts(now=datetime(2024, 1, 1, 9, 20))
+        assert mock_create.call_count == 1, "❌ Phải tạo container trước giờ đăng"
+        mock_publish.assert_not_called()
+
+        mock_status.reset_mock()
+        process_scheduled_posts(now=datetime(2024, 1, 1, 9, 30))
+
+        assert mock_create.call_count == 1, "❌ Đến giờ không được tạo lại container"
+        mock_status.assert_not_called()
+        mock_publish.assert_called_once_with("page", "token", "c1")
+        requests_body = gc.open_by_key.return_value.batch_update.call_args[0][0]["requests"]
+        assert [r["deleteDimension"]["range"]["startIndex"] for r in requests_body] == [1], "❌ Phải xóa dòng đã đăng"
+
+    @patch("scheduler.publish_instagram_container", return_value={"success": True, "post_id": "ig_1"})
+    @patch("scheduler.get_container_status")
+    @patch("scheduler.create_instagram_container", side_effect=[{"success": True, "creation_id": "c1"},
+                                                                {"success": True, "creation_id": "c2"}])
+    @patch("scheduler.get_gsheet_client")
+    def test_failed_container_is_recreated(self, mock_client, mock_create, mock_status, mock_publish,
+                                           mock_log, mock_sleep):
+        """Test container hết hạn/lỗi lúc đến giờ thì tạo lại rồi mới publish"""
+        gc, worksheet = mock_sheet([HEADER, make_row(platform="Instagram", time_str="09:05", image="img")])
+        mock_client.return_value = gc
+        mock_status.return_value = "IN_PROGRESS"
+
+        with patch("scheduler.IG_STAGE_POLL_TIMEOUT", 0):
+            process_scheduled_posts(now=NOW)
+        mock_status.side_effect = ["EXPIRED", "FINISHED"]
+        with patch("scheduler.asyncio.sleep"):
+            process_scheduled_posts(now=datetime(2024, 1, 1, 9, 5))
+
+        mock_publish.assert_called_once_with("page", "token", "c2")
+
+    @patch("scheduler.create_instagram_container", side_effect=AssertionError("Không được tạo container"))
+    @patch("scheduler.post_content_to_facebook", return_value={"success": True, "post_id": "1"})
+    @patch("scheduler.get_gsheet_client")
+    def test_staging_lock_held_by_other_worker(self, mock_client, mock_fb, mock_create, mock_log, mock_sleep):
+        """Test worker khác đang tạo container thì bỏ qua, không tạo trùng"""
+        gc, worksheet = mock_sheet([HEADER, make_row(platform="Instagram", time_str="09:05", image="img")])
+        mock_client.return_value = gc
+        scheduler.job_store.acquire_lock(scheduler.IG_STAGE_LOCK, "w_other", 60, db_path=scheduler.JOB_STORE_FILE)
+
+        assert process_scheduled_posts(now=NOW) is not None, "❌ Không được lỗi khi không lấy được khóa"
+        mock_create.assert_not_called()
+
+@patch("scheduler.write_log")
+class TestRetryBackoff:
+
+    @pytest.mark.parametrize("error_msg, expected", [
+        ("HTTP 500: Internal Server Error", scheduler.ERROR_TRANSIENT),
+        ("HTTP 429: Too Many Requests", scheduler.ERROR_TRANSIENT),
+        ('HTTP 400: {"error": {"message": "Invalid OAuth access token", "code": 190}}', scheduler.ERROR_PERMANENT),
+        ('HTTP 400: {"error": {"message": "Application request limit reached", "code": 4}}', scheduler.ERROR_TRANSIENT),
+        ("Không tạo được media: {'error': {'message': 'Media download has failed', 'code': 9004}}", scheduler.ERROR_PERMANENT),
+        ('HTTP 400: {"error": {"message": "There have been too many calls from this ad-account", "code": 80000}}',
+         scheduler.ERROR_TRANSIENT),
+        ('HTTP 400: {"error": {"message": "Rate limit", "code": 80099}}', scheduler.ERROR_TRANSIENT),
+        ('HTTP 400: {"error": {"message": "Unknown", "code": 80100}}', scheduler.ERROR_PERMANENT),
+        ("Timeout khi kết nối Facebook API", scheduler.ERROR_TRANSIENT),
+        ("Instagram yêu cầu phải có ảnh", scheduler.ERROR_PERMANENT),
+        ("Lỗi không xác định: boom", scheduler.ERROR_TRANSIENT),
+    ])
+    def test_classify_publish_error(self, mock_log, error_msg, expected):
+        """Test phân loại lỗi tạm thời / vĩnh viễn"""
+        assert scheduler.classify_publish_error(error_msg) == expected, f"❌ Phân loại sai: {error_msg}"
+
+    @patch("scheduler.random.uniform", return_value=1.0)
+    def test_retry_delay_grows_and_is_capped(self, mock_uniform, mock_log):
+        """Test thời gian chờ nhân đôi sau mỗi lần lỗi và không vượt quá mức tối đa"""
+        delays = [scheduler.retry_delay(attempts) for attempts in range(1, 9)]
+
+        assert delays[:4] == [60, 120, 240, 480], "❌ Thời gian chờ phải nhân đôi"
+        assert max(delays) == scheduler.RETRY_MAX_DELAY, "❌ Không được vượt quá RETRY_MAX_DELAY"
+
+    @patch("scheduler.post_content_to_facebook", return_value={"error": "HTTP 503: Service Unavailable"})
+    @patch("scheduler.get_gsheet_client")
+    def test_transient_error_waits_for_backoff(self, mock_client, mock_fb, mock_log):
+        """Test lỗi tạm thời chỉ được thử lại sau thời gian backoff"""
+        gc, worksheet = mock_sheet([HEADER, make_row()])
+        mock_client.return_value = gc
+
+        process_scheduled_posts(now=NOW)
+        process_scheduled_posts(now=NOW + timedelta(seconds=30))
+        assert mock_fb.call_count == 1, "❌ Chưa hết backoff thì không được thử lại"
+
+        process_scheduled_posts(now=NOW + timedelta(minutes=2))
+        assert mock_fb.call_count == 2, "❌ Hết backoff phải thử lại"
+        assert scheduler.job_store.get_upcoming_jobs(db_path=scheduler.JOB_STORE_FILE)[0]["attempts"] == 2, \
+            "❌ Phải đếm số lần thử"
+
+    @patch("scheduler.post_content_to_facebook",
+           return_value={"error": 'HTTP 400: {"error": {"message": "Invalid OAuth access token", "code": 190}}'})
+    @patch("scheduler.get_gsheet_client")
+    def test_permanent_error_goes_to_dead_letter(self, mock_client, mock_fb, mock_log):
+        """Test lỗi vĩnh viễn chuyển vào dead-letter ngay, không thử lại"""
+        gc, worksheet = mock_sheet([HEADER, make_row()])
+        mock_client.return_value = gc
+
+        next_runs = process_scheduled_posts(now=NOW)
+        process_scheduled_posts(now=NOW + timedelta(days=1))
+
+        assert mock_fb.call_count == 1, "❌ Lỗi vĩnh viễn không được thử lại"
+        assert next_runs == [], "❌ Bài dead-letter không còn trong lịch"
+        dead = scheduler.job_store.get_dead_letters(db_path=scheduler.JOB_STORE_FILE)
+        assert [(d["error_class"], d["attempts"]) for d in dead] == [(scheduler.ERROR_PERMANENT, 1)], \
+            "❌ Phải ghi vào dead-letter"
+        assert mock_log.call_args[0][2] == "DEAD_LETTER", "❌ Phải ghi log dead-letter"
+        gc.open_by_key.return_value.batch_update.assert_not_called()
+
+    @patch("scheduler.RETRY_MAX_ATTEMPTS", 2)
+    @patch("scheduler.post_content_to_facebook", return_value={"error": "Timeout khi kết nối Facebook API"})
+    @patch("scheduler.get_gsheet_client")
+    def test_max_attempts_goes_to_dead_letter(self, mock_client, mock_fb, mock_log):
+        """Test lỗi tạm thời quá số lần thử thì chuyển vào dead-letter"""
+        gc, worksheet = mock_sheet([HEADER, make_row()])
+        mock_client.return_value = gc
+
+        for minutes in (0, 5, 60):
+            process_scheduled_posts(now=NOW + timedelta(minutes=minutes))
+
+        assert mock_fb.call_count == 2, "❌ Chỉ được thử RETRY_MAX_ATTEMPTS lần"
+        dead = scheduler.job_store.get_dead_letters(db_path=scheduler.JOB_STORE_FILE)
+        assert [(d["error_class"], d["attempts"]) for d in dead] == [(scheduler.ERROR_TRANSIENT, 2)], \
+            "❌ Phải ghi vào dead-letter sau lần thử cuối"
+
+class TestStructuredLog:
+
+    def test_write_log_record(self, tmp_path):
+        """Test write_log ghi 1 dòng JSON có đủ trường, tự phân loại lỗi"""
+        log_file = str(tmp_path / "log.jsonl")
+        with patch("scheduler.LOG_FILE", log_file):
+            scheduler.write_log("facebook", "once", "ERROR", "C" * 200, "", error_msg="HTTP 503", row=3, latency_ms=12.345)
+        scheduler.event_log.flush()
+
+        record = scheduler.event_log.read_records(log_file)[0]
+        assert (record["row"], record["platform"], record["status"]) == (3, "facebook", "ERROR"), "❌ Sai nội dung"
+        assert record["latency_ms"] == 12.3, "❌ latency_ms phải làm tròn"
+        assert record["error_class"] == scheduler.ERROR_TRANSIENT, "❌ Phải phân loại lỗi"
+        assert len(record["caption"]) == 80, "❌ Caption tối đa 80 ký tự"
+
+    @patch("scheduler.post_content_to_facebook", return_value={"success": True, "post_id": "post_1"})
+    @patch("scheduler.get_gsheet_client")
+    def test_publish_is_logged_with_latency(self, mock_client, mock_fb, tmp_path):
+        """Test bài đăng thành công được ghi log kèm số dòng, post_id và thời gian gọi API"""
+        gc, worksheet = mock_sheet([HEADER, make_row()])
+        mock_client.return_value = gc
+        log_file = str(tmp_path / "log.jsonl")
+
+        with patch("scheduler.LOG_FILE", log_file):
+            process_scheduled_posts(now=NOW)
+        scheduler.event_log.flush()
+
+        records = [r for r in scheduler.event_log.read_records(log_file) if r["status"] == "SUCCESS"]
+        assert [(r["row"], r["post_id"]) for r in records] == [(2, "post_1")], "❌ Phải ghi log bài đã đăng"
+        assert records[0]["latency_ms"] is not None, "❌ Phải có thời gian gọi API"
+
+@patch("scheduler.write_log")
+class TestSchedulerMetrics:
+
+    @patch("scheduler.post_content_to_instagram", return_value={"error": "HTTP 500"})
+    @patch("scheduler.post_content_to_facebook", return_value={"success": True, "post_id": "1"})
+    @patch("scheduler.get_gsheet_client")
+    def test_tick_metrics(self, mock_client, mock_fb, mock_ig, mock_log):
+        """Test một lượt kiểm tra ghi thời gian đọc sheet, parse, đăng bài và số job"""
+        scheduler.metrics.reset()
+        gc, worksheet = mock_sheet([HEADER, make_row(), make_row(platform="Instagram", image="img"),
+                                    make_row(time_str="15:00")])
+        mock_client.return_value = gc
+
+        process_scheduled_posts(now=NOW)
+
+        text = scheduler.metrics.render()
+        assert 'scheduler_publish_total{platform="facebook",result="success"} 1' in text, "❌ Phải đếm bài thành công"
+        assert 'scheduler_publish_total{platform="instagram",result="failure"} 1' in text, "❌ Phải đếm bài lỗi"
+        assert 'scheduler_publish_latency_seconds_count{platform="facebook"} 1' in text, "❌ Thiếu thời gian gọi API"
+        assert 'scheduler_publish_lateness_seconds_count{platform="facebook"} 1' in text, "❌ Thiếu độ trễ so với giờ hẹn"
+        assert 'scheduler_sheet_read_seconds_count{result="full"} 1' in text, "❌ Thiếu thời gian đọc sheet"
+        assert "scheduler_parse_seconds_count 1" in text, "❌ Thiếu thời gian parse"
+        assert "scheduler_tick_seconds_count 1" in text, "❌ Thiếu thời gian cả lượt"
+        assert "scheduler_due_jobs 2" in text, "❌ Sai số bài đến hạn"
+        assert 'scheduler_jobs{status="pending"} 2' in text, "❌ Sai số job đang chờ"
+
+    @patch("scheduler.post_content_to_facebook", return_value={"success": True, "post_id": "1"})
+    @patch("scheduler.get_gsheet_client")
+    def test_tick_trace(self, mock_client, mock_fb, mock_log):
+        """Test mỗi lượt kiểm tra là một trace, đọc sheet và đăng bài nằm trong trace đó"""
+        gc, worksheet = mock_sheet([HEADER, make_row()])
+        mock_client.return_value = gc
+
+        with patch.dict(scheduler.tracing._config, enabled=True, export_file=None):
+            scheduler.tracing.clear()
+            process_scheduled_posts(now=NOW)
+            traces = scheduler.tracing.get_traces()
+        scheduler.tracing.clear()
+
+        assert len(traces) == 1, "❌ Mỗi lượt kiểm tra là một trace"
+        spans = {record["name"]: record for record in traces[0]["spans"]}
+        assert spans["scheduler.tick"]["parent_id"] is None, "❌ Lượt kiểm tra là span gốc"
+        assert spans["read_schedule_sheet"]["parent_id"] == spans["scheduler.tick"]["span_id"], "❌ Sai span cha"
+        assert spans["dispatch_post"]["parent_id"] == spans["dispatch_due_posts"]["span_id"], "❌ Đăng bài phải nằm trong lượt đăng"
+        assert "FACEBOOK" in spans["dispatch_post"]["attributes"]["job"], "❌ Thiếu nhãn job"
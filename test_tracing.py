@@ -0,0 +1,159 @@
+import asyncio
+import json
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import tracing
+
+# ==========================================
+# ====== TRACING TESTS ======
+# ==========================================
+
+@pytest.fixture(autouse=True)
+def tracing_enabled():
+    """Mỗi test bật tracing với bộ nhớ trace trống, không ghi file"""
+    with patch.dict(tracing._config, enabled=True, export_file=None):
+        tracing.clear()
+        yield
+    tracing.clear()
+
+@tracing.traced()
+def inner(value):
+    return value * 2
+
+@tracing.traced("outer")
+def outer(value):
+    return inner(value) + 1
+
+@tracing.traced("tick", root=True)
+def tick(value):
+    return outer(value)
+
+@tracing.traced()
+async def inner_async(value):
+    await asyncio.sleep(0)
+    return inner(value)
+
+@tracing.traced("async_tick", root=True)
+def async_tick(values):
+    async def run_all():
+        return await asyncio.gather(*(inner_async(value) for value in values))
+    return asyncio.run(run_all())
+
+def spans_by_name(trace):
+    return {record["name"]: record for record in trace["spans"]}
+
+class TestTracing:
+
+    def test_nested_spans_in_one_trace(self):
+        """Test span lồng nhau nằm trong cùng trace, đúng span cha"""
+        assert tick(3) == 7, "❌ Decorator không được đổi kết quả"
+
+        traces = tracing.get_traces()
+        assert len(traces) == 1, "❌ Mỗi lượt là một trace"
+        spans = spans_by_name(traces[0])
+        assert set(spans) == {"tick", "outer", "inner"}, "❌ Thiếu span"
+        assert spans["tick"]["parent_id"] is None, "❌ Span gốc không có cha"
+        assert spans["outer"]["parent_id"] == spans["tick"]["span_id"], "❌ Sai span cha"
+        assert spans["inner"]["parent_id"] == spans["outer"]["span_id"], "❌ Sai span cha"
+        assert [(row["name"], row["depth"]) for row in tracing.waterfall(traces[0])] == \
+            [("tick", 0), ("outer", 1), ("inner", 2)], "❌ Sai waterfall"
+
+    def test_disabled_records_nothing(self):
+        """Test tắt tracing thì không ghi trace, hàm vẫn chạy bình thường"""
+        tracing.configure(enabled=False)
+
+        assert tick(3) == 7, "❌ Hàm phải chạy bình thường"
+        assert tracing.start_span("x", root=True) is None, "❌ Không được mở span khi tắt"
+        assert tracing.get_traces() == [], "❌ Không được ghi trace khi tắt"
+
+    def test_span_outside_trace_is_skipped(self):
+        """Test hàm gọi ngoài lượt chạy (không có trace) không được ghi"""
+        outer(1)
+
+        assert tracing.get_traces() == [], "❌ Span ngoài trace không được ghi"
+
+    def test_error_is_recorded(self):
+        """Test lỗi trong span được ghi lại và raise tiếp"""
+        @tracing.traced("failing", root=True)
+        def failing():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            failing()
+
+        record = tracing.get_traces()[0]["spans"][0]
+        assert record["error"] == "ValueError: boom", "❌ Phải ghi lỗi vào span"
+        assert tracing.otlp_span(record)["status"] == {"code": 2, "message": "ValueError: boom"}, "❌ Sai status OTLP"
+
+    def test_async_and_thread_pool_spans_nest(self):
+        """Test span trong task asyncio và thread pool (qua bind) nằm dưới span gốc"""
+        assert async_tick([1, 2]) == [2, 4], "❌ Sai kết quả async"
+
+        with tracing.span("pool", root=True):
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                list(executor.map(tracing.bind(inner), [1, 2]))
+
+        async_trace, pool_trace = tracing.get_traces()
+        ids = {record["span_id"]: record["name"] for record in async_trace["spans"]}
+        parents = sorted((record["name"], ids.get(record["parent_id"])) for record in async_trace["spans"])
+        assert parents == [("async_tick", None), ("inner", "inner_async"), ("inner", "inner_async"),
+                           ("inner_async", "async_tick"), ("inner_async", "async_tick")], "❌ Sai cây span async"
+        root_id = spans_by_name(pool_trace)["pool"]["span_id"]
+        assert [record["parent_id"] for record in pool_trace["spans"] if record["name"] == "inner"] == \
+            [root_id, root_id], "❌ Span trong thread pool phải nằm dưới span gốc"
+
+    def test_otlp_export(self, tmp_path):
+        """Test xuất OTLP JSON: resource, span, thuộc tính; file xuất mỗi trace một dòng"""
+        path = tmp_path / "traces.jsonl"
+        tracing.configure(export_file=str(path), service_name="test")
+        with tracing.span("tick", root=True, job="row 2"):
+            tracing.set_attribute("count", 3)
+            inner(1)
+        tick(1)
+
+        lines = path.read_text(encoding="utf-8").splitlines()
+        assert len(lines) == 2, "❌ Mỗi trace một dòng"
+        payload = json.loads(lines[0])
+        resource_spans = payload["resourceSpans"][0]
+        assert resource_spans["resource"]["attributes"] == \
+            [{"key": "service.name", "value": {"stringValue": "test"}}], "❌ Sai service.name"
+        spans = resource_spans["scopeSpans"][0]["spans"]
+        root = next(s for s in spans if s["name"] == "tick")
+        child = next(s for s in spans if s["name"] == "inner")
+        assert len(root["traceId"]) == 32 and len(root["spanId"]) == 16, "❌ Sai độ dài id"
+        assert root["parentSpanId"] == "" and child["parentSpanId"] == root["spanId"], "❌ Sai span cha"
+        assert int(root["endTimeUnixNano"]) >= int(root["startTimeUnixNano"]), "❌ Sai thời gian"
+        assert {"key": "count", "value": {"intValue": "3"}} in root["attributes"], "❌ Thiếu thuộc tính"
+        assert {"key": "job", "value": {"stringValue": "row 2"}} in root["attributes"], "❌ Thiếu thuộc tính"
+
+    def test_traces_are_kept_per_session(self):
+        """Test mỗi phiên chỉ thấy trace của mình, span gốc có thuộc tính session.id"""
+        with tracing.span("streamlit.rerun", root=True, session_id="s1"):
+            inner(1)
+        with tracing.span("streamlit.rerun", root=True, session_id="s2"):
+            pass
+
+        s1_traces = tracing.get_traces(session_id="s1")
+        assert len(s1_traces) == 1 and len(tracing.get_traces(session_id="s2")) == 1, "❌ Trace phải tách theo phiên"
+        assert tracing.get_traces() == [], "❌ Trace của phiên không được lẫn vào trace chung"
+        root = spans_by_name(s1_traces[0])["streamlit.rerun"]
+        assert root["attributes"]["session.id"] == "s1", "❌ Thiếu session.id"
+
+    def test_control_flow_exit_closes_span(self):
+        """Test rerun dừng giữa chừng (st.stop/st.rerun là BaseException) vẫn đóng span, không tính là lỗi"""
+        class RerunException(BaseException):
+            pass
+
+        with pytest.raises(RerunException):
+            with tracing.span("streamlit.rerun", root=True, session_id="s1"):
+                raise RerunException()
+        with tracing.span("streamlit.rerun", root=True, session_id="s1"):
+            inner(1)
+
+        first, second = tracing.get_traces(session_id="s1")
+        assert first["spans"][0]["error"] is None, "❌ Ngắt điều khiển không phải lỗi"
+        assert spans_by_name(second)["inner"]["parent_id"] == spans_by_name(second)["streamlit.rerun"]["span_id"], \
+            "❌ Span của rerun sau không được gắn vào rerun trước"
+        assert tracing._current_span.get() is None, "❌ Không được còn span mở sau rerun"
@@ -0,0 +1,273 @@
+# ==========================================
+# ====== TRACING (span lồng nhau) ======
+# ==========================================
+# Chức năng chính: Đo thời gian lồng nhau của các hàm I/O trong một lượt chạy
+# - Mỗi trace là một lượt: một lần rerun Streamlit (app.py) hoặc một lượt kiểm tra của scheduler
+# - @traced() bọc hàm (đồng bộ hoặc async) thành span con của span đang chạy
+# - Span ngoài trace (không có lượt nào đang chạy) không được ghi
+# - Giữ TRACE_MAX_TRACES trace gần nhất trong bộ nhớ theo từng phiên (session_id, vd mỗi phiên trình duyệt
+#   của Streamlit chỉ thấy trace của mình), xem dạng waterfall, xuất JSON theo định dạng OTLP
+# - Tắt mặc định: khi tắt, hàm được bọc chỉ thêm một lần kiểm tra cờ
+#
+# Bật bằng biến môi trường:
+#   TRACE_ENABLED=1                  ghi trace
+#   TRACE_EXPORT_FILE=traces.jsonl   ghi thêm mỗi trace xong thành 1 dòng OTLP JSON (định dạng file của OTLP exporter)
+
+import functools
+import inspect
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Số trace gần nhất giữ trong bộ nhớ cho mỗi phiên, số phiên tối đa (bỏ phiên lâu không chạy nhất)
+TRACE_MAX_TRACES = 50
+TRACE_MAX_SESSIONS = 100
+
+# Tên scope trong bản xuất OTLP
+TRACE_SCOPE_NAME = "xuongbinhgom.tracing"
+
+# OTLP: SPAN_KIND_INTERNAL, STATUS_CODE_UNSET, STATUS_CODE_ERROR
+OTLP_SPAN_KIND_INTERNAL = 1
+OTLP_STATUS_UNSET = 0
+OTLP_STATUS_ERROR = 2
+
+_config = {
+    "enabled": os.getenv("TRACE_ENABLED", "") == "1",
+    "export_file": os.getenv("TRACE_EXPORT_FILE") or None,
+    "service_name": os.getenv("OTEL_SERVICE_NAME") or "xuongbinhgom",
+}
+
+# Span đang chạy của luồng/task hiện tại (task asyncio tự nhận bản sao khi tạo)
+_current_span = ContextVar("current_span", default=None)
+
+_traces = OrderedDict()  # session_id (None: không theo phiên) → deque các trace đã xong
+_traces_lock = threading.Lock()
+_export_lock = threading.Lock()
+
+# ====== Hàm cấu hình tracing ======
+# Chức năng: Bật/tắt tracing, đặt file xuất OTLP và tên service (chỉ đổi giá trị được truyền).
+def configure(enabled=None, export_file=None, service_name=None):
+    if enabled is not None:
+        _config["enabled"] = bool(enabled)
+    if export_file is not None:
+        _config["export_file"] = export_file or None
+    if service_name is not None:
+        _config["service_name"] = service_name
+
+def is_enabled():
+    return _config["enabled"]
+
+def new_id(bits):
+    return format(random.getrandbits(bits), f"0{bits // 4}x")
+
+# ====== Hàm mở / đóng span ======
+# Chức năng: start_span mở span con của span đang chạy (root=True: mở trace mới), end_span đóng span.
+# - Trả về None (không ghi gì) khi tracing tắt hoặc span con không nằm trong trace nào.
+# - session_id (chỉ với root): phiên của trace, ghi vào thuộc tính "session.id" của span gốc.
+# - Dùng khi mở và đóng span ở 2 chỗ khác nhau; còn lại dùng span()/@traced().
+def start_span(name, root=False, attributes=None, session_id=None):
+    if not _config["enabled"]:
+        return None
+    parent = None if root else _current_span.get()
+    if parent is None and not root:
+        return None
+    attributes = dict(attributes or {})
+    if parent:
+        trace = parent["trace"]
+    else:
+        trace = {"trace_id": new_id(128), "name": name, "session_id": session_id, "spans": []}
+        if session_id is not None:
+            attributes["session.id"] = session_id
+    record = {
+        "trace": trace,
+        "span_id": new_id(64),
+        "parent_id": parent["span_id"] if parent else None,
+        "name": name,
+        "start_ns": time.time_ns(),
+        "end_ns": None,
+        "attributes": attributes,
+        "error": None,
+    }
+    record["token"] = _current_span.set(record)
+    return record
+
+def end_span(record, error=None):
+    if record is None:
+        return
+    record["end_ns"] = time.time_ns()
+    if error is not None:
+        record["error"] = f"{type(error).__name__}: {error}"
+    try:
+        _current_span.reset(record.pop("token"))
+    except (KeyError, ValueError):
+        pass  # đóng ở context khác (vd rerun bị ngắt giữa chừng): không khôi phục span cha
+    trace = record["trace"]
+    trace["spans"].append(record)
+    if record["parent_id"] is None:
+        store_trace(trace)
+        if _config["export_file"]:
+            export_trace_to_file(trace, _config["export_file"])
+
+def store_trace(trace):
+    with _traces_lock:
+        traces = _traces.pop(trace["session_id"], None) or deque(maxlen=TRACE_MAX_TRACES)
+        traces.append(trace)
+        _traces[trace["session_id"]] = traces
+        while len(_traces) > TRACE_MAX_SESSIONS:
+            _traces.popitem(last=False)
+
+# ====== Hàm đo một đoạn code ======
+# Chức năng: with span(name, **attributes): ... → span con (hoặc trace mới nếu root=True).
+# - Span luôn được đóng; lỗi (Exception) được ghi vào span rồi raise lại. Ngắt điều khiển
+#   (BaseException: st.stop()/st.rerun() của Streamlit, KeyboardInterrupt) không bị coi là lỗi.
+@contextmanager
+def span(name, root=False, session_id=None, **attributes):
+    record = start_span(name, root=root, attributes=attributes, session_id=session_id)
+    error = None
+    try:
+        yield record
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        end_span(record, error)
+
+# ====== Decorator đo thời gian hàm ======
+# Chức năng: @traced("tên span") bọc hàm đồng bộ hoặc async thành span (mặc định tên là tên hàm).
+# - root=True: mỗi lần gọi là một trace mới (vd một lượt kiểm tra của scheduler).
+def traced(name=None, root=False):
+    def decorator(fn):
+        span_name = name or fn.__name__
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not _config["enabled"]:
+                    return await fn(*args, **kwargs)
+                with span(span_name, root=root):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _config["enabled"]:
+                return fn(*args, **kwargs)
+            with span(span_name, root=root):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# ====== Hàm gắn thuộc tính cho span đang chạy ======
+# Chức năng: Thêm key=value vào span hiện tại (bỏ qua nếu không có span).
+def set_attribute(key, value):
+    record = _current_span.get() if _config["enabled"] else None
+    if record is not None:
+        record["attributes"][key] = value
+
+# ====== Hàm mang span hiện tại sang thread khác ======
+# Chức năng: Trả về hàm chạy fn với span hiện tại làm span cha (thread pool không tự mang context theo).
+# - Trả về chính fn nếu không có span đang chạy.
+def bind(fn):
+    parent = _current_span.get() if _config["enabled"] else None
+    if parent is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _current_span.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+    return wrapper
+
+# ====== Hàm đọc các trace gần nhất ======
+# Chức năng: Trả về các trace đã xong của phiên session_id (cũ trước, mới sau).
+def get_traces(session_id=None):
+    with _traces_lock:
+        return list(_traces.get(session_id, ()))
+
+def clear():
+    with _traces_lock:
+        _traces.clear()
+
+# ====== Hàm tạo dữ liệu waterfall ======
+# Chức năng: Chuyển một trace thành các dòng waterfall theo thứ tự bắt đầu.
+# - Mỗi dòng: name, depth (độ sâu lồng nhau), offset_ms (tính từ đầu trace), duration_ms, error.
+# - Span chưa đóng (còn chạy trong thread khác) không có trong trace.
+def waterfall(trace):
+    spans = sorted(trace["spans"], key=lambda record: record["start_ns"])
+    if not spans:
+        return []
+    by_id = {record["span_id"]: record for record in spans}
+    origin = spans[0]["start_ns"]
+    rows = []
+    for record in spans:
+        depth = 0
+        parent_id = record["parent_id"]
+        while parent_id in by_id:
+            depth += 1
+            parent_id = by_id[parent_id]["parent_id"]
+        rows.append({
+            "name": record["name"],
+            "depth": depth,
+            "offset_ms": (record["start_ns"] - origin) / 1e6,
+            "duration_ms": (record["end_ns"] - record["start_ns"]) / 1e6,
+            "error": record["error"],
+        })
+    return rows
+
+def trace_duration_ms(trace):
+    root = next((record for record in trace["spans"] if record["parent_id"] is None), None)
+    return (root["end_ns"] - root["start_ns"]) / 1e6 if root else None
+
+# ====== Hàm xuất OTLP JSON ======
+# Chức năng: Tạo ExportTraceServiceRequest dạng JSON (OTLP/HTTP JSON) từ danh sách trace.
+# - Dùng được với collector OpenTelemetry hoặc file exporter của OTLP.
+def export_otlp(traces, service_name=None):
+    spans = [otlp_span(record) for trace in traces for record in trace["spans"]]
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [otlp_attribute("service.name", service_name or _config["service_name"])]},
+            "scopeSpans": [{"scope": {"name": TRACE_SCOPE_NAME}, "spans": spans}],
+        }]
+    }
+
+def otlp_span(record):
+    status = {"code": OTLP_STATUS_UNSET}
+    if record["error"]:
+        status = {"code": OTLP_STATUS_ERROR, "message": record["error"]}
+    return {
+        "traceId": record["trace"]["trace_id"],
+        "spanId": record["span_id"],
+        "parentSpanId": record["parent_id"] or "",
+        "name": record["name"],
+        "kind": OTLP_SPAN_KIND_INTERNAL,
+        "startTimeUnixNano": str(record["start_ns"]),
+        "endTimeUnixNano": str(record["end_ns"]),
+        "attributes": [otlp_attribute(key, value) for key, value in record["attributes"].items()],
+        "status": status,
+    }
+
+def otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+# ====== Hàm ghi trace ra file ======
+# Chức năng: Ghi thêm một trace thành 1 dòng OTLP JSON. Lỗi ghi chỉ in ra (không ảnh hưởng lượt chạy).
+def export_trace_to_file(trace, path):
+    line = json.dumps(export_otlp([trace]), ensure_ascii=False)
+    try:
+        with _export_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        print(f"⚠️ Lỗi ghi trace {path}: {e}")